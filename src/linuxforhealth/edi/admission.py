@@ -0,0 +1,400 @@
+"""
+admission.py
+
+Admission control for EDI workflows embedded in long running services.
+
+An AdmissionController bounds the number of messages, and message bytes, processed concurrently, overall and per
+tenant. A message which would exceed a budget is queued until in-flight messages complete. It is rejected with an
+EdiAdmissionException when its lane's queue is full or it is not admitted within the queue timeout, so bursts are
+met with backpressure rather than unbounded memory growth.
+
+Messages are admitted through one of two lanes:
+* latency - small, latency sensitive messages, such as HL7v2 ADT and X12 eligibility requests
+* bulk - X12 837 claims, DICOM instances and messages at least the bulk message size
+
+The bulk lane may use at most a share of the overall budgets, so bulk messages do not starve latency sensitive
+messages, and a queued bulk message is not admitted while a queued latency message can be. Within a lane, queued
+messages are admitted in arrival order, skipping messages whose tenant budget is exhausted.
+
+Usage:
+controller = get_admission_controller()
+with controller.admit(len(message), tenant="partner-a", lane=AdmissionLane.LATENCY):
+    edi_result = EdiWorkflow(message).run()
+
+edi_result = run_admitted_workflow(message, tenant="partner-a")
+"""
+from collections import deque
+from enum import Enum
+from functools import lru_cache
+import logging
+import re
+import threading
+import time
+from typing import Deque, Dict, Hashable, Optional, Union
+
+from .config import get_settings
+from .exceptions import EdiAdmissionException
+from .models import EdiResult
+from .pipeline import EdiPipeline
+from .support import EdiMessageBuffer
+from .workflows import EdiWorkflow
+
+logger = logging.getLogger(__name__)
+
+# X12 transaction sets processed in the bulk lane
+BULK_X12_TRANSACTION_SETS = frozenset({"837"})
+
+# the number of leading characters searched for the first X12 transaction set identifier
+_X12_HEADER_SIZE = 512
+# the fixed length of an X12 ISA segment, including the segment terminator
+_X12_ISA_LENGTH = 106
+
+
+class AdmissionLane(str, Enum):
+    """Admission lanes, in priority order"""
+
+    LATENCY = "latency"
+    BULK = "bulk"
+
+
+def classify_message(
+    input_message: EdiMessageBuffer, bulk_message_size: int
+) -> AdmissionLane:
+    """
+    Returns the admission lane for a message, inspecting only the message's leading bytes.
+    :param input_message: The input message
+    :param bulk_message_size: The size, in bytes, at which messages are processed in the bulk lane
+    :returns: AdmissionLane
+    """
+    data = input_message.data
+    if len(data) >= bulk_message_size or bytes(data[128:132]) == b"DICM":
+        return AdmissionLane.BULK
+
+    lead = input_message.lead(_X12_HEADER_SIZE)
+    if lead[:3].upper() == "ISA" and len(lead) >= _X12_ISA_LENGTH:
+        element_separator = re.escape(lead[3])
+        segment_terminator = re.escape(lead[_X12_ISA_LENGTH - 1])
+        match = re.search(f"{segment_terminator}\\s*ST{element_separator}(\\w+)", lead)
+        if match and match.group(1) in BULK_X12_TRANSACTION_SETS:
+            return AdmissionLane.BULK
+    return AdmissionLane.LATENCY
+
+
+class _Request:
+    """A message requesting admission"""
+
+    __slots__ = ("size", "tenant", "lane")
+
+    def __init__(self, size: int, tenant: Hashable, lane: AdmissionLane):
+        self.size = size
+        self.tenant = tenant
+        self.lane = lane
+
+
+class AdmissionTicket:
+    """
+    An admitted message. The message's budget is returned to the controller when the ticket is released.
+    Tickets are context managers, releasing the ticket on exit.
+    """
+
+    __slots__ = ("_controller", "_request", "_is_released")
+
+    def __init__(self, controller: "AdmissionController", request: _Request):
+        self._controller = controller
+        self._request = request
+        self._is_released = False
+
+    @property
+    def size(self) -> int:
+        return self._request.size
+
+    @property
+    def tenant(self) -> Hashable:
+        return self._request.tenant
+
+    @property
+    def lane(self) -> AdmissionLane:
+        return self._request.lane
+
+    def release(self) -> None:
+        """Releases the ticket. Releasing a ticket more than once has no effect."""
+        if not self._is_released:
+            self._is_released = True
+            self._controller._release(self._request)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class AdmissionController:
+    """
+    Bounds the messages and message bytes processed concurrently, overall and per tenant.
+    Controllers are thread safe, and are shared by the threads processing messages within a process.
+    """
+
+    def __init__(
+        self,
+        max_messages: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        tenant_max_messages: Optional[int] = None,
+        tenant_max_bytes: Optional[int] = None,
+        bulk_share: float = 0.5,
+        bulk_message_size: int = 1024 * 1024,
+        max_queue: int = 100,
+        queue_timeout: Optional[float] = 30.0,
+    ):
+        """
+        Configures the controller's budgets. Budgets which are None are not limited.
+        :param max_messages: The number of messages processed concurrently
+        :param max_bytes: The message bytes processed concurrently
+        :param tenant_max_messages: The number of messages processed concurrently for each tenant
+        :param tenant_max_bytes: The message bytes processed concurrently for each tenant
+        :param bulk_share: The share, from 0 to 1, of the overall budgets available to the bulk lane
+        :param bulk_message_size: The size, in bytes, at which messages are processed in the bulk lane
+        :param max_queue: The number of messages queued in each lane. 0 rejects messages which cannot be admitted
+        immediately.
+        :param queue_timeout: The time, in seconds, a message is queued before it is rejected. None waits indefinitely.
+        """
+        if not 0 < bulk_share <= 1:
+            raise ValueError("bulk_share must be greater than 0 and at most 1")
+
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.tenant_max_messages = tenant_max_messages
+        self.tenant_max_bytes = tenant_max_bytes
+        self.bulk_share = bulk_share
+        self.bulk_message_size = bulk_message_size
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.admitted_count = 0
+        self.rejected_count = 0
+
+        self._bulk_max_messages = (
+            max(1, int(max_messages * bulk_share)) if max_messages else max_messages
+        )
+        self._bulk_max_bytes = int(max_bytes * bulk_share) if max_bytes else max_bytes
+
+        self._condition = threading.Condition()
+        self._messages = 0
+        self._bytes = 0
+        self._bulk_messages = 0
+        self._bulk_bytes = 0
+        self._tenant_messages: Dict[Hashable, int] = {}
+        self._tenant_bytes: Dict[Hashable, int] = {}
+        self._queues: Dict[AdmissionLane, Deque[_Request]] = {
+            lane: deque() for lane in AdmissionLane
+        }
+
+    @property
+    def in_flight_messages(self) -> int:
+        return self._messages
+
+    @property
+    def in_flight_bytes(self) -> int:
+        return self._bytes
+
+    def tenant_in_flight(self, tenant: Hashable) -> Dict[str, int]:
+        """Returns a tenant's in-flight messages and bytes"""
+        with self._condition:
+            return {
+                "messages": self._tenant_messages.get(tenant, 0),
+                "bytes": self._tenant_bytes.get(tenant, 0),
+            }
+
+    def queued_count(self, lane: Optional[AdmissionLane] = None) -> int:
+        """Returns the number of queued messages in a lane, or in all lanes"""
+        with self._condition:
+            if lane is not None:
+                return len(self._queues[lane])
+            return sum(len(q) for q in self._queues.values())
+
+    def _reject(self, msg: str) -> None:
+        self.rejected_count += 1
+        raise EdiAdmissionException(msg)
+
+    def _fits(self, request: _Request) -> bool:
+        """Returns True if a request fits within its overall, lane and tenant budgets"""
+        if self.max_messages and self._messages >= self.max_messages:
+            return False
+        if self.max_bytes and self._bytes + request.size > self.max_bytes:
+            return False
+
+        if request.lane == AdmissionLane.BULK:
+            if (
+                self._bulk_max_messages
+                and self._bulk_messages >= self._bulk_max_messages
+            ):
+                return False
+            if (
+                self._bulk_max_bytes
+                and self._bulk_bytes + request.size > self._bulk_max_bytes
+            ):
+                return False
+
+        tenant = request.tenant
+        if (
+            self.tenant_max_messages
+            and self._tenant_messages.get(tenant, 0) >= self.tenant_max_messages
+        ):
+            return False
+        if (
+            self.tenant_max_bytes
+            and self._tenant_bytes.get(tenant, 0) + request.size > self.tenant_max_bytes
+        ):
+            return False
+        return True
+
+    def _can_admit(self, request: _Request) -> bool:
+        """
+        Returns True if a request fits within its budgets, and no request ahead of it can be admitted: an earlier
+        request in its lane, or, for bulk requests, a latency request.
+        """
+        if not self._fits(request):
+            return False
+
+        for queued_request in self._queues[request.lane]:
+            if queued_request is request:
+                break
+            if self._fits(queued_request):
+                return False
+
+        if request.lane == AdmissionLane.BULK:
+            return not any(self._fits(r) for r in self._queues[AdmissionLane.LATENCY])
+        return True
+
+    def _check_size(self, request: _Request) -> None:
+        """Rejects a request which exceeds a budget on its own, and could never be admitted"""
+        budgets = [
+            ("overall", self.max_bytes),
+            ("tenant", self.tenant_max_bytes),
+        ]
+        if request.lane == AdmissionLane.BULK:
+            budgets.append(("bulk lane", self._bulk_max_bytes))
+
+        for name, max_bytes in budgets:
+            if max_bytes and request.size > max_bytes:
+                self._reject(
+                    f"Message size {request.size} exceeds the {name} budget of {max_bytes} bytes"
+                )
+
+    def admit(
+        self,
+        size: int,
+        tenant: Hashable = None,
+        lane: AdmissionLane = AdmissionLane.LATENCY,
+        timeout: Optional[float] = None,
+    ) -> AdmissionTicket:
+        """
+        Admits a message, waiting until it fits within its budgets.
+        :param size: The message size in bytes
+        :param tenant: Identifies the message's tenant or source. Defaults to None, which is budgeted as a tenant.
+        :param lane: The message's admission lane. Defaults to the latency lane.
+        :param timeout: The time, in seconds, the message is queued. Defaults to the controller's queue timeout.
+        :returns: AdmissionTicket, which must be released when the message is processed
+        :raises: EdiAdmissionException if the message exceeds a budget on its own, the lane's queue is full, or the
+        message is not admitted within the timeout
+        """
+        request = _Request(size, tenant, AdmissionLane(lane))
+        timeout = self.queue_timeout if timeout is None else timeout
+
+        with self._condition:
+            self._check_size(request)
+
+            if not self._can_admit(request):
+                queue = self._queues[request.lane]
+                if len(queue) >= self.max_queue:
+                    self._reject(f"The {request.lane.value} admission queue is full")
+
+                queue.append(request)
+                deadline = None if timeout is None else time.monotonic() + timeout
+                try:
+                    while not self._can_admit(request):
+                        remaining = (
+                            None if deadline is None else deadline - time.monotonic()
+                        )
+                        if remaining is not None and remaining <= 0:
+                            self._reject(
+                                f"Message was not admitted within {timeout} seconds"
+                            )
+                        self._condition.wait(remaining)
+                finally:
+                    queue.remove(request)
+                    # requests queued behind this request may now be admitted
+                    self._condition.notify_all()
+
+            self._acquire(request)
+            self.admitted_count += 1
+            return AdmissionTicket(self, request)
+
+    def _acquire(self, request: _Request) -> None:
+        """Adds an admitted request to the in-flight totals"""
+        self._messages += 1
+        self._bytes += request.size
+        if request.lane == AdmissionLane.BULK:
+            self._bulk_messages += 1
+            self._bulk_bytes += request.size
+
+        tenant = request.tenant
+        self._tenant_messages[tenant] = self._tenant_messages.get(tenant, 0) + 1
+        self._tenant_bytes[tenant] = self._tenant_bytes.get(tenant, 0) + request.size
+
+    def _release(self, request: _Request) -> None:
+        """Removes a released request from the in-flight totals, and wakes queued requests"""
+        with self._condition:
+            self._messages -= 1
+            self._bytes -= request.size
+            if request.lane == AdmissionLane.BULK:
+                self._bulk_messages -= 1
+                self._bulk_bytes -= request.size
+
+            tenant = request.tenant
+            self._tenant_messages[tenant] -= 1
+            self._tenant_bytes[tenant] -= request.size
+            if not self._tenant_messages[tenant]:
+                del self._tenant_messages[tenant]
+                del self._tenant_bytes[tenant]
+
+            self._condition.notify_all()
+
+
+@lru_cache()
+def get_admission_controller() -> AdmissionController:
+    """Returns the process's AdmissionController, configured from the admission settings"""
+    settings = get_settings()
+    return AdmissionController(
+        max_messages=settings.admission_max_messages,
+        max_bytes=settings.admission_max_bytes,
+        tenant_max_messages=settings.admission_tenant_max_messages,
+        tenant_max_bytes=settings.admission_tenant_max_bytes,
+        bulk_share=settings.admission_bulk_share,
+        bulk_message_size=settings.admission_bulk_message_size,
+        max_queue=settings.admission_max_queue,
+        queue_timeout=settings.admission_queue_timeout,
+    )
+
+
+def run_admitted_workflow(
+    input_message: Union[bytes, str, EdiMessageBuffer],
+    tenant: Hashable = None,
+    pipeline: Optional[EdiPipeline] = None,
+    controller: Optional[AdmissionController] = None,
+) -> EdiResult:
+    """
+    Runs an EDI workflow once the message is admitted, classifying the message into the latency or bulk lane.
+    :param input_message: The input message
+    :param tenant: Identifies the message's tenant or source
+    :param pipeline: The pipeline to execute. Defaults to the pipeline with all stages.
+    :param controller: The admission controller. Defaults to the controller returned by get_admission_controller.
+    :returns: EdiResult
+    :raises: EdiAdmissionException if the message is not admitted
+    """
+    controller = controller or get_admission_controller()
+    if not isinstance(input_message, EdiMessageBuffer):
+        input_message = EdiMessageBuffer(input_message)
+
+    lane = classify_message(input_message, controller.bulk_message_size)
+    with controller.admit(len(input_message.data), tenant, lane):
+        return EdiWorkflow(input_message).run(pipeline=pipeline)
@@ -8,23 +8,26 @@ edi_metadata: EdiMessageMetadata = analyze(input_message)
 """
 import abc
 from enum import Enum
-import json
-from typing import Optional, Type, Dict, Union
+from typing import Type, Dict, Union
 import logging
 
 from .models import EdiMessageMetadata, EdiMessageFormat, BaseMessageFormat
-from .support import load_json, load_xml, create_checksum
+from .support import (
+    load_json,
+    create_checksum,
+    construct_fhir_resource,
+    EdiMessageBuffer,
+)
 from .exceptions import EdiDataValidationException
+from .fhir_xml import is_fhir_xml, scan_fhir_xml
 
-from lxml.etree import _Element
-from fhir.resources import construct_fhir_element as construct_fhir_r4
-from fhir.resources.DSTU2 import construct_fhir_element as construct_fhir_dstu2
-from fhir.resources.STU3 import construct_fhir_element as construct_fhir_stu3
 
 logger = logging.getLogger(__name__)
 
 # the minimum message size required for analysis and classification
 MESSAGE_SAMPLE_SIZE: int = 3
+# the number of leading characters searched for the HL7 MSH and X12 ISA and GS header segments
+HEADER_SAMPLE_SIZE: int = 4096
 
 
 class EdiAnalyzer(metaclass=abc.ABCMeta):
@@ -45,12 +48,12 @@ class EdiAnalyzer(metaclass=abc.ABCMeta):
 
     def __init__(
         self,
-        input_message: str,
+        input_message: EdiMessageBuffer,
         base_message_format: BaseMessageFormat,
         edi_message_format: EdiMessageFormat,
     ):
         """ "
-        :param input_message: The input EDI message
+        :param input_message: The input EDI message buffer
         :param base_message_format: The base message format (TEXT, JSON, XML, etc)
         :param edi_message_format: The edi message format (FHIR, XML, HL7, etc)
         """
@@ -63,22 +66,16 @@ class EdiAnalyzer(metaclass=abc.ABCMeta):
         Returns EdiMessageMetadata for the associated message
         """
         metadata_fields = {
-            "baseMessageFormat": self.base_message_format.value,
-            "ediMessageFormat": self.edi_message_format.value,
+            "baseMessageFormat": self.base_message_format,
+            "ediMessageFormat": self.edi_message_format,
             "checksum": create_checksum(self.input_message),
+            "messageSize": len(self.input_message),
         }
 
-        # handle str and bytes
-        if isinstance(self.input_message, str):
-            metadata_fields["messageSize"] = len(
-                bytes(self.input_message.encode("utf-8"))
-            )
-        else:
-            metadata_fields["messageSize"] = len(self.input_message)
-
         additional_fields = self.analyze_message_data()
         metadata_fields.update(additional_fields)
-        message_metadata = EdiMessageMetadata(**metadata_fields)
+        # fields are generated by the analyzer, so model validation is skipped
+        message_metadata = EdiMessageMetadata.construct(**metadata_fields)
         return message_metadata
 
     @abc.abstractmethod
@@ -96,8 +93,7 @@ class FhirAnalyzer(EdiAnalyzer):
     """
 
     EdiAnalysis FHIR Implementation
-    Currently only FHIR JSON is supported. FHIR XML support is included as a "starting point" for if/when FHIR XML
-    is supported.
+    Supports FHIR JSON and FHIR XML resources.
     """
 
     class FhirSpecificationVersion(str, Enum):
@@ -105,13 +101,6 @@ class FhirAnalyzer(EdiAnalyzer):
         STU3 = "STU3"
         DSTU2 = "DSTU2"
 
-    # maps FHIR factory functions to a specification version
-    version_map = {
-        construct_fhir_r4: FhirSpecificationVersion.R4,
-        construct_fhir_stu3: FhirSpecificationVersion.STU3,
-        construct_fhir_dstu2: FhirSpecificationVersion.DSTU2,
-    }
-
     def _parse_json_specification_version(self, fhir_json: Dict) -> str:
         """
         Parses the input message using multiple passes to determine the FHIR specification version.
@@ -122,14 +111,18 @@ class FhirAnalyzer(EdiAnalyzer):
         resourceType = fhir_json.get("resourceType")
         specification_version = None
 
-        for c in (construct_fhir_r4, construct_fhir_stu3, construct_fhir_dstu2):
+        for version in FhirAnalyzer.FhirSpecificationVersion:
             try:
-                fhir_resource = c(resourceType, fhir_json)
+                fhir_resource = construct_fhir_resource(
+                    version.value, resourceType, fhir_json
+                )
                 if fhir_resource:
-                    specification_version = FhirAnalyzer.version_map[c]
+                    specification_version = version
                     break
             except Exception as ex:
-                logger.debug(f"FHIR Resource is not compatible with {c.__name__}")
+                logger.debug(
+                    f"FHIR Resource is not compatible with FHIR {version.value}"
+                )
 
         if not specification_version:
             raise EdiDataValidationException(
@@ -146,7 +139,7 @@ class FhirAnalyzer(EdiAnalyzer):
         - implementationVersions
         :returns: dictionary
         """
-        fhir_json = load_json(self.input_message)
+        fhir_json = load_json(self.input_message.parseable())
 
         data = {
             "specificationVersion": self._parse_json_specification_version(fhir_json),
@@ -157,47 +150,37 @@ class FhirAnalyzer(EdiAnalyzer):
 
     def _analyze_fhir_xml_data(self) -> Dict:
         """
-        An initial implementation for when FHIR XML is supported.
+        Parses additional data from a FHIR XML message for the EDI Analysis.
+        The message is streamed, reading the resource type, profiles and top level element names without building
+        the document tree. The specification version is the first release which defines the resource type and its
+        top level elements.
+        Sets the following fields:
+        - specificationVersion
+        - implementationVersions
+        :raises: EdiDataValidationException if the specification version cannot be determined
         :returns: dictionary
         """
+        summary = scan_fhir_xml(self.input_message.data)
+        specification_version = summary.specification_version()
+        if not specification_version:
+            raise EdiDataValidationException(
+                "Resource is not compatible with FHIR R4, STU3, DSTU2"
+            )
 
-        def _get_namespace(xml_root: _Element) -> Optional[str]:
-            """Returns the XML namespace for a root element"""
-            namespace: str = ""
-
-            if "}" in xml_root.tag:
-                tag_value = xml_root.tag
-                end_index = tag_value.find("}") + 1
-                namespace = tag_value[0:end_index]
-
-            return namespace
-
-        data = {"specificationVersion": "http://hl7.org/fhir"}
-
-        fhir_xml = load_xml(self.input_message)
-        fhir_namespace = _get_namespace(fhir_xml)
-
-        profile_elements = fhir_xml.findall(
-            fhir_namespace + "meta/" + fhir_namespace + "profile/[@value]"
-        )
-        if profile_elements:
-            data["implementationVersions"] = [
-                e.attrib["value"] for e in profile_elements
-            ]
-
-        return data
+        return {
+            "specificationVersion": FhirAnalyzer.FhirSpecificationVersion(
+                specification_version
+            ),
+            "implementationVersions": summary.profiles,
+        }
 
     def analyze_message_data(self) -> Dict:
         """
         Analyzes FHIR message to parse edi format specific fields.
-        :raises: NotImplementedError if the FHIR message is XML
         """
-        if self.base_message_format == BaseMessageFormat.JSON:
-            return self._analyze_fhir_json_data()
-        else:
-            raise NotImplementedError(
-                f"FHIR {self.base_message_format} is not supported"
-            )
+        if self.base_message_format == BaseMessageFormat.XML:
+            return self._analyze_fhir_xml_data()
+        return self._analyze_fhir_json_data()
 
 
 class Hl7Analyzer(EdiAnalyzer):
@@ -214,12 +197,17 @@ class Hl7Analyzer(EdiAnalyzer):
         :returns: dictionary
         """
 
-        records = self.input_message.split("\r")
+        # only the MSH segment is required, so the remainder of the message is not decoded
+        message_text = self.input_message.lead(HEADER_SAMPLE_SIZE)
+        msh_end = message_text.find("\r")
+        if msh_end == -1 and len(self.input_message) > HEADER_SAMPLE_SIZE:
+            message_text = self.input_message.text
+            msh_end = message_text.find("\r")
+        msh_record = message_text[0:msh_end] if msh_end != -1 else message_text
         data = {}
 
         # validate that the message as records and a delimiter character
-        if records and records[0][3:4]:
-            msh_record = records[0]
+        if msh_record[3:4]:
             delimiter = msh_record[3:4]
 
             implementation_version = msh_record.split(delimiter)[11]
@@ -242,11 +230,21 @@ class X12Analyzer(EdiAnalyzer):
         - implementationVersions
         :returns: dictionary
         """
-        records = self.input_message.replace("\r", "").replace("\n", "").split("~")
+        # only the ISA and GS segments are required, so the remainder of the message is not decoded or split
+        message_text = self.input_message.lead(HEADER_SAMPLE_SIZE)
+        isa_end = message_text.find("~")
+        gs_end = message_text.find("~", isa_end + 1) if isa_end != -1 else -1
+        if gs_end == -1 and len(self.input_message) > HEADER_SAMPLE_SIZE:
+            message_text = self.input_message.text
+            isa_end = message_text.find("~")
         data = {}
 
-        if records and len(records) >= 2:
-            gs_segment = records[1].replace("~", "")
+        if isa_end != -1:
+            gs_end = message_text.find("~", isa_end + 1)
+            gs_segment = message_text[
+                isa_end + 1 : gs_end if gs_end != -1 else len(message_text)
+            ]
+            gs_segment = gs_segment.replace("\r", "").replace("\n", "")
             delimiter = gs_segment[2:3]
 
             implementation_version = gs_segment.split(delimiter)[8]
@@ -267,12 +265,13 @@ class PassthroughAnalyzer(EdiAnalyzer):
         return {}
 
 
-def _get_base_message_format(input_message: Union[bytes, str]) -> BaseMessageFormat:
+def _get_base_message_format(input_message: EdiMessageBuffer) -> BaseMessageFormat:
     """returns the base message format (BINARY, JSON, XML, TEXT, etc) for a message"""
     base_message_format: Union[BaseMessageFormat, None] = None
-    first_char = input_message.lstrip()[0:1]
 
-    if isinstance(input_message, bytes):
+    first_char = "" if input_message.is_binary else input_message.lead(1)
+
+    if input_message.is_binary:
         base_message_format = BaseMessageFormat.BINARY
     elif first_char in ("{", "["):
         base_message_format = BaseMessageFormat.JSON
@@ -284,7 +283,7 @@ def _get_base_message_format(input_message: Union[bytes, str]) -> BaseMessageFor
 
 
 def _get_edi_message_format(
-    input_message: str, base_message_format: BaseMessageFormat
+    input_message: EdiMessageBuffer, base_message_format: BaseMessageFormat
 ) -> EdiMessageFormat:
     """
     Returns the edi message format (HL7, X12, FHIR, etc) for an input message.
@@ -292,27 +291,26 @@ def _get_edi_message_format(
     :param input_message: The input message
     :param base_message_format: The base message format (JSON, XML, etc)
     :raises: EdiDataValidationException if the edi message format cannot be determined
-    :raises: NotImplementedError if the edi message format is not supported
     """
     edi_message_format: Union[EdiMessageFormat, None] = None
 
     if base_message_format == BaseMessageFormat.TEXT:
-        first_chars = input_message.lstrip()[0:3]
+        first_chars = input_message.lead(3)
         if first_chars.upper() == "MSH":
             edi_message_format = EdiMessageFormat.HL7
         elif first_chars.upper() == "ISA":
             edi_message_format = EdiMessageFormat.X12
     elif base_message_format == BaseMessageFormat.JSON:
-        json_message = json.loads(input_message)
+        json_message = load_json(input_message.parseable())
         if json_message.get("resourceType") is not None:
             edi_message_format = EdiMessageFormat.FHIR
     elif base_message_format == BaseMessageFormat.XML:
-        xml_message = load_xml(input_message)
-        if "http://hl7.org/fhir" in xml_message.tag.lower():
-            raise NotImplementedError("FHIR Xml Support Is Not Implemented")
+        # only the root element is parsed
+        if is_fhir_xml(input_message.data):
+            edi_message_format = EdiMessageFormat.FHIR
     elif base_message_format == BaseMessageFormat.BINARY:
         # test for DICOM identifier
-        if input_message[128:132] == "DICM".encode("utf-8"):
+        if input_message.data[128:132] == b"DICM":
             edi_message_format = EdiMessageFormat.DICOM
 
     if edi_message_format is None:
@@ -323,7 +321,7 @@ def _get_edi_message_format(
     return edi_message_format
 
 
-def analyze(input_message: Union[bytes, str]):
+def analyze(input_message: Union[bytes, str, EdiMessageBuffer]):
     """
     Returns an EdiMessageMetadata document for the given input message
 
@@ -334,6 +332,9 @@ def analyze(input_message: Union[bytes, str]):
     if input_message is None or len(input_message) < MESSAGE_SAMPLE_SIZE:
         raise EdiDataValidationException("Invalid input message")
 
+    if not isinstance(input_message, EdiMessageBuffer):
+        input_message = EdiMessageBuffer(input_message)
+
     base_message_format: BaseMessageFormat = _get_base_message_format(input_message)
     edi_message_format: EdiMessageFormat = _get_edi_message_format(
         input_message, base_message_format
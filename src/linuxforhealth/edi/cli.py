@@ -4,25 +4,50 @@ cli.py
 Implements a command line interface for the EDI service/application.
 """
 import argparse
+import os
+import sys
+from typing import Iterator, List, Optional, Tuple, Union
 
-from .models import EdiResult
-from .workflows import EdiWorkflow, load_workflow_from_file
+from .models import CompressionFormat, EdiResult, EdiStudyResult, ValidationLevel
+from .support import (
+    COMPRESSION_MAGIC_SIZE,
+    DICOMDIR_FILE_NAME,
+    detect_compression,
+    dump_edi_result,
+)
+from .pipeline import EdiPipeline, get_default_pipeline
+from .profiling import MessageProfiler
+from .sinks import create_result_sink
+from .spool import SpoolWatcher
+from .workflows import (
+    BatchWorkflow,
+    EdiWorkflow,
+    load_workflow_from_file,
+    load_study_workflow,
+)
 
 CLI_DESCRIPTION = """
 Analyze, Enrich, Validate and Translate EDI Messages using the LinuxForHealth CLI!
 The LinuxForHealth EDI CLI accepts an input EDI message and returns an EdiResult object (JSON).
 The CLI's options are used to specify which EDI operations are included.
 If no options are provided, the CLI will execute all available operations.
+DICOM studies are processed by providing the study directory or DICOMDIR file, which returns an EdiStudyResult.
+Multiple EDI files, or zip archives, are processed as a batch, returning one EdiResult JSON line per message.
+gzip, bzip2 and zip files are decompressed in memory. Batch runs which use a journal can be resumed, skipping files
+which were already processed.
+Results are written to an NDJSON, SQLite or Parquet file, rather than stdout, with the output option.
+Files delivered to a spool directory are processed continuously with "lfhedi watch <spool directory>".
 """
 
+WATCH_DESCRIPTION = """
+Continuously processes EDI files delivered to a spool directory.
+Files are claimed by renaming them, processed, and moved to the done or failed directory alongside a
+<file name>.result.ndjson file containing the file's results. Files should be renamed into the spool once written.
+"""
 
-def create_arg_parser() -> argparse.Namespace:
-    arg_parser = argparse.ArgumentParser(
-        prog="LinuxForHealth EDI",
-        description=CLI_DESCRIPTION,
-        formatter_class=argparse.RawDescriptionHelpFormatter,
-        epilog="All messages are analyzed by default",
-    )
+
+def add_pipeline_arguments(arg_parser: argparse.ArgumentParser) -> None:
+    """Adds the arguments which configure the processing pipeline"""
     arg_parser.add_argument(
         "-a",
         "--all",
@@ -44,6 +69,13 @@ def create_arg_parser() -> argparse.Namespace:
         action="store_const",
         const="validate",
     )
+    arg_parser.add_argument(
+        "-l",
+        "--validation-level",
+        help="the validation level used when validating the EDI message. Defaults to full",
+        choices=[v.value for v in ValidationLevel],
+        default=ValidationLevel.FULL.value,
+    )
     arg_parser.add_argument(
         "-t",
         "--translate",
@@ -51,6 +83,44 @@ def create_arg_parser() -> argparse.Namespace:
         action="store_const",
         const="translate",
     )
+    arg_parser.add_argument(
+        "--profile",
+        help="profiles messages, writing per-message profiles and aggregated collapsed stacks to this directory",
+    )
+    arg_parser.add_argument(
+        "--profile-every",
+        help="profiles every Nth message with cProfile. Defaults to every message unless --profile-slower-than is used",
+        type=int,
+    )
+    arg_parser.add_argument(
+        "--profile-slower-than",
+        help="samples every message, writing the stacks of messages which take longer than this number of seconds",
+        type=float,
+    )
+
+
+def add_output_arguments(arg_parser: argparse.ArgumentParser) -> None:
+    """Adds the arguments which write results to a result sink"""
+    arg_parser.add_argument(
+        "-o",
+        "--output",
+        help="writes results to a .ndjson, .jsonl, .db, .sqlite or .parquet file. Parquet requires pyarrow",
+    )
+    arg_parser.add_argument(
+        "--output-max-size",
+        help="the size, in MB, at which an NDJSON output file is rotated",
+        type=int,
+    )
+
+
+def create_arg_parser() -> argparse.Namespace:
+    arg_parser = argparse.ArgumentParser(
+        prog="LinuxForHealth EDI",
+        description=CLI_DESCRIPTION,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="All messages are analyzed by default",
+    )
+    add_pipeline_arguments(arg_parser)
 
     arg_parser.add_argument(
         "-p",
@@ -60,11 +130,183 @@ def create_arg_parser() -> argparse.Namespace:
         const="pretty",
     )
 
-    arg_parser.add_argument("edi_file", help="the path to the EDI message")
+    arg_parser.add_argument(
+        "-j",
+        "--journal",
+        help="records processed files in a journal, and skips files journaled by a previous run",
+    )
+    arg_parser.add_argument(
+        "--retry-failed",
+        help="reprocesses journaled files which failed",
+        action="store_true",
+    )
+
+    arg_parser.add_argument(
+        "-w",
+        "--workers",
+        help="the number of processes used for batch runs. Files are scheduled largest first. Defaults to 1",
+        type=int,
+        default=1,
+    )
+    arg_parser.add_argument(
+        "--memory-budget",
+        help="the estimated memory, in MB, available to files processed concurrently in a batch run",
+        type=int,
+    )
+    arg_parser.add_argument(
+        "--timeout",
+        help="the wall clock time limit, in seconds, per file in a batch run. Workers which exceed the limit are replaced",
+        type=float,
+    )
+    arg_parser.add_argument(
+        "--cpu-timeout",
+        help="the CPU time limit, in seconds, per file in a batch run",
+        type=float,
+    )
+    arg_parser.add_argument(
+        "--max-worker-messages",
+        help="the number of files a batch worker process handles before it is replaced",
+        type=int,
+    )
+    arg_parser.add_argument(
+        "--max-worker-rss",
+        help="the resident memory, in MB, above which a batch worker process is replaced",
+        type=int,
+    )
+    add_output_arguments(arg_parser)
+
+    arg_parser.add_argument(
+        "edi_file",
+        nargs="+",
+        help="the path to the EDI message, DICOM study directory, or DICOMDIR file. Multiple EDI files are processed as a batch",
+    )
     return arg_parser.parse_args()
 
 
-def process_edi(args) -> EdiResult:
+def create_watch_arg_parser(argv: List[str]) -> argparse.Namespace:
+    """Parses the arguments of the watch command, which processes files delivered to a spool directory"""
+    arg_parser = argparse.ArgumentParser(
+        prog="LinuxForHealth EDI watch",
+        description=WATCH_DESCRIPTION,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    add_pipeline_arguments(arg_parser)
+    arg_parser.add_argument(
+        "--done",
+        help="the directory processed files are moved to. Defaults to <spool directory>/done",
+    )
+    arg_parser.add_argument(
+        "--failed",
+        help="the directory failed files are moved to. Defaults to <spool directory>/failed",
+    )
+    arg_parser.add_argument(
+        "-w",
+        "--workers",
+        help="the number of processes used to process files. Defaults to 1",
+        type=int,
+        default=1,
+    )
+    arg_parser.add_argument(
+        "--chunk-size",
+        help="the number of files sent to a worker process at a time. Defaults to 16",
+        type=int,
+        default=16,
+    )
+    arg_parser.add_argument(
+        "--timeout",
+        help="the wall clock time limit, in seconds, per chunk of files. Workers which exceed the limit are replaced",
+        type=float,
+    )
+    arg_parser.add_argument(
+        "--poll-interval",
+        help="the maximum time, in seconds, between checks for new files. Defaults to 1",
+        type=float,
+        default=1.0,
+    )
+    arg_parser.add_argument(
+        "--no-inotify",
+        help="polls the spool directory rather than using inotify",
+        action="store_true",
+    )
+    add_output_arguments(arg_parser)
+
+    arg_parser.add_argument(
+        "spool_directory", help="the directory files are delivered to"
+    )
+    return arg_parser.parse_args(argv)
+
+
+def is_archive(file_path: str) -> bool:
+    """Returns True if a file is a zip archive, which may contain multiple messages"""
+    if not os.path.isfile(file_path):
+        return False
+    with open(file_path, "rb") as f:
+        return (
+            detect_compression(f.read(COMPRESSION_MAGIC_SIZE)) == CompressionFormat.ZIP
+        )
+
+
+def is_batch(args) -> bool:
+    """Returns True if the CLI arguments specify a batch run"""
+    return len(args.edi_file) > 1 or bool(args.journal) or is_archive(args.edi_file[0])
+
+
+def create_pipeline(args) -> EdiPipeline:
+    """Returns the pipeline for the CLI arguments, attaching a MessageProfiler when profiling is requested"""
+    pipeline = get_default_pipeline(
+        enrich=bool(args.enrich),
+        validate=bool(args.validate),
+        translate=bool(args.translate),
+        validation_level=ValidationLevel(args.validation_level),
+    )
+    if not args.profile:
+        return pipeline
+
+    profiler = MessageProfiler(
+        args.profile,
+        every=args.profile_every
+        or (None if args.profile_slower_than is not None else 1),
+        slower_than=args.profile_slower_than,
+    )
+    # the default pipeline is shared, so the profiled pipeline is a copy
+    return EdiPipeline(pipeline.stages, profiler=profiler)
+
+
+def process_batch(args) -> Iterator[Tuple[str, Union[EdiResult, Exception]]]:
+    """
+    Processes a batch of EDI files, returning the result for each processed file.
+    Files recorded in the journal by a previous run are skipped.
+    """
+    batch_workflow = BatchWorkflow(
+        args.edi_file,
+        journal_path=args.journal,
+        pipeline=create_pipeline(args),
+        retry_failed=args.retry_failed,
+        max_workers=args.workers,
+        memory_budget=args.memory_budget * 1024 * 1024 if args.memory_budget else None,
+        message_timeout=args.timeout,
+        cpu_timeout=args.cpu_timeout,
+        max_messages_per_worker=args.max_worker_messages,
+        max_worker_rss=args.max_worker_rss * 1024 * 1024
+        if args.max_worker_rss
+        else None,
+    )
+    yield from batch_workflow.run()
+
+    if batch_workflow.skipped_count:
+        print(
+            f"Skipped {batch_workflow.skipped_count} journaled files",
+            file=sys.stderr,
+        )
+    if batch_workflow.metrics.memory:
+        step_peaks = ", ".join(
+            f"{name} {m.peakBytes / 1024:.1f} KB ({m.sampleCount} sampled)"
+            for name, m in batch_workflow.metrics.memory.items()
+        )
+        print(f"Peak memory by step: {step_peaks}", file=sys.stderr)
+
+
+def process_edi(args) -> Union[EdiResult, EdiStudyResult]:
     """
     Processes an EDI message.
     Keyword arguments are used to drive workflow processing and align with CLI options. The "analyze" step is included
@@ -73,22 +315,90 @@ def process_edi(args) -> EdiResult:
     - enrich
     - validate
     - translate
+    - validation_level
+    - profile
 
     Additional kwargs used for processing:
     - pretty: indicates if the output EDIResult is "pretty printed"
     """
-    workflow: EdiWorkflow = load_workflow_from_file(args.edi_file)
-    result = workflow.run(
-        enrich=args.enrich, validate=args.validate, translate=args.translate
+    edi_file = args.edi_file[0]
+    if os.path.isdir(edi_file) or os.path.basename(edi_file) == DICOMDIR_FILE_NAME:
+        return load_study_workflow(edi_file).run()
+
+    workflow: EdiWorkflow = load_workflow_from_file(edi_file)
+    return workflow.run(pipeline=create_pipeline(args))
+
+
+def watch(args) -> None:
+    """Processes files delivered to a spool directory until interrupted"""
+    sink = (
+        create_result_sink(args.output, max_file_size=_output_max_file_size(args))
+        if args.output
+        else None
+    )
+    watcher = SpoolWatcher(
+        args.spool_directory,
+        pipeline=create_pipeline(args),
+        done_directory=args.done,
+        failed_directory=args.failed,
+        max_workers=args.workers,
+        chunk_size=args.chunk_size,
+        message_timeout=args.timeout,
+        poll_interval=args.poll_interval,
+        use_inotify=not args.no_inotify,
+        sink=sink,
     )
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+        if sink:
+            sink.close()
+        print(
+            f"Processed {watcher.processed_count} files, {watcher.failed_count} failed",
+            file=sys.stderr,
+        )
+
 
-    return result
+def _output_max_file_size(args) -> Optional[int]:
+    """Returns the NDJSON output rotation size, in bytes"""
+    return args.output_max_size * 1024 * 1024 if args.output_max_size else None
+
+
+def write_results(args, results: Iterator[Tuple[str, Union[EdiResult, Exception]]]):
+    """Writes results to the output file specified in the CLI arguments"""
+    with create_result_sink(
+        args.output, max_file_size=_output_max_file_size(args)
+    ) as sink:
+        for file_path, edi_result in results:
+            sink.write(file_path, edi_result)
+    print(f"Wrote {sink.count} results to {args.output}", file=sys.stderr)
 
 
 def main():
+    if sys.argv[1:2] == ["watch"]:
+        watch(create_watch_arg_parser(sys.argv[2:]))
+        return
+
     args = create_arg_parser()
+
+    if args.output and is_batch(args):
+        write_results(args, process_batch(args))
+        return
+
+    if is_batch(args):
+        # batch results are written as one JSON line per file
+        for file_path, edi_result in process_batch(args):
+            if isinstance(edi_result, Exception):
+                print(f"{file_path}: {edi_result}", file=sys.stderr)
+            else:
+                print(dump_edi_result(edi_result))
+        return
+
     edi_result = process_edi(args)
-    if args.pretty:
-        print(edi_result.json(indent=4, sort_keys=True))
-    else:
-        print(edi_result.json())
+    if args.output and isinstance(edi_result, EdiResult):
+        write_results(args, iter([(args.edi_file[0], edi_result)]))
+        return
+    print(dump_edi_result(edi_result, pretty=bool(args.pretty)))
@@ -0,0 +1,138 @@
+"""
+config.py
+
+EDI application settings.
+Settings are read from environment variables prefixed with LFH_EDI_, or from a .env file in the working directory.
+"""
+from functools import lru_cache
+from typing import List, Optional
+from pydantic import BaseSettings, validator
+
+# supported JSON backends. "auto" selects the fastest installed backend
+JSON_BACKENDS = ("auto", "orjson", "ujson", "json")
+# duplicate message handling. "flag" marks duplicates in the result, "skip" also skips the remaining workflow steps
+DEDUPE_MODES = ("flag", "skip")
+# supported FHIR releases, in the order FHIR messages are matched against them
+FHIR_RELEASES = ("R4", "STU3", "DSTU2")
+
+
+class EdiSettings(BaseSettings):
+    """
+    EDI application settings
+    """
+
+    json_backend: str = "auto"
+    # directory containing terminology reference files and indexes used for enrichment
+    terminology_directory: Optional[str] = None
+    # maximum number of terminology lookups cached per code system
+    terminology_cache_size: int = 65536
+    # directory containing the persistent checksum index used to detect duplicate messages
+    dedupe_directory: Optional[str] = None
+    # number of days a checksum is considered a duplicate. None retains checksums indefinitely
+    dedupe_retention_days: Optional[float] = None
+    dedupe_mode: str = "flag"
+    # number of checksums appended to the index log before the index is compacted
+    dedupe_compact_threshold: int = 100000
+    # maximum decompressed size, in bytes, of a gzip or bzip2 message or a zip archive member. None is unlimited
+    max_decompressed_size: Optional[int] = 4 * 1024 * 1024 * 1024
+    # fraction of messages, from 0 to 1, for which per-step memory usage is traced with tracemalloc
+    memory_sample_rate: float = 0.0
+    # number of processes used to fully validate large X12 837 transactions. 1 validates within the current process
+    x12_validation_workers: int = 1
+    # number of claims in each chunk of a large X12 837 transaction validated in parallel
+    x12_validation_chunk_claims: int = 1000
+    # FHIR releases and resource types whose model classes are loaded when a worker starts
+    fhir_warmup_releases: List[str] = ["R4"]
+    fhir_warmup_resource_types: List[str] = []
+    # messages and message bytes processed concurrently by admitted workflows, overall and per tenant. None is unlimited
+    admission_max_messages: Optional[int] = None
+    admission_max_bytes: Optional[int] = None
+    admission_tenant_max_messages: Optional[int] = None
+    admission_tenant_max_bytes: Optional[int] = None
+    # share, from 0 to 1, of the overall admission budgets available to bulk messages
+    admission_bulk_share: float = 0.5
+    # size, in bytes, at which messages are admitted as bulk messages
+    admission_bulk_message_size: int = 1048576
+    # number of messages queued in each admission lane, and the seconds a message is queued before it is rejected
+    admission_max_queue: int = 100
+    admission_queue_timeout: float = 30.0
+
+    @validator("json_backend")
+    def validate_json_backend(cls, value: str) -> str:
+        value = value.lower()
+        if value not in JSON_BACKENDS:
+            raise ValueError(f"json_backend must be one of {', '.join(JSON_BACKENDS)}")
+        return value
+
+    @validator("memory_sample_rate")
+    def validate_memory_sample_rate(cls, value: float) -> float:
+        if not 0 <= value <= 1:
+            raise ValueError("memory_sample_rate must be between 0 and 1")
+        return value
+
+    @validator(
+        "x12_validation_workers",
+        "x12_validation_chunk_claims",
+        "admission_bulk_message_size",
+    )
+    def validate_positive(cls, value: int, field) -> int:
+        if value < 1:
+            raise ValueError(f"{field.name} must be at least 1")
+        return value
+
+    @validator(
+        "admission_max_messages",
+        "admission_max_bytes",
+        "admission_tenant_max_messages",
+        "admission_tenant_max_bytes",
+    )
+    def validate_admission_budget(cls, value: Optional[int], field) -> Optional[int]:
+        if value is not None and value < 1:
+            raise ValueError(f"{field.name} must be at least 1")
+        return value
+
+    @validator("max_decompressed_size")
+    def validate_max_decompressed_size(cls, value: Optional[int]) -> Optional[int]:
+        if value is not None and value < 1:
+            raise ValueError("max_decompressed_size must be at least 1")
+        return value
+
+    @validator("admission_bulk_share")
+    def validate_admission_bulk_share(cls, value: float) -> float:
+        if not 0 < value <= 1:
+            raise ValueError(
+                "admission_bulk_share must be greater than 0 and at most 1"
+            )
+        return value
+
+    @validator("admission_max_queue", "admission_queue_timeout")
+    def validate_not_negative(cls, value, field):
+        if value < 0:
+            raise ValueError(f"{field.name} must not be negative")
+        return value
+
+    @validator("fhir_warmup_releases", each_item=True)
+    def validate_fhir_warmup_releases(cls, value: str) -> str:
+        value = value.upper()
+        if value not in FHIR_RELEASES:
+            raise ValueError(
+                f"fhir_warmup_releases values must be one of {', '.join(FHIR_RELEASES)}"
+            )
+        return value
+
+    @validator("dedupe_mode")
+    def validate_dedupe_mode(cls, value: str) -> str:
+        value = value.lower()
+        if value not in DEDUPE_MODES:
+            raise ValueError(f"dedupe_mode must be one of {', '.join(DEDUPE_MODES)}")
+        return value
+
+    class Config:
+        env_prefix = "lfh_edi_"
+        env_file = ".env"
+
+
+@lru_cache()
+def get_settings() -> EdiSettings:
+    """Returns the EDI settings, loading them on first use"""
+    return EdiSettings()
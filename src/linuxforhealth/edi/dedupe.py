@@ -0,0 +1,432 @@
+"""
+dedupe.py
+
+A persistent index of EDI message checksums, used to detect messages which were processed by a previous run.
+
+The index directory contains:
+* checksums.idx - a sorted, memory-mapped table of (SHA-256 digest, first seen timestamp) records
+* checksums.log - records appended since the table was last compacted
+* checksums.bloom - a Bloom filter containing the digests within the table
+* checksums.lock - locked while the index is compacted
+
+Lookups check the Bloom filter first, so most new messages are identified without searching the table. Compaction
+merges the log into the table, drops records which are older than the retention window and rebuilds the Bloom filter.
+The index is compacted when it is opened if the log exceeds the compaction threshold, unless another process is
+compacting it.
+
+Indexes may be shared by multiple processes. Compaction holds an exclusive lock on the lock file, while opening the
+index and appending to the log hold a shared lock, so records appended by other processes are merged rather than
+lost. Locks are not available on platforms without fcntl, where a single process should use the index at a time.
+A checksum which expires and is seen again is recorded with the new timestamp, and lookups use the newest record.
+
+Usage:
+index = DedupeIndex("/data/dedupe", retention_seconds=90 * 86400)
+if not index.check_and_add(edi_result.metadata.checksum):
+    ...
+"""
+from contextlib import contextmanager
+from functools import lru_cache
+import logging
+import math
+import mmap
+import os
+import struct
+import tempfile
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .config import get_settings
+
+logger = logging.getLogger(__name__)
+
+TABLE_FILE_NAME = "checksums.idx"
+LOG_FILE_NAME = "checksums.log"
+BLOOM_FILE_NAME = "checksums.bloom"
+LOCK_FILE_NAME = "checksums.lock"
+
+TABLE_MAGIC = b"LFHEDDX1"
+BLOOM_MAGIC = b"LFHEDBF1"
+# magic value and record count
+TABLE_HEADER = struct.Struct("<8sQ")
+# magic value, bit count and hash count
+BLOOM_HEADER = struct.Struct("<8sQQ")
+# SHA-256 digest and first seen timestamp, in seconds since the epoch
+RECORD = struct.Struct("<32sQ")
+
+# the minimum number of digests a Bloom filter is sized for
+MIN_BLOOM_CAPACITY = 100000
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+
+
+class BloomFilter:
+    """
+    A Bloom filter for SHA-256 digests.
+    Digests are uniformly distributed, so bit positions are derived from the digest using double hashing rather than
+    by rehashing the value.
+    """
+
+    def __init__(
+        self, bit_count: int, hash_count: int, bits: Optional[bytearray] = None
+    ):
+        """
+        :param bit_count: The number of bits in the filter
+        :param hash_count: The number of bit positions set per digest
+        :param bits: The filter's bits. Defaults to an empty filter.
+        """
+        self.bit_count = bit_count
+        self.hash_count = hash_count
+        self.bits = bits if bits is not None else bytearray((bit_count + 7) // 8)
+
+    @classmethod
+    def create(
+        cls, capacity: int, false_positive_rate: float = BLOOM_FALSE_POSITIVE_RATE
+    ) -> "BloomFilter":
+        """
+        Creates an empty filter sized for a number of digests.
+        :param capacity: The expected number of digests
+        :param false_positive_rate: The false positive rate at capacity
+        """
+        capacity = max(capacity, 1)
+        bit_count = int(-capacity * math.log(false_positive_rate) / (math.log(2) ** 2))
+        hash_count = max(1, round(bit_count / capacity * math.log(2)))
+        return cls(bit_count, hash_count)
+
+    def _positions(self, digest: bytes) -> Iterator[int]:
+        """Returns the bit positions for a digest"""
+        h1 = int.from_bytes(digest[0:8], "little")
+        h2 = int.from_bytes(digest[8:16], "little") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.bit_count
+
+    def add(self, digest: bytes) -> None:
+        """Adds a digest to the filter"""
+        for position in self._positions(digest):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, digest: bytes) -> bool:
+        """Returns False if the digest was not added to the filter. True results may be false positives."""
+        for position in self._positions(digest):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def save(self, file_path: str) -> None:
+        """Writes the filter to a file"""
+        with open(file_path, "wb") as f:
+            f.write(BLOOM_HEADER.pack(BLOOM_MAGIC, self.bit_count, self.hash_count))
+            f.write(self.bits)
+
+    @classmethod
+    def load(cls, file_path: str) -> "BloomFilter":
+        """
+        Reads a filter from a file.
+        :raises: ValueError if the file is not a Bloom filter
+        """
+        with open(file_path, "rb") as f:
+            data = f.read()
+
+        if len(data) < BLOOM_HEADER.size:
+            raise ValueError(f"{file_path} is not a Bloom filter")
+        magic, bit_count, hash_count = BLOOM_HEADER.unpack_from(data, 0)
+        if magic != BLOOM_MAGIC:
+            raise ValueError(f"{file_path} is not a Bloom filter")
+        return cls(bit_count, hash_count, bytearray(data[BLOOM_HEADER.size :]))
+
+
+class DedupeIndex:
+    """
+    A persistent set of message checksums with an optional retention window.
+    """
+
+    def __init__(
+        self,
+        index_directory: str,
+        retention_seconds: Optional[float] = None,
+        compact_threshold: int = 100000,
+    ):
+        """
+        Opens the index, creating the directory if required.
+        :param index_directory: The index directory
+        :param retention_seconds: Checksums first seen before the retention window are not considered duplicates, and
+        are removed when the index is compacted. Defaults to None, which retains checksums indefinitely.
+        :param compact_threshold: The number of log records which triggers compaction when the index is opened. The
+        index is not compacted if another process holds the compaction lock.
+        """
+        self.index_directory = index_directory
+        self.retention_seconds = retention_seconds
+        self.compact_threshold = compact_threshold
+
+        os.makedirs(index_directory, exist_ok=True)
+        self.table_path = os.path.join(index_directory, TABLE_FILE_NAME)
+        self.log_path = os.path.join(index_directory, LOG_FILE_NAME)
+        self.bloom_path = os.path.join(index_directory, BLOOM_FILE_NAME)
+        self.lock_path = os.path.join(index_directory, LOCK_FILE_NAME)
+
+        self._mmap: Optional[mmap.mmap] = None
+        self.table_size = 0
+        self.bloom: Optional[BloomFilter] = None
+        self.log_records: Dict[bytes, int] = {}
+        self._log_file = None
+        self._lock_file = open(self.lock_path, "ab")
+
+        with self._lock(exclusive=False):
+            self._open()
+        if len(self.log_records) >= compact_threshold:
+            self.compact(blocking=False)
+
+    @contextmanager
+    def _lock(self, exclusive: bool, blocking: bool = True) -> Iterator[bool]:
+        """
+        Locks the index's lock file.
+        :param exclusive: True for an exclusive lock, False for a shared lock
+        :param blocking: When False, the lock is not acquired if another process holds a conflicting lock
+        :returns: True if the lock was acquired
+        """
+        if fcntl is None:
+            yield True
+            return
+
+        operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        if not blocking:
+            operation |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(self._lock_file.fileno(), operation)
+        except BlockingIOError:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _open(self) -> None:
+        """Maps the table, loads the Bloom filter and log, and opens the log for appending"""
+        if os.path.isfile(self.table_path):
+            with open(self.table_path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic = None
+            if len(self._mmap) >= TABLE_HEADER.size:
+                magic, self.table_size = TABLE_HEADER.unpack_from(self._mmap, 0)
+            if magic != TABLE_MAGIC:
+                self._mmap.close()
+                raise ValueError(f"{self.table_path} is not a dedupe index")
+
+        self.log_records = dict(self._read_log())
+
+        if os.path.isfile(self.bloom_path):
+            self.bloom = BloomFilter.load(self.bloom_path)
+        else:
+            self.bloom = BloomFilter.create(
+                max(MIN_BLOOM_CAPACITY, 2 * (self.table_size + len(self.log_records)))
+            )
+            for digest, _ in self._table_records():
+                self.bloom.add(digest)
+
+        for digest in self.log_records:
+            self.bloom.add(digest)
+
+        self._log_file = open(self.log_path, "ab")
+
+    def _read_log(self) -> Iterator[Tuple[bytes, int]]:
+        """Reads log records. A partially written final record is ignored."""
+        if not os.path.isfile(self.log_path):
+            return
+
+        with open(self.log_path, "rb") as f:
+            data = f.read()
+
+        complete_size = len(data) - len(data) % RECORD.size
+        for offset in range(0, complete_size, RECORD.size):
+            yield RECORD.unpack_from(data, offset)
+
+    def _table_records(self) -> Iterator[Tuple[bytes, int]]:
+        """Reads the table's records in digest order"""
+        for i in range(self.table_size):
+            yield RECORD.unpack_from(self._mmap, TABLE_HEADER.size + i * RECORD.size)
+
+    def _search_table(self, digest: bytes) -> Optional[int]:
+        """
+        Searches the table for a digest.
+        :returns: the digest's first seen timestamp, or None if the digest is not in the table
+        """
+        low = 0
+        high = self.table_size
+
+        while low < high:
+            middle = (low + high) // 2
+            record_digest, timestamp = RECORD.unpack_from(
+                self._mmap, TABLE_HEADER.size + middle * RECORD.size
+            )
+            if record_digest < digest:
+                low = middle + 1
+            elif record_digest > digest:
+                high = middle
+            else:
+                return timestamp
+
+        return None
+
+    def _is_retained(self, timestamp: int, now: float) -> bool:
+        """Returns True if a timestamp is within the retention window"""
+        return (
+            self.retention_seconds is None or timestamp >= now - self.retention_seconds
+        )
+
+    def first_seen(self, checksum: str) -> Optional[int]:
+        """
+        Returns the timestamp when a checksum was first added.
+        :param checksum: The hex SHA-256 message checksum
+        :returns: seconds since the epoch, or None if the checksum is not indexed or has expired
+        """
+        digest = bytes.fromhex(checksum)
+        if digest not in self.bloom:
+            return None
+
+        # an expired checksum which is seen again is recorded in the log, so the newest record is used
+        timestamps = [
+            self._search_table(digest) if self._mmap else None,
+            self.log_records.get(digest),
+        ]
+        timestamp = max((t for t in timestamps if t is not None), default=None)
+        if timestamp is None or not self._is_retained(timestamp, time.time()):
+            return None
+        return timestamp
+
+    def __contains__(self, checksum: str) -> bool:
+        """Returns True if a checksum is indexed and within the retention window"""
+        return self.first_seen(checksum) is not None
+
+    def add(self, checksum: str) -> None:
+        """
+        Adds a checksum to the index. Checksums which are already indexed, and retained, are not added again.
+        :param checksum: The hex SHA-256 message checksum
+        """
+        self.check_and_add(checksum)
+
+    def check_and_add(self, checksum: str) -> bool:
+        """
+        Adds a checksum to the index if it is not already present.
+        :param checksum: The hex SHA-256 message checksum
+        :returns: True if the checksum was already indexed
+        """
+        if checksum in self:
+            return True
+
+        digest = bytes.fromhex(checksum)
+        timestamp = int(time.time())
+        with self._lock(exclusive=False):
+            self._log_file.write(RECORD.pack(digest, timestamp))
+            self._log_file.flush()
+        self.log_records[digest] = timestamp
+        self.bloom.add(digest)
+        return False
+
+    def _temp_path(self, file_name: str) -> str:
+        """Returns a new, unique temporary file path within the index directory"""
+        fd, temp_path = tempfile.mkstemp(
+            prefix=f"{file_name}.", suffix=".tmp", dir=self.index_directory
+        )
+        os.close(fd)
+        return temp_path
+
+    def compact(self, blocking: bool = True) -> Optional[int]:
+        """
+        Merges the log into the table, removes expired checksums and rebuilds the Bloom filter.
+        The index is reloaded under the compaction lock, so records appended by other processes are merged.
+        :param blocking: When False, the index is not compacted if another process holds the compaction lock
+        :returns: the number of checksums in the compacted index, or None if the index was not compacted
+        """
+        with self._lock(exclusive=True, blocking=blocking) as is_locked:
+            if not is_locked:
+                logger.debug(f"Dedupe index {self.index_directory} is being compacted")
+                return None
+
+            self._close_files()
+            self._open()
+
+            now = time.time()
+            records: Dict[bytes, int] = {}
+            if self._mmap:
+                for digest, timestamp in self._table_records():
+                    records[digest] = timestamp
+            for digest, timestamp in self.log_records.items():
+                records[digest] = max(records.get(digest, timestamp), timestamp)
+
+            digests = sorted(d for d, t in records.items() if self._is_retained(t, now))
+
+            table_temp_path = self._temp_path(TABLE_FILE_NAME)
+            bloom_temp_path = self._temp_path(BLOOM_FILE_NAME)
+            try:
+                with open(table_temp_path, "wb") as f:
+                    f.write(TABLE_HEADER.pack(TABLE_MAGIC, len(digests)))
+                    for digest in digests:
+                        f.write(RECORD.pack(digest, records[digest]))
+                    f.flush()
+                    os.fsync(f.fileno())
+
+                bloom = BloomFilter.create(max(MIN_BLOOM_CAPACITY, 2 * len(digests)))
+                for digest in digests:
+                    bloom.add(digest)
+                bloom.save(bloom_temp_path)
+
+                self._close_files()
+                os.replace(table_temp_path, self.table_path)
+                os.replace(bloom_temp_path, self.bloom_path)
+            finally:
+                for temp_path in (table_temp_path, bloom_temp_path):
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+
+            open(self.log_path, "wb").close()
+            self._open()
+
+        logger.info(
+            f"Compacted dedupe index {self.index_directory}: {len(digests)} checksums"
+        )
+        return len(digests)
+
+    def _close_files(self) -> None:
+        """Closes the table and log"""
+        if self._mmap:
+            self._mmap.close()
+            self._mmap = None
+        if self._log_file:
+            self._log_file.close()
+            self._log_file = None
+
+    def close(self) -> None:
+        """Closes the index"""
+        self._close_files()
+        if self._lock_file:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+@lru_cache()
+def get_dedupe_index() -> Optional[DedupeIndex]:
+    """Returns the DedupeIndex for the configured directory, or None if duplicate detection is not configured"""
+    settings = get_settings()
+    if not settings.dedupe_directory:
+        return None
+
+    retention_seconds = None
+    if settings.dedupe_retention_days is not None:
+        retention_seconds = settings.dedupe_retention_days * 86400
+
+    return DedupeIndex(
+        settings.dedupe_directory,
+        retention_seconds=retention_seconds,
+        compact_threshold=settings.dedupe_compact_threshold,
+    )
@@ -28,3 +28,51 @@ class EdiDataValidationException(EdiException):
     """
 
     pass
+
+
+class EdiDedupeException(EdiException):
+    """
+    Raised when an exception occurs during duplicate detection.
+    """
+
+    pass
+
+
+class EdiEnrichmentException(EdiException):
+    """
+    Raised when an exception occurs during the enrichment phase.
+    """
+
+    pass
+
+
+class EdiTranslationException(EdiException):
+    """
+    Raised when an exception occurs during the translation phase.
+    """
+
+    pass
+
+
+class EdiTimeoutException(EdiException):
+    """
+    Raised when processing a message exceeds its CPU or wall clock time limit.
+    """
+
+    pass
+
+
+class EdiWorkerException(EdiException):
+    """
+    Raised when a worker process exits while processing a message.
+    """
+
+    pass
+
+
+class EdiAdmissionException(EdiException):
+    """
+    Raised when a message is not admitted for processing because its budgets are exhausted.
+    """
+
+    pass
@@ -0,0 +1,390 @@
+"""
+fhir_xml.py
+
+Streaming FHIR XML support.
+
+FHIR XML messages are read with an lxml pull parser, which is fed the message in chunks, so a message is read without
+copying it or building its full element tree. Elements are cleared once they are processed, so memory use is bounded
+by the depth of the document rather than its size, and large Bundles are processed in a single pass.
+
+* scan_fhir_xml reads the resourceType, meta.profile values and top level element names used by analysis and
+  structural validation
+* load_fhir_xml converts a FHIR XML resource to its FHIR JSON representation as it is parsed, using the fhir.resources
+  model classes to resolve element types and cardinality, and validates it with the same models as FHIR JSON
+* iter_fhir_xml_codes extracts Coding and Identifier system and code values for enrichment
+
+Usage:
+summary = scan_fhir_xml(message_bytes)
+fhir_resource = load_fhir_xml(message_bytes, "R4")
+"""
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple, Type, Union
+import mmap
+
+from lxml import etree
+from pydantic.fields import SHAPE_LIST, ModelField
+
+from .config import FHIR_RELEASES
+from .exceptions import EdiDataValidationException
+from .support import construct_fhir_resource, get_fhir_model_class
+
+FHIR_NAMESPACE = "http://hl7.org/fhir"
+XHTML_NAMESPACE = "http://www.w3.org/1999/xhtml"
+_FHIR_TAG_PREFIX = f"{{{FHIR_NAMESPACE}}}"
+# narrative divs are in the XHTML namespace
+_XHTML_DIV_TAG = f"{{{XHTML_NAMESPACE}}}div"
+
+# the number of bytes fed to the parser at a time
+FEED_SIZE = 64 * 1024
+
+# the element type of fields which contain a resource, such as Bundle.entry.resource and contained
+_RESOURCE_ELEMENT_TYPE = "Resource"
+# the element type of extensions and ids on primitive elements
+_PRIMITIVE_EXTENSION_TYPE = "FHIRPrimitiveExtension"
+# attributes of complex elements which are represented as JSON properties
+_COMPLEX_ATTRIBUTES = ("id", "url")
+
+XmlData = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+
+def _fail(msg: str) -> None:
+    raise EdiDataValidationException(msg)
+
+
+def _local_name(element: etree._Element) -> str:
+    """Returns an element's name without the FHIR namespace. Elements in other namespaces retain their namespace."""
+    tag = element.tag
+    return tag[len(_FHIR_TAG_PREFIX) :] if tag.startswith(_FHIR_TAG_PREFIX) else tag
+
+
+def _release_previous(element: etree._Element) -> None:
+    """Clears an element, and removes its processed siblings, so the tree does not grow as the message is parsed"""
+    element.clear()
+    parent = element.getparent()
+    if parent is not None:
+        while element.getprevious() is not None:
+            del parent[0]
+
+
+def _iter_events(
+    data: XmlData, events: Tuple[str, ...] = ("start", "end")
+) -> Iterator[Tuple[str, etree._Element]]:
+    """
+    Parses an XML message, feeding the parser the message in chunks.
+    Parsing stops when the iterator is closed.
+    :param data: The XML message
+    :param events: The parser events returned
+    :returns: iterator of (event, element) tuples
+    :raises: EdiDataValidationException if the message is not well formed
+    """
+    parser = etree.XMLPullParser(events=events, resolve_entities=False, no_network=True)
+    try:
+        with memoryview(data) as view:
+            for offset in range(0, len(view), FEED_SIZE):
+                parser.feed(bytes(view[offset : offset + FEED_SIZE]))
+                yield from parser.read_events()
+        parser.close()
+        yield from parser.read_events()
+    except etree.XMLSyntaxError as ex:
+        raise EdiDataValidationException(
+            f"FHIR XML message is not well formed: {ex}"
+        ) from ex
+
+
+def is_fhir_xml(data: XmlData) -> bool:
+    """
+    Returns True if the root element of an XML message is in the FHIR namespace.
+    Only the root element is parsed.
+    """
+    try:
+        for _, element in _iter_events(data, ("start",)):
+            return element.tag.startswith(_FHIR_TAG_PREFIX)
+    except EdiDataValidationException:
+        return False
+    return False
+
+
+class FhirXmlSummary:
+    """The resource type, profiles and top level element names of a FHIR XML resource"""
+
+    __slots__ = ("resource_type", "profiles", "element_names")
+
+    def __init__(
+        self, resource_type: str, profiles: List[str], element_names: List[str]
+    ):
+        """
+        :param resource_type: The resource type, the root element's name
+        :param profiles: The meta.profile values
+        :param element_names: The names of the root element's children, in message order, without duplicates
+        """
+        self.resource_type = resource_type
+        self.profiles = profiles
+        self.element_names = element_names
+
+    def specification_version(self) -> Optional[str]:
+        """
+        Returns the first FHIR release which defines the resource type and each of its top level elements.
+        :returns: R4, STU3, DSTU2 or None if no release is compatible
+        """
+        for release in FHIR_RELEASES:
+            model_class = get_fhir_model_class(release, self.resource_type)
+            if model_class is not None and all(
+                n in _get_fields(model_class) for n in self.element_names
+            ):
+                return release
+        return None
+
+
+def scan_fhir_xml(data: XmlData) -> FhirXmlSummary:
+    """
+    Reads the resource type, profiles and top level element names of a FHIR XML resource in a single pass.
+    :param data: The FHIR XML message
+    :returns: FhirXmlSummary
+    :raises: EdiDataValidationException if the message is not well formed, or is not a FHIR resource
+    """
+    resource_type = None
+    profiles: List[str] = []
+    element_names: Dict[str, None] = {}
+    depth = 0
+    in_meta = False
+
+    for event, element in _iter_events(data):
+        if event == "end":
+            depth -= 1
+            if depth == 1:
+                _release_previous(element)
+            continue
+
+        depth += 1
+        if depth == 1:
+            if not element.tag.startswith(_FHIR_TAG_PREFIX):
+                _fail(f"XML root element {element.tag} is not a FHIR resource")
+            resource_type = _local_name(element)
+        elif depth == 2:
+            name = _local_name(element)
+            element_names[name] = None
+            in_meta = name == "meta"
+        elif depth == 3 and in_meta and _local_name(element) == "profile":
+            profile = element.get("value")
+            if profile:
+                profiles.append(profile)
+
+    if resource_type is None:
+        _fail("FHIR XML message does not contain a resource")
+    return FhirXmlSummary(resource_type, profiles, list(element_names))
+
+
+@lru_cache(maxsize=None)
+def _get_fields(model_class: Type) -> Dict[str, ModelField]:
+    """Returns a model's fields by element name, excluding primitive extension (_) fields"""
+    return {
+        f.alias: f
+        for f in model_class.__fields__.values()
+        if not f.alias.startswith("_")
+        and f.alias not in ("resource_type", "fhir_comments")
+    }
+
+
+class _Frame:
+    """An element being converted, and the JSON value it is converted to"""
+
+    __slots__ = ("kind", "name", "is_list", "model_class", "value", "primitive")
+
+    COMPLEX = 0
+    PRIMITIVE = 1
+    RESOURCE = 2
+    XHTML = 3
+
+    def __init__(
+        self,
+        kind: int,
+        name: str,
+        is_list: bool = False,
+        model_class: Optional[Type] = None,
+        value: Optional[Dict] = None,
+        primitive: Optional[str] = None,
+    ):
+        """
+        :param kind: The element kind: COMPLEX, PRIMITIVE, RESOURCE (a resource container) or XHTML
+        :param name: The element name
+        :param is_list: Indicates if the element repeats within its parent
+        :param model_class: The model class of the element's children: the element's class, or the primitive extension
+        class for primitive elements
+        :param value: The element's JSON object. For primitive elements, the primitive extension object.
+        :param primitive: A primitive element's value
+        """
+        self.kind = kind
+        self.name = name
+        self.is_list = is_list
+        self.model_class = model_class
+        self.value = value
+        self.primitive = primitive
+
+
+def _start_resource(release: str, element: etree._Element) -> _Frame:
+    """Starts the conversion of a resource element"""
+    resource_type = _local_name(element)
+    model_class = get_fhir_model_class(release, resource_type)
+    if model_class is None:
+        _fail(f"{resource_type} is not a FHIR {release} resource")
+    return _Frame(
+        _Frame.COMPLEX,
+        resource_type,
+        model_class=model_class,
+        value={"resourceType": resource_type},
+    )
+
+
+def _start_element(release: str, parent: _Frame, element: etree._Element) -> _Frame:
+    """Starts the conversion of an element within a complex element"""
+    name = "div" if element.tag == _XHTML_DIV_TAG else _local_name(element)
+    field = _get_fields(parent.model_class).get(name) if parent.model_class else None
+
+    if field is None:
+        # unknown elements are retained, so they are reported by model validation
+        return _Frame(_Frame.COMPLEX, name, value=dict(element.attrib))
+
+    is_list = field.shape == SHAPE_LIST
+    element_type = getattr(field.type_, "__resource_type__", None)
+    if element_type == _RESOURCE_ELEMENT_TYPE:
+        return _Frame(_Frame.RESOURCE, name, is_list)
+    if element_type:
+        value = {a: element.get(a) for a in _COMPLEX_ATTRIBUTES if a in element.attrib}
+        return _Frame(
+            _Frame.COMPLEX,
+            name,
+            is_list,
+            get_fhir_model_class(release, element_type),
+            value,
+        )
+    if field.type_.__name__ == "Xhtml":
+        return _Frame(_Frame.XHTML, name, is_list)
+
+    value = {"id": element.get("id")} if "id" in element.attrib else {}
+    return _Frame(
+        _Frame.PRIMITIVE,
+        name,
+        is_list,
+        get_fhir_model_class(release, _PRIMITIVE_EXTENSION_TYPE),
+        value,
+        element.get("value"),
+    )
+
+
+def _add_value(parent: Dict, frame: _Frame, value) -> None:
+    """Adds a converted element to its parent's JSON object"""
+    if frame.is_list:
+        parent.setdefault(frame.name, []).append(value)
+    else:
+        parent[frame.name] = value
+
+
+def _add_primitive(parent: Dict, frame: _Frame) -> None:
+    """
+    Adds a converted primitive element to its parent's JSON object.
+    Primitive extensions and ids are added to the "_<name>" property. For repeating elements, the "_<name>" list is
+    aligned with the values, containing null for values without extensions.
+    """
+    extension_name = f"_{frame.name}"
+    if not frame.is_list:
+        if frame.primitive is not None:
+            parent[frame.name] = frame.primitive
+        if frame.value:
+            parent[extension_name] = frame.value
+        return
+
+    values = parent.setdefault(frame.name, [])
+    values.append(frame.primitive)
+    if frame.value or extension_name in parent:
+        extensions = parent.setdefault(extension_name, [None] * (len(values) - 1))
+        extensions.append(frame.value or None)
+
+
+def convert_fhir_xml(data: XmlData, release: str) -> Dict:
+    """
+    Converts a FHIR XML resource to its FHIR JSON representation in a single pass.
+    :param data: The FHIR XML message
+    :param release: The FHIR release: R4, STU3 or DSTU2
+    :returns: The FHIR JSON resource
+    :raises: EdiDataValidationException if the message is not well formed, or contains a resource which is not
+    defined for the release
+    """
+    stack: List[_Frame] = []
+    # the depth of the current element within an XHTML narrative
+    xhtml_depth = 0
+    resource = None
+
+    for event, element in _iter_events(data):
+        if event == "start":
+            if xhtml_depth:
+                xhtml_depth += 1
+            elif not stack:
+                stack.append(_start_resource(release, element))
+            elif stack[-1].kind == _Frame.RESOURCE:
+                frame = _start_resource(release, element)
+                stack[-1].value = frame.value
+                stack.append(frame)
+            else:
+                frame = _start_element(release, stack[-1], element)
+                xhtml_depth = 1 if frame.kind == _Frame.XHTML else 0
+                stack.append(frame)
+            continue
+
+        if xhtml_depth:
+            xhtml_depth -= 1
+            if xhtml_depth:
+                continue
+
+        frame = stack.pop()
+        if not stack:
+            resource = frame.value
+        elif stack[-1].kind != _Frame.RESOURCE:
+            parent = stack[-1].value
+            if frame.kind == _Frame.PRIMITIVE:
+                _add_primitive(parent, frame)
+            elif frame.kind == _Frame.XHTML:
+                _add_value(
+                    parent,
+                    frame,
+                    etree.tostring(element, encoding="unicode", with_tail=False),
+                )
+            elif frame.value is not None:
+                _add_value(parent, frame, frame.value)
+        _release_previous(element)
+
+    if resource is None:
+        _fail("FHIR XML message does not contain a resource")
+    return resource
+
+
+def load_fhir_xml(data: XmlData, release: str):
+    """
+    Loads a FHIR XML resource into a domain model.
+    :param data: The FHIR XML message
+    :param release: The FHIR release: R4, STU3 or DSTU2
+    :returns: FHIR Resource Model
+    :raises: EdiDataValidationException if the message is not a FHIR resource
+    :raises: pydantic.ValidationError if the resource is not valid
+    """
+    fhir_json = convert_fhir_xml(data, release)
+    return construct_fhir_resource(release, fhir_json["resourceType"], fhir_json)
+
+
+def iter_fhir_xml_codes(data: XmlData) -> Iterator[Tuple[str, str]]:
+    """
+    Extracts the system and code, or value, of Coding and Identifier elements from a FHIR XML message.
+    Elements are inspected when they end, once their children are parsed, and their children are then released.
+    :param data: The FHIR XML message
+    :returns: iterator of (system, code) tuples, in message order
+    """
+    for event, element in _iter_events(data, ("end",)):
+        system = code = None
+        for child in element:
+            name = _local_name(child) if isinstance(child.tag, str) else None
+            if name == "system":
+                system = child.get("value")
+            elif name == "code" or (name == "value" and code is None):
+                code = child.get("value")
+        if system and code:
+            yield system, code
+        del element[:]
@@ -0,0 +1,132 @@
+"""
+hl7_message.py
+
+A lazily parsed HL7v2 message, compatible with hl7.Message.
+
+hl7.parse splits every segment into fields, repetitions and components when a message is loaded. LazyHl7Message
+splits the message into segment strings in a single pass, and parses a segment into an hl7.Segment the first time it
+is accessed, using the message's parse plan, so segments which are not accessed are never parsed.
+
+Segment lookups by id, such as message.segments("OBX") or message["PID.F3"], compare the raw segment ids and only
+parse the matching segments. Iterating the message parses every segment. Parsed segments are cached within the
+message, so modifications made through the hl7.Message API are retained and serialized by str().
+
+Usage:
+message = LazyHl7Message.parse(message_text)
+patient_id = message["PID.F3"]
+"""
+from typing import Iterator, Optional
+
+from hl7 import Message, Segment, Sequence
+from hl7.parser import _ParsePlan, _split, create_parse_plan
+
+
+class LazyHl7Message(Message):
+    """
+    An hl7.Message whose segments are parsed on first access.
+    Unparsed segments are held as strings within the underlying list.
+    """
+
+    def __init__(
+        self, separator=None, sequence=[], esc="\\", separators="\r|~^&", factory=None
+    ):
+        super().__init__(
+            separator=separator,
+            sequence=sequence,
+            esc=esc,
+            separators=separators,
+            factory=factory,
+        )
+        self._segment_plan: Optional[_ParsePlan] = None
+
+    @classmethod
+    def parse(cls, text: str) -> "LazyHl7Message":
+        """
+        Splits an HL7 message into segments, without parsing the segments.
+        Segments are split as hl7.parse splits them, so parsed segments are identical.
+        :param text: The HL7 message
+        :returns: LazyHl7Message
+        :raises: hl7.ParseException if the message does not start with an MSH, BHS or FHS segment
+        """
+        text = text.strip()
+        plan = create_parse_plan(text)
+        message = cls(
+            separator=plan.separator,
+            sequence=text.split(plan.separator),
+            esc=plan.esc,
+            separators=plan.separators,
+            factory=plan.factory,
+        )
+        message._segment_plan = plan.next()
+        return message
+
+    @property
+    def parsed_count(self) -> int:
+        """Returns the number of segments which have been parsed"""
+        return sum(1 for s in list.__iter__(self) if not isinstance(s, str))
+
+    def parse_all(self) -> "LazyHl7Message":
+        """
+        Parses every segment which has not been parsed.
+        :returns: the message
+        """
+        for index in range(len(self)):
+            self._parse_segment(index)
+        return self
+
+    def _parse_segment(self, index: int) -> Segment:
+        """Returns the segment at an index, parsing and caching it on first access"""
+        segment = list.__getitem__(self, index)
+        if isinstance(segment, str):
+            segment = _split(segment, self._segment_plan)
+            list.__setitem__(self, index, segment)
+        return segment
+
+    def _has_segment_id(self, index: int, segment_id: str) -> bool:
+        """Returns True if the segment at an index has the segment id, without parsing the segment"""
+        segment = list.__getitem__(self, index)
+        if not isinstance(segment, str):
+            return segment[0][0] == segment_id
+        return segment.startswith(segment_id) and segment[
+            len(segment_id) : len(segment_id) + 1
+        ] in ("", self.separators[1])
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self._parse_segment(key)
+        if isinstance(key, slice):
+            for index in range(*key.indices(len(self))):
+                self._parse_segment(index)
+        return super().__getitem__(key)
+
+    def __iter__(self) -> Iterator[Segment]:
+        for index in range(len(self)):
+            yield self._parse_segment(index)
+
+    def segments(self, segment_id: str) -> Sequence:
+        """
+        Returns the segments identified by the segment id, parsing only the matching segments.
+        :raises: KeyError if the message does not contain the segment
+        """
+        matches = Sequence(
+            self._parse_segment(i)
+            for i in range(len(self))
+            if self._has_segment_id(i, segment_id)
+        )
+        if not matches:
+            raise KeyError(f"No {segment_id} segments")
+        return matches
+
+    def __eq__(self, other) -> bool:
+        return list(self) == list(other)
+
+    def __ne__(self, other) -> bool:
+        return not self == other
+
+    def __str__(self) -> str:
+        return (
+            self.separator.join(
+                s if isinstance(s, str) else str(s) for s in list.__iter__(self)
+            )
+            + self.separator
+        )
@@ -0,0 +1,182 @@
+"""
+journal.py
+
+An append-only journal of processed EDI files, used to resume batch runs.
+
+Each journal line is a JSON object recording a file's path, size, modification time, checksum and outcome. The
+journal is loaded into an in-memory index when it is opened, so checking whether a file was processed is a dictionary
+lookup which does not read the file.
+
+Entries are flushed to the operating system as they are written, and synced to disk in batches. If a process fails,
+entries written since the last sync may be lost and those files are reprocessed when the run is resumed.
+"""
+from enum import Enum
+import json
+import logging
+import os
+import time
+from typing import Dict, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class JournalOutcome(str, Enum):
+    """
+    The processing outcome recorded for a file
+    """
+
+    SUCCESS = "success"
+    FAILURE = "failure"
+
+
+class JournalEntry(NamedTuple):
+    """
+    The journal index entry for a processed file
+    """
+
+    size: int
+    mtime: int
+    checksum: Optional[str]
+    outcome: JournalOutcome
+
+
+class BatchJournal:
+    """
+    Records the files processed by a batch run.
+
+    Files are identified by absolute path, size and modification time (in nanoseconds). A file which is modified after
+    it is journaled is processed again.
+    """
+
+    def __init__(
+        self,
+        journal_path: str,
+        sync_batch_size: int = 100,
+        sync_interval: float = 1.0,
+    ):
+        """
+        Opens the journal, loading existing entries into the index.
+        :param journal_path: The path to the journal file. The file is created if it does not exist.
+        :param sync_batch_size: The number of entries written between disk syncs
+        :param sync_interval: The maximum number of seconds between disk syncs
+        """
+        self.journal_path = journal_path
+        self.sync_batch_size = sync_batch_size
+        self.sync_interval = sync_interval
+        self.index: Dict[str, JournalEntry] = {}
+
+        self._load()
+
+        self._file = open(journal_path, "a", encoding="utf-8")
+        self._pending_count = 0
+        self._last_sync = time.monotonic()
+
+    def _load(self) -> None:
+        """
+        Loads the journal index.
+        A partially written final line, left by a failed process, is ignored and terminated so that new entries start on
+        a new line.
+        """
+        if not os.path.exists(self.journal_path):
+            return
+
+        with open(self.journal_path, "r", encoding="utf-8") as f:
+            line = ""
+            for line in f:
+                try:
+                    data = json.loads(line)
+                    self.index[data["path"]] = JournalEntry(
+                        size=data["size"],
+                        mtime=data["mtime"],
+                        checksum=data.get("checksum"),
+                        outcome=JournalOutcome(data["outcome"]),
+                    )
+                except (ValueError, KeyError):
+                    logger.warning(
+                        f"Skipping invalid journal entry in {self.journal_path}"
+                    )
+
+        if line and not line.endswith("\n"):
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write("\n")
+
+    @staticmethod
+    def _key(file_path: str) -> str:
+        """Returns the index key for a file path"""
+        return os.path.abspath(file_path)
+
+    def is_processed(
+        self, file_path: str, size: int, mtime: int, retry_failed: bool = False
+    ) -> bool:
+        """
+        Returns True if the file, at its current size and modification time, is journaled.
+        :param file_path: The file path
+        :param size: The file size in bytes
+        :param mtime: The file modification time in nanoseconds
+        :param retry_failed: When True, files which failed are not considered processed
+        """
+        entry = self.index.get(self._key(file_path))
+        if entry is None or entry.size != size or entry.mtime != mtime:
+            return False
+        return not (retry_failed and entry.outcome == JournalOutcome.FAILURE)
+
+    def record(
+        self,
+        file_path: str,
+        size: int,
+        mtime: int,
+        checksum: Optional[str],
+        outcome: JournalOutcome,
+    ) -> None:
+        """
+        Appends an entry to the journal.
+        :param file_path: The file path
+        :param size: The file size in bytes
+        :param mtime: The file modification time in nanoseconds
+        :param checksum: The file's SHA-256 checksum, if it was analyzed
+        :param outcome: The processing outcome
+        """
+        key = self._key(file_path)
+        entry = JournalEntry(size, mtime, checksum, JournalOutcome(outcome))
+        self.index[key] = entry
+
+        self._file.write(
+            json.dumps(
+                {
+                    "path": key,
+                    "size": size,
+                    "mtime": mtime,
+                    "checksum": checksum,
+                    "outcome": entry.outcome.value,
+                }
+            )
+        )
+        self._file.write("\n")
+        self._file.flush()
+
+        self._pending_count += 1
+        if (
+            self._pending_count >= self.sync_batch_size
+            or time.monotonic() - self._last_sync >= self.sync_interval
+        ):
+            self.sync()
+
+    def sync(self) -> None:
+        """Syncs written entries to disk"""
+        if self._pending_count:
+            os.fsync(self._file.fileno())
+            self._pending_count = 0
+        self._last_sync = time.monotonic()
+
+    def close(self) -> None:
+        """Syncs and closes the journal"""
+        if not self._file.closed:
+            self._file.flush()
+            self.sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -2,10 +2,13 @@
 models.py
 
 EDI Pydantic Domain Models.
+
+Models are validated when created from external data. Workflows build their models from trusted, internally generated
+values using `construct()`, which skips validation on the per-message hot path.
 """
 from pydantic import BaseModel
 from enum import Enum
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 
 class BaseMessageFormat(str, Enum):
@@ -31,6 +34,53 @@ class EdiMessageFormat(str, Enum):
     X12 = "X12"
 
 
+class ValidationLevel(str, Enum):
+    """
+    EDI message validation levels, in order of increasing cost. Each level includes the checks of the levels before it.
+    * envelope - validates the message envelope or header (ISA/GS/ST, MSH, resourceType)
+    * structural - validates segment and element counts, and required fields, without building a data model
+    * full - runs the structural checks, and parses the message into its data model
+    """
+
+    ENVELOPE = "envelope"
+    STRUCTURAL = "structural"
+    FULL = "full"
+
+
+class CompressionFormat(str, Enum):
+    """
+    Compression formats detected and decompressed when EDI files are loaded
+    """
+
+    BZIP2 = "bzip2"
+    GZIP = "gzip"
+    ZIP = "zip"
+
+
+class EdiCompressionMetadata(BaseModel):
+    """
+    Describes the compressed file, or archive, an EDI message was loaded from
+    """
+
+    compressionFormat: CompressionFormat
+    # the size and SHA-256 checksum of the compressed file
+    compressedSize: int
+    compressedChecksum: str
+    # the message's member name within a zip archive
+    archiveMember: Optional[str]
+
+    class Config:
+        extra = "forbid"
+        schema_extra = {
+            "example": {
+                "compressionFormat": "zip",
+                "compressedSize": 311,
+                "compressedChecksum": "0f2c5d35d3c4a6f5e1c0b9f8e3a1d7c6b5a4f3e2d1c0b9a8f7e6d5c4b3a2f1e0",
+                "archiveMember": "claims/270.x12",
+            }
+        }
+
+
 class EdiMessageMetadata(BaseModel):
     """
     EDI message metadata including the message type, version, record count, etc.
@@ -57,6 +107,34 @@ class EdiMessageMetadata(BaseModel):
         }
 
 
+class EdiStageMemory(BaseModel):
+    """
+    Memory allocated by a workflow step, measured with tracemalloc.
+    Aggregate metrics combine the sampled workflows: peakBytes is the largest peak, and netBytes and allocatedBlocks
+    are totals.
+    """
+
+    # the peak memory allocated during the step, in bytes
+    peakBytes: int
+    # the memory allocated by the step which remained allocated when it completed, in bytes
+    netBytes: int
+    # the change in the number of allocated memory blocks
+    allocatedBlocks: int
+    # the number of sampled workflows measured
+    sampleCount: int = 1
+
+    class Config:
+        extra = "forbid"
+        schema_extra = {
+            "example": {
+                "peakBytes": 1843200,
+                "netBytes": 524288,
+                "allocatedBlocks": 4096,
+                "sampleCount": 1,
+            }
+        }
+
+
 class EdiProcessingMetrics(BaseModel):
     """
     Captures processing metrics for EDI operations
@@ -67,13 +145,48 @@ class EdiProcessingMetrics(BaseModel):
     validateTime: float = 0.0
     translateTime: float = 0.0
     totalTime: float = 0.0
+    # per-step memory usage, keyed by step name. Only recorded for sampled messages
+    memory: Optional[Dict[str, EdiStageMemory]] = None
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.update_total_time()
+
+    def update_total_time(self):
+        """
+        Sets totalTime to the sum of the step times.
+        Called directly for instances created with construct(), which bypasses __init__.
+        """
         self.totalTime = (
             self.analyzeTime + self.enrichTime + self.validateTime + self.translateTime
         )
 
+    def add(self, metrics: "EdiProcessingMetrics") -> None:
+        """
+        Adds a workflow's metrics to aggregate metrics, such as the totals for a batch.
+        Step times are summed, and the memory of each step is combined across the sampled workflows.
+        :param metrics: The workflow's metrics
+        """
+        self.analyzeTime += metrics.analyzeTime
+        self.enrichTime += metrics.enrichTime
+        self.validateTime += metrics.validateTime
+        self.translateTime += metrics.translateTime
+        self.update_total_time()
+
+        if not metrics.memory:
+            return
+        if self.memory is None:
+            self.memory = {}
+        for step_name, step_memory in metrics.memory.items():
+            total = self.memory.get(step_name)
+            if total is None:
+                self.memory[step_name] = step_memory.copy()
+                continue
+            total.peakBytes = max(total.peakBytes, step_memory.peakBytes)
+            total.netBytes += step_memory.netBytes
+            total.allocatedBlocks += step_memory.allocatedBlocks
+            total.sampleCount += step_memory.sampleCount
+
     class Config:
         extra = "forbid"
         schema_extra = {
@@ -83,6 +196,34 @@ class EdiProcessingMetrics(BaseModel):
                 "validateTime": 0.013415911,
                 "translateTime": 2.625179046,
                 "totalTime": 2.794358141,
+                "memory": {
+                    "translate": {
+                        "peakBytes": 1843200,
+                        "netBytes": 524288,
+                        "allocatedBlocks": 4096,
+                        "sampleCount": 1,
+                    }
+                },
+            }
+        }
+
+
+class EdiCode(BaseModel):
+    """
+    A code referenced within an EDI message, resolved to a display name during enrichment
+    """
+
+    codeSystem: str
+    code: str
+    display: Optional[str]
+
+    class Config:
+        extra = "forbid"
+        schema_extra = {
+            "example": {
+                "codeSystem": "LOINC",
+                "code": "8867-4",
+                "display": "Heart rate",
             }
         }
 
@@ -94,6 +235,11 @@ class EdiResult(BaseModel):
 
     metadata: Optional[EdiMessageMetadata]
     metrics: Optional[EdiProcessingMetrics]
+    codes: Optional[List[EdiCode]]
+    translation: Optional[Dict[str, Any]]
+    validationLevel: Optional[ValidationLevel]
+    duplicate: Optional[bool]
+    compression: Optional[EdiCompressionMetadata]
 
     class Config:
         extra = "forbid"
@@ -109,9 +255,138 @@ class EdiResult(BaseModel):
                 },
                 "metrics": {
                     "analyzeTime": 0.142347273,
-                    "enrichTime": 0.0,
+                    "enrichTime": 0.000213549,
                     "validateTime": 0.013415911,
                     "translateTime": 2.625179046,
                 },
+                "codes": [
+                    {
+                        "codeSystem": "LOINC",
+                        "code": "8867-4",
+                        "display": "Heart rate",
+                    }
+                ],
+                "translation": {
+                    "resourceType": "Bundle",
+                    "type": "collection",
+                    "entry": [
+                        {
+                            "fullUrl": "urn:uuid:0b7a6c34-8c1c-4bdf-a3c1-7a1a8d6f0f6e",
+                            "resource": {
+                                "resourceType": "Patient",
+                                "id": "0b7a6c34-8c1c-4bdf-a3c1-7a1a8d6f0f6e",
+                                "name": [{"family": "DOE", "given": ["JOHN"]}],
+                            },
+                        }
+                    ],
+                },
+                "validationLevel": "full",
+                "duplicate": False,
+            }
+        }
+
+
+class DicomSeriesSummary(BaseModel):
+    """
+    Instance counts for a DICOM series within a study
+    """
+
+    seriesInstanceUid: str
+    modality: Optional[str]
+    instanceCount: int = 0
+
+    class Config:
+        extra = "forbid"
+        schema_extra = {
+            "example": {
+                "seriesInstanceUid": "1.2.826.0.1.3680043.8.498.10200",
+                "modality": "CT",
+                "instanceCount": 312,
+            }
+        }
+
+
+class DicomStudySummary(BaseModel):
+    """
+    Series and instance counts for a DICOM study
+    """
+
+    studyInstanceUid: str
+    instanceCount: int = 0
+    series: List[DicomSeriesSummary] = []
+
+    class Config:
+        extra = "forbid"
+        schema_extra = {
+            "example": {
+                "studyInstanceUid": "1.2.826.0.1.3680043.8.498.10100",
+                "instanceCount": 312,
+                "series": [
+                    {
+                        "seriesInstanceUid": "1.2.826.0.1.3680043.8.498.10200",
+                        "modality": "CT",
+                        "instanceCount": 312,
+                    }
+                ],
+            }
+        }
+
+
+class EdiInstanceFailure(BaseModel):
+    """
+    Captures an input which could not be processed within an aggregate workflow
+    """
+
+    path: str
+    error: str
+
+    class Config:
+        extra = "forbid"
+        schema_extra = {
+            "example": {
+                "path": "/data/studies/1001/IM000042",
+                "error": "File is missing DICOM File Meta Information header",
+            }
+        }
+
+
+class EdiStudyResult(BaseModel):
+    """
+    DICOM Study Processing Result
+    """
+
+    studies: List[DicomStudySummary] = []
+    failures: List[EdiInstanceFailure] = []
+    metrics: Optional[EdiProcessingMetrics]
+
+    class Config:
+        extra = "forbid"
+        schema_extra = {
+            "example": {
+                "studies": [
+                    {
+                        "studyInstanceUid": "1.2.826.0.1.3680043.8.498.10100",
+                        "instanceCount": 312,
+                        "series": [
+                            {
+                                "seriesInstanceUid": "1.2.826.0.1.3680043.8.498.10200",
+                                "modality": "CT",
+                                "instanceCount": 312,
+                            }
+                        ],
+                    }
+                ],
+                "failures": [
+                    {
+                        "path": "/data/studies/1001/IM000042",
+                        "error": "File is missing DICOM File Meta Information header",
+                    }
+                ],
+                "metrics": {
+                    "analyzeTime": 1.842347273,
+                    "enrichTime": 0.0,
+                    "validateTime": 0.0,
+                    "translateTime": 0.0,
+                },
             }
         }
@@ -0,0 +1,673 @@
+"""
+pipeline.py
+
+Defines the stages used to process an EdiWorkflow and the pipeline which executes them.
+
+Usage:
+pipeline = EdiPipeline([AnalyzeStage(), ValidateStage()])
+pipeline.run(workflow)
+
+for workflow, exception in pipeline.stream(workflows, batch_size=100):
+    ...
+"""
+import abc
+from contextlib import nullcontext
+from functools import lru_cache
+from itertools import islice
+from typing import (
+    Any,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+    TYPE_CHECKING,
+)
+import logging
+import random
+import tracemalloc
+
+from .analysis import analyze
+from .dedupe import DedupeIndex, get_dedupe_index
+from .config import get_settings
+from .exceptions import (
+    EdiException,
+    EdiAnalysisException,
+    EdiDataValidationException,
+    EdiDedupeException,
+    EdiEnrichmentException,
+    EdiValidationException,
+    EdiTimeoutException,
+    EdiTranslationException,
+)
+from .fhir_xml import load_fhir_xml
+from .models import (
+    BaseMessageFormat,
+    EdiMessageFormat,
+    EdiStageMemory,
+    ValidationLevel,
+)
+from .support import MemoryTracer, Timer, load_fhir_json, load_hl7, load_dicom
+from .terminology import TerminologyService, extract_codes, get_terminology_service
+from .translation import Hl7FhirTranslator, get_hl7_translator
+from .validation import validate_message
+from .x12_validation import load_x12_parallel
+from .x12_translation import X12FhirTranslator, get_x12_translator
+
+if TYPE_CHECKING:
+    from .profiling import MessageProfiler
+    from .workflows import EdiWorkflow
+
+logger = logging.getLogger(__name__)
+
+# workflow attributes which are available before any stage is executed
+INITIAL_INPUTS: FrozenSet[str] = frozenset({"input_message"})
+
+
+class EdiStage(metaclass=abc.ABCMeta):
+    """
+    Abstract base class for an EdiPipeline stage.
+
+    Stages declare the EdiWorkflow attributes they require (inputs) and populate (outputs). The pipeline uses these
+    declarations to verify stage order when it is configured, and skips a stage for a workflow if a required input is
+    not available.
+
+    Stage instances are shared across workflows, and should not store per-message state.
+
+    Subclasses implement `process` and may override:
+    * should_run - to skip the stage based on message metadata
+    * process_batch - to process many workflows in a single operation
+    """
+
+    # the stage name, used to register and order stages
+    name: str = None
+    # workflow attributes required by the stage
+    inputs: FrozenSet[str] = frozenset()
+    # workflow attributes populated by the stage
+    outputs: FrozenSet[str] = frozenset()
+    # limits the stage to specific EDI message formats. None supports all formats
+    formats: Optional[FrozenSet[EdiMessageFormat]] = None
+    # the EdiProcessingMetrics field used to record the stage's elapsed time
+    metric_name: Optional[str] = None
+    # the exception raised for unexpected stage errors
+    exception_class: Type[EdiException] = EdiException
+
+    def should_run(self, workflow: "EdiWorkflow") -> bool:
+        """
+        Returns True if the stage is executed for the workflow.
+        The default implementation checks that inputs are available and the message format is supported.
+        """
+        for attribute_name in self.inputs:
+            if getattr(workflow, attribute_name, None) is None:
+                return False
+
+        if self.formats is not None:
+            meta_data = workflow.meta_data
+            return meta_data is not None and meta_data.ediMessageFormat in self.formats
+
+        return True
+
+    @abc.abstractmethod
+    def process(self, workflow: "EdiWorkflow") -> None:
+        """
+        Processes a single workflow, setting the stage's output attributes.
+        """
+        return
+
+    def process_batch(
+        self, workflows: List["EdiWorkflow"]
+    ) -> List[Optional[Exception]]:
+        """
+        Processes a batch of workflows.
+        The default implementation processes each workflow individually. Stages with a per-call overhead override this
+        method to process the batch in a single operation.
+
+        A workflow which fails must not prevent the remainder of the batch from being processed, and each workflow is
+        processed at most once, so implementations return the exception raised for each workflow rather than raising.
+        :param workflows: The workflows to process
+        :returns: A list, in workflow order, containing the exception raised for each workflow or None
+        """
+        exceptions: List[Optional[Exception]] = []
+        for workflow in workflows:
+            try:
+                self.process(workflow)
+            except Exception as ex:
+                exceptions.append(ex)
+            else:
+                exceptions.append(None)
+        return exceptions
+
+
+class AnalyzeStage(EdiStage):
+    """
+    Generates EdiMessageMetadata for the input message.
+    """
+
+    name = "analyze"
+    inputs = frozenset({"input_message"})
+    outputs = frozenset({"meta_data"})
+    metric_name = "analyzeTime"
+    exception_class = EdiAnalysisException
+
+    def process(self, workflow: "EdiWorkflow") -> None:
+        workflow.meta_data = analyze(workflow.input_message)
+
+
+class DedupeStage(EdiStage):
+    """
+    Flags messages whose checksum is recorded in the configured dedupe index, then records the message's checksum.
+    In skip mode, the remaining stages are skipped for duplicate messages. The stage is skipped when no dedupe
+    directory is configured.
+    """
+
+    name = "dedupe"
+    inputs = frozenset({"meta_data"})
+    outputs = frozenset({"duplicate"})
+    exception_class = EdiDedupeException
+
+    def __init__(
+        self, dedupe_index: Optional[DedupeIndex] = None, skip: Optional[bool] = None
+    ):
+        """
+        :param dedupe_index: The dedupe index. Defaults to the index for the configured directory.
+        :param skip: When True, duplicate workflows are cancelled. Defaults to the configured dedupe mode.
+        """
+        self._dedupe_index = dedupe_index
+        self.skip = get_settings().dedupe_mode == "skip" if skip is None else skip
+
+    @property
+    def dedupe_index(self) -> Optional[DedupeIndex]:
+        """Returns the dedupe index, opening the configured index on first use"""
+        if self._dedupe_index is None:
+            self._dedupe_index = get_dedupe_index()
+        return self._dedupe_index
+
+    def should_run(self, workflow: "EdiWorkflow") -> bool:
+        return self.dedupe_index is not None and super().should_run(workflow)
+
+    def process(self, workflow: "EdiWorkflow") -> None:
+        workflow.duplicate = self.dedupe_index.check_and_add(
+            workflow.meta_data.checksum
+        )
+        if workflow.duplicate and self.skip:
+            workflow.cancel()
+
+
+class EnrichStage(EdiStage):
+    """
+    Adds additional data to the input message.
+    Resolves the codes referenced in HL7, X12 and FHIR messages to display names using the configured terminology
+    directory. The stage is skipped when no terminology is configured.
+    """
+
+    name = "enrich"
+    inputs = frozenset({"input_message", "meta_data"})
+    outputs = frozenset({"codes"})
+    formats = frozenset(
+        {EdiMessageFormat.HL7, EdiMessageFormat.X12, EdiMessageFormat.FHIR}
+    )
+    metric_name = "enrichTime"
+    exception_class = EdiEnrichmentException
+
+    def __init__(self, terminology_service: Optional[TerminologyService] = None):
+        """
+        :param terminology_service: The terminology service. Defaults to the service for the configured directory.
+        """
+        self._terminology_service = terminology_service
+
+    @property
+    def terminology_service(self) -> TerminologyService:
+        """Returns the terminology service, loading the configured service on first use"""
+        if self._terminology_service is None:
+            self._terminology_service = get_terminology_service()
+        return self._terminology_service
+
+    def should_run(self, workflow: "EdiWorkflow") -> bool:
+        return self.terminology_service.is_available and super().should_run(workflow)
+
+    def process(self, workflow: "EdiWorkflow") -> None:
+        codes = extract_codes(
+            workflow.input_message, workflow.meta_data.ediMessageFormat
+        )
+        workflow.codes = self.terminology_service.resolve(codes)
+
+
+class ValidateStage(EdiStage):
+    """
+    Validates the input message at a ValidationLevel. Levels are cumulative: full validation runs the structural checks
+    before loading the message into its data model, and populates the workflow's data_model attribute. Envelope and structural validation check the message
+    without building a data model, so stages which require the data model, such as translate, are skipped.
+    """
+
+    name = "validate"
+    inputs = frozenset({"input_message", "meta_data"})
+    outputs = frozenset({"data_model", "validation_level"})
+    metric_name = "validateTime"
+    exception_class = EdiValidationException
+
+    def __init__(
+        self,
+        validation_level: ValidationLevel = ValidationLevel.FULL,
+        x12_workers: Optional[int] = None,
+        x12_chunk_claims: Optional[int] = None,
+    ):
+        """
+        :param validation_level: The validation level. Defaults to full validation.
+        :param x12_workers: The number of processes used to fully validate large X12 837 transactions. Defaults to
+        the configured number of X12 validation workers.
+        :param x12_chunk_claims: The number of claims in each chunk of an X12 837 transaction validated in parallel.
+        Defaults to the configured chunk size.
+        """
+        self.validation_level = ValidationLevel(validation_level)
+        settings = get_settings()
+        self.x12_workers = x12_workers or settings.x12_validation_workers
+        self.x12_chunk_claims = x12_chunk_claims or settings.x12_validation_chunk_claims
+
+    def _load_data_model(self, workflow: "EdiWorkflow") -> Any:
+        """Loads the input message into its data model, raising an exception if the message is invalid"""
+        input_message = workflow.input_message
+        edi_message_format = workflow.meta_data.ediMessageFormat
+
+        if edi_message_format == EdiMessageFormat.FHIR:
+            if workflow.meta_data.baseMessageFormat == BaseMessageFormat.XML:
+                return load_fhir_xml(
+                    input_message.data, workflow.meta_data.specificationVersion
+                )
+            return load_fhir_json(input_message.parseable())
+        elif edi_message_format == EdiMessageFormat.HL7:
+            # segments are parsed on first access, so every segment is parsed to validate the whole message
+            return load_hl7(input_message.text).parse_all()
+        elif edi_message_format == EdiMessageFormat.X12:
+            return load_x12_parallel(
+                input_message.text, self.x12_workers, self.x12_chunk_claims
+            )
+        elif edi_message_format == EdiMessageFormat.DICOM:
+            return load_dicom(input_message.data)
+        return None
+
+    def process(self, workflow: "EdiWorkflow") -> None:
+        # validation levels are cumulative, so full validation includes the structural checks
+        lightweight_level = self.validation_level
+        if lightweight_level == ValidationLevel.FULL:
+            lightweight_level = ValidationLevel.STRUCTURAL
+
+        try:
+            validate_message(
+                workflow.input_message, workflow.meta_data, lightweight_level
+            )
+            if self.validation_level == ValidationLevel.FULL:
+                workflow.data_model = self._load_data_model(workflow)
+        except EdiDataValidationException:
+            raise
+        except Exception as ex:
+            msg = f"Exception occurred validating {workflow.meta_data.baseMessageFormat} {workflow.meta_data.ediMessageFormat}"
+            raise EdiDataValidationException(msg) from ex
+
+        workflow.validation_level = self.validation_level
+
+
+class TranslateStage(EdiStage):
+    """
+    Translates the input message to a different, supported format.
+    HL7v2 ADT and ORU messages are translated to FHIR R4 Bundles. Other HL7 message types are not translated.
+    X12 270, 271 and 837 professional transactions are translated to FHIR R4 Bundles. Other transactions are not
+    translated.
+    """
+
+    name = "translate"
+    inputs = frozenset({"meta_data", "data_model"})
+    outputs = frozenset({"translation"})
+    formats = frozenset({EdiMessageFormat.HL7, EdiMessageFormat.X12})
+    metric_name = "translateTime"
+    exception_class = EdiTranslationException
+
+    def __init__(
+        self,
+        hl7_translator: Optional[Hl7FhirTranslator] = None,
+        x12_translator: Optional[X12FhirTranslator] = None,
+    ):
+        """
+        :param hl7_translator: The HL7 translator. Defaults to the translator for the default templates.
+        :param x12_translator: The X12 translator. Defaults to the translator for the default transaction sets.
+        """
+        self._hl7_translator = hl7_translator
+        self._x12_translator = x12_translator
+
+    @property
+    def hl7_translator(self) -> Hl7FhirTranslator:
+        """Returns the HL7 translator, compiling the default templates on first use"""
+        if self._hl7_translator is None:
+            self._hl7_translator = get_hl7_translator()
+        return self._hl7_translator
+
+    @property
+    def x12_translator(self) -> X12FhirTranslator:
+        """Returns the X12 translator"""
+        if self._x12_translator is None:
+            self._x12_translator = get_x12_translator()
+        return self._x12_translator
+
+    def process(self, workflow: "EdiWorkflow") -> None:
+        if workflow.meta_data.ediMessageFormat == EdiMessageFormat.X12:
+            workflow.translation = self.x12_translator.translate(workflow.data_model)
+        else:
+            workflow.translation = self.hl7_translator.translate(workflow.data_model)
+
+    def process_batch(
+        self, workflows: List["EdiWorkflow"]
+    ) -> List[Optional[Exception]]:
+        exceptions: List[Optional[Exception]] = [None] * len(workflows)
+        x12_indexes, hl7_indexes = [], []
+        for i, workflow in enumerate(workflows):
+            if workflow.meta_data.ediMessageFormat == EdiMessageFormat.X12:
+                x12_indexes.append(i)
+            else:
+                hl7_indexes.append(i)
+
+        x12_exceptions = super().process_batch([workflows[i] for i in x12_indexes])
+        for i, ex in zip(x12_indexes, x12_exceptions):
+            exceptions[i] = ex
+
+        hl7_workflows = [workflows[i] for i in hl7_indexes]
+        try:
+            translations = self.hl7_translator.translate_batch(
+                [w.data_model for w in hl7_workflows]
+            )
+        except Exception:
+            # translations are assigned once the batch completes, so no HL7 workflow has been translated
+            hl7_exceptions = super().process_batch(hl7_workflows)
+        else:
+            for workflow, translation in zip(hl7_workflows, translations):
+                workflow.translation = translation
+            hl7_exceptions = [None] * len(hl7_workflows)
+
+        for i, ex in zip(hl7_indexes, hl7_exceptions):
+            exceptions[i] = ex
+        return exceptions
+
+
+class EdiPipeline:
+    """
+    Executes an ordered list of EdiStages against EdiWorkflows.
+
+    Workflows are processed individually with `run`, or as a stream with `stream`. Streams are processed in batches,
+    so that each stage processes a batch of workflows before the next stage is executed.
+    """
+
+    def __init__(
+        self,
+        stages: Iterable[EdiStage],
+        profiler: Optional["MessageProfiler"] = None,
+        memory_sample_rate: Optional[float] = None,
+    ):
+        """
+        :param stages: The pipeline stages, in execution order
+        :param profiler: Profiles a sample of the workflows processed by the pipeline. When provided, batches are
+        processed one workflow at a time so that each profile is attributed to a single message.
+        :param memory_sample_rate: The fraction of workflows, from 0 to 1, for which per-stage memory usage is traced
+        and recorded in the workflow's metrics. Defaults to the configured rate.
+        :raises: ValueError if a stage's inputs are not provided by a preceding stage
+        """
+        self.profiler = profiler
+        self.memory_sample_rate = (
+            get_settings().memory_sample_rate
+            if memory_sample_rate is None
+            else memory_sample_rate
+        )
+        self.stages: List[EdiStage] = []
+        for stage in stages:
+            self.register(stage)
+
+    def _check_stages(self, stages: List[EdiStage]) -> None:
+        """
+        Validates stage names and that each stage's inputs are provided by a preceding stage.
+        :raises: ValueError if the stage configuration is invalid
+        """
+        available_inputs = set(INITIAL_INPUTS)
+        stage_names = set()
+
+        for stage in stages:
+            if stage.name in stage_names:
+                raise ValueError(f"Stage {stage.name} is already registered")
+            stage_names.add(stage.name)
+
+            missing_inputs = stage.inputs - available_inputs
+            if missing_inputs:
+                raise ValueError(
+                    f"Stage {stage.name} requires {', '.join(sorted(missing_inputs))} which is not provided by a preceding stage"
+                )
+            available_inputs.update(stage.outputs)
+
+    def _index(self, stage_name: str) -> int:
+        """Returns the position of a registered stage"""
+        for index, stage in enumerate(self.stages):
+            if stage.name == stage_name:
+                return index
+        raise ValueError(f"Stage {stage_name} is not registered")
+
+    @property
+    def stage_names(self) -> List[str]:
+        """Returns the registered stage names in execution order"""
+        return [s.name for s in self.stages]
+
+    def register(
+        self,
+        stage: EdiStage,
+        before: Optional[str] = None,
+        after: Optional[str] = None,
+    ) -> None:
+        """
+        Registers a stage. Stages are appended unless a position is provided.
+        :param stage: The stage to register
+        :param before: Inserts the stage before the named stage
+        :param after: Inserts the stage after the named stage
+        :raises: ValueError if the resulting stage order is invalid
+        """
+        if before and after:
+            raise ValueError("Only one of before or after may be provided")
+
+        if before:
+            index = self._index(before)
+        elif after:
+            index = self._index(after) + 1
+        else:
+            index = len(self.stages)
+
+        stages = self.stages[0:index] + [stage] + self.stages[index:]
+        self._check_stages(stages)
+        self.stages = stages
+
+    def unregister(self, stage_name: str) -> EdiStage:
+        """
+        Removes a stage from the pipeline.
+        :param stage_name: The stage name
+        :raises: ValueError if a remaining stage requires the removed stage's outputs
+        :returns: the removed stage
+        """
+        index = self._index(stage_name)
+        stages = self.stages[0:index] + self.stages[index + 1 :]
+        self._check_stages(stages)
+        return self.stages.pop(index)
+
+    def _raise_stage_exception(self, stage: EdiStage, ex: Exception) -> None:
+        """Raises an exception from a stage, wrapping unexpected exceptions in the stage's exception class"""
+        if isinstance(
+            ex,
+            (EdiDataValidationException, EdiTimeoutException, stage.exception_class),
+        ):
+            raise ex
+
+        raise stage.exception_class(
+            f"An EDI {stage.name.title()} Exception Occurred: {ex}"
+        ) from ex
+
+    def _is_memory_sampled(self) -> bool:
+        """Returns True if memory is traced for the next workflow"""
+        return self.memory_sample_rate > 0 and random.random() < self.memory_sample_rate
+
+    def run(self, workflow: "EdiWorkflow") -> None:
+        """
+        Executes the pipeline's stages for a single workflow.
+        :param workflow: The workflow to process
+        :raises: EdiDataValidationException if the message is invalid, otherwise the failed stage's exception class
+        """
+        self._run(workflow, self._is_memory_sampled())
+
+    def _run(self, workflow: "EdiWorkflow", trace_memory: bool) -> None:
+        """
+        Executes the pipeline's stages for a single workflow, profiling and tracing memory if requested.
+        tracemalloc is started for the workflow, unless it is already tracing, since tracing slows every allocation.
+        """
+        start_tracing = trace_memory and not tracemalloc.is_tracing()
+        if start_tracing:
+            tracemalloc.start()
+
+        try:
+            if self.profiler is None:
+                self._run_stages(workflow, trace_memory)
+            else:
+                with self.profiler.profile(workflow):
+                    self._run_stages(workflow, trace_memory)
+        finally:
+            if start_tracing:
+                tracemalloc.stop()
+
+    def _run_stages(self, workflow: "EdiWorkflow", trace_memory: bool) -> None:
+        """Executes the pipeline's stages for a single workflow"""
+        for stage in self.stages:
+            if workflow.cancelled:
+                return
+            if not stage.should_run(workflow):
+                continue
+
+            tracer = MemoryTracer() if trace_memory else nullcontext()
+            with Timer() as t, tracer:
+                try:
+                    stage.process(workflow)
+                except Exception as ex:
+                    self._raise_stage_exception(stage, ex)
+
+            if stage.metric_name:
+                setattr(workflow.metrics, stage.metric_name, t.elapsed_time)
+            if trace_memory:
+                if workflow.metrics.memory is None:
+                    workflow.metrics.memory = {}
+                workflow.metrics.memory[stage.name] = EdiStageMemory.construct(
+                    peakBytes=tracer.peak_bytes,
+                    netBytes=tracer.net_bytes,
+                    allocatedBlocks=tracer.allocated_blocks,
+                )
+            workflow.operations.append(stage.name)
+
+    def run_batch(self, workflows: List["EdiWorkflow"]) -> List[Optional[Exception]]:
+        """
+        Executes the pipeline's stages for a batch of workflows.
+        Each stage processes the batch before the next stage is executed. A workflow which fails, or is cancelled, is
+        excluded from subsequent stages, without affecting the remainder of the batch.
+
+        Stage elapsed time is divided evenly across the workflows processed in the stage's batch. Workflows which are
+        profiled, or sampled for memory tracing, are processed individually so that their measurements are not shared.
+        :param workflows: The workflows to process
+        :returns: A list, in workflow order, containing the exception raised for each workflow or None
+        """
+        exceptions: List[Optional[Exception]] = [None] * len(workflows)
+        individual_indexes = set()
+
+        for i, workflow in enumerate(workflows):
+            trace_memory = self._is_memory_sampled()
+            if self.profiler is None and not trace_memory:
+                continue
+
+            individual_indexes.add(i)
+            try:
+                self._run(workflow, trace_memory)
+            except Exception as ex:
+                exceptions[i] = ex
+
+        for stage in self.stages:
+            batch_indexes = [
+                i
+                for i, w in enumerate(workflows)
+                if i not in individual_indexes
+                and exceptions[i] is None
+                and not w.cancelled
+                and stage.should_run(w)
+            ]
+            if not batch_indexes:
+                continue
+
+            batch = [workflows[i] for i in batch_indexes]
+            with Timer() as t:
+                try:
+                    batch_exceptions = stage.process_batch(batch)
+                except Exception as ex:
+                    # the workflows the batch completed are unknown, so none are processed again
+                    logger.debug(f"Stage {stage.name} batch failed: {ex}")
+                    batch_exceptions = [ex] * len(batch)
+                if batch_exceptions is None:
+                    # stages written before process_batch returned outcomes
+                    batch_exceptions = [None] * len(batch)
+
+            for i, ex in zip(batch_indexes, batch_exceptions):
+                if ex is None:
+                    continue
+                try:
+                    self._raise_stage_exception(stage, ex)
+                except Exception as stage_ex:
+                    exceptions[i] = stage_ex
+
+            elapsed_time = t.elapsed_time / len(batch_indexes)
+            for i in batch_indexes:
+                if exceptions[i] is not None:
+                    continue
+                if stage.metric_name:
+                    setattr(workflows[i].metrics, stage.metric_name, elapsed_time)
+                workflows[i].operations.append(stage.name)
+
+        return exceptions
+
+    def stream(
+        self, workflows: Iterable["EdiWorkflow"], batch_size: int = 100
+    ) -> Iterator[Tuple["EdiWorkflow", Optional[Exception]]]:
+        """
+        Executes the pipeline over a stream of workflows, in batches.
+        :param workflows: The workflows to process
+        :param batch_size: The number of workflows processed by each stage at a time
+        :returns: An iterator of (workflow, exception) tuples, in input order. exception is None on success.
+        """
+        workflow_iterator = iter(workflows)
+        while True:
+            batch = list(islice(workflow_iterator, batch_size))
+            if not batch:
+                return
+            yield from zip(batch, self.run_batch(batch))
+
+
+@lru_cache()
+def get_default_pipeline(
+    enrich: bool = True,
+    validate: bool = True,
+    translate: bool = True,
+    validation_level: ValidationLevel = ValidationLevel.FULL,
+) -> EdiPipeline:
+    """
+    Returns the default pipeline for a combination of optional stages.
+    The analyze stage is always included, followed by the dedupe stage when a dedupe directory is configured. Pipelines are cached, so unused stages are not evaluated per message.
+    Translation requires the message's data model, so a full validate stage is included when only translate is
+    requested.
+    The returned pipeline is shared, and should not be modified. Custom pipelines are created with EdiPipeline.
+    """
+    stages = [AnalyzeStage()]
+    if get_settings().dedupe_directory:
+        stages.append(DedupeStage())
+    if enrich:
+        stages.append(EnrichStage())
+    if validate:
+        stages.append(ValidateStage(validation_level))
+    elif translate:
+        stages.append(ValidateStage(ValidationLevel.FULL))
+    if translate:
+        stages.append(TranslateStage())
+    return EdiPipeline(stages)
@@ -0,0 +1,355 @@
+"""
+pool.py
+
+A process pool which enforces per-message time limits and recycles worker processes.
+
+Each worker process executes one task at a time. A task which exceeds the wall clock time limit is stopped by killing
+the worker, and a task which exceeds the CPU time limit is stopped by the operating system, which terminates the worker
+with SIGXCPU when its RLIMIT_CPU soft limit is reached. Either way the worker is replaced, so a message which never
+completes does not stall a worker slot, and the limit cannot be caught and ignored by the code processing the message.
+Workers are also replaced after a number of tasks, or when their resident memory exceeds a limit, to release memory
+accumulated by long running processes.
+
+CPU time limits require the resource module, which is not available on Windows.
+
+Time limits and worker failures are returned as task results: EdiTimeoutException and EdiWorkerException.
+
+Usage:
+with WorkerPool(4, message_timeout=60) as pool:
+    pool.submit(task_id, process_file, file_path)
+    for task_id, result in pool.wait():
+        ...
+"""
+import logging
+import math
+import multiprocessing
+from multiprocessing.connection import Connection, wait
+import os
+import pickle
+import signal
+import time
+from typing import Any, Callable, Hashable, List, Optional, Tuple
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from .exceptions import EdiException, EdiTimeoutException, EdiWorkerException
+
+logger = logging.getLogger(__name__)
+
+# the signal which terminates a worker when it exceeds its CPU time limit
+_CPU_LIMIT_SIGNAL = getattr(signal, "SIGXCPU", None)
+
+
+def get_rss() -> int:
+    """
+    Returns the current process's resident memory in bytes
+    :raises: NotImplementedError if resident memory is not available on the platform
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        if resource is None:
+            raise NotImplementedError(
+                "Resident memory is not available on this platform"
+            )
+        # peak resident memory, in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _set_cpu_limit(cpu_timeout: Optional[float], default_limit: int) -> None:
+    """
+    Sets the worker's RLIMIT_CPU soft limit, which the operating system enforces in whole seconds of the process's
+    total CPU time.
+    :param cpu_timeout: The CPU time limit for the next task, in seconds, added to the CPU time used so far and rounded
+    up. None restores the default limit.
+    :param default_limit: The soft limit when no task is running
+    """
+    _, hard_limit = resource.getrlimit(resource.RLIMIT_CPU)
+    soft_limit = default_limit
+    if cpu_timeout is not None:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        soft_limit = math.ceil(usage.ru_utime + usage.ru_stime + cpu_timeout)
+        if hard_limit != resource.RLIM_INFINITY:
+            soft_limit = min(soft_limit, hard_limit)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft_limit, hard_limit))
+
+
+def _send_result(connection: Connection, task_id: Hashable, result: Any, recycle: bool):
+    """Sends a task result, replacing results which cannot be pickled with an EdiException"""
+    try:
+        connection.send((task_id, result, recycle))
+    except (pickle.PicklingError, AttributeError, TypeError):
+        connection.send(
+            (task_id, EdiException(f"{type(result).__name__}: {result}"), recycle)
+        )
+
+
+def _worker_main(
+    connection: Connection,
+    initializer: Optional[Callable],
+    initargs: Tuple,
+    cpu_timeout: Optional[float],
+    max_messages: Optional[int],
+    max_rss: Optional[int],
+) -> None:
+    """
+    Executes tasks received from the pool until the pool closes the connection or the worker is recycled.
+    :param connection: The worker's connection to the pool
+    :param initializer: Called once when the worker starts
+    :param initargs: The initializer arguments
+    :param cpu_timeout: The CPU time limit per task, in seconds
+    :param max_messages: The number of tasks executed before the worker exits
+    :param max_rss: The resident memory, in bytes, above which the worker exits after its current task
+    """
+    # the pool is interrupted, rather than each worker
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if cpu_timeout:
+        # SIGXCPU terminates the worker, without a core dump
+        signal.signal(_CPU_LIMIT_SIGNAL, signal.SIG_DFL)
+        resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+        default_cpu_limit = resource.getrlimit(resource.RLIMIT_CPU)[0]
+    if initializer:
+        initializer(*initargs)
+
+    message_count = 0
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+
+        task_id, fn, args = task
+        try:
+            if cpu_timeout:
+                _set_cpu_limit(cpu_timeout, default_cpu_limit)
+            result = fn(*args)
+        except Exception as ex:
+            result = ex
+        finally:
+            if cpu_timeout:
+                _set_cpu_limit(None, default_cpu_limit)
+
+        message_count += 1
+        recycle = bool(
+            (max_messages and message_count >= max_messages)
+            or (max_rss and get_rss() > max_rss)
+        )
+        _send_result(connection, task_id, result, recycle)
+        if recycle:
+            return
+
+
+class _Worker:
+    """A worker process, its connection and current task"""
+
+    __slots__ = ("process", "connection", "task_id", "deadline")
+
+    def __init__(self, process: multiprocessing.Process, connection: Connection):
+        self.process = process
+        self.connection = connection
+        self.task_id: Optional[Hashable] = None
+        self.deadline: Optional[float] = None
+
+    @property
+    def is_busy(self) -> bool:
+        return self.deadline is not None
+
+
+class WorkerPool:
+    """
+    A fixed size pool of worker processes with per-task time limits and worker recycling.
+    Tasks are submitted to idle workers, and results are collected with `wait`.
+    """
+
+    def __init__(
+        self,
+        max_workers: int,
+        initializer: Optional[Callable] = None,
+        initargs: Tuple = (),
+        message_timeout: Optional[float] = None,
+        cpu_timeout: Optional[float] = None,
+        max_messages_per_worker: Optional[int] = None,
+        max_worker_rss: Optional[int] = None,
+    ):
+        """
+        Starts the pool's worker processes.
+        :param max_workers: The number of worker processes
+        :param initializer: Called once in each worker process when it starts. Must be picklable.
+        :param initargs: The initializer arguments
+        :param message_timeout: The wall clock time limit per task, in seconds. The worker is killed and replaced when
+        a task exceeds the limit.
+        :param cpu_timeout: The CPU time limit per task, in seconds, enforced in whole seconds by RLIMIT_CPU. The
+        operating system terminates a worker which exceeds the limit, and the worker is replaced.
+        :param max_messages_per_worker: The number of tasks a worker executes before it is replaced
+        :param max_worker_rss: The resident memory, in bytes, above which a worker is replaced after its current task
+        :raises: NotImplementedError if a CPU time or resident memory limit is not available on the platform
+        """
+        if cpu_timeout and (resource is None or _CPU_LIMIT_SIGNAL is None):
+            raise NotImplementedError(
+                "CPU time limits are not available on this platform"
+            )
+        if max_worker_rss:
+            # fails before any worker starts if resident memory is not available
+            get_rss()
+
+        self.max_workers = max_workers
+        self.initializer = initializer
+        self.initargs = initargs
+        self.message_timeout = message_timeout
+        self.cpu_timeout = cpu_timeout
+        self.max_messages_per_worker = max_messages_per_worker
+        self.max_worker_rss = max_worker_rss
+        self.recycled_count = 0
+        self.timeout_count = 0
+
+        self._context = multiprocessing.get_context()
+        self._workers: List[_Worker] = [
+            self._start_worker() for _ in range(max_workers)
+        ]
+
+    def _start_worker(self) -> _Worker:
+        """Starts a worker process"""
+        parent_connection, child_connection = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(
+                child_connection,
+                self.initializer,
+                self.initargs,
+                self.cpu_timeout,
+                self.max_messages_per_worker,
+                self.max_worker_rss,
+            ),
+            daemon=True,
+        )
+        process.start()
+        child_connection.close()
+        return _Worker(process, parent_connection)
+
+    def _replace_worker(self, worker: _Worker, kill: bool = False) -> None:
+        """Stops a worker process and starts its replacement"""
+        if kill:
+            worker.process.kill()
+        worker.process.join()
+        worker.connection.close()
+        self._workers[self._workers.index(worker)] = self._start_worker()
+
+    @property
+    def idle_count(self) -> int:
+        """Returns the number of workers available for a task"""
+        return sum(1 for w in self._workers if not w.is_busy)
+
+    @property
+    def busy_count(self) -> int:
+        """Returns the number of tasks in progress"""
+        return self.max_workers - self.idle_count
+
+    def submit(self, task_id: Hashable, fn: Callable, *args) -> None:
+        """
+        Submits a task to an idle worker.
+        :param task_id: Identifies the task's result
+        :param fn: The task function. Must be picklable.
+        :param args: The task arguments
+        :raises: RuntimeError if no worker is idle
+        """
+        for worker in self._workers:
+            if not worker.is_busy:
+                break
+        else:
+            raise RuntimeError("No idle worker is available")
+
+        worker.task_id = task_id
+        worker.deadline = (
+            time.monotonic() + self.message_timeout
+            if self.message_timeout
+            else float("inf")
+        )
+        worker.connection.send((task_id, fn, args))
+
+    def wait(self) -> List[Tuple[Hashable, Any]]:
+        """
+        Waits for at least one task to complete, fail or time out.
+        :returns: list of (task id, task result or exception) tuples. Empty if no tasks are in progress.
+        """
+        busy_workers = [w for w in self._workers if w.is_busy]
+        if not busy_workers:
+            return []
+
+        deadline = min(w.deadline for w in busy_workers)
+        timeout = (
+            None if deadline == float("inf") else max(0.0, deadline - time.monotonic())
+        )
+        ready = wait([w.connection for w in busy_workers], timeout=timeout)
+
+        results = []
+        now = time.monotonic()
+        for worker in busy_workers:
+            task_id = worker.task_id
+            if worker.connection in ready:
+                try:
+                    result_task_id, result, recycle = worker.connection.recv()
+                except (EOFError, OSError):
+                    worker.process.join()
+                    exit_code = worker.process.exitcode
+                    if (
+                        _CPU_LIMIT_SIGNAL is not None
+                        and exit_code == -_CPU_LIMIT_SIGNAL
+                    ):
+                        self.timeout_count += 1
+                        result = EdiTimeoutException(
+                            f"Message processing exceeded {self.cpu_timeout} CPU seconds"
+                        )
+                    else:
+                        logger.warning(f"Worker exited with code {exit_code}")
+                        result = EdiWorkerException(
+                            f"Worker process exited with code {exit_code} while processing the message"
+                        )
+                    results.append((task_id, result))
+                    self._replace_worker(worker)
+                    continue
+
+                results.append((result_task_id, result))
+                worker.task_id = worker.deadline = None
+                if recycle:
+                    self.recycled_count += 1
+                    self._replace_worker(worker)
+            elif worker.deadline <= now:
+                self.timeout_count += 1
+                results.append(
+                    (
+                        task_id,
+                        EdiTimeoutException(
+                            f"Message processing exceeded {self.message_timeout} seconds"
+                        ),
+                    )
+                )
+                self._replace_worker(worker, kill=True)
+
+        return results
+
+    def close(self) -> None:
+        """Stops the worker processes. Tasks in progress are abandoned."""
+        for worker in self._workers:
+            if worker.is_busy:
+                worker.process.kill()
+            else:
+                try:
+                    worker.connection.send(None)
+                except OSError:
+                    pass
+        for worker in self._workers:
+            worker.process.join()
+            worker.connection.close()
+        self._workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,201 @@
+"""
+profiling.py
+
+Profiles EDI workflows for a sample of messages.
+
+A MessageProfiler is attached to an EdiPipeline. Every Nth message is profiled with cProfile, and written as a pstats
+dump. When a slow message threshold is configured, every message is sampled with a low overhead stack sampler, and
+messages which exceed the threshold are written as collapsed stacks. Messages profiled with cProfile are also sampled,
+so sampled stacks for every profiled message are appended to a per-process collapsed stack file, which is compatible
+with flame graph tools such as flamegraph.pl and speedscope.
+
+Dumps are named using the message's format and checksum:
+* <format>-<checksum>.prof - cProfile stats, readable with pstats or snakeviz
+* <format>-<checksum>.collapsed - sampled stacks for a slow message
+* profile-<pid>.collapsed - sampled stacks aggregated across a run
+
+Usage:
+profiler = MessageProfiler("/tmp/profiles", every=100, slower_than=0.5)
+pipeline = EdiPipeline([AnalyzeStage(), ValidateStage()], profiler=profiler)
+"""
+from collections import Counter
+import contextlib
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+from types import FrameType
+from typing import Dict, Iterator, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .workflows import EdiWorkflow
+
+logger = logging.getLogger(__name__)
+
+# the default interval, in seconds, between stack samples
+SAMPLE_INTERVAL = 0.005
+
+
+def _collapse_stack(frame: FrameType) -> str:
+    """Returns a frame's stack in collapsed format: semicolon delimited frames, outermost first"""
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+
+class StackSampler:
+    """
+    Samples a thread's stack at a fixed interval from a background thread.
+    Sampling does not instrument function calls, so it adds little overhead to the sampled thread.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        """
+        :param interval: The interval, in seconds, between samples
+        """
+        self.interval = interval
+        self.stacks: Counter = Counter()
+        self._thread_id: Optional[int] = None
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        """Records samples until the sampler is stopped"""
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self.stacks[_collapse_stack(frame)] += 1
+
+    def start(self) -> None:
+        """Starts sampling the calling thread"""
+        self._thread_id = threading.get_ident()
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        """
+        Stops sampling.
+        :returns: a Counter of collapsed stacks and sample counts
+        """
+        self._stop_event.set()
+        self._thread.join()
+        return self.stacks
+
+
+def write_collapsed_stacks(stacks: Dict[str, int], file_path: str) -> None:
+    """
+    Appends stacks to a collapsed stack file, one "frame;frame;frame count" line per stack.
+    :param stacks: collapsed stacks and sample counts
+    :param file_path: The output file path
+    """
+    with open(file_path, "a", encoding="utf-8") as f:
+        for stack, count in stacks.items():
+            f.write(f"{stack} {count}\n")
+
+
+class MessageProfiler:
+    """
+    Profiles a sample of the messages processed by an EdiPipeline.
+    """
+
+    def __init__(
+        self,
+        output_directory: str,
+        every: Optional[int] = None,
+        slower_than: Optional[float] = None,
+        sample_interval: float = SAMPLE_INTERVAL,
+    ):
+        """
+        :param output_directory: The directory where profiles are written. Created if it does not exist.
+        :param every: Profiles every Nth message with cProfile
+        :param slower_than: Samples every message, writing the stacks of messages which take longer than this number
+        of seconds
+        :param sample_interval: The interval, in seconds, between stack samples
+        :raises: ValueError if neither every nor slower_than is provided
+        """
+        if not every and slower_than is None:
+            raise ValueError("One of every or slower_than is required")
+
+        self.output_directory = output_directory
+        self.every = every
+        self.slower_than = slower_than
+        self.sample_interval = sample_interval
+        self.message_count = 0
+        self.profiled_count = 0
+        os.makedirs(output_directory, exist_ok=True)
+
+    def _dump_path(self, workflow: "EdiWorkflow", extension: str) -> str:
+        """Returns the dump path for a workflow, tagged with its message format and checksum"""
+        meta_data = workflow.meta_data
+        if meta_data is None:
+            name = f"unknown-{os.getpid()}-{self.message_count}"
+        else:
+            name = f"{meta_data.ediMessageFormat.value.lower()}-{meta_data.checksum}"
+        return os.path.join(self.output_directory, f"{name}.{extension}")
+
+    @property
+    def aggregate_path(self) -> str:
+        """Returns the collapsed stack file for sampled messages in the current process"""
+        return os.path.join(self.output_directory, f"profile-{os.getpid()}.collapsed")
+
+    @contextlib.contextmanager
+    def profile(self, workflow: "EdiWorkflow") -> Iterator[None]:
+        """
+        Profiles a workflow, if it is selected, while the context is active.
+        :param workflow: The workflow being processed
+        """
+        self.message_count += 1
+
+        profile = None
+        if self.every and self.message_count % self.every == 0:
+            profile = cProfile.Profile()
+        elif self.slower_than is None:
+            yield
+            return
+
+        # the sampler runs alongside cProfile, so cProfile'd messages are included in the aggregate stacks
+        sampler = StackSampler(self.sample_interval)
+        sampler.start()
+        if profile is not None:
+            profile.enable()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed_time = time.perf_counter() - start_time
+            if profile is not None:
+                profile.disable()
+                self.profiled_count += 1
+                profile.dump_stats(self._dump_path(workflow, "prof"))
+            self._write_samples(workflow, sampler.stop(), elapsed_time, profile is None)
+
+    def _write_samples(
+        self,
+        workflow: "EdiWorkflow",
+        stacks: Counter,
+        elapsed_time: float,
+        check_slow: bool,
+    ) -> None:
+        """
+        Appends a workflow's samples to the aggregate file, and writes a dump if the workflow was slow
+        :param check_slow: Indicates if a slow workflow is written as a collapsed stack dump. False for workflows which
+        were profiled with cProfile.
+        """
+        if stacks:
+            write_collapsed_stacks(stacks, self.aggregate_path)
+
+        if check_slow and elapsed_time > self.slower_than:
+            self.profiled_count += 1
+            dump_path = self._dump_path(workflow, "collapsed")
+            if os.path.exists(dump_path):
+                os.remove(dump_path)
+            write_collapsed_stacks(stacks, dump_path)
+            logger.info(
+                f"Message took {elapsed_time:.3f} seconds, profile written to {dump_path}"
+            )
@@ -0,0 +1,128 @@
+"""
+shared_buffer.py
+
+Transfers message bytes to worker processes through shared memory.
+
+Sending a message to a worker process pickles the message, writes it through a pipe and unpickles a copy within the
+worker. A SharedMessageBlock copies a batch of messages into a single shared memory block once, and workers receive
+a small SharedBufferRef per message: the block's name and the message's offset and size. Workers attach to the block
+and operate on memoryview slices of it, so message bytes are not copied into the worker's heap unless a workflow step
+decodes them.
+
+The process which creates a block owns it, and unlinks it when the block is closed. Workers release their views
+when a batch is complete.
+
+Usage:
+with SharedMessageBlock(messages) as block:
+    results = executor.submit(process, block.refs).result()
+
+# within the worker
+with attach_shared_buffers(refs) as buffers:
+    workflows = [EdiWorkflow(b) for b in buffers]
+"""
+from contextlib import contextmanager
+import logging
+from multiprocessing.shared_memory import SharedMemory
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Union
+
+from .support import EdiMessageBuffer
+
+logger = logging.getLogger(__name__)
+
+
+class SharedBufferRef(NamedTuple):
+    """Locates a message within a shared memory block"""
+
+    name: str
+    offset: int
+    size: int
+    is_binary: bool
+
+
+class SharedMessageBlock:
+    """
+    A shared memory block containing a batch of messages.
+    The block is unlinked when it is closed, so it must remain open until the workers which use it are complete.
+    """
+
+    def __init__(
+        self,
+        messages: Iterable[Union[bytes, bytearray, memoryview, str, EdiMessageBuffer]],
+    ):
+        """
+        Copies messages into a new shared memory block.
+        :param messages: The messages. str messages are encoded to UTF-8.
+        """
+        buffers = [
+            m if isinstance(m, EdiMessageBuffer) else EdiMessageBuffer(m)
+            for m in messages
+        ]
+        sizes = [len(b.data) for b in buffers]
+        # shared memory blocks may not be empty
+        self._memory = SharedMemory(create=True, size=max(sum(sizes), 1))
+
+        self.refs: List[SharedBufferRef] = []
+        offset = 0
+        for buffer, size in zip(buffers, sizes):
+            self._memory.buf[offset : offset + size] = buffer.data
+            self.refs.append(
+                SharedBufferRef(self._memory.name, offset, size, buffer.is_binary)
+            )
+            offset += size
+
+    @property
+    def name(self) -> str:
+        return self._memory.name
+
+    @property
+    def size(self) -> int:
+        """Returns the number of message bytes within the block"""
+        return sum(r.size for r in self.refs)
+
+    def close(self) -> None:
+        """Closes and unlinks the block"""
+        if self._memory is None:
+            return
+        self._memory.close()
+        self._memory.unlink()
+        self._memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+@contextmanager
+def attach_shared_buffers(
+    refs: Iterable[SharedBufferRef],
+) -> Iterator[List[EdiMessageBuffer]]:
+    """
+    Attaches to the shared memory blocks containing messages, returning a message buffer per message.
+    The buffers' views are released on exit, so the buffers must not be used after the context exits.
+    :param refs: The message references
+    :returns: list of EdiMessageBuffer, in reference order
+    """
+    refs = list(refs)
+    blocks: Dict[str, SharedMemory] = {}
+    views: List[memoryview] = []
+    try:
+        for ref in refs:
+            if ref.name not in blocks:
+                blocks[ref.name] = SharedMemory(name=ref.name)
+            views.append(blocks[ref.name].buf[ref.offset : ref.offset + ref.size])
+
+        yield [
+            EdiMessageBuffer(view, is_binary=ref.is_binary)
+            for view, ref in zip(views, refs)
+        ]
+    finally:
+        try:
+            for view in views:
+                view.release()
+            for block in blocks.values():
+                block.close()
+        except BufferError:
+            # a view is still exported, so the mapping is released when the worker exits
+            logger.warning("Unable to release shared memory message buffers")
@@ -0,0 +1,342 @@
+"""
+sinks.py
+
+Result sinks write EdiResults, or the exceptions raised for failed messages, to an output in buffered batches.
+
+Results are buffered in memory and written when the buffer is full, or when the sink is flushed or closed, so output
+is written in bulk rather than per message. The SQLite and Parquet sinks flatten results into columns: metadata and
+metrics fields become columns prefixed with "metadata_" and "metrics_", and failed messages populate the "error"
+column.
+
+Sinks:
+* NdjsonResultSink - newline delimited JSON files, rotated by size
+* SqliteResultSink - a SQLite table, with a transaction per batch
+* ParquetResultSink - a Parquet file, with a row group per batch. Requires pyarrow.
+
+Usage:
+with create_result_sink("results.db") as sink:
+    for message_path, result in batch_workflow.run():
+        sink.write(message_path, result)
+"""
+import abc
+import os
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from pydantic import BaseModel
+
+from .models import EdiResult
+from .support import get_json_backend, model_to_dict
+
+# flattened result columns and their SQL types
+RESULT_COLUMNS: List[Tuple[str, str]] = [
+    ("path", "TEXT"),
+    ("error", "TEXT"),
+    ("metadata_baseMessageFormat", "TEXT"),
+    ("metadata_ediMessageFormat", "TEXT"),
+    ("metadata_specificationVersion", "TEXT"),
+    ("metadata_implementationVersions", "TEXT"),
+    ("metadata_messageSize", "INTEGER"),
+    ("metadata_checksum", "TEXT"),
+    ("metrics_analyzeTime", "REAL"),
+    ("metrics_enrichTime", "REAL"),
+    ("metrics_validateTime", "REAL"),
+    ("metrics_translateTime", "REAL"),
+    ("metrics_totalTime", "REAL"),
+    ("validationLevel", "TEXT"),
+    ("duplicate", "INTEGER"),
+    ("codeCount", "INTEGER"),
+    ("compression_compressionFormat", "TEXT"),
+    ("compression_compressedChecksum", "TEXT"),
+]
+
+# the default number of results buffered before they are written
+BUFFER_SIZE = 1000
+
+
+def result_to_dict(
+    message_path: Optional[str], result: Union[EdiResult, Exception]
+) -> Dict[str, Any]:
+    """
+    Converts a result to a JSON compatible dictionary: the EdiResult fields with a "path" field, or the path and an
+    "error" field for failed messages.
+    :param message_path: The path of the processed message, if it was loaded from a file
+    :param result: The EdiResult, or the exception raised for the message
+    :returns: dictionary
+    """
+    if isinstance(result, Exception):
+        return {"path": message_path, "error": f"{type(result).__name__}: {result}"}
+    return {"path": message_path, **model_to_dict(result)}
+
+
+def _flatten_model(row: Dict[str, Any], prefix: str, model: Optional[BaseModel]):
+    """Adds a model's fields to a row as prefixed columns"""
+    if model is None:
+        return
+    for name, value in model_to_dict(model).items():
+        if isinstance(value, list):
+            value = ",".join(str(v) for v in value)
+        elif isinstance(value, dict):
+            continue
+        row[f"{prefix}_{name}"] = value
+
+
+def flatten_result(
+    message_path: Optional[str], result: Union[EdiResult, Exception]
+) -> Dict[str, Any]:
+    """
+    Flattens a result into a row containing the RESULT_COLUMNS.
+    Per-step memory metrics, codes and translations are not flattened. The number of resolved codes is included.
+    :param message_path: The path of the processed message, if it was loaded from a file
+    :param result: The EdiResult, or the exception raised for the message
+    :returns: dictionary of column names and values
+    """
+    row: Dict[str, Any] = dict.fromkeys(c for c, _ in RESULT_COLUMNS)
+    row["path"] = message_path
+
+    if isinstance(result, Exception):
+        row["error"] = f"{type(result).__name__}: {result}"
+        return row
+
+    _flatten_model(row, "metadata", result.metadata)
+    _flatten_model(row, "metrics", result.metrics)
+    _flatten_model(row, "compression", result.compression)
+    row["validationLevel"] = (
+        result.validationLevel.value if result.validationLevel else None
+    )
+    # stored as an INTEGER column, which sqlite and parquet do not accept booleans for
+    row["duplicate"] = int(result.duplicate) if result.duplicate is not None else None
+    row["codeCount"] = len(result.codes) if result.codes is not None else None
+
+    # drops fields which are not result columns, such as compressedSize
+    return {c: row.get(c) for c, _ in RESULT_COLUMNS}
+
+
+class ResultSink(metaclass=abc.ABCMeta):
+    """
+    Abstract base class for a buffered result sink.
+    Subclasses implement `_write_batch`, which writes a batch of buffered results.
+    """
+
+    def __init__(self, buffer_size: int = BUFFER_SIZE):
+        """
+        :param buffer_size: The number of results buffered before they are written
+        """
+        self.buffer_size = buffer_size
+        self.count = 0
+        self._buffer: List[Tuple[Optional[str], Union[EdiResult, Exception]]] = []
+
+    def write(
+        self, message_path: Optional[str], result: Union[EdiResult, Exception]
+    ) -> None:
+        """
+        Buffers a result, writing the buffer when it is full.
+        :param message_path: The path of the processed message, if it was loaded from a file
+        :param result: The EdiResult, or the exception raised for the message
+        """
+        self._buffer.append((message_path, result))
+        self.count += 1
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes buffered results"""
+        if self._buffer:
+            self._write_batch(self._buffer)
+            self._buffer = []
+
+    @abc.abstractmethod
+    def _write_batch(
+        self, results: List[Tuple[Optional[str], Union[EdiResult, Exception]]]
+    ) -> None:
+        """Writes a batch of results"""
+        return
+
+    def close(self) -> None:
+        """Writes buffered results and closes the sink"""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class NdjsonResultSink(ResultSink):
+    """
+    Writes results as newline delimited JSON.
+    Each line is the EdiResult JSON with a "path" field, or the path and "error" for failed messages.
+    When a maximum file size is provided, a new numbered file is started once the current file reaches the limit:
+    results.ndjson, results.1.ndjson, results.2.ndjson, etc.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        max_file_size: Optional[int] = None,
+        buffer_size: int = BUFFER_SIZE,
+    ):
+        """
+        :param file_path: The output file path
+        :param max_file_size: The size, in bytes, at which the output file is rotated. Defaults to None, which does not
+        rotate the output.
+        :param buffer_size: The number of results buffered before they are written
+        """
+        super().__init__(buffer_size)
+        self.file_path = file_path
+        self.max_file_size = max_file_size
+        self.file_paths: List[str] = []
+        self._file = None
+        self._open(file_path)
+
+    def _open(self, file_path: str) -> None:
+        """Opens an output file"""
+        self._file = open(file_path, "w", encoding="utf-8")
+        self.file_paths.append(file_path)
+
+    def _rotate(self) -> None:
+        """Closes the current output file and opens the next numbered file"""
+        self._file.close()
+        root, extension = os.path.splitext(self.file_path)
+        self._open(f"{root}.{len(self.file_paths)}{extension}")
+
+    def _write_batch(
+        self, results: List[Tuple[Optional[str], Union[EdiResult, Exception]]]
+    ) -> None:
+        dumps = get_json_backend().dumps
+        lines = [dumps(result_to_dict(p, r)) for p, r in results]
+        lines.append("")
+
+        if (
+            self.max_file_size is not None
+            and self._file.tell() > 0
+            and self._file.tell() >= self.max_file_size
+        ):
+            self._rotate()
+        self._file.write("\n".join(lines))
+        self._file.flush()
+
+    def close(self) -> None:
+        super().close()
+        self._file.close()
+
+
+class SqliteResultSink(ResultSink):
+    """
+    Writes flattened results to a SQLite table, inserting each batch in a single transaction.
+    The table is created if it does not exist.
+    """
+
+    def __init__(
+        self,
+        database_path: str,
+        table_name: str = "edi_results",
+        buffer_size: int = BUFFER_SIZE,
+    ):
+        """
+        :param database_path: The SQLite database path
+        :param table_name: The results table name
+        :param buffer_size: The number of results buffered before they are written
+        """
+        super().__init__(buffer_size)
+        self.database_path = database_path
+        self.table_name = table_name
+        self._connection = sqlite3.connect(database_path)
+
+        column_definitions = ", ".join(f'"{c}" {t}' for c, t in RESULT_COLUMNS)
+        with self._connection:
+            self._connection.execute(
+                f'CREATE TABLE IF NOT EXISTS "{table_name}" ({column_definitions})'
+            )
+        column_names = ", ".join(f'"{c}"' for c, _ in RESULT_COLUMNS)
+        placeholders = ", ".join("?" for _ in RESULT_COLUMNS)
+        self._insert_sql = (
+            f'INSERT INTO "{table_name}" ({column_names}) VALUES ({placeholders})'
+        )
+
+    def _write_batch(
+        self, results: List[Tuple[Optional[str], Union[EdiResult, Exception]]]
+    ) -> None:
+        rows = (tuple(flatten_result(p, r).values()) for p, r in results)
+        with self._connection:
+            self._connection.executemany(self._insert_sql, rows)
+
+    def close(self) -> None:
+        super().close()
+        self._connection.close()
+
+
+class ParquetResultSink(ResultSink):
+    """
+    Writes flattened results to a Parquet file, writing each batch as a row group.
+    Requires pyarrow, installed with the `parquet` extra.
+    """
+
+    def __init__(self, file_path: str, buffer_size: int = 10000):
+        """
+        :param file_path: The output file path
+        :param buffer_size: The number of results buffered before they are written. Larger row groups compress and
+        scan more efficiently.
+        :raises: ImportError if pyarrow is not installed
+        """
+        import pyarrow
+        import pyarrow.parquet
+
+        super().__init__(buffer_size)
+        self.file_path = file_path
+        self._pyarrow = pyarrow
+
+        types = {
+            "TEXT": pyarrow.string(),
+            "INTEGER": pyarrow.int64(),
+            "REAL": pyarrow.float64(),
+        }
+        self._schema = pyarrow.schema([(c, types[t]) for c, t in RESULT_COLUMNS])
+        self._writer = pyarrow.parquet.ParquetWriter(file_path, self._schema)
+
+    def _write_batch(
+        self, results: List[Tuple[Optional[str], Union[EdiResult, Exception]]]
+    ) -> None:
+        columns: Dict[str, List] = {c: [] for c, _ in RESULT_COLUMNS}
+        for message_path, result in results:
+            for column, value in flatten_result(message_path, result).items():
+                columns[column].append(value)
+        self._writer.write_table(
+            self._pyarrow.Table.from_pydict(columns, schema=self._schema)
+        )
+
+    def close(self) -> None:
+        super().close()
+        self._writer.close()
+
+
+# sink classes by output file extension
+_SINK_EXTENSIONS = {
+    ".ndjson": NdjsonResultSink,
+    ".jsonl": NdjsonResultSink,
+    ".db": SqliteResultSink,
+    ".sqlite": SqliteResultSink,
+    ".parquet": ParquetResultSink,
+}
+
+
+def create_result_sink(
+    output_path: str, max_file_size: Optional[int] = None
+) -> ResultSink:
+    """
+    Creates the result sink for an output file, based on its extension: .ndjson or .jsonl, .db or .sqlite, .parquet
+    :param output_path: The output file path
+    :param max_file_size: The size, in bytes, at which NDJSON output is rotated
+    :raises: ValueError if the extension is not supported
+    :raises: ImportError if the sink's optional dependency is not installed
+    """
+    extension = os.path.splitext(output_path)[1].lower()
+    sink_class = _SINK_EXTENSIONS.get(extension)
+    if sink_class is None:
+        raise ValueError(
+            f"Unsupported result output {output_path}. Supported extensions are {', '.join(_SINK_EXTENSIONS)}"
+        )
+    if sink_class is NdjsonResultSink:
+        return sink_class(output_path, max_file_size=max_file_size)
+    return sink_class(output_path)
@@ -0,0 +1,430 @@
+"""
+spool.py
+
+Continuously processes EDI files delivered to a spool directory.
+
+Files are claimed by renaming them into a claimed directory, so a file is processed once, and are then moved to a done
+or failed directory alongside a "<file name>.result.ndjson" file containing the file's results. A file fails if any of
+its messages failed.
+
+New files are detected with inotify on Linux. Elsewhere, the spool directory's modification time is polled and the
+directory is only scanned when it has changed, so an idle spool is not rescanned each tick. The spool is also scanned
+periodically to recover from missed events.
+
+Files should be delivered atomically, by writing to a hidden file (a name starting with ".") or another directory on
+the same file system and renaming it into the spool. Hidden files and directories in the spool are ignored.
+
+Usage:
+with SpoolWatcher("/data/spool", max_workers=4) as watcher:
+    watcher.run()
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+from .models import EdiResult
+from .pipeline import EdiPipeline, get_default_pipeline
+from .pool import WorkerPool
+from .sinks import ResultSink, result_to_dict
+from .support import get_json_backend, warm_up_fhir_models
+from .workflows import (
+    LARGE_FILE_SIZE,
+    _init_batch_worker,
+    _process_batch_file,
+    _process_file,
+    get_large_file_pipeline,
+)
+
+logger = logging.getLogger(__name__)
+
+# the default directory names within the spool
+CLAIMED_DIRECTORY = ".claimed"
+DONE_DIRECTORY = "done"
+FAILED_DIRECTORY = "failed"
+
+RESULT_FILE_SUFFIX = ".result.ndjson"
+
+# the directory modification time granularity assumed when polling, in nanoseconds
+MTIME_GRANULARITY_NS = 1_000_000_000
+
+# inotify event masks, from sys/inotify.h
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def _is_spool_file(name: str) -> bool:
+    """Returns True if a spool directory entry name may be processed"""
+    return not name.startswith(".")
+
+
+class _InotifyMonitor:
+    """Reports files closed after writing, or moved into, a directory using inotify"""
+
+    def __init__(self, directory: str):
+        """
+        :param directory: The directory to monitor
+        :raises: OSError if inotify is not available
+        """
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if (
+            libc.inotify_add_watch(
+                self._fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO
+            )
+            < 0
+        ):
+            errno = ctypes.get_errno()
+            os.close(self._fd)
+            raise OSError(errno, f"inotify_add_watch failed for {directory}")
+
+    def wait(self, timeout: float) -> Optional[List[str]]:
+        """
+        Waits for new files.
+        :param timeout: The maximum time to wait, in seconds
+        :returns: The names of new files, or None if events were lost and the directory should be scanned
+        """
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return []
+
+        names = []
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except BlockingIOError:
+                return names
+
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+                offset += _INOTIFY_EVENT.size
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                if not mask & IN_ISDIR:
+                    names.append(
+                        os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+                    )
+                offset += length
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+class _PollingMonitor:
+    """Detects directory changes by polling the directory's modification time"""
+
+    def __init__(self, directory: str):
+        """
+        :param directory: The directory to monitor
+        """
+        self.directory = directory
+        self._mtime_ns: Optional[int] = None
+
+    def _is_changed(self) -> bool:
+        mtime_ns = os.stat(self.directory).st_mtime_ns
+        # a file added within the file system's timestamp granularity of the last check may not change the mtime
+        if (
+            mtime_ns == self._mtime_ns
+            and time.time_ns() - mtime_ns > MTIME_GRANULARITY_NS
+        ):
+            return False
+        self._mtime_ns = mtime_ns
+        return True
+
+    def wait(self, timeout: float) -> Optional[List[str]]:
+        """
+        Waits for the directory to change.
+        :param timeout: The maximum time to wait, in seconds
+        :returns: None if the directory changed and should be scanned, otherwise an empty list
+        """
+        if self._is_changed():
+            return None
+        time.sleep(timeout)
+        return None if self._is_changed() else []
+
+    def close(self) -> None:
+        return
+
+
+def _process_spool_files(
+    file_paths: List[str],
+) -> List[Tuple[Optional[str], List[Tuple[str, Union[EdiResult, Exception]]]]]:
+    """Processes a chunk of spool files within a worker process"""
+    return [
+        _process_batch_file(p, os.path.getsize(p) >= LARGE_FILE_SIZE)
+        for p in file_paths
+    ]
+
+
+class SpoolWatcher:
+    """
+    Watches a spool directory, processing files as they are delivered.
+
+    Claimed files are processed within the current process, or in chunks by a WorkerPool when more than one worker, or
+    a time limit, is configured. Files left in the claimed directory by a watcher which stopped are returned to the
+    spool when the watcher starts, so a spool directory is watched by a single SpoolWatcher at a time.
+    """
+
+    def __init__(
+        self,
+        spool_directory: str,
+        pipeline: Optional[EdiPipeline] = None,
+        done_directory: Optional[str] = None,
+        failed_directory: Optional[str] = None,
+        max_workers: int = 1,
+        chunk_size: int = 16,
+        message_timeout: Optional[float] = None,
+        poll_interval: float = 1.0,
+        rescan_interval: float = 60.0,
+        use_inotify: bool = True,
+        sink: Optional[ResultSink] = None,
+    ):
+        """
+        Configures the SpoolWatcher instance, creating its directories if they do not exist.
+        :param spool_directory: The directory files are delivered to
+        :param pipeline: The pipeline to execute. Defaults to the pipeline with all stages. Pipelines are sent to
+        worker processes, so custom pipelines must be picklable.
+        :param done_directory: The directory processed files are moved to. Defaults to "done" within the spool.
+        :param failed_directory: The directory failed files are moved to. Defaults to "failed" within the spool.
+        :param max_workers: The number of processes. Defaults to 1, which processes files within the current process.
+        :param chunk_size: The number of files sent to a worker process at a time
+        :param message_timeout: The wall clock time limit, in seconds, per chunk of files. Files in a chunk which
+        exceeds the limit fail with an EdiTimeoutException.
+        :param poll_interval: The maximum time, in seconds, between checks for new files
+        :param rescan_interval: The time, in seconds, between full scans of the spool directory
+        :param use_inotify: Indicates if inotify is used, when available, to detect new files
+        :param sink: Optional sink which also receives each message's result
+        """
+        self.spool_directory = spool_directory
+        self._pipeline = pipeline
+        self.pipeline = pipeline or get_default_pipeline()
+        self.done_directory = done_directory or os.path.join(
+            spool_directory, DONE_DIRECTORY
+        )
+        self.failed_directory = failed_directory or os.path.join(
+            spool_directory, FAILED_DIRECTORY
+        )
+        self.claimed_directory = os.path.join(spool_directory, CLAIMED_DIRECTORY)
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.message_timeout = message_timeout
+        self.poll_interval = poll_interval
+        self.rescan_interval = rescan_interval
+        self.sink = sink
+        self.processed_count = 0
+        self.failed_count = 0
+
+        for directory in (
+            self.spool_directory,
+            self.claimed_directory,
+            self.done_directory,
+            self.failed_directory,
+        ):
+            os.makedirs(directory, exist_ok=True)
+
+        self._monitor: Union[_InotifyMonitor, _PollingMonitor, None] = None
+        if use_inotify:
+            try:
+                self._monitor = _InotifyMonitor(spool_directory)
+            except (OSError, AttributeError, TypeError) as ex:
+                logger.info(f"inotify is not available, polling the spool: {ex}")
+        if self._monitor is None:
+            self._monitor = _PollingMonitor(spool_directory)
+
+        self._pool: Optional[WorkerPool] = None
+        if max_workers > 1 or message_timeout:
+            self._pool = WorkerPool(
+                max_workers,
+                initializer=_init_batch_worker,
+                initargs=(self._pipeline, None),
+                message_timeout=message_timeout,
+            )
+        else:
+            warm_up_fhir_models()
+
+        self._pending: Dict[str, None] = {}
+        self._last_scan = 0.0
+        self._is_stopped = False
+        self._recover_claimed()
+
+    def _recover_claimed(self) -> None:
+        """Returns files left in the claimed directory to the spool"""
+        for name in os.listdir(self.claimed_directory):
+            os.replace(
+                os.path.join(self.claimed_directory, name),
+                os.path.join(self.spool_directory, name),
+            )
+            logger.info(f"Returned claimed file {name} to the spool")
+
+    def _scan(self) -> None:
+        """Adds the spool directory's files to the pending files"""
+        self._last_scan = time.monotonic()
+        with os.scandir(self.spool_directory) as entries:
+            for entry in entries:
+                if _is_spool_file(entry.name) and entry.is_file(follow_symlinks=False):
+                    self._pending[entry.name] = None
+
+    def _claim(self) -> List[Tuple[str, str]]:
+        """
+        Claims the pending files by renaming them into the claimed directory.
+        Files which were removed, or share a name with a file which is still being processed, are not claimed.
+        :returns: list of (file name, claimed path) tuples
+        """
+        claimed = []
+        for name in list(self._pending):
+            claimed_path = os.path.join(self.claimed_directory, name)
+            if os.path.exists(claimed_path):
+                continue
+            del self._pending[name]
+            try:
+                os.rename(os.path.join(self.spool_directory, name), claimed_path)
+            except FileNotFoundError:
+                continue
+            claimed.append((name, claimed_path))
+        return claimed
+
+    @staticmethod
+    def _destination_path(directory: str, name: str) -> str:
+        """Returns a path within a directory for a file, adding a numeric suffix if the name is in use"""
+        path = os.path.join(directory, name)
+        suffix = 0
+        while os.path.exists(path):
+            suffix += 1
+            path = os.path.join(directory, f"{name}.{suffix}")
+        return path
+
+    def _complete(
+        self, name: str, results: List[Tuple[str, Union[EdiResult, Exception]]]
+    ) -> None:
+        """Moves a processed file to the done or failed directory and writes its results alongside"""
+        is_failed = any(isinstance(r, Exception) for _, r in results)
+        destination_path = self._destination_path(
+            self.failed_directory if is_failed else self.done_directory, name
+        )
+        claimed_path = os.path.join(self.claimed_directory, name)
+
+        dumps = get_json_backend().dumps
+        with open(destination_path + RESULT_FILE_SUFFIX, "w", encoding="utf-8") as f:
+            for message_path, result in results:
+                # results are reported relative to the file's final location
+                message_path = destination_path + message_path[len(claimed_path) :]
+                f.write(dumps(result_to_dict(message_path, result)) + "\n")
+                if self.sink:
+                    self.sink.write(message_path, result)
+        os.replace(claimed_path, destination_path)
+
+        self.processed_count += 1
+        if is_failed:
+            self.failed_count += 1
+            logger.warning(f"Failed to process {name}")
+
+    def _process_claimed(self, claimed: List[Tuple[str, str]]) -> None:
+        """Processes claimed files, returning once every file is complete"""
+        if self._pool is None:
+            large_file_pipeline = None
+            for name, claimed_path in claimed:
+                if os.path.getsize(claimed_path) >= LARGE_FILE_SIZE:
+                    large_file_pipeline = (
+                        large_file_pipeline or get_large_file_pipeline()
+                    )
+                    _, results = _process_file(claimed_path, large_file_pipeline, True)
+                else:
+                    _, results = _process_file(claimed_path, self.pipeline)
+                self._complete(name, results)
+            return
+
+        chunks = [
+            claimed[i : i + self.chunk_size]
+            for i in range(0, len(claimed), self.chunk_size)
+        ]
+        in_progress: Dict[int, List[Tuple[str, str]]] = {}
+        while chunks or in_progress:
+            while chunks and self._pool.idle_count:
+                chunk = chunks.pop()
+                in_progress[len(chunks)] = chunk
+                self._pool.submit(
+                    len(chunks), _process_spool_files, [p for _, p in chunk]
+                )
+
+            for task_id, task_result in self._pool.wait():
+                chunk = in_progress.pop(task_id)
+                if isinstance(task_result, Exception):
+                    for name, claimed_path in chunk:
+                        self._complete(name, [(claimed_path, task_result)])
+                else:
+                    for (name, _), (_, results) in zip(chunk, task_result):
+                        self._complete(name, results)
+
+    def process_pending(self) -> int:
+        """
+        Claims and processes the files which have been delivered to the spool since the last call.
+        :returns: the number of files processed
+        """
+        self._wait(0)
+        return self._process_pending()
+
+    def _wait(self, timeout: float) -> None:
+        """Waits for new files, adding them to the pending files"""
+        names = self._monitor.wait(timeout)
+        if names is None or time.monotonic() - self._last_scan >= self.rescan_interval:
+            self._scan()
+        else:
+            self._pending.update((n, None) for n in names if _is_spool_file(n))
+
+    def _process_pending(self) -> int:
+        """Claims and processes the pending files"""
+        claimed = self._claim()
+        if claimed:
+            self._process_claimed(claimed)
+        elif self.sink:
+            # flushes buffered results once the spool is idle
+            self.sink.flush()
+        return len(claimed)
+
+    def run(self, duration: Optional[float] = None) -> None:
+        """
+        Processes files as they are delivered, until the watcher is stopped.
+        :param duration: The number of seconds to run. Defaults to None, which runs until stop is called.
+        """
+        self._is_stopped = False
+        end_time = time.monotonic() + duration if duration is not None else None
+        self._scan()
+        while not self._is_stopped:
+            if self._process_pending():
+                # checks for files delivered while processing without waiting
+                timeout = 0.0
+            else:
+                timeout = self.poll_interval
+
+            if end_time is not None:
+                remaining = end_time - time.monotonic()
+                if remaining <= 0:
+                    return
+                timeout = min(timeout, remaining)
+
+            self._wait(timeout)
+
+    def stop(self) -> None:
+        """Stops the watcher after the files in progress are processed"""
+        self._is_stopped = True
+
+    def close(self) -> None:
+        """Stops the watcher's worker processes and monitor"""
+        if self._pool:
+            self._pool.close()
+        self._monitor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
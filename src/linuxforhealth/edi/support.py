@@ -1,101 +1,825 @@
+import bz2
+import codecs
+from enum import Enum
+import gzip
+import mmap
+import os
+import re
+import sys
 import time
+import tracemalloc
 from io import BytesIO
 from json import JSONDecodeError
 import json
 import logging
-from typing import Union, List
+from functools import lru_cache
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    Union,
+    List,
+    Optional,
+    Pattern,
+    TextIO,
+    Tuple,
+    Type,
+)
+import zipfile
 from lxml import etree
 from lxml.etree import ParseError
 import hashlib
+from pydantic import BaseModel
 from pydicom import dcmread
+from pydicom.dataset import FileDataset
 from pydicom.fileset import FileSet
-from fhir.resources import construct_fhir_element as construct_fhir_r4
 from fhir.resources import FHIRAbstractModel as FHIRAbstractModelR4
-from fhir.resources.STU3 import construct_fhir_element as construct_fhir_stu3
+from fhir.resources import get_fhir_model_class as get_fhir_model_class_r4
 from fhir.resources.STU3 import FHIRAbstractModel as FHIRAbstractModelSTU3
-from fhir.resources.DSTU2 import construct_fhir_element as construct_fhir_dstu2
+from fhir.resources.STU3 import get_fhir_model_class as get_fhir_model_class_stu3
 from fhir.resources.DSTU2 import FHIRAbstractModel as FHIRAbstractModelDSTU2
+from fhir.resources.DSTU2 import get_fhir_model_class as get_fhir_model_class_dstu2
 import hl7
 from hl7 import Message
 from linuxforhealth.x12.io import X12ModelReader, X12SegmentGroup
+from .config import FHIR_RELEASES, get_settings
+from .exceptions import EdiDataValidationException
+from .hl7_message import LazyHl7Message
+from .models import CompressionFormat, EdiCompressionMetadata
 
 logger = logging.getLogger(__name__)
 
+# DICOM header elements read when scanning the instances within a study
+DICOM_HEADER_TAGS = [
+    "StudyInstanceUID",
+    "SeriesInstanceUID",
+    "SOPInstanceUID",
+    "Modality",
+]
 
-def create_checksum(edi_message: str) -> str:
+DICOMDIR_FILE_NAME = "DICOMDIR"
+
+# the number of leading bytes sampled when determining if a message is text or binary
+UNICODE_SAMPLE_SIZE: int = 1024
+
+# leading bytes used to detect compressed files
+COMPRESSION_MAGIC: Dict[bytes, CompressionFormat] = {
+    b"\x1f\x8b": CompressionFormat.GZIP,
+    b"BZh": CompressionFormat.BZIP2,
+    b"PK\x03\x04": CompressionFormat.ZIP,
+    # an empty zip archive
+    b"PK\x05\x06": CompressionFormat.ZIP,
+}
+COMPRESSION_MAGIC_SIZE: int = 4
+# the number of bytes read at a time when decompressing or hashing a stream
+STREAM_CHUNK_SIZE: int = 1024 * 1024
+# the estimated decompressed size, as a multiple of the compressed size, for files which do not record it
+COMPRESSION_RATIO: float = 20.0
+
+_TEXT_LEADING_CHAR = re.compile(r"\S")
+_BYTES_LEADING_CHAR = re.compile(rb"\S")
+
+
+class EdiMessageBuffer:
+    """
+    Holds an EDI message as the original bytes along with a lazily decoded text representation.
+
+    Hashing, sizing, XML parsing and DICOM reading operate on the original buffer, so a message is not re-encoded or
+    copied as it moves through workflow steps. Text is decoded at most once, and only for formats which require it.
+    """
+
+    __slots__ = ("_data", "_text", "is_binary")
+
+    def __init__(
+        self,
+        message: Union[bytes, bytearray, memoryview, str],
+        is_binary: Optional[bool] = None,
+    ):
+        """
+        :param message: The input message. str messages are encoded to UTF-8 once.
+        :param is_binary: Indicates if the message is binary. Defaults to True for byte inputs and False for str inputs.
+        """
+        if isinstance(message, str):
+            self._text: Optional[str] = message
+            self._data = message.encode("utf-8")
+            self.is_binary = bool(is_binary)
+        else:
+            self._text = None
+            self._data = message
+            self.is_binary = True if is_binary is None else is_binary
+
+    @property
+    def data(self) -> Union[bytes, bytearray, memoryview]:
+        """Returns the message bytes without copying"""
+        return self._data
+
+    @property
+    def text(self) -> str:
+        """Returns the message as text, decoding the message bytes on first access"""
+        if self._text is None:
+            self._text = str(self._data, "utf-8")
+        return self._text
+
+    def parseable(self) -> Union[str, bytes, bytearray, memoryview]:
+        """
+        Returns the decoded text if it is already available, otherwise the message bytes.
+        Used with parsers which accept either representation.
+        """
+        return self._data if self._text is None else self._text
+
+    def lead(self, size: int) -> str:
+        """
+        Returns up to `size` characters starting at the first non-whitespace character.
+        The message is searched in place, without stripping a copy of the entire message.
+        :param size: The number of characters to return
+        """
+        if self._text is not None:
+            match = _TEXT_LEADING_CHAR.search(self._text)
+            return self._text[match.start() : match.start() + size] if match else ""
+
+        match = _BYTES_LEADING_CHAR.search(self._data)
+        if not match:
+            return ""
+        return str(self._data[match.start() : match.start() + size], "utf-8", "replace")
+
+    def __len__(self) -> int:
+        """Returns the message size in bytes"""
+        if isinstance(self._data, memoryview):
+            return self._data.nbytes
+        return len(self._data)
+
+
+def is_unicode(data: Union[bytes, bytearray, memoryview]) -> bool:
+    """
+    Returns True if the leading bytes of a message are valid UTF-8.
+    A multi-byte character truncated at the end of the sample is not treated as an error.
+    :param data: The message bytes
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        decoder.decode(data[0:UNICODE_SAMPLE_SIZE], final=False)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+MessageData = Union[str, bytes, bytearray, memoryview, mmap.mmap]
+
+
+@lru_cache(maxsize=None)
+def _compile_message_pattern(pattern: str, is_text: bool) -> Pattern:
+    """Compiles a pattern for str or bytes messages"""
+    return re.compile(pattern if is_text else pattern.encode("utf-8"))
+
+
+def _decode_segment(value: Union[str, bytes, memoryview]) -> str:
+    return value if isinstance(value, str) else str(value, "utf-8")
+
+
+def find_message_start(data: MessageData) -> int:
+    """
+    Returns the offset of the first non-whitespace character within a message, or -1 if the message is empty.
+    :param data: The message text or bytes
+    """
+    match = _compile_message_pattern(r"\S", isinstance(data, str)).search(data)
+    return match.start() if match else -1
+
+
+def decode_message_slice(data: MessageData, start: int, end: Optional[int]) -> str:
+    """
+    Decodes part of a message. A multi-byte character split by the slice boundaries is replaced.
+    :param data: The message text or bytes
+    :param start: The start offset
+    :param end: The end offset. None decodes to the end of the message.
+    """
+    value = data[start:end]
+    return value if isinstance(value, str) else str(value, "utf-8", "replace")
+
+
+def iter_message_segments(
+    data: MessageData, separator_pattern: str, start: int = 0
+) -> Iterator[str]:
+    """
+    Yields the non-empty segments of a message, decoding one segment at a time.
+    The message is scanned in place, so byte and memory mapped messages are not decoded, or split, as a whole.
+    :param data: The message text or bytes
+    :param separator_pattern: A regular expression matching segment separators, such as "~" or "[\\r\\n]+"
+    :param start: The offset at which the first segment starts
+    """
+    separator = _compile_message_pattern(separator_pattern, isinstance(data, str))
+    position = start
+    for match in separator.finditer(data, start):
+        segment = _decode_segment(data[position : match.start()])
+        if segment:
+            yield segment
+        position = match.end()
+
+    segment = _decode_segment(data[position:])
+    if segment:
+        yield segment
+
+
+class JsonBackend:
+    """
+    A JSON implementation used for message parsing and result serialization.
+    Backends raise json.JSONDecodeError, or a subclass, for invalid input.
+    """
+
+    __slots__ = ("name", "loads", "dumps")
+
+    def __init__(
+        self,
+        name: str,
+        loads: Callable[[Union[str, bytes, memoryview]], Any],
+        dumps: Callable[[Any, bool], str],
+    ):
+        """
+        :param name: The backend name
+        :param loads: Parses a str or bytes-like message
+        :param dumps: Serializes an object to a str. The second parameter indicates if output is pretty printed.
+        """
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+
+
+def _create_stdlib_backend() -> JsonBackend:
+    """Returns a JsonBackend for the standard library json module"""
+
+    def loads(message: Union[str, bytes, memoryview]) -> Any:
+        if isinstance(message, memoryview):
+            # the json module accepts str, bytes and bytearray
+            message = message.tobytes()
+        return json.loads(message)
+
+    def dumps(data: Any, pretty: bool = False) -> str:
+        if pretty:
+            return json.dumps(data, indent=4, sort_keys=True)
+        return json.dumps(data)
+
+    return JsonBackend("json", loads, dumps)
+
+
+def _create_orjson_backend() -> JsonBackend:
+    """Returns a JsonBackend for orjson, which parses bytes-like input without decoding it first"""
+    import orjson
+
+    def dumps(data: Any, pretty: bool = False) -> str:
+        option = orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS if pretty else 0
+        return orjson.dumps(data, option=option).decode("utf-8")
+
+    return JsonBackend("orjson", orjson.loads, dumps)
+
+
+def _create_ujson_backend() -> JsonBackend:
+    """Returns a JsonBackend for ujson"""
+    import ujson
+
+    def loads(message: Union[str, bytes, memoryview]) -> Any:
+        if isinstance(message, memoryview):
+            message = message.tobytes()
+        try:
+            return ujson.loads(message)
+        except ValueError as ex:
+            raise JSONDecodeError(str(ex), "", 0) from ex
+
+    def dumps(data: Any, pretty: bool = False) -> str:
+        if pretty:
+            return ujson.dumps(data, indent=4, sort_keys=True)
+        return ujson.dumps(data)
+
+    return JsonBackend("ujson", loads, dumps)
+
+
+# backend factories, in "auto" selection order
+_JSON_BACKEND_FACTORIES = {
+    "orjson": _create_orjson_backend,
+    "ujson": _create_ujson_backend,
+    "json": _create_stdlib_backend,
+}
+
+
+@lru_cache()
+def get_json_backend() -> JsonBackend:
+    """
+    Returns the configured JsonBackend.
+    The backend is selected on first use from the json_backend setting (LFH_EDI_JSON_BACKEND).
+    "auto" selects the first installed backend from orjson, ujson and the standard library.
+    :raises: ImportError if a specific backend is configured and is not installed
+    """
+    backend_name = get_settings().json_backend
+
+    if backend_name != "auto":
+        return _JSON_BACKEND_FACTORIES[backend_name]()
+
+    for name, factory in _JSON_BACKEND_FACTORIES.items():
+        try:
+            backend = factory()
+            logger.debug(f"Selected JSON backend {name}")
+            return backend
+        except ImportError:
+            continue
+
+
+def detect_compression(
+    data: Union[bytes, bytearray, memoryview]
+) -> Optional[CompressionFormat]:
+    """
+    Detects a compressed file from its leading bytes.
+    :param data: The file's leading bytes. At least COMPRESSION_MAGIC_SIZE bytes are required to detect all formats.
+    :returns: the CompressionFormat, or None if the data is not compressed
+    """
+    for magic, compression_format in COMPRESSION_MAGIC.items():
+        if data[0 : len(magic)] == magic:
+            return compression_format
+    return None
+
+
+class _HashingReader:
+    """
+    Wraps a binary stream, computing the size and SHA-256 checksum of the bytes read.
+    Used to checksum a compressed file in the same pass which decompresses it.
+    """
+
+    def __init__(self, stream: BinaryIO):
+        self.stream = stream
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.stream.read(size)
+        self.hash.update(data)
+        self.size += len(data)
+        return data
+
+    def drain(self) -> None:
+        """Reads the remainder of the stream, so that the checksum includes any trailing bytes"""
+        while self.read(STREAM_CHUNK_SIZE):
+            pass
+
+
+def _read_decompressed(decompressor: BinaryIO, max_size: Optional[int]) -> bytearray:
+    """
+    Reads a decompressed stream in chunks, stopping once the output exceeds the maximum size.
+    :raises: EdiDataValidationException if the output exceeds the maximum size
+    """
+    contents = bytearray()
+    chunk = decompressor.read(STREAM_CHUNK_SIZE)
+    while chunk:
+        contents += chunk
+        if max_size is not None and len(contents) > max_size:
+            raise EdiDataValidationException(
+                f"Decompressed message exceeds the {max_size} byte limit"
+            )
+        chunk = decompressor.read(STREAM_CHUNK_SIZE)
+    return contents
+
+
+def estimate_decompressed_size(
+    stream: BinaryIO, compression_format: CompressionFormat
+) -> int:
+    """
+    Estimates the size of the largest message within a compressed stream, without decompressing it.
+    Zip archives record each member's size in their central directory. gzip files record the size, modulo 2**32, in
+    their trailer. Sizes which are not recorded, or which are smaller than the compressed size, are estimated with
+    COMPRESSION_RATIO.
+    :param stream: The compressed stream, which must be seekable
+    :param compression_format: The stream's compression format
+    :returns: the estimated size in bytes
+    """
+    compressed_size = stream.seek(0, os.SEEK_END)
+    estimated_size = int(compressed_size * COMPRESSION_RATIO)
+
+    if compression_format == CompressionFormat.ZIP:
+        stream.seek(0)
+        with zipfile.ZipFile(stream) as archive:
+            return max((m.file_size for m in archive.infolist()), default=0)
+    elif compression_format == CompressionFormat.GZIP and compressed_size >= 4:
+        stream.seek(compressed_size - 4)
+        recorded_size = int.from_bytes(stream.read(4), "little")
+        if recorded_size >= compressed_size:
+            return recorded_size
+    return estimated_size
+
+
+def decompress_stream(
+    stream: BinaryIO,
+    compression_format: CompressionFormat,
+    max_size: Optional[int] = None,
+) -> Tuple[bytearray, EdiCompressionMetadata]:
+    """
+    Decompresses a gzip or bzip2 stream into memory, without writing temporary files.
+    The compressed checksum is computed as the stream is read. The message is decompressed in full, since analysis
+    and validation read the message's header and trailer.
+    :param stream: The compressed stream, positioned at its start
+    :param compression_format: The stream's compression format
+    :param max_size: The maximum decompressed size, in bytes. Defaults to None, which does not limit the size.
+    :returns: tuple of (decompressed bytes, compression metadata)
+    :raises: ValueError if the compression format is not a stream format
+    :raises: EdiDataValidationException if the decompressed message exceeds the maximum size
+    """
+    reader = _HashingReader(stream)
+    if compression_format == CompressionFormat.GZIP:
+        decompressor = gzip.GzipFile(fileobj=reader, mode="rb")
+    elif compression_format == CompressionFormat.BZIP2:
+        decompressor = bz2.BZ2File(reader, mode="rb")
+    else:
+        raise ValueError(f"{compression_format} is not a stream compression format")
+
+    with decompressor:
+        contents = _read_decompressed(decompressor, max_size)
+    reader.drain()
+
+    compression = EdiCompressionMetadata.construct(
+        compressionFormat=compression_format,
+        compressedSize=reader.size,
+        compressedChecksum=reader.hash.hexdigest(),
+        archiveMember=None,
+    )
+    return contents, compression
+
+
+def iter_zip_members(
+    stream: BinaryIO,
+    max_size: Optional[int] = None,
+) -> Iterator[Tuple[bytearray, EdiCompressionMetadata]]:
+    """
+    Decompresses each file within a zip archive into memory, without writing temporary files.
+    Directories are skipped. Members are decompressed one at a time as the iterator advances, so the iterator holds only
+    the current member.
+    :param stream: The zip archive stream, which must be seekable
+    :param max_size: The maximum decompressed size of a member, in bytes. Defaults to None, which does not limit the
+    size.
+    :returns: iterator of (member bytes, compression metadata) tuples
+    :raises: EdiDataValidationException if a member exceeds the maximum size
+    """
+    # zip archives are read from their central directory, so the archive is checksummed in a separate pass
+    stream.seek(0)
+    reader = _HashingReader(stream)
+    reader.drain()
+    stream.seek(0)
+
+    with zipfile.ZipFile(stream) as archive:
+        for member in archive.infolist():
+            if member.is_dir():
+                continue
+            compression = EdiCompressionMetadata.construct(
+                compressionFormat=CompressionFormat.ZIP,
+                compressedSize=reader.size,
+                compressedChecksum=reader.hash.hexdigest(),
+                archiveMember=member.filename,
+            )
+            # the recorded size is checked first, and the decompressed size is checked as the member is read
+            if max_size is not None and member.file_size > max_size:
+                raise EdiDataValidationException(
+                    f"Archive member {member.filename} exceeds the {max_size} byte limit"
+                )
+            with archive.open(member) as member_stream:
+                contents = _read_decompressed(member_stream, max_size)
+            yield contents, compression
+
+
+def create_checksum(edi_message: Union[str, bytes, EdiMessageBuffer]) -> str:
     """
     Creates a SHA-256 checksum for an EDI message.
     :param edi_message: The input EDI message
     :returns: The SHA-256 checksum as a hex digest
     """
-    if isinstance(edi_message, bytes):
-        checksum = hashlib.sha256(edi_message).hexdigest()
-    else:
+    if isinstance(edi_message, EdiMessageBuffer):
+        checksum = hashlib.sha256(edi_message.data).hexdigest()
+    elif isinstance(edi_message, str):
         checksum = hashlib.sha256(edi_message.encode("utf-8")).hexdigest()
+    else:
+        checksum = hashlib.sha256(edi_message).hexdigest()
 
     return checksum
 
 
-def load_json(message: str) -> dict:
+def load_json(message: Union[str, bytes, memoryview]) -> dict:
     """
     Attempts to load the message as a JSON object.
     Returns the JSON object if successful, otherwise None.
     :param message: the input message
     :returns: The JSON object (dictionary) or None
     """
-    return json.loads(message)
+    return get_json_backend().loads(message)
 
 
-def load_xml(message: str):
+def load_xml(message: Union[str, bytes]):
     """
     Attempts to load the message as a XML object.
     Returns the XML object if successful, otherwise None.
-    :param message: the input message
+    :param message: the input message. bytes are parsed in place.
     :returns: The XML object  or None
     """
-    return etree.fromstring(message.encode("utf-8"))
+    if isinstance(message, str):
+        message = message.encode("utf-8")
+    return etree.fromstring(message)
+
+
+# FHIR model class factories by FHIR release
+_FHIR_MODEL_CLASS_FACTORIES: Dict[str, Callable] = {
+    "R4": get_fhir_model_class_r4,
+    "STU3": get_fhir_model_class_stu3,
+    "DSTU2": get_fhir_model_class_dstu2,
+}
+
+
+@lru_cache(maxsize=None)
+def get_fhir_model_class(release: str, resource_type: str) -> Optional[Type]:
+    """
+    Returns the fhir.resources model class for a resource, or element, type.
+    The class's module is imported on first use, and the class is cached for the life of the process.
+    :param release: The FHIR release: R4, STU3 or DSTU2
+    :param resource_type: The resource or element type
+    :returns: The model class, or None if the type is not defined for the release
+    """
+    factory = _FHIR_MODEL_CLASS_FACTORIES.get(release)
+    if factory is None:
+        return None
+    try:
+        return factory(resource_type)
+    except KeyError:
+        return None
+
+
+def construct_fhir_resource(release: str, resource_type: str, data: Dict):
+    """
+    Constructs and validates a FHIR resource model.
+    :param release: The FHIR release: R4, STU3 or DSTU2
+    :param resource_type: The resource type
+    :param data: The resource data
+    :returns: FHIR Resource Model
+    :raises: LookupError if the resource type is not defined for the release
+    :raises: pydantic.ValidationError if the data is not valid for the resource type
+    """
+    model_class = get_fhir_model_class(release, resource_type)
+    if model_class is None:
+        raise LookupError(f"{resource_type} is not a FHIR {release} resource type")
+    return model_class.parse_obj(data)
+
+
+def warm_up_fhir_models(
+    releases: Optional[Iterable[str]] = None,
+    resource_types: Optional[Iterable[str]] = None,
+) -> int:
+    """
+    Loads FHIR model classes so the first messages processed by a worker do not import them.
+    fhir.resources imports the classes of a model's elements when the elements are first validated, so element
+    classes referenced by each model's fields are loaded as well.
+    :param releases: The FHIR releases. Defaults to the fhir_warmup_releases setting.
+    :param resource_types: The resource types. Defaults to the fhir_warmup_resource_types setting.
+    :returns: The number of model classes loaded
+    """
+    settings = get_settings()
+    releases = settings.fhir_warmup_releases if releases is None else releases
+    if resource_types is None:
+        resource_types = settings.fhir_warmup_resource_types
+
+    class_count = 0
+    with Timer() as timer:
+        for release in releases:
+            pending = list(resource_types)
+            loaded = set()
+            while pending:
+                type_name = pending.pop()
+                if type_name in loaded:
+                    continue
+                loaded.add(type_name)
+
+                model_class = get_fhir_model_class(release, type_name)
+                if model_class is None:
+                    continue
+                class_count += 1
+                for field in model_class.__fields__.values():
+                    element_type = getattr(field.type_, "__resource_type__", None)
+                    if element_type and element_type not in loaded:
+                        pending.append(element_type)
+
+    logger.info(
+        f"Loaded {class_count} FHIR model classes in {timer.elapsed_time:.3f} seconds"
+    )
+    return class_count
 
 
 def load_fhir_json(
-    input_message: str,
+    input_message: Union[str, bytes, memoryview],
 ) -> Union[FHIRAbstractModelR4, FHIRAbstractModelSTU3, FHIRAbstractModelDSTU2, None]:
     """
     Loads a FHIR Json Resource into a domain model
     :param input_message: The message to load.
     :returns: FHIR Resource Model
     """
-    parsed_data = json.loads(input_message)
+    parsed_data = load_json(input_message)
     resource_type: str = parsed_data.get("resourceType")
-    for c in (construct_fhir_r4, construct_fhir_stu3, construct_fhir_dstu2):
-        fhir_resource = c(resource_type, parsed_data)
+    for release in FHIR_RELEASES:
+        fhir_resource = construct_fhir_resource(release, resource_type, parsed_data)
         if fhir_resource:
             return fhir_resource
     return None
 
 
+def iter_x12(
+    input_message: str, output_delimiters: bool = False
+) -> Iterator[X12SegmentGroup]:
+    """
+    Streams an X12 input as transaction set models.
+    Transaction sets are parsed as they are read, so only the current transaction set is held in memory.
+    :param input_message: The X12 message or file path
+    :param output_delimiters: Includes delimiters within each segment model when True
+    :returns: transaction set model iterator
+    """
+    with X12ModelReader(input_message, output_delimiters=output_delimiters) as r:
+        yield from r.models()
+
+
 def load_x12(input_message: str) -> List[X12SegmentGroup]:
     """
     Loads an X12 input into a model list
     """
-    models: List[X12SegmentGroup] = []
-
-    with X12ModelReader(input_message) as r:
-        for m in r.models():
-            models.append(m)
-    return models
+    return list(iter_x12(input_message))
 
 
 def load_hl7(input_message: str) -> Message:
     """
-    Loads a HL7 input into a model
+    Loads a HL7 input into a model.
+    The message's segments are parsed on first access. The returned LazyHl7Message is an hl7.Message.
     """
-    return hl7.parse(input_message)
+    return LazyHl7Message.parse(input_message)
 
 
-def load_dicom(input_message: bytes) -> FileSet:
+def load_dicom(input_message: Union[bytes, memoryview]) -> FileSet:
+    """
+    Loads a DICOM input into a model.
+    BytesIO shares the underlying buffer for bytes inputs, so the message is not copied.
+    """
     return dcmread(BytesIO(input_message))
 
 
+def load_dicom_header(file_path: str) -> FileDataset:
+    """
+    Loads the DICOM header elements used to group an instance into a study and series.
+    Pixel data and unrequested elements are not read.
+    :param file_path: The path to the DICOM instance
+    :returns: The partially loaded DICOM dataset
+    """
+    return dcmread(file_path, stop_before_pixels=True, specific_tags=DICOM_HEADER_TAGS)
+
+
+def list_dicom_instances(study_path: str) -> List[str]:
+    """
+    Lists the DICOM instance paths for a study.
+    The study path may reference a DICOMDIR file, a directory containing a DICOMDIR, or a directory of instances.
+    Directories without a DICOMDIR are searched recursively.
+    :param study_path: The path to the study
+    :returns: list of instance file paths
+    """
+    if os.path.isdir(study_path):
+        dicomdir_path = os.path.join(study_path, DICOMDIR_FILE_NAME)
+    else:
+        dicomdir_path = study_path
+
+    if os.path.isfile(dicomdir_path):
+        file_set = FileSet(dcmread(dicomdir_path))
+        return [instance.path for instance in file_set]
+
+    instance_paths: List[str] = []
+    directories: List[str] = [study_path]
+    while directories:
+        with os.scandir(directories.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    directories.append(entry.path)
+                elif entry.is_file():
+                    instance_paths.append(entry.path)
+    instance_paths.sort()
+    return instance_paths
+
+
+def model_to_dict(model: BaseModel) -> dict:
+    """
+    Converts a model to a dictionary of JSON compatible values.
+    Unlike BaseModel.dict(), include/exclude processing and value copies are skipped, which is significantly faster
+    for the small, flat result models returned by workflows.
+    :param model: The model to convert
+    :returns: dictionary
+    """
+    return {k: _to_primitive(v) for k, v in model.__dict__.items()}
+
+
+def _to_primitive(value: Any) -> Any:
+    """Converts a model field value to a JSON compatible value"""
+    if isinstance(value, BaseModel):
+        return model_to_dict(value)
+    elif isinstance(value, list):
+        return [_to_primitive(v) for v in value]
+    elif isinstance(value, dict):
+        # dictionaries contain models, such as per-step metrics, or JSON data which is not traversed
+        return {
+            k: model_to_dict(v) if isinstance(v, BaseModel) else v
+            for k, v in value.items()
+        }
+    elif isinstance(value, Enum):
+        return value.value
+    return value
+
+
+def dump_edi_result(edi_result: BaseModel, pretty: bool = False) -> str:
+    """
+    Serializes an EdiResult, or aggregate result, to JSON using the configured JsonBackend.
+    Whitespace within the output varies by backend.
+    :param edi_result: The result model
+    :param pretty: Indents the output and sorts keys when True
+    :returns: The JSON string
+    """
+    return get_json_backend().dumps(model_to_dict(edi_result), pretty)
+
+
+class FhirNdjsonWriter:
+    """
+    Writes FHIR resources to a text stream as newline delimited JSON (NDJSON), one resource per line.
+    Resources are serialized as they are written, so output size does not affect memory use.
+    """
+
+    def __init__(self, stream: TextIO):
+        """
+        :param stream: The output text stream
+        """
+        self.stream = stream
+        self.count = 0
+        self._dumps = get_json_backend().dumps
+
+    def write(self, resource: Dict) -> None:
+        """
+        Writes a resource.
+        :param resource: The FHIR resource as a dictionary
+        """
+        self.stream.write(self._dumps(resource, False))
+        self.stream.write("\n")
+        self.count += 1
+
+    def close(self) -> None:
+        """Flushes the output stream. The stream is not closed."""
+        self.stream.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FhirBundleWriter(FhirNdjsonWriter):
+    """
+    Writes FHIR resources to a text stream as the entries of a single Bundle.
+    The Bundle is written incrementally, and is complete once the writer is closed.
+    """
+
+    def __init__(self, stream: TextIO, bundle_type: str = "collection"):
+        """
+        :param stream: The output text stream
+        :param bundle_type: The Bundle type
+        """
+        super().__init__(stream)
+        self.bundle_type = bundle_type
+        self._closed = False
+
+    def _header(self) -> str:
+        """Returns the Bundle's opening JSON, excluding entries"""
+        return (
+            f'{{"resourceType":"Bundle","type":{self._dumps(self.bundle_type, False)}'
+        )
+
+    def write(self, resource: Dict) -> None:
+        """
+        Writes a resource as a Bundle entry, with a "urn:uuid" fullUrl based on the resource id.
+        :param resource: The FHIR resource as a dictionary
+        """
+        if self.count == 0:
+            self.stream.write(self._header())
+            self.stream.write(',"entry":[')
+        else:
+            self.stream.write(",")
+
+        entry = {"fullUrl": f"urn:uuid:{resource['id']}", "resource": resource}
+        self.stream.write(self._dumps(entry, False))
+        self.count += 1
+
+    def close(self) -> None:
+        """Completes the Bundle and flushes the output stream. The stream is not closed."""
+        if not self._closed:
+            if self.count == 0:
+                self.stream.write(self._header())
+                self.stream.write("}")
+            else:
+                self.stream.write("]}")
+            self._closed = True
+        super().close()
+
+
 class Timer:
     """
     Context manager which mesasures elapsed time
@@ -108,3 +832,27 @@ class Timer:
     def __exit__(self, *args):
         self.end = time.time()
         self.elapsed_time = self.end - self.start
+
+
+class MemoryTracer:
+    """
+    Context manager which measures the memory allocated within a block using tracemalloc.
+    tracemalloc must be tracing when the block is entered.
+    """
+
+    def __enter__(self):
+        if hasattr(tracemalloc, "reset_peak"):
+            self.start_size = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        else:
+            # Python 3.8 resets the peak by clearing traces
+            tracemalloc.clear_traces()
+            self.start_size = 0
+        self.start_blocks = sys.getallocatedblocks()
+        return self
+
+    def __exit__(self, *args):
+        current_size, peak_size = tracemalloc.get_traced_memory()
+        self.peak_bytes = max(0, peak_size - self.start_size)
+        self.net_bytes = current_size - self.start_size
+        self.allocated_blocks = sys.getallocatedblocks() - self.start_blocks
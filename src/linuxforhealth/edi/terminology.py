@@ -0,0 +1,461 @@
+"""
+terminology.py
+
+Resolves medical codes (NPI, ICD-10, CPT, HCPCS, LOINC) to display names using local reference files.
+
+Reference files are CSV files containing a code and display name, which are compiled once into a sorted index.
+Indexes are memory-mapped and searched in place, so lookups do not load the reference data into process memory and
+worker processes share the index pages through the OS page cache. Each index is fronted by an in-process LRU cache.
+
+Usage:
+compile_terminology_index("loinc.csv", "loinc.idx")
+index = TerminologyIndex("loinc.idx")
+display_name = index.lookup("8867-4")
+"""
+import csv
+from enum import Enum
+from functools import lru_cache
+import logging
+import mmap
+import os
+import re
+import struct
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .config import get_settings
+from .fhir_xml import iter_fhir_xml_codes
+from .models import EdiCode, EdiMessageFormat
+from .support import (
+    EdiMessageBuffer,
+    MessageData,
+    decode_message_slice,
+    find_message_start,
+    iter_message_segments,
+    load_json,
+)
+
+logger = logging.getLogger(__name__)
+
+INDEX_MAGIC = b"LFHEDIT1"
+# magic value and record count
+INDEX_HEADER = struct.Struct("<8sQ")
+INDEX_OFFSET = struct.Struct("<Q")
+INDEX_FILE_EXTENSION = ".idx"
+REFERENCE_FILE_EXTENSION = ".csv"
+
+
+class CodeSystem(str, Enum):
+    """
+    Code systems supported for terminology enrichment.
+    The value is the base name of the code system's reference and index files.
+    """
+
+    CPT = "cpt"
+    HCPCS = "hcpcs"
+    ICD10 = "icd10"
+    LOINC = "loinc"
+    NPI = "npi"
+
+
+def normalize_code(code_system: CodeSystem, code: str) -> str:
+    """
+    Normalizes a code for indexing and lookup.
+    ICD-10 codes are indexed without a decimal point, as X12 transmits them without one.
+    """
+    code = code.strip().upper()
+    if code_system == CodeSystem.ICD10:
+        code = code.replace(".", "")
+    return code
+
+
+def compile_terminology_index(
+    reference_path: str,
+    index_path: str,
+    code_system: Optional[CodeSystem] = None,
+    code_column: int = 0,
+    display_column: int = 1,
+    has_header: bool = True,
+    delimiter: str = ",",
+) -> int:
+    """
+    Compiles a CSV reference file into a sorted terminology index.
+
+    Index layout:
+    * header - magic value and record count
+    * offsets - little-endian unsigned 64 bit record offsets, in code order
+    * records - code, tab, display name, newline
+
+    The index is written to a temporary file and renamed, so concurrent readers never observe a partial index.
+    :param reference_path: The path to the CSV reference file
+    :param index_path: The path to the index file
+    :param code_system: Used to normalize codes. Defaults to the code system matching the index file name.
+    :param code_column: The zero-based column containing the code
+    :param display_column: The zero-based column containing the display name
+    :param has_header: Indicates if the first CSV row is a header
+    :param delimiter: The CSV delimiter
+    :returns: the number of indexed codes
+    """
+    if code_system is None:
+        code_system = CodeSystem(os.path.splitext(os.path.basename(index_path))[0])
+
+    entries: Dict[bytes, bytes] = {}
+    with open(reference_path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f, delimiter=delimiter)
+        if has_header:
+            next(reader, None)
+
+        for row in reader:
+            if len(row) <= max(code_column, display_column):
+                continue
+            code = normalize_code(code_system, row[code_column])
+            if not code or code in entries:
+                continue
+            display = " ".join(row[display_column].split())
+            entries[code.encode("utf-8")] = display.encode("utf-8")
+
+    codes = sorted(entries)
+    offsets: List[int] = []
+    position = INDEX_HEADER.size + INDEX_OFFSET.size * len(codes)
+    for code in codes:
+        offsets.append(position)
+        position += len(code) + len(entries[code]) + 2
+
+    temp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, len(codes)))
+        f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+        for code in codes:
+            f.write(code + b"\t" + entries[code] + b"\n")
+    os.replace(temp_path, index_path)
+
+    return len(codes)
+
+
+class TerminologyIndex:
+    """
+    A memory-mapped terminology index, searched with a binary search over the record offsets.
+    """
+
+    def __init__(
+        self,
+        index_path: str,
+        code_system: Optional[CodeSystem] = None,
+        cache_size: int = 65536,
+    ):
+        """
+        :param index_path: The path to a compiled index
+        :param code_system: Used to normalize codes. Defaults to the code system matching the index file name.
+        :param cache_size: The maximum number of lookups cached in process memory
+        :raises: ValueError if the file is not a terminology index
+        """
+        if code_system is None:
+            code_system = CodeSystem(os.path.splitext(os.path.basename(index_path))[0])
+
+        self.index_path = index_path
+        self.code_system = code_system
+
+        with open(index_path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.size = INDEX_HEADER.unpack_from(self._mmap, 0)
+        if magic != INDEX_MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{index_path} is not a terminology index")
+
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    def _lookup(self, code: str) -> Optional[str]:
+        """
+        Searches the index for a code.
+        :param code: The code to lookup
+        :returns: the code's display name, or None if the code is not indexed
+        """
+        key = normalize_code(self.code_system, code).encode("utf-8")
+        low = 0
+        high = self.size
+
+        while low < high:
+            middle = (low + high) // 2
+            (record_start,) = INDEX_OFFSET.unpack_from(
+                self._mmap, INDEX_HEADER.size + middle * INDEX_OFFSET.size
+            )
+            code_end = self._mmap.find(b"\t", record_start)
+            record_code = self._mmap[record_start:code_end]
+
+            if record_code < key:
+                low = middle + 1
+            elif record_code > key:
+                high = middle
+            else:
+                display_end = self._mmap.find(b"\n", code_end)
+                return self._mmap[code_end + 1 : display_end].decode("utf-8")
+
+        return None
+
+    def close(self) -> None:
+        """Closes the memory map"""
+        self._mmap.close()
+
+
+class TerminologyService:
+    """
+    Provides lookups for the code systems available within a terminology directory.
+
+    The directory contains an index (<code system>.idx), or reference file (<code system>.csv), per code system, such
+    as loinc.idx or icd10.csv. Reference files are compiled to an index on first use, or when the reference file is
+    newer than its index.
+    """
+
+    def __init__(self, terminology_directory: Optional[str], cache_size: int = 65536):
+        """
+        :param terminology_directory: The directory containing reference files and indexes. None disables lookups.
+        :param cache_size: The maximum number of lookups cached per code system
+        """
+        self.terminology_directory = terminology_directory
+        self.indexes: Dict[CodeSystem, TerminologyIndex] = {}
+
+        if not terminology_directory:
+            return
+
+        for code_system in CodeSystem:
+            base_path = os.path.join(terminology_directory, code_system.value)
+            index_path = base_path + INDEX_FILE_EXTENSION
+            reference_path = base_path + REFERENCE_FILE_EXTENSION
+
+            if os.path.isfile(reference_path) and (
+                not os.path.isfile(index_path)
+                or os.path.getmtime(reference_path) > os.path.getmtime(index_path)
+            ):
+                count = compile_terminology_index(
+                    reference_path, index_path, code_system
+                )
+                logger.info(
+                    f"Compiled {count} {code_system.name} codes to {index_path}"
+                )
+
+            if os.path.isfile(index_path):
+                self.indexes[code_system] = TerminologyIndex(
+                    index_path, code_system, cache_size
+                )
+
+    @property
+    def is_available(self) -> bool:
+        """Returns True if at least one code system is available"""
+        return bool(self.indexes)
+
+    def lookup(self, code_system: CodeSystem, code: str) -> Optional[str]:
+        """
+        Returns the display name for a code, or None if the code, or code system, is not available
+        """
+        index = self.indexes.get(code_system)
+        return index.lookup(code) if index else None
+
+    def resolve(self, codes: Iterator[Tuple[CodeSystem, str]]) -> List[EdiCode]:
+        """
+        Resolves codes to EdiCode models, removing duplicates.
+        Codes for code systems which are not available are excluded.
+        :param codes: (code system, code) tuples
+        :returns: list of EdiCode models in first occurrence order
+        """
+        resolved_codes: List[EdiCode] = []
+        seen = set()
+
+        for code_system, code in codes:
+            if code_system not in self.indexes:
+                continue
+            key = (code_system, normalize_code(code_system, code))
+            if not key[1] or key in seen:
+                continue
+            seen.add(key)
+            resolved_codes.append(
+                EdiCode.construct(
+                    codeSystem=code_system.name,
+                    code=code,
+                    display=self.lookup(code_system, code),
+                )
+            )
+
+        return resolved_codes
+
+
+@lru_cache()
+def get_terminology_service() -> TerminologyService:
+    """Returns the TerminologyService for the configured terminology directory"""
+    settings = get_settings()
+    return TerminologyService(
+        settings.terminology_directory, settings.terminology_cache_size
+    )
+
+
+# HL7 coding system identifiers (CE/CWE component 3) mapped to code systems
+HL7_CODING_SYSTEMS = {
+    "C4": CodeSystem.CPT,
+    "CPT": CodeSystem.CPT,
+    "HCPCS": CodeSystem.HCPCS,
+    "HPC": CodeSystem.HCPCS,
+    "I10": CodeSystem.ICD10,
+    "I10C": CodeSystem.ICD10,
+    "ICD10": CodeSystem.ICD10,
+    "ICD10CM": CodeSystem.ICD10,
+    "LN": CodeSystem.LOINC,
+}
+
+# FHIR coding and identifier systems mapped to code systems
+FHIR_CODING_SYSTEMS = {
+    "http://hl7.org/fhir/sid/icd-10": CodeSystem.ICD10,
+    "http://hl7.org/fhir/sid/icd-10-cm": CodeSystem.ICD10,
+    "http://hl7.org/fhir/sid/us-npi": CodeSystem.NPI,
+    "http://loinc.org": CodeSystem.LOINC,
+    "http://www.ama-assn.org/go/cpt": CodeSystem.CPT,
+    "urn:oid:2.16.840.1.113883.6.285": CodeSystem.HCPCS,
+}
+
+# X12 HI segment qualifiers for ICD-10 diagnosis codes
+X12_ICD10_QUALIFIERS = frozenset({"ABK", "ABF", "ABJ", "ABN", "APR", "BBR", "BBQ"})
+# X12 product/service qualifier for CPT and HCPCS procedure codes
+X12_PROCEDURE_QUALIFIER = "HC"
+
+_HL7_SEGMENT_SEPARATOR = r"[\r\n]+"
+
+
+def _extract_hl7_codes(data: MessageData) -> Iterator[Tuple[CodeSystem, str]]:
+    """
+    Extracts codes from coded element (CE/CWE) and extended person (XCN) fields in an HL7 message.
+    Coded elements are identified by their coding system component rather than by segment and field position, so
+    codes are found in any segment.
+    """
+    segments = iter_message_segments(data, _HL7_SEGMENT_SEPARATOR)
+    msh_segment = next(segments, "")
+    if not msh_segment.startswith("MSH"):
+        return
+
+    field_separator = msh_segment[3:4]
+    encoding_characters = msh_segment[4:8]
+    component_separator = encoding_characters[0:1] or "^"
+    repetition_separator = encoding_characters[1:2] or "~"
+    subcomponent_separator = encoding_characters[3:4] or "&"
+
+    for segment in segments:
+        for field in segment.split(field_separator)[1:]:
+            if component_separator not in field:
+                continue
+
+            for repetition in field.split(repetition_separator):
+                components = repetition.split(component_separator)
+
+                # CE/CWE identifier and alternate identifier
+                for code_index, system_index in ((0, 2), (3, 5)):
+                    if len(components) > system_index:
+                        code_system = HL7_CODING_SYSTEMS.get(
+                            components[system_index].upper()
+                        )
+                        if code_system and components[code_index]:
+                            yield code_system, components[code_index]
+
+                # XCN assigning authority
+                if len(components) > 8 and components[0]:
+                    assigning_authority = components[8].split(subcomponent_separator)
+                    if assigning_authority[0].upper() == "NPI":
+                        yield CodeSystem.NPI, components[0]
+
+
+def _extract_x12_codes(data: MessageData) -> Iterator[Tuple[CodeSystem, str]]:
+    """
+    Extracts NPI (NM1 XX qualifier), ICD-10 diagnosis (HI) and procedure (SV1, SV2) codes from an X12 message.
+    Delimiters are read from the ISA segment.
+    """
+    isa_start = find_message_start(data)
+    isa_segment = (
+        decode_message_slice(data, isa_start, isa_start + 106)
+        if isa_start != -1
+        else ""
+    )
+    if not isa_segment.startswith("ISA") or len(isa_segment) < 106:
+        return
+
+    element_separator = isa_segment[3]
+    component_separator = isa_segment[104]
+    segment_terminator = isa_segment[105]
+
+    for segment in iter_message_segments(
+        data, re.escape(segment_terminator), isa_start
+    ):
+        elements = segment.strip().split(element_separator)
+        segment_name = elements[0]
+
+        if segment_name == "NM1":
+            if len(elements) > 9 and elements[8] == "XX" and elements[9]:
+                yield CodeSystem.NPI, elements[9]
+        elif segment_name == "HI":
+            for element in elements[1:]:
+                components = element.split(component_separator)
+                if (
+                    len(components) > 1
+                    and components[0] in X12_ICD10_QUALIFIERS
+                    and components[1]
+                ):
+                    yield CodeSystem.ICD10, components[1]
+        elif segment_name in ("SV1", "SV2"):
+            element_index = 1 if segment_name == "SV1" else 2
+            if len(elements) > element_index:
+                components = elements[element_index].split(component_separator)
+                if (
+                    components[0] == X12_PROCEDURE_QUALIFIER
+                    and len(components) > 1
+                    and components[1]
+                ):
+                    # HCPCS level II codes begin with a letter, CPT codes begin with a digit
+                    code = components[1]
+                    if code[0].isalpha():
+                        yield CodeSystem.HCPCS, code
+                    else:
+                        yield CodeSystem.CPT, code
+
+
+def _extract_fhir_codes(fhir_json) -> Iterator[Tuple[CodeSystem, str]]:
+    """
+    Extracts codes from FHIR Coding and Identifier elements with a supported system.
+    """
+    stack = [fhir_json]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            system = value.get("system")
+            code = value.get("code") or value.get("value")
+            if isinstance(system, str) and isinstance(code, str):
+                code_system = FHIR_CODING_SYSTEMS.get(system)
+                if code_system:
+                    yield code_system, code
+            stack.extend(reversed(list(value.values())))
+        elif isinstance(value, list):
+            stack.extend(reversed(value))
+
+
+def _extract_fhir_xml_codes(data) -> Iterator[Tuple[CodeSystem, str]]:
+    """
+    Extracts codes from FHIR XML Coding and Identifier elements with a supported system.
+    """
+    for system, code in iter_fhir_xml_codes(data):
+        code_system = FHIR_CODING_SYSTEMS.get(system)
+        if code_system:
+            yield code_system, code
+
+
+def extract_codes(
+    input_message: EdiMessageBuffer, edi_message_format: EdiMessageFormat
+) -> Iterator[Tuple[CodeSystem, str]]:
+    """
+    Extracts (code system, code) tuples from an EDI message, in message order.
+    Codes are extracted from the message text, so enrichment does not depend on the validation step.
+    :param input_message: The input message
+    :param edi_message_format: The message's EDI format
+    """
+    if edi_message_format == EdiMessageFormat.HL7:
+        return _extract_hl7_codes(input_message.parseable())
+    elif edi_message_format == EdiMessageFormat.X12:
+        return _extract_x12_codes(input_message.parseable())
+    elif edi_message_format == EdiMessageFormat.FHIR:
+        if input_message.lead(1) == "<":
+            return _extract_fhir_xml_codes(input_message.data)
+        return _extract_fhir_codes(load_json(input_message.parseable()))
+    return iter(())
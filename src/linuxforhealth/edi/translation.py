@@ -0,0 +1,705 @@
+"""
+translation.py
+
+Translates HL7v2 messages to FHIR R4 Bundles using declarative mapping templates.
+
+Templates are compiled once into nested callables, so the template structure, field paths and transforms are not
+re-interpreted for each message. A template is a dictionary describing a FHIR resource, where values are:
+* literal values - included as-is. Strings are literal unless they start with "@".
+* field paths - "@SEG-F[(R)][.C[.S]][|transform]", such as "@PID-5.1" or "@PID-7|date". "@.C[.S]" references a
+  component of the current repetition within "$each".
+* {"$each": "@SEG-F", "$map": template} - maps each repetition of a field to a list of values
+* {"$if": path, "$in": [values], "$then": template, "$else": template} - includes a value conditionally. If "$in" is
+  omitted, the condition is true when the path has a value.
+* {"$ref": "ResourceType"} - the fullUrl of the first resource of the type within the Bundle
+* {"$refs": "ResourceType"} - a list of references to all resources of the type within the Bundle
+
+A resource template with a "$segment" key produces one resource per occurrence of the segment, and field paths for
+that segment resolve to the current occurrence.
+
+Empty values are omitted. Objects which only contain literal values, once empty values are removed, are omitted.
+
+Usage:
+translator = get_hl7_translator()
+fhir_bundle = translator.translate(load_hl7(message))
+"""
+from functools import lru_cache
+import logging
+import re
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from hl7 import Message, Segment
+from hl7.util import unescape
+
+logger = logging.getLogger(__name__)
+
+Evaluator = Callable[["TranslationContext"], Any]
+ResourceTemplate = Dict[str, Any]
+
+_PATH_PATTERN = re.compile(
+    r"^@(?:(?P<segment>[A-Z][A-Z0-9]{2})-(?P<field>\d+)(?:\((?P<repeat>\d+)\))?)?"
+    r"(?:\.(?P<component>\d+))?(?:\.(?P<subcomponent>\d+))?"
+    r"(?:\|(?P<transform>\w+))?$"
+)
+
+# HL7 table 0396 coding systems mapped to FHIR system URIs
+HL7_CODING_SYSTEM_URIS = {
+    "C4": "http://www.ama-assn.org/go/cpt",
+    "CPT": "http://www.ama-assn.org/go/cpt",
+    "HCPCS": "urn:oid:2.16.840.1.113883.6.285",
+    "I10": "http://hl7.org/fhir/sid/icd-10-cm",
+    "I10C": "http://hl7.org/fhir/sid/icd-10-cm",
+    "I9C": "http://hl7.org/fhir/sid/icd-9-cm",
+    "LN": "http://loinc.org",
+    "NDC": "http://hl7.org/fhir/sid/ndc",
+    "RXNORM": "http://www.nlm.nih.gov/research/umls/rxnorm",
+    "SCT": "http://snomed.info/sct",
+    "SNM": "http://snomed.info/sct",
+    "UCUM": "http://unitsofmeasure.org",
+}
+
+
+def _transform_date(value: str) -> str:
+    """Converts an HL7 DTM value to a FHIR date"""
+    if len(value) >= 8 and value[0:8].isdigit():
+        return f"{value[0:4]}-{value[4:6]}-{value[6:8]}"
+    elif len(value) >= 6 and value[0:6].isdigit():
+        return f"{value[0:4]}-{value[4:6]}"
+    return value[0:4] if value[0:4].isdigit() else ""
+
+
+def _transform_datetime(value: str) -> str:
+    """
+    Converts an HL7 DTM value to a FHIR dateTime.
+    FHIR requires a time zone when a time is included, so values without a UTC offset are truncated to a date.
+    """
+    offset_index = max(value.find("+"), value.find("-"))
+    if offset_index == -1 or len(value[0:offset_index]) < 12:
+        return _transform_date(value)
+
+    timestamp = value[0:offset_index].split(".")[0]
+    offset = value[offset_index:]
+    seconds = timestamp[12:14] or "00"
+    return (
+        f"{_transform_date(timestamp)}T{timestamp[8:10]}:{timestamp[10:12]}:{seconds}"
+        f"{offset[0:3]}:{offset[3:5] or '00'}"
+    )
+
+
+def _transform_decimal(value: str) -> Optional[float]:
+    """Converts an HL7 NM value to a number"""
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _mapping_transform(mapping: Dict[str, str]) -> Callable[[str], str]:
+    """Returns a transform which maps HL7 table values to FHIR codes. Unmapped values are omitted."""
+
+    def transform(value: str) -> str:
+        return mapping.get(value.upper(), "")
+
+    return transform
+
+
+# transforms applied to field path values, referenced by name within templates
+TRANSFORMS: Dict[str, Callable[[str], Any]] = {
+    "date": _transform_date,
+    "datetime": _transform_datetime,
+    "decimal": _transform_decimal,
+    "coding_system": lambda v: HL7_CODING_SYSTEM_URIS.get(v.upper(), v),
+    "gender": _mapping_transform(
+        {"F": "female", "M": "male", "O": "other", "A": "other", "U": "unknown"}
+    ),
+    "patient_class": _mapping_transform(
+        {"E": "EMER", "I": "IMP", "O": "AMB", "P": "PRENC", "R": "AMB", "B": "OBSENC"}
+    ),
+    "allergy_category": _mapping_transform(
+        {
+            "DA": "medication",
+            "DRUG": "medication",
+            "MA": "medication",
+            "FA": "food",
+            "EA": "environment",
+            "AA": "environment",
+            "PA": "environment",
+        }
+    ),
+    "observation_status": _mapping_transform(
+        {
+            "C": "corrected",
+            "D": "entered-in-error",
+            "F": "final",
+            "I": "registered",
+            "P": "preliminary",
+            "R": "preliminary",
+            "S": "preliminary",
+            "W": "entered-in-error",
+            "X": "cancelled",
+        }
+    ),
+    "report_status": _mapping_transform(
+        {
+            "A": "partial",
+            "C": "corrected",
+            "F": "final",
+            "I": "registered",
+            "P": "preliminary",
+            "R": "partial",
+            "S": "partial",
+            "X": "cancelled",
+        }
+    ),
+}
+
+
+class TranslationContext:
+    """
+    The per-message state used by compiled templates.
+    """
+
+    __slots__ = ("segments", "segment_id", "segment", "repetition", "references")
+
+    def __init__(self, segments: Dict[str, List[Segment]]):
+        """
+        :param segments: The message's segments, indexed by segment id
+        """
+        self.segments = segments
+        # the current occurrence of a "$segment" resource template's segment
+        self.segment_id: Optional[str] = None
+        self.segment: Optional[Segment] = None
+        # the current (segment, repetition) within "$each"
+        self.repetition: Optional[Tuple[Segment, Any]] = None
+        # Bundle fullUrls by resource type
+        self.references: Dict[str, List[str]] = {}
+
+    def get_segment(self, segment_id: str) -> Optional[Segment]:
+        """Returns the current occurrence of a segment, or its first occurrence"""
+        if segment_id == self.segment_id:
+            return self.segment
+        segments = self.segments.get(segment_id)
+        return segments[0] if segments else None
+
+
+def _repetition_value(
+    segment: Segment, repetition: Any, component: int, subcomponent: int
+) -> str:
+    """
+    Returns a component or subcomponent value from a field repetition.
+    Missing values are returned as an empty string. Surrounding whitespace is removed.
+    """
+    value = repetition
+    for index in (component, subcomponent):
+        if isinstance(value, str):
+            return unescape(segment, value).strip() if index == 1 else ""
+        if index > len(value):
+            return ""
+        value = value[index - 1]
+
+    while not isinstance(value, str):
+        if not value:
+            return ""
+        value = value[0]
+    return unescape(segment, value).strip()
+
+
+def _field_repetitions(segment: Optional[Segment], field: int) -> List[Any]:
+    """Returns the repetitions for a segment field"""
+    if segment is None or field >= len(segment):
+        return []
+    return segment[field]
+
+
+def _compile_path(path: str) -> Evaluator:
+    """
+    Compiles a field path into an evaluator.
+    :raises: ValueError if the path or transform is invalid
+    """
+    match = _PATH_PATTERN.match(path)
+    if not match:
+        raise ValueError(f"Invalid field path {path}")
+
+    segment_id = match.group("segment")
+    field = int(match.group("field") or 0)
+    repeat = int(match.group("repeat") or 1)
+    component = int(match.group("component") or 1)
+    subcomponent = int(match.group("subcomponent") or 1)
+    transform_name = match.group("transform")
+
+    transform = None
+    if transform_name:
+        if transform_name not in TRANSFORMS:
+            raise ValueError(f"Unknown transform {transform_name} in {path}")
+        transform = TRANSFORMS[transform_name]
+
+    if segment_id:
+
+        def extract(context: TranslationContext) -> str:
+            segment = context.get_segment(segment_id)
+            repetitions = _field_repetitions(segment, field)
+            if repeat > len(repetitions):
+                return ""
+            return _repetition_value(
+                segment, repetitions[repeat - 1], component, subcomponent
+            )
+
+    else:
+
+        def extract(context: TranslationContext) -> str:
+            if context.repetition is None:
+                return ""
+            segment, repetition = context.repetition
+            return _repetition_value(segment, repetition, component, subcomponent)
+
+    if transform is None:
+        return extract
+
+    def evaluate(context: TranslationContext) -> Any:
+        value = extract(context)
+        return transform(value) if value else ""
+
+    return evaluate
+
+
+def _is_empty(value: Any) -> bool:
+    return value is None or value == "" or value == [] or value == {}
+
+
+def _compile_each(template: Dict) -> Evaluator:
+    """Compiles a "$each" template"""
+    match = _PATH_PATTERN.match(template["$each"])
+    if not match or not match.group("segment") or match.group("component"):
+        raise ValueError(f"$each requires a segment field path: {template['$each']}")
+
+    segment_id = match.group("segment")
+    field = int(match.group("field"))
+    map_evaluator = compile_template(template["$map"])
+
+    def evaluate(context: TranslationContext) -> List[Any]:
+        segment = context.get_segment(segment_id)
+        values = []
+        parent_repetition = context.repetition
+        for repetition in _field_repetitions(segment, field):
+            context.repetition = (segment, repetition)
+            value = map_evaluator(context)
+            if not _is_empty(value):
+                values.append(value)
+        context.repetition = parent_repetition
+        return values
+
+    return evaluate
+
+
+def _compile_if(template: Dict) -> Evaluator:
+    """Compiles a "$if" template"""
+    condition = _compile_path(template["$if"])
+    allowed_values = frozenset(template.get("$in", ()))
+    then_evaluator = compile_template(template.get("$then"))
+    else_evaluator = compile_template(template.get("$else"))
+
+    def evaluate(context: TranslationContext) -> Any:
+        value = condition(context)
+        matched = value in allowed_values if allowed_values else not _is_empty(value)
+        return then_evaluator(context) if matched else else_evaluator(context)
+
+    return evaluate
+
+
+def _literal(value: Any) -> Evaluator:
+    def evaluate(context: TranslationContext) -> Any:
+        return value
+
+    evaluate.is_literal = True
+    return evaluate
+
+
+def compile_template(template: Any) -> Evaluator:
+    """
+    Compiles a template, or template value, into an evaluator.
+    :param template: The template
+    :raises: ValueError if the template is invalid
+    :returns: A callable which accepts a TranslationContext and returns the translated value
+    """
+    if isinstance(template, str):
+        return (
+            _compile_path(template) if template.startswith("@") else _literal(template)
+        )
+
+    if isinstance(template, list):
+        item_evaluators = [compile_template(t) for t in template]
+
+        def evaluate_list(context: TranslationContext) -> List[Any]:
+            values = []
+            for evaluator in item_evaluators:
+                value = evaluator(context)
+                # "$each" and "$refs" values are flattened into the list
+                if isinstance(value, list):
+                    values.extend(value)
+                elif not _is_empty(value):
+                    values.append(value)
+            return values
+
+        return evaluate_list
+
+    if isinstance(template, dict):
+        if "$each" in template:
+            return _compile_each(template)
+        if "$if" in template:
+            return _compile_if(template)
+        if "$ref" in template:
+            resource_type = template["$ref"]
+
+            def evaluate_ref(context: TranslationContext) -> str:
+                references = context.references.get(resource_type)
+                return references[0] if references else ""
+
+            return evaluate_ref
+        if "$refs" in template:
+            resource_type = template["$refs"]
+
+            def evaluate_refs(context: TranslationContext) -> List[Dict]:
+                return [
+                    {"reference": r} for r in context.references.get(resource_type, ())
+                ]
+
+            return evaluate_refs
+
+        evaluators = [
+            (k, compile_template(v)) for k, v in template.items() if k != "$segment"
+        ]
+        has_dynamic_values = any(
+            not getattr(e, "is_literal", False) for _, e in evaluators
+        )
+
+        def evaluate_dict(context: TranslationContext) -> Optional[Dict]:
+            data = {}
+            is_populated = not has_dynamic_values
+            for key, evaluator in evaluators:
+                value = evaluator(context)
+                if _is_empty(value):
+                    continue
+                data[key] = value
+                if not getattr(evaluator, "is_literal", False):
+                    is_populated = True
+            return data if is_populated else None
+
+        return evaluate_dict
+
+    return _literal(template)
+
+
+class CompiledResourceTemplate:
+    """
+    A compiled resource template
+    """
+
+    __slots__ = ("resource_type", "segment_id", "evaluator")
+
+    def __init__(self, template: ResourceTemplate):
+        """
+        :param template: The resource template
+        :raises: ValueError if the template does not include a resourceType or is invalid
+        """
+        if "resourceType" not in template:
+            raise ValueError("Resource templates require a resourceType")
+        self.resource_type: str = template["resourceType"]
+        self.segment_id: Optional[str] = template.get("$segment")
+        self.evaluator: Evaluator = compile_template(template)
+
+
+PATIENT_TEMPLATE: ResourceTemplate = {
+    "$segment": "PID",
+    "resourceType": "Patient",
+    "identifier": {
+        "$each": "@PID-3",
+        "$map": {
+            "value": "@.1",
+            "type": {
+                "coding": [
+                    {
+                        "system": "http://terminology.hl7.org/CodeSystem/v2-0203",
+                        "code": "@.5",
+                    }
+                ]
+            },
+            "assigner": {"display": "@.4"},
+        },
+    },
+    "name": {
+        "$each": "@PID-5",
+        "$map": {
+            "family": "@.1",
+            "given": ["@.2", "@.3"],
+            "suffix": ["@.4"],
+            "prefix": ["@.5"],
+        },
+    },
+    "birthDate": "@PID-7|date",
+    "gender": "@PID-8|gender",
+    "address": {
+        "$each": "@PID-11",
+        "$map": {
+            "line": ["@.1", "@.2"],
+            "city": "@.3",
+            "state": "@.4",
+            "postalCode": "@.5",
+            "country": "@.6",
+        },
+    },
+    "telecom": [
+        {
+            "$each": "@PID-13",
+            "$map": {"system": "phone", "use": "home", "value": "@.1"},
+        },
+        {
+            "$each": "@PID-14",
+            "$map": {"system": "phone", "use": "work", "value": "@.1"},
+        },
+    ],
+    "maritalStatus": {
+        "coding": [
+            {
+                "system": "http://terminology.hl7.org/CodeSystem/v3-MaritalStatus",
+                "code": "@PID-16.1",
+            }
+        ]
+    },
+}
+
+ENCOUNTER_TEMPLATE: ResourceTemplate = {
+    "$segment": "PV1",
+    "resourceType": "Encounter",
+    "identifier": [{"value": "@PV1-19.1"}],
+    "status": {"$if": "@PV1-45", "$then": "finished", "$else": "in-progress"},
+    # class is required, so patient classes without an ActCode mapping are translated as unknown
+    "class": {
+        "$if": "@PV1-2|patient_class",
+        "$then": {
+            "system": "http://terminology.hl7.org/CodeSystem/v3-ActCode",
+            "code": "@PV1-2|patient_class",
+        },
+        "$else": {
+            "system": "http://terminology.hl7.org/CodeSystem/v3-NullFlavor",
+            "code": "UNK",
+            "display": "unknown",
+        },
+    },
+    "subject": {"reference": {"$ref": "Patient"}},
+    "participant": [
+        {
+            "type": [
+                {
+                    "coding": [
+                        {
+                            "system": "http://terminology.hl7.org/CodeSystem/v3-ParticipationType",
+                            "code": participation_type,
+                        }
+                    ]
+                }
+            ],
+            "individual": {
+                "identifier": {"value": f"@PV1-{field}.1"},
+                "display": f"@PV1-{field}.2",
+            },
+        }
+        for field, participation_type in (
+            (7, "ATND"),
+            (8, "REF"),
+            (9, "CON"),
+            (17, "ADM"),
+        )
+    ],
+    "period": {"start": "@PV1-44|datetime", "end": "@PV1-45|datetime"},
+    "location": [{"location": {"display": "@PV1-3.1"}}],
+}
+
+ALLERGY_INTOLERANCE_TEMPLATE: ResourceTemplate = {
+    "$segment": "AL1",
+    "resourceType": "AllergyIntolerance",
+    "patient": {"reference": {"$ref": "Patient"}},
+    "category": ["@AL1-2|allergy_category"],
+    "code": {
+        "coding": [
+            {
+                "system": "@AL1-3.3|coding_system",
+                "code": "@AL1-3.1",
+                "display": "@AL1-3.2",
+            }
+        ],
+        "text": "@AL1-3.2",
+    },
+    "reaction": [
+        {"manifestation": {"$each": "@AL1-5", "$map": {"text": "@.1"}}},
+    ],
+}
+
+DIAGNOSTIC_REPORT_TEMPLATE: ResourceTemplate = {
+    "$segment": "OBR",
+    "resourceType": "DiagnosticReport",
+    "identifier": [{"value": "@OBR-3.1"}],
+    "status": "@OBR-25|report_status",
+    "code": {
+        "coding": [
+            {
+                "system": "@OBR-4.3|coding_system",
+                "code": "@OBR-4.1",
+                "display": "@OBR-4.2",
+            }
+        ],
+        "text": "@OBR-4.2",
+    },
+    "subject": {"reference": {"$ref": "Patient"}},
+    "effectiveDateTime": "@OBR-7|datetime",
+    "issued": "@OBR-22|datetime",
+    "result": {"$refs": "Observation"},
+}
+
+OBSERVATION_TEMPLATE: ResourceTemplate = {
+    "$segment": "OBX",
+    "resourceType": "Observation",
+    "status": "@OBX-11|observation_status",
+    "code": {
+        "coding": [
+            {
+                "system": "@OBX-3.3|coding_system",
+                "code": "@OBX-3.1",
+                "display": "@OBX-3.2",
+            }
+        ],
+        "text": "@OBX-3.2",
+    },
+    "subject": {"reference": {"$ref": "Patient"}},
+    "effectiveDateTime": "@OBX-14|datetime",
+    "valueQuantity": {
+        "$if": "@OBX-2",
+        "$in": ["NM"],
+        "$then": {
+            "value": "@OBX-5|decimal",
+            "unit": "@OBX-6.1",
+            "system": "http://unitsofmeasure.org",
+            "code": "@OBX-6.1",
+        },
+    },
+    "valueString": {"$if": "@OBX-2", "$in": ["ST", "TX", "FT"], "$then": "@OBX-5"},
+    "interpretation": [
+        {
+            "coding": [
+                {
+                    "system": "http://terminology.hl7.org/CodeSystem/v3-ObservationInterpretation",
+                    "code": "@OBX-8",
+                }
+            ]
+        }
+    ],
+    "referenceRange": [{"text": "@OBX-7"}],
+}
+
+# resource templates by HL7 message code (MSH-9.1), or message code and trigger event (MSH-9.1^MSH-9.2)
+DEFAULT_HL7_TEMPLATES: Dict[str, List[ResourceTemplate]] = {
+    "ADT": [PATIENT_TEMPLATE, ENCOUNTER_TEMPLATE, ALLERGY_INTOLERANCE_TEMPLATE],
+    "ORU": [
+        PATIENT_TEMPLATE,
+        ENCOUNTER_TEMPLATE,
+        DIAGNOSTIC_REPORT_TEMPLATE,
+        OBSERVATION_TEMPLATE,
+    ],
+}
+
+
+class Hl7FhirTranslator:
+    """
+    Translates HL7v2 messages to FHIR R4 collection Bundles.
+    Templates are compiled when the translator is created. Translators are stateless and may be shared.
+    """
+
+    def __init__(self, templates: Optional[Dict[str, List[ResourceTemplate]]] = None):
+        """
+        :param templates: Resource templates by message code, or message code and trigger event (ADT^A08).
+        Defaults to ADT and ORU templates.
+        :raises: ValueError if a template is invalid
+        """
+        if templates is None:
+            templates = DEFAULT_HL7_TEMPLATES
+
+        self.templates: Dict[str, List[CompiledResourceTemplate]] = {
+            message_type: [CompiledResourceTemplate(t) for t in resource_templates]
+            for message_type, resource_templates in templates.items()
+        }
+
+    def _get_templates(
+        self, message: Message
+    ) -> Optional[List[CompiledResourceTemplate]]:
+        """Returns the compiled templates for a message's type"""
+        msh_segment = message[0]
+        message_type = _repetition_value(msh_segment, msh_segment[9][0], 1, 1)
+        trigger_event = _repetition_value(msh_segment, msh_segment[9][0], 2, 1)
+
+        return self.templates.get(
+            f"{message_type}^{trigger_event}"
+        ) or self.templates.get(message_type)
+
+    def supports(self, message: Message) -> bool:
+        """Returns True if the message's type has translation templates"""
+        return self._get_templates(message) is not None
+
+    def translate(self, message: Message) -> Optional[Dict]:
+        """
+        Translates an HL7 message to a FHIR Bundle.
+        :param message: The parsed HL7 message
+        :returns: The FHIR Bundle as a dictionary, or None if the message type is not supported
+        """
+        templates = self._get_templates(message)
+        if templates is None:
+            return None
+
+        segments: Dict[str, List[Segment]] = {}
+        for segment in message:
+            segments.setdefault(str(segment[0][0]).strip(), []).append(segment)
+
+        context = TranslationContext(segments)
+
+        # fullUrls are assigned before resources are evaluated, so resources may reference later resources
+        resource_instances: List[
+            Tuple[CompiledResourceTemplate, Optional[Segment], str]
+        ] = []
+        for template in templates:
+            if template.segment_id:
+                occurrences = segments.get(template.segment_id, [])
+            else:
+                occurrences = [None]
+
+            for segment in occurrences:
+                resource_id = str(uuid.uuid4())
+                context.references.setdefault(template.resource_type, []).append(
+                    f"urn:uuid:{resource_id}"
+                )
+                resource_instances.append((template, segment, resource_id))
+
+        entries = []
+        for template, segment, resource_id in resource_instances:
+            context.segment_id = template.segment_id
+            context.segment = segment
+            resource = {
+                "resourceType": template.resource_type,
+                "id": resource_id,
+                **(template.evaluator(context) or {}),
+            }
+            entries.append({"fullUrl": f"urn:uuid:{resource_id}", "resource": resource})
+
+        return {"resourceType": "Bundle", "type": "collection", "entry": entries}
+
+    def translate_batch(self, messages: Iterable[Message]) -> List[Optional[Dict]]:
+        """
+        Translates a batch of HL7 messages.
+        :param messages: The parsed HL7 messages
+        :returns: FHIR Bundles in message order. Unsupported messages are returned as None.
+        """
+        return [self.translate(m) for m in messages]
+
+
+@lru_cache()
+def get_hl7_translator() -> Hl7FhirTranslator:
+    """Returns the Hl7FhirTranslator for the default templates, compiling them on first use"""
+    return Hl7FhirTranslator()
@@ -0,0 +1,508 @@
+"""
+validation.py
+
+Lightweight EDI message validation for the envelope and structural validation levels.
+
+Envelope validation inspects the message header and trailer:
+* X12 - ISA, GS and ST headers, and SE, GE and IEA trailers
+* HL7 - the MSH segment's encoding characters, message type, control id and version
+* FHIR - the resourceType
+* DICOM - the DICM preamble
+
+Structural validation also checks the message's segments and elements against lightweight schemas, which are
+compiled once per segment or resource type, without building the message's data model:
+* X12 - segment counts, control numbers, and element counts and required elements for each segment
+* HL7 - segment ids and required fields
+* FHIR - top level element names and required elements. XML resources are streamed.
+* DICOM - required file meta and instance identifiers
+
+Failures raise EdiDataValidationException.
+"""
+from functools import lru_cache
+import importlib
+from io import BytesIO
+from itertools import islice
+import pkgutil
+import re
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from linuxforhealth.x12 import v5010 as x12_v5010
+from linuxforhealth.x12.v5010 import segments as x12_segments
+from pydicom import dcmread
+
+from .exceptions import EdiDataValidationException
+from .fhir_xml import scan_fhir_xml
+from .models import EdiMessageFormat, EdiMessageMetadata, ValidationLevel
+from .support import (
+    EdiMessageBuffer,
+    MessageData,
+    decode_message_slice,
+    find_message_start,
+    get_fhir_model_class,
+    iter_message_segments,
+    load_json,
+)
+
+# the fixed length of an X12 ISA segment, including the segment terminator
+X12_ISA_LENGTH = 106
+# the number of trailing bytes searched for the X12 trailer segments, doubled until the trailers are found
+X12_TRAILER_SAMPLE_SIZE = 4096
+
+# HL7 fields required for structural validation, by segment
+HL7_REQUIRED_FIELDS: Dict[str, Tuple[int, ...]] = {
+    "MSH": (9, 10, 11, 12),
+    "EVN": (2,),
+    "PID": (3, 5),
+    "PV1": (2,),
+    "NK1": (1,),
+    "AL1": (3,),
+    "DG1": (1,),
+    "ORC": (1,),
+    "OBR": (4,),
+    "OBX": (3, 11),
+}
+
+# DICOM elements required for structural validation
+DICOM_REQUIRED_TAGS = ("SOPClassUID", "SOPInstanceUID")
+DICOM_REQUIRED_FILE_META_TAGS = ("MediaStorageSOPClassUID", "TransferSyntaxUID")
+
+_HL7_SEGMENT_ID = re.compile(r"^[A-Z][A-Z0-9]{2}$")
+_HL7_SEGMENT_SEPARATOR = r"[\r\n]+"
+
+
+def _fail(msg: str) -> None:
+    """Raises an EdiDataValidationException"""
+    raise EdiDataValidationException(msg)
+
+
+class X12SegmentSchema:
+    """
+    Element counts and required element positions for an X12 segment, derived from the segment's X12 model.
+    """
+
+    __slots__ = ("max_elements", "required_elements")
+
+    def __init__(self, max_elements: int, required_elements: Tuple[int, ...]):
+        """
+        :param max_elements: The maximum number of elements, excluding the segment name
+        :param required_elements: One-based positions of required elements
+        """
+        self.max_elements = max_elements
+        self.required_elements = required_elements
+
+
+@lru_cache(maxsize=None)
+def _get_x12_segment_classes() -> Dict[str, List[type]]:
+    """
+    Returns the 5010 segment models by segment name, including the transaction specific models which refine the base
+    segment models.
+    """
+    segment_classes: Dict[str, List[type]] = {}
+    for name, segment_class in vars(x12_segments).items():
+        if name.endswith("Segment") and name != "X12Segment":
+            segment_classes[name[0:-7].upper()] = [segment_class]
+
+    for module_info in pkgutil.iter_modules(x12_v5010.__path__):
+        if not module_info.ispkg:
+            continue
+        module = importlib.import_module(
+            f"{x12_v5010.__name__}.{module_info.name}.segments"
+        )
+        for segment_class in vars(module).values():
+            if not isinstance(segment_class, type):
+                continue
+            for base_classes in segment_classes.values():
+                if segment_class is not base_classes[0] and issubclass(
+                    segment_class, base_classes[0]
+                ):
+                    base_classes.append(segment_class)
+    return segment_classes
+
+
+@lru_cache(maxsize=None)
+def get_x12_segment_schema(segment_name: str) -> Optional[X12SegmentSchema]:
+    """
+    Compiles the schema for an X12 segment from its 5010 segment models.
+    An element is required if it is required by the base segment model and by each transaction specific model.
+    :param segment_name: The segment name, such as "NM1"
+    :returns: X12SegmentSchema, or None if the segment is not modeled
+    """
+    segment_classes = _get_x12_segment_classes().get(segment_name)
+    if segment_classes is None:
+        return None
+
+    max_elements = 0
+    required_elements = None
+    for segment_class in segment_classes:
+        element_fields = [
+            f
+            for name, f in segment_class.__fields__.items()
+            if name not in ("delimiters", "segment_name")
+        ]
+        max_elements = max(max_elements, len(element_fields))
+        class_required_elements = {
+            i for i, f in enumerate(element_fields, start=1) if f.required
+        }
+        if required_elements is None:
+            required_elements = class_required_elements
+        else:
+            required_elements &= class_required_elements
+
+    return X12SegmentSchema(
+        max_elements=max_elements,
+        required_elements=tuple(sorted(required_elements)),
+    )
+
+
+def _x12_delimiters(data: MessageData, start: int) -> Tuple[str, str]:
+    """
+    Returns the element separator and segment terminator defined within an X12 message's ISA segment.
+    :param data: The X12 message
+    :param start: The offset of the ISA segment
+    :raises: EdiDataValidationException if the message does not start with an ISA segment
+    """
+    isa_segment = (
+        decode_message_slice(data, start, start + X12_ISA_LENGTH) if start != -1 else ""
+    )
+    if not isa_segment.startswith("ISA") or len(isa_segment) < X12_ISA_LENGTH:
+        _fail("X12 message does not start with an ISA segment")
+    return isa_segment[3], isa_segment[X12_ISA_LENGTH - 1]
+
+
+def _split_x12_segments(
+    segments: Iterable[str], element_separator: str
+) -> Iterable[List[str]]:
+    """Splits X12 segments into elements, skipping empty segments"""
+    return (s.strip().split(element_separator) for s in segments if s.strip())
+
+
+def _x12_trailer(
+    data: MessageData, element_separator: str, segment_terminator: str
+) -> List[List[str]]:
+    """Returns the last three segments of an X12 message, decoding only the end of the message"""
+    sample_size = X12_TRAILER_SAMPLE_SIZE
+    while True:
+        sample_start = max(len(data) - sample_size, 0)
+        segments = (
+            decode_message_slice(data, sample_start, None)
+            .rstrip()
+            .rsplit(segment_terminator, 4)
+        )
+        # the first segment within a sample may be incomplete
+        if len(segments) == 5 or sample_start == 0:
+            break
+        sample_size *= 2
+
+    return list(_split_x12_segments(segments[-4:], element_separator))[-3:]
+
+
+def _validate_x12_envelope(data: MessageData, start: int) -> None:
+    """
+    Validates X12 interchange, group and transaction headers and trailers.
+    Only the leading and trailing segments are split, so the cost does not depend on the message size.
+    """
+    element_separator, segment_terminator = _x12_delimiters(data, start)
+
+    header = list(
+        islice(
+            _split_x12_segments(
+                iter_message_segments(data, re.escape(segment_terminator), start),
+                element_separator,
+            ),
+            3,
+        )
+    )
+    trailer = _x12_trailer(data, element_separator, segment_terminator)
+
+    if len(header[0]) != 17:
+        _fail(f"ISA segment has {len(header[0]) - 1} elements, expected 16")
+
+    if [s[0] for s in header[1:]] != ["GS", "ST"]:
+        _fail("X12 interchange does not contain a GS and ST header")
+
+    if [s[0] for s in trailer] != ["SE", "GE", "IEA"]:
+        _fail("X12 interchange does not end with SE, GE and IEA trailers")
+
+
+def _validate_x12_structure(segments: Iterable[List[str]]) -> None:
+    """Validates X12 segment counts, control numbers and segment elements"""
+    group_count = 0
+    transaction_count = 0
+    transaction_segment_count = 0
+    group_header = None
+    transaction_header = None
+
+    for segment in segments:
+        segment_name = segment[0]
+
+        if transaction_header is not None:
+            transaction_segment_count += 1
+
+        if segment_name == "GS":
+            group_header = segment
+            group_count += 1
+            transaction_count = 0
+        elif segment_name == "ST":
+            transaction_header = segment
+            transaction_count += 1
+            transaction_segment_count = 1
+        elif segment_name == "SE":
+            if transaction_header is None or segment[2:3] != transaction_header[2:3]:
+                _fail("ST and SE transaction control numbers do not match")
+            if segment[1] != str(transaction_segment_count):
+                _fail(
+                    f"SE segment count {segment[1]} != actual count {transaction_segment_count}"
+                )
+            transaction_header = None
+        elif segment_name == "GE":
+            if group_header is None or segment[2:3] != group_header[6:7]:
+                _fail("GS and GE group control numbers do not match")
+            if segment[1] != str(transaction_count):
+                _fail(
+                    f"GE transaction count {segment[1]} != actual count {transaction_count}"
+                )
+            group_header = None
+        elif segment_name == "IEA" and segment[1] != str(group_count):
+            _fail(f"IEA group count {segment[1]} != actual count {group_count}")
+
+        schema = get_x12_segment_schema(segment_name)
+        if schema is None:
+            continue
+
+        element_count = len(segment) - 1
+        if element_count > schema.max_elements:
+            _fail(
+                f"{segment_name} segment has {element_count} elements, maximum is {schema.max_elements}"
+            )
+        for position in schema.required_elements:
+            if position > element_count or not segment[position]:
+                _fail(f"{segment_name}{position:02d} is required")
+
+
+def validate_x12(data: MessageData, validation_level: ValidationLevel) -> None:
+    """
+    Validates an X12 message.
+    Segments are scanned within the message text or bytes, so a memory mapped message is not decoded or split as a
+    whole.
+    :param data: The X12 message
+    :param validation_level: The envelope or structural validation level
+    :raises: EdiDataValidationException if the message is invalid
+    """
+    start = find_message_start(data)
+    _validate_x12_envelope(data, start)
+
+    if validation_level == ValidationLevel.STRUCTURAL:
+        element_separator, segment_terminator = _x12_delimiters(data, start)
+        _validate_x12_structure(
+            _split_x12_segments(
+                iter_message_segments(data, re.escape(segment_terminator), start),
+                element_separator,
+            )
+        )
+
+
+def validate_hl7(data: MessageData, validation_level: ValidationLevel) -> None:
+    """
+    Validates an HL7v2 message.
+    Segments are scanned within the message text or bytes, so a memory mapped message is not decoded or split as a
+    whole.
+    :param data: The HL7 message
+    :param validation_level: The envelope or structural validation level
+    :raises: EdiDataValidationException if the message is invalid
+    """
+    start = find_message_start(data)
+    header = decode_message_slice(data, start, start + 8) if start != -1 else ""
+    if not header.startswith("MSH") or len(header) < 8:
+        _fail("HL7 message does not start with an MSH segment")
+
+    field_separator = header[3]
+    segments = iter_message_segments(data, _HL7_SEGMENT_SEPARATOR, start)
+    if validation_level == ValidationLevel.ENVELOPE:
+        # only the MSH segment is split
+        segments = islice(segments, 1)
+
+    for segment_index, segment in enumerate(segments):
+        fields = segment.split(field_separator)
+        segment_id = fields[0]
+        if not _HL7_SEGMENT_ID.match(segment_id):
+            _fail(f"Invalid HL7 segment id {segment_id} at segment {segment_index + 1}")
+
+        # MSH-1 is the field separator, so MSH field positions are offset by one
+        offset = 1 if segment_id == "MSH" else 0
+        for field_number in HL7_REQUIRED_FIELDS.get(segment_id, ()):
+            field_index = field_number - offset
+            if field_index >= len(fields) or not fields[field_index]:
+                _fail(f"{segment_id}-{field_number} is required")
+
+
+class FhirResourceSchema:
+    """
+    Top level element names and required elements for a FHIR resource type, derived from its fhir.resources model.
+    """
+
+    __slots__ = ("element_names", "required_elements", "required_choices")
+
+    def __init__(
+        self,
+        element_names: FrozenSet[str],
+        required_elements: Tuple[str, ...],
+        required_choices: Tuple[FrozenSet[str], ...],
+    ):
+        """
+        :param element_names: Valid element names, including primitive extension ("_") names
+        :param required_elements: Required element names
+        :param required_choices: Choice elements ([x]) where one of the element names is required
+        """
+        self.element_names = element_names
+        self.required_elements = required_elements
+        self.required_choices = required_choices
+
+
+@lru_cache(maxsize=None)
+def get_fhir_resource_schema(
+    specification_version: str, resource_type: str
+) -> Optional[FhirResourceSchema]:
+    """
+    Compiles the schema for a FHIR resource type.
+    :param specification_version: The FHIR specification version: R4, STU3 or DSTU2
+    :param resource_type: The resource type
+    :returns: FhirResourceSchema, or None if the resource type is not defined for the version
+    """
+    model_class = get_fhir_model_class(specification_version, resource_type)
+    if model_class is None:
+        return None
+
+    element_names = {"resourceType"}
+    required_elements = []
+    choices: Dict[str, List[str]] = {}
+    for field in model_class.__fields__.values():
+        alias = field.alias
+        if alias == "resource_type":
+            continue
+
+        element_names.add(alias)
+        element_names.add(f"_{alias}")
+
+        field_extra = field.field_info.extra
+        if field_extra.get("one_of_many_required"):
+            choices.setdefault(field_extra["one_of_many"], []).append(alias)
+        elif field.required or field_extra.get("element_required"):
+            required_elements.append(alias)
+
+    return FhirResourceSchema(
+        element_names=frozenset(element_names),
+        required_elements=tuple(required_elements),
+        required_choices=tuple(frozenset(c) for c in choices.values()),
+    )
+
+
+def validate_fhir(
+    message: EdiMessageBuffer,
+    meta_data: EdiMessageMetadata,
+    validation_level: ValidationLevel,
+) -> None:
+    """
+    Validates a FHIR JSON or XML resource.
+    XML resources are streamed, reading the resource type and top level element names without building the document
+    tree.
+    :param message: The FHIR message
+    :param meta_data: The message metadata, which provides the FHIR specification version
+    :param validation_level: The envelope or structural validation level
+    :raises: EdiDataValidationException if the resource is invalid
+    """
+    if message.lead(1) == "<":
+        summary = scan_fhir_xml(message.data)
+        resource_type = summary.resource_type
+        element_names = summary.element_names
+    else:
+        try:
+            fhir_json = load_json(message.parseable())
+        except ValueError as ex:
+            raise EdiDataValidationException("FHIR resource is not valid JSON") from ex
+
+        if not isinstance(fhir_json, dict) or not isinstance(
+            fhir_json.get("resourceType"), str
+        ):
+            _fail("FHIR resource does not contain a resourceType")
+        resource_type = fhir_json["resourceType"]
+        element_names = fhir_json.keys()
+
+    schema = get_fhir_resource_schema(meta_data.specificationVersion, resource_type)
+    if schema is None:
+        _fail(
+            f"{resource_type} is not a FHIR {meta_data.specificationVersion} resource"
+        )
+
+    if validation_level == ValidationLevel.ENVELOPE:
+        return
+
+    for element_name in element_names:
+        if element_name not in schema.element_names:
+            _fail(f"{resource_type}.{element_name} is not a valid element")
+
+    for element_name in schema.required_elements:
+        if (
+            element_name not in element_names
+            and f"_{element_name}" not in element_names
+        ):
+            _fail(f"{resource_type}.{element_name} is required")
+
+    for choice in schema.required_choices:
+        if choice.isdisjoint(element_names):
+            _fail(f"{resource_type} requires one of {', '.join(sorted(choice))}")
+
+
+def validate_dicom(data: bytes, validation_level: ValidationLevel) -> None:
+    """
+    Validates a DICOM instance.
+    :param data: The DICOM instance
+    :param validation_level: The envelope or structural validation level
+    :raises: EdiDataValidationException if the instance is invalid
+    """
+    if bytes(data[128:132]) != b"DICM":
+        _fail("DICOM instance does not contain a DICM preamble")
+
+    if validation_level == ValidationLevel.ENVELOPE:
+        return
+
+    try:
+        dataset = dcmread(
+            BytesIO(data),
+            stop_before_pixels=True,
+            specific_tags=list(DICOM_REQUIRED_TAGS),
+        )
+    except Exception as ex:
+        raise EdiDataValidationException("DICOM header could not be read") from ex
+
+    for tag in DICOM_REQUIRED_FILE_META_TAGS:
+        if not getattr(dataset.file_meta, tag, None):
+            _fail(f"DICOM file meta {tag} is required")
+
+    for tag in DICOM_REQUIRED_TAGS:
+        if not getattr(dataset, tag, None):
+            _fail(f"DICOM {tag} is required")
+
+
+def validate_message(
+    message: EdiMessageBuffer,
+    meta_data: EdiMessageMetadata,
+    validation_level: ValidationLevel,
+) -> None:
+    """
+    Validates an EDI message at the envelope or structural validation level.
+    Formats without lightweight validation, such as C-CDA, are not validated.
+    :param message: The EDI message
+    :param meta_data: The message metadata
+    :param validation_level: The envelope or structural validation level
+    :raises: EdiDataValidationException if the message is invalid
+    """
+    edi_message_format = meta_data.ediMessageFormat
+
+    if edi_message_format == EdiMessageFormat.X12:
+        validate_x12(message.parseable(), validation_level)
+    elif edi_message_format == EdiMessageFormat.HL7:
+        validate_hl7(message.parseable(), validation_level)
+    elif edi_message_format == EdiMessageFormat.FHIR:
+        validate_fhir(message, meta_data, validation_level)
+    elif edi_message_format == EdiMessageFormat.DICOM:
+        validate_dicom(message.data, validation_level)
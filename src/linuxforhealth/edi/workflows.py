@@ -4,24 +4,54 @@ workflows.py
 Defines EDI processing workflows.
 """
 
-from typing import Union, Optional
-from pydantic import ValidationError
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from typing import Union, Optional, List, Tuple, Dict, Deque, Iterable, Iterator
 
 from .models import (
     EdiMessageMetadata,
     EdiProcessingMetrics,
     EdiResult,
     EdiMessageFormat,
+    EdiStudyResult,
+    DicomStudySummary,
+    DicomSeriesSummary,
+    EdiInstanceFailure,
+    EdiCode,
+    ValidationLevel,
+    CompressionFormat,
+    EdiCompressionMetadata,
 )
-from .support import Timer, load_fhir_json, load_hl7, load_x12, load_dicom
-from .analysis import analyze
+from .support import (
+    COMPRESSION_MAGIC_SIZE,
+    UNICODE_SAMPLE_SIZE,
+    Timer,
+    load_dicom_header,
+    list_dicom_instances,
+    EdiMessageBuffer,
+    is_unicode,
+    detect_compression,
+    decompress_stream,
+    estimate_decompressed_size,
+    iter_zip_members,
+    warm_up_fhir_models,
+)
+from .config import get_settings
+from .journal import BatchJournal, JournalOutcome
+from .pipeline import EdiPipeline, get_default_pipeline
+from .pool import WorkerPool
+from .shared_buffer import SharedBufferRef, SharedMessageBlock, attach_shared_buffers
 from .exceptions import (
+    EdiException,
     EdiAnalysisException,
-    EdiValidationException,
     EdiDataValidationException,
 )
 import logging
+import mmap
 import os
+import zipfile
+import zlib
 
 logger = logging.getLogger(__name__)
 
@@ -34,139 +64,814 @@ class EdiWorkflow:
 
     Transitions in the EDI workflow include:
         * analyze - Generates an EdiMessageMetadata object for the EDI Message.
+        * dedupe - Flags messages which were processed by a previous run.
         * enrich - Enriches the input message with additional data using custom transformations.
         * validate - Validates the input message.
         * translate- Translates the input message in a supported format to a different supported format. Example: translate HL7v2 to FHIR
         * complete - Marks the EDI workflow as complete, returning an EDI result.
         * cancel - Cancels the current workflow process, returning an EDI result.
         * fail - Reached if the workflow encounters an unrecoverable error. Returns an EDI result
+
+    Steps are executed as EdiPipeline stages. Custom pipelines may add, remove or reorder stages.
     """
 
-    def __init__(self, input_message: Union[bytes, str]):
+    def __init__(
+        self,
+        input_message: Union[bytes, str, EdiMessageBuffer],
+        compression: Optional[EdiCompressionMetadata] = None,
+    ):
         """
         Configures the EdiProcess instance.
         Attributes include:
-        - input_message: cached source message
+        - input_message: cached source message buffer
         - data_model: edi domain model (FHIR, HL7, X12, etc)
         - meta_data: EdiMessageMetadata object
         - metrics: EdiProcessingMetrics object
-        - operations: List of EdiOperations completed for this instance
+        - operations: List of pipeline stage names completed for this instance
+        - codes: List of EdiCode objects resolved by the enrich step
+        - translation: the translated message, such as a FHIR Bundle, generated by the translate step
+        - validation_level: the ValidationLevel applied by the validate step
+        - duplicate: True if the message was processed by a previous run, set by the dedupe step
+        - cancelled: True if the workflow was cancelled, skipping the remaining steps
+        - compression: describes the compressed file the message was loaded from
         """
 
-        self.input_message = input_message
+        if not isinstance(input_message, EdiMessageBuffer):
+            input_message = EdiMessageBuffer(input_message)
+
+        self.input_message: EdiMessageBuffer = input_message
         self.data_model = None
         self.meta_data: Optional[EdiMessageMetadata] = None
-        self.metrics: EdiProcessingMetrics = EdiProcessingMetrics(
-            analyzeTime=0.0, enrichTime=0.0, validateTime=0.0, translateTime=0.0
+        self.metrics: EdiProcessingMetrics = EdiProcessingMetrics.construct()
+        self.operations: List[str] = []
+        self.codes: Optional[List[EdiCode]] = None
+        self.translation: Optional[Dict] = None
+        self.validation_level: Optional[ValidationLevel] = None
+        self.duplicate: Optional[bool] = None
+        self.cancelled: bool = False
+        self.compression: Optional[EdiCompressionMetadata] = compression
+
+    def cancel(self) -> None:
+        """Cancels the workflow. The pipeline skips the workflow's remaining steps."""
+        self.cancelled = True
+
+    def _create_edi_result(self) -> EdiResult:
+        """
+        Creates an EdiResult from the workflow's metadata and metrics.
+        The models are generated by the workflow, so they are not re-validated.
+        """
+        metrics = self.metrics.copy()
+        metrics.update_total_time()
+        return EdiResult.construct(
+            metadata=self.meta_data,
+            metrics=metrics,
+            codes=self.codes,
+            translation=self.translation,
+            validationLevel=self.validation_level,
+            duplicate=self.duplicate,
+            compression=self.compression,
         )
-        self.operations: Optional[EdiOperations] = []
 
-    def _analyze(self):
+    def run(
+        self,
+        enrich=True,
+        validate=True,
+        translate=True,
+        pipeline: Optional[EdiPipeline] = None,
+        validation_level: Union[ValidationLevel, str] = ValidationLevel.FULL,
+    ) -> EdiResult:
         """
-        Generates EdiMessageMetadata for the input message.
+        Runs an EDI workflow process.
+
+        :param enrich: Indicates if the enrich step is executed. Defaults to True.
+        :param validate: Indicates if the validation step is executed. Defaults to True.
+        :param translate: Indicates if the translate step is executed. Defaults to True.
+        :param pipeline: Runs a custom EdiPipeline. When provided, the enrich, validate and translate flags are ignored.
+        :param validation_level: The validation level: envelope, structural or full. Defaults to full. Envelope and
+        structural validation do not build a data model, so the message is not translated.
         """
-        with Timer() as t:
-            self.meta_data = analyze(self.input_message)
+        if pipeline is None:
+            pipeline = get_default_pipeline(
+                enrich=bool(enrich),
+                validate=bool(validate),
+                translate=bool(translate),
+                validation_level=ValidationLevel(validation_level),
+            )
 
-        self.metrics.analyzeTime = t.elapsed_time
+        pipeline.run(self)
+        return self._create_edi_result()
+
+
+def run_workflows(
+    input_messages: Iterable[Union[bytes, str, EdiMessageBuffer]],
+    pipeline: Optional[EdiPipeline] = None,
+    batch_size: int = 100,
+    max_workers: int = 1,
+) -> Iterator[Union[EdiResult, EdiException]]:
+    """
+    Runs EDI workflows for a stream of messages.
+    Messages are processed in batches, so each pipeline stage processes a batch of messages at a time.
+    :param input_messages: The input messages
+    :param pipeline: The pipeline to execute. Defaults to the pipeline with all stages.
+    :param batch_size: The number of messages processed by each stage at a time
+    :param max_workers: The number of processes. Defaults to 1, which processes messages within the current process.
+    Batches are transferred to worker processes in shared memory, and the pipeline is sent to each worker when it
+    starts, so custom pipelines must be picklable.
+    :returns: An iterator containing an EdiResult, or the exception raised, for each message in input order
+    """
+    if max_workers > 1:
+        yield from _run_workflows_parallel(
+            input_messages, pipeline, batch_size, max_workers
+        )
+        return
+
+    if pipeline is None:
+        pipeline = get_default_pipeline()
+
+    workflows = (EdiWorkflow(m) for m in input_messages)
+    for workflow, exception in pipeline.stream(workflows, batch_size=batch_size):
+        yield exception if exception else workflow._create_edi_result()
+
+
+def _process_shared_batch(
+    refs: List[SharedBufferRef],
+) -> List[Union[EdiResult, Exception]]:
+    """
+    Processes a batch of messages held in shared memory within a batch worker process.
+    Workflows operate on views of the shared memory block, and only the results are returned.
+    """
+    pipeline = _worker_pipelines[0] or get_default_pipeline()
+    with attach_shared_buffers(refs) as buffers:
+        workflows = [EdiWorkflow(b) for b in buffers]
+        exceptions = pipeline.run_batch(workflows)
+        return [
+            exception or workflow._create_edi_result()
+            for workflow, exception in zip(workflows, exceptions)
+        ]
+
+
+def _run_workflows_parallel(
+    input_messages: Iterable[Union[bytes, str, EdiMessageBuffer]],
+    pipeline: Optional[EdiPipeline],
+    batch_size: int,
+    max_workers: int,
+) -> Iterator[Union[EdiResult, EdiException]]:
+    """
+    Runs EDI workflows for a stream of messages with a process pool.
+    Each batch is copied into a shared memory block, which is unlinked when the batch completes. Up to two batches per
+    worker are in progress, so the stream is not read ahead of the workers.
+    :returns: An iterator containing an EdiResult, or the exception raised, for each message in input order
+    """
+    message_iterator = iter(input_messages)
+    in_progress: Deque[Tuple[SharedMessageBlock, Future]] = deque()
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers,
+        initializer=_init_batch_worker,
+        initargs=(pipeline, None),
+    ) as executor:
+        try:
+            while True:
+                while len(in_progress) < max_workers * 2:
+                    messages = list(islice(message_iterator, batch_size))
+                    if not messages:
+                        break
+                    block = SharedMessageBlock(messages)
+                    in_progress.append(
+                        (block, executor.submit(_process_shared_batch, block.refs))
+                    )
+
+                if not in_progress:
+                    return
+
+                block, future = in_progress.popleft()
+                try:
+                    results = future.result()
+                finally:
+                    block.close()
+                yield from results
+        finally:
+            for block, future in in_progress:
+                future.cancel()
+            executor.shutdown(wait=True)
+            for block, _ in in_progress:
+                block.close()
+
+
+def _create_workflow(
+    contents: Union[bytes, bytearray, mmap.mmap],
+    compression: Optional[EdiCompressionMetadata] = None,
+) -> EdiWorkflow:
+    """Creates a workflow for message bytes loaded from a file"""
+    # text is decoded lazily by the workflow steps which require it
+    input_message = EdiMessageBuffer(contents, is_binary=not is_unicode(contents))
+    return EdiWorkflow(input_message, compression=compression)
+
+
+def load_workflows_from_file(
+    file_path: str, memory_map: bool = False
+) -> Iterator[Tuple[str, EdiWorkflow]]:
+    """
+    Loads an EDI workflow for each message within an EDI file.
+    gzip and bzip2 files are detected by their leading bytes and decompressed in memory, without temporary files.
+    Each file within a zip archive is loaded as a separate message, named "<file path>!<member name>". Archive
+    members are decompressed as they are iterated. Decompressed messages are limited to the configured
+    max_decompressed_size.
+    :param file_path: The path to the EDI file
+    :param memory_map: When True, an uncompressed file is memory mapped rather than read, so pages are loaded on
+    demand and are not copied to the process heap. Empty files cannot be memory mapped.
+    :returns: iterator of (message path, EdiWorkflow) tuples
+    :raises: OSError if the file cannot be read
+    :raises: EdiDataValidationException if a compressed file cannot be decompressed, or exceeds the maximum size
+    """
+    max_size = get_settings().max_decompressed_size
+    with open(file_path, "rb") as f:
+        compression_format = detect_compression(f.read(COMPRESSION_MAGIC_SIZE))
+        f.seek(0)
+
+        if compression_format is None:
+            if memory_map:
+                contents = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                contents: bytes = f.read()
+            yield file_path, _create_workflow(contents)
+            return
+
+        try:
+            if compression_format != CompressionFormat.ZIP:
+                contents, compression = decompress_stream(
+                    f, compression_format, max_size
+                )
+                yield file_path, _create_workflow(contents, compression)
+                return
+
+            for contents, compression in iter_zip_members(f, max_size):
+                yield f"{file_path}!{compression.archiveMember}", _create_workflow(
+                    contents, compression
+                )
+        except (OSError, EOFError, zipfile.BadZipFile, zlib.error) as ex:
+            raise EdiDataValidationException(
+                f"Unable to decompress {compression_format.value} file {file_path}: {ex}"
+            ) from ex
+
+
+def load_workflow_from_file(file_path: str, memory_map: bool = False) -> EdiWorkflow:
+    """
+    Loads an EDI workflow from an EDI file.
+    Compressed files are decompressed in memory. Zip archives must contain a single message.
+    :param file_path: The path to the EDI file
+    :param memory_map: When True, an uncompressed file is memory mapped rather than read, so pages are loaded on
+    demand and are not copied to the process heap. Empty files cannot be memory mapped.
+    :returns: EdiWorkflow
+    :raises: EdiDataValidationException if the file is an archive which does not contain exactly one message
+    """
+    workflows = list(islice(load_workflows_from_file(file_path, memory_map), 2))
+    if len(workflows) != 1:
+        raise EdiDataValidationException(
+            f"{file_path} contains {'no' if not workflows else 'multiple'} messages. "
+            "Archives with multiple messages are processed as a batch"
+        )
+    return workflows[0][1]
+
+
+# files whose messages are at least this size, once decompressed, are processed by the large file pipeline.
+# Uncompressed files are memory mapped.
+LARGE_FILE_SIZE: int = 64 * 1024 * 1024
+# decompressed message bytes held by a batch before its messages are processed
+BATCH_BUFFER_SIZE: int = 64 * 1024 * 1024
+# estimated peak memory used to process a message, as a multiple of the message size
+MEMORY_FACTOR: float = 10.0
+# estimated peak memory used to process a memory mapped X12, HL7, FHIR XML or DICOM message with the large file
+# pipeline. Segments and elements are scanned over the mapped file, so memory use is mostly the mapped pages.
+LARGE_FILE_MEMORY_FACTOR: float = 2.0
+
+# pipelines used by batch worker processes, set when the worker is initialized
+_worker_pipelines: Tuple[Optional[EdiPipeline], Optional[EdiPipeline]] = (None, None)
+
+
+def _init_batch_worker(
+    pipeline: Optional[EdiPipeline], large_file_pipeline: Optional[EdiPipeline]
+) -> None:
+    """Sets the pipelines used by a batch worker process, and loads the configured FHIR model classes"""
+    global _worker_pipelines
+    _worker_pipelines = (pipeline, large_file_pipeline)
+    warm_up_fhir_models()
+
+
+def _file_checksum(workflow: EdiWorkflow) -> Optional[str]:
+    """
+    Returns the checksum of the file a workflow was loaded from: the compressed checksum for compressed files,
+    otherwise the message checksum. None if the message was not analyzed.
+    """
+    if workflow.compression is not None:
+        return workflow.compression.compressedChecksum
+    return workflow.meta_data.checksum if workflow.meta_data else None
+
+
+def _inspect_file(file_path: str, size: int) -> Tuple[int, bool]:
+    """
+    Estimates the size of the largest message within a file once it is decompressed, and checks if a large file is
+    processed over its memory mapped bytes. Compressed files are decompressed into memory, and FHIR JSON is parsed
+    into memory, so neither is streamed.
+    :param file_path: The path to the EDI file
+    :param size: The file size
+    :returns: tuple of (estimated message size, True if the file is streamed)
+    """
+    try:
+        with open(file_path, "rb") as f:
+            lead = f.read(UNICODE_SAMPLE_SIZE)
+            compression_format = detect_compression(lead)
+            if compression_format is not None:
+                return estimate_decompressed_size(f, compression_format), False
+    except (OSError, zipfile.BadZipFile):
+        return size, False
+
+    return size, lead.lstrip()[0:1] not in (b"{", b"[")
+
+
+def _process_file(
+    file_path: str,
+    pipeline: EdiPipeline,
+    memory_map: bool = False,
+) -> Tuple[Optional[str], List[Tuple[str, Union[EdiResult, Exception]]]]:
+    """
+    Processes each message within an EDI file.
+    :param file_path: The path to the EDI file
+    :param pipeline: The pipeline to execute
+    :param memory_map: Indicates if an uncompressed file is memory mapped
+    :returns: tuple of (file checksum, list of (message path, EdiResult or the exception raised)). The checksum is
+    None if the file could not be read or analyzed.
+    """
+    checksum = None
+    results = []
+    try:
+        for message_path, workflow in load_workflows_from_file(file_path, memory_map):
+            try:
+                pipeline.run(workflow)
+                result = workflow._create_edi_result()
+            except Exception as ex:
+                result = ex
+            checksum = _file_checksum(workflow)
+            results.append((message_path, result))
+    except (OSError, EdiDataValidationException) as ex:
+        results.append((file_path, ex))
 
-    def _enrich(self):
+    return checksum, results
+
+
+def _process_batch_file(
+    file_path: str, is_large: bool
+) -> Tuple[Optional[str], List[Tuple[str, Union[EdiResult, Exception]]]]:
+    """
+    Processes an EDI file within a batch worker process.
+    Runs within a worker process, so the return value is kept small and picklable.
+    """
+    pipeline, large_file_pipeline = _worker_pipelines
+    if is_large:
+        return _process_file(
+            file_path, large_file_pipeline or get_large_file_pipeline(), True
+        )
+    return _process_file(file_path, pipeline or get_default_pipeline())
+
+
+def get_large_file_pipeline() -> EdiPipeline:
+    """
+    Returns the default pipeline for large files.
+    Full validation and translation build a model for the entire message, so large files are validated structurally
+    without a data model and are not translated.
+    """
+    return get_default_pipeline(
+        translate=False, validation_level=ValidationLevel.STRUCTURAL
+    )
+
+
+class BatchWorkflow:
+    """
+    Processes a batch of EDI files, optionally recording each processed file in a BatchJournal.
+
+    When a journal is used, files which were processed by a previous run, and have not changed since, are skipped, so
+    an interrupted run resumes where it stopped.
+
+    Files whose messages are at least `large_file_size` bytes, once decompressed, are processed individually with the
+    large file pipeline, and uncompressed large files are memory mapped. Other files are processed in batches, which
+    are run whenever they hold `batch_size` messages or BATCH_BUFFER_SIZE decompressed bytes, so archive members are
+    processed as they are read rather than all held in memory.
+
+    When more than one worker, or a time limit, is configured, files are processed by a WorkerPool, which enforces
+    per-file time limits and recycles worker processes. Files are stat'd up front and scheduled largest first, so the
+    largest files do not start at the end of the run, and a file is only started when its estimated memory use fits
+    within the memory budget alongside the files in progress.
+    """
+
+    def __init__(
+        self,
+        file_paths: Iterable[str],
+        journal_path: Optional[str] = None,
+        pipeline: Optional[EdiPipeline] = None,
+        batch_size: int = 100,
+        retry_failed: bool = False,
+        max_workers: int = 1,
+        large_file_size: Optional[int] = LARGE_FILE_SIZE,
+        large_file_pipeline: Optional[EdiPipeline] = None,
+        memory_budget: Optional[int] = None,
+        message_timeout: Optional[float] = None,
+        cpu_timeout: Optional[float] = None,
+        max_messages_per_worker: Optional[int] = None,
+        max_worker_rss: Optional[int] = None,
+    ):
         """
-        Adds additional data to the input message.
+        Configures the BatchWorkflow instance.
+        :param file_paths: The EDI file paths
+        :param journal_path: The path to the journal file. Defaults to None, which disables journaling.
+        :param pipeline: The pipeline to execute. Defaults to the pipeline with all stages.
+        :param batch_size: The number of messages processed by each stage at a time
+        :param retry_failed: When True, journaled files which failed are processed again
+        :param max_workers: The number of processes. Defaults to 1, which processes files in batches within the current
+        process. Pipelines are sent to worker processes, so custom pipelines must be picklable.
+        :param large_file_size: The size, in bytes, at which files are processed as large files. None disables large
+        file processing.
+        :param large_file_pipeline: The pipeline executed for large files. Defaults to the pipeline returned by
+        get_large_file_pipeline.
+        :param memory_budget: The estimated memory, in bytes, available to files processed concurrently. Defaults to
+        None, which does not limit concurrent files.
+        :param message_timeout: The wall clock time limit per file, in seconds. A worker which exceeds the limit is
+        killed and replaced, and the file's result is an EdiTimeoutException.
+        :param cpu_timeout: The CPU time limit per file, in seconds, rounded up to whole seconds. A worker which
+        exceeds the limit is terminated and replaced, and the file's result is an EdiTimeoutException. Not available on
+        Windows.
+        :param max_messages_per_worker: The number of files a worker process handles before it is replaced
+        :param max_worker_rss: The resident memory, in bytes, above which a worker process is replaced
         """
-        pass
+        self.file_paths = file_paths
+        self.journal_path = journal_path
+        self._pipeline = pipeline
+        self.pipeline = pipeline or get_default_pipeline()
+        self.batch_size = batch_size
+        self.retry_failed = retry_failed
+        self.max_workers = max_workers
+        self.large_file_size = large_file_size
+        self._large_file_pipeline = large_file_pipeline
+        self.large_file_pipeline = large_file_pipeline or get_large_file_pipeline()
+        self.memory_budget = memory_budget
+        self.message_timeout = message_timeout
+        self.cpu_timeout = cpu_timeout
+        self.max_messages_per_worker = max_messages_per_worker
+        self.max_worker_rss = max_worker_rss
+        self.processed_count = 0
+        self.skipped_count = 0
+        # step times and sampled memory, aggregated across the processed messages
+        self.metrics = EdiProcessingMetrics()
+
+    def _is_large(self, size: int) -> bool:
+        """Returns True if a file of the given size is processed as a large file"""
+        return self.large_file_size is not None and 0 < self.large_file_size <= size
 
-    def _validate(self):
+    def _inspect(self, file_path: str, size: int) -> Tuple[int, bool, float]:
         """
-        Validates the input message and populates the data_model instance attribute.
+        Plans the processing of a file from its decompressed message size.
+        :param file_path: The path to the EDI file
+        :param size: The file size
+        :returns: tuple of (estimated message size, True if the file is a large file, estimated peak memory use)
         """
-        with Timer() as t:
-            edi_message_format = self.meta_data.ediMessageFormat
+        message_size, is_streamed = _inspect_file(file_path, size)
+        is_large = self._is_large(message_size)
+        if is_large and is_streamed:
+            return message_size, is_large, size * LARGE_FILE_MEMORY_FACTOR
+        return message_size, is_large, message_size * MEMORY_FACTOR
 
-            try:
-                if edi_message_format == EdiMessageFormat.FHIR:
-                    self.data_model = load_fhir_json(self.input_message)
-                elif edi_message_format == EdiMessageFormat.HL7:
-                    self.data_model = load_hl7(self.input_message)
-                elif edi_message_format == EdiMessageFormat.X12:
-                    self.data_model = load_x12(self.input_message)
-                elif edi_message_format == EdiMessageFormat.DICOM:
-                    self.data_model = load_dicom(self.input_message)
-            except Exception as ex:
-                msg = f"Exception occurred validating {self.meta_data.baseMessageFormat} {edi_message_format}"
-                raise EdiDataValidationException(msg) from ex
+    def _stat(
+        self, file_path: str, journal: Optional[BatchJournal]
+    ) -> Tuple[bool, Union[os.stat_result, OSError]]:
+        """
+        Stats a file and checks the journal.
+        :returns: tuple of (True if the file is skipped, the file's stat result or the OSError raised)
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError as ex:
+            return False, ex
 
-        self.metrics.validateTime = t.elapsed_time
+        if journal and journal.is_processed(
+            file_path, stat.st_size, stat.st_mtime_ns, self.retry_failed
+        ):
+            self.skipped_count += 1
+            return True, stat
+        return False, stat
 
-    def _translate(self):
+    def _record(
+        self,
+        journal: Optional[BatchJournal],
+        file_path: str,
+        stat: Union[os.stat_result, OSError],
+        checksum: Optional[str],
+        results: List[Union[EdiResult, Exception]],
+    ) -> None:
         """
-        Translates the input message to a different, supported format.
+        Counts a processed file, adds its messages' metrics to the batch metrics and records it in the journal. A file
+        fails if any of its messages failed.
         """
-        pass
+        self.processed_count += 1
+        for result in results:
+            if isinstance(result, EdiResult) and result.metrics is not None:
+                self.metrics.add(result.metrics)
+        if journal and not isinstance(stat, OSError):
+            journal.record(
+                file_path,
+                stat.st_size,
+                stat.st_mtime_ns,
+                checksum,
+                JournalOutcome.FAILURE
+                if any(isinstance(r, Exception) for r in results)
+                else JournalOutcome.SUCCESS,
+            )
 
-    def _create_edi_result(self) -> EdiResult:
+    def _process_batch(
+        self,
+        file_paths: List[str],
+        journal: Optional[BatchJournal],
+    ) -> List[Tuple[str, Union[EdiResult, Exception]]]:
         """
-        Creates an EdiResult
+        Processes a batch of files within the current process, skipping journaled files.
+        Pending messages are run through the pipeline whenever they reach BATCH_BUFFER_SIZE bytes, so the messages of
+        compressed files and archives are released as they are processed.
+        :returns: list of (message path, EdiResult or exception) tuples in input order
         """
-        result_data = {
-            "metadata": self.meta_data.dict() if self.meta_data else None,
-            "metrics": self.metrics.dict(),
-        }
+        # message paths and results, in input order
+        message_paths: List[str] = []
+        results: List[Optional[Union[EdiResult, Exception]]] = []
+        # file checksums of processed messages, by result index
+        checksums: Dict[int, Optional[str]] = {}
+        # workflows which have not been processed, by result index
+        workflows: Dict[int, EdiWorkflow] = {}
+        pending_size = 0
+        # processed files, with the range of their results and their checksum if it is already known
+        processed_files: List[
+            Tuple[str, Union[os.stat_result, OSError], int, int, Optional[str]]
+        ] = []
 
-        return EdiResult(**result_data)
+        def run_pending() -> None:
+            """Processes the pending workflows, keeping only their results and checksums"""
+            exceptions = self.pipeline.run_batch(list(workflows.values()))
+            for index, exception in zip(workflows.keys(), exceptions):
+                results[index] = exception or workflows[index]._create_edi_result()
+                checksums[index] = _file_checksum(workflows[index])
+            workflows.clear()
 
-    def run(self, enrich=True, validate=True, translate=True):
-        """
-        Runs an EDI workflow process.
+        for file_path in file_paths:
+            is_skipped, stat = self._stat(file_path, journal)
+            if is_skipped:
+                continue
 
-        :param enrich: Indicates if the enrich step is executed. Defaults to True.
-        :param validate: Indicates if the validation step is executed. Defaults to True.
-        :param translate: Indicates if the translate step is executed. Defaults to True.
+            start = len(results)
+            checksum = None
+            if isinstance(stat, OSError):
+                message_paths.append(file_path)
+                results.append(stat)
+            elif self._inspect(file_path, stat.st_size)[1]:
+                checksum, file_results = _process_file(
+                    file_path, self.large_file_pipeline, memory_map=True
+                )
+                for message_path, result in file_results:
+                    message_paths.append(message_path)
+                    results.append(result)
+            else:
+                try:
+                    for message_path, workflow in load_workflows_from_file(file_path):
+                        workflows[len(results)] = workflow
+                        message_paths.append(message_path)
+                        results.append(None)
+                        pending_size += len(workflow.input_message)
+                        if pending_size >= BATCH_BUFFER_SIZE:
+                            run_pending()
+                            pending_size = 0
+                except (OSError, EdiDataValidationException) as ex:
+                    message_paths.append(file_path)
+                    results.append(ex)
+
+            processed_files.append((file_path, stat, start, len(results), checksum))
+
+        run_pending()
+        for file_path, stat, start, end, checksum in processed_files:
+            for index in range(start, end):
+                checksum = checksums.get(index) or checksum
+            self._record(journal, file_path, stat, checksum, results[start:end])
+
+        return list(zip(message_paths, results))
+
+    def _run_parallel(
+        self, journal: Optional[BatchJournal]
+    ) -> Iterator[Tuple[str, Union[EdiResult, Exception]]]:
+        """
+        Processes files with a WorkerPool, scheduling the largest files first within the memory budget.
+        :returns: An iterator containing (message path, EdiResult or the exception raised) in completion order
         """
+        # (message size, file path, stat, True if the file is large, estimated memory) for each pending file
+        pending: List[Tuple[int, str, os.stat_result, bool, float]] = []
+        for file_path in self.file_paths:
+            is_skipped, stat = self._stat(file_path, journal)
+            if is_skipped:
+                continue
+            if isinstance(stat, OSError):
+                self._record(journal, file_path, stat, None, [stat])
+                yield file_path, stat
+            else:
+                message_size, is_large, memory = self._inspect(file_path, stat.st_size)
+                pending.append((message_size, file_path, stat, is_large, memory))
+
+        # longest processing time first, approximating processing time by message size
+        pending.sort(key=lambda p: p[0], reverse=True)
+
+        in_progress: Dict[int, Tuple[str, os.stat_result, float]] = {}
+        memory_in_use = 0.0
+        task_id = 0
+
+        with WorkerPool(
+            self.max_workers,
+            initializer=_init_batch_worker,
+            initargs=(self._pipeline, self._large_file_pipeline),
+            message_timeout=self.message_timeout,
+            cpu_timeout=self.cpu_timeout,
+            max_messages_per_worker=self.max_messages_per_worker,
+            max_worker_rss=self.max_worker_rss,
+        ) as pool:
+            while pending or in_progress:
+                # starts the largest pending files which fit within the idle workers and memory budget
+                index = 0
+                while index < len(pending) and pool.idle_count:
+                    _, file_path, stat, is_large, memory = pending[index]
+                    if (
+                        in_progress
+                        and self.memory_budget is not None
+                        and memory_in_use + memory > self.memory_budget
+                    ):
+                        index += 1
+                        continue
+
+                    pending.pop(index)
+                    task_id += 1
+                    pool.submit(task_id, _process_batch_file, file_path, is_large)
+                    in_progress[task_id] = (file_path, stat, memory)
+                    memory_in_use += memory
+
+                for completed_id, task_result in pool.wait():
+                    file_path, stat, memory = in_progress.pop(completed_id)
+                    memory_in_use -= memory
+                    if isinstance(task_result, Exception):
+                        checksum, file_results = None, [(file_path, task_result)]
+                    else:
+                        checksum, file_results = task_result
 
+                    self._record(
+                        journal, file_path, stat, checksum, [r for _, r in file_results]
+                    )
+                    yield from file_results
+
+    def run(self) -> Iterator[Tuple[str, Union[EdiResult, Exception]]]:
+        """
+        Runs the batch.
+        :returns: An iterator containing (message path, EdiResult or the exception raised) for each processed message.
+        The message path is the file path, or "<file path>!<member name>" for archive members. Results are returned in
+        input order when files are processed within the current process, otherwise in completion order. Skipped files
+        are not included.
+        """
+        journal = BatchJournal(self.journal_path) if self.journal_path else None
         try:
-            self._analyze()
-        except EdiDataValidationException:
-            raise
-        except Exception as ex:
-            raise EdiAnalysisException(
-                f"An EDI Analyze Exception Occurred: {ex}"
-            ) from ex
+            if self.max_workers > 1 or self.message_timeout or self.cpu_timeout:
+                yield from self._run_parallel(journal)
+                return
+
+            warm_up_fhir_models()
+            file_iterator = iter(self.file_paths)
+            while True:
+                file_paths = list(islice(file_iterator, self.batch_size))
+                if not file_paths:
+                    return
+                yield from self._process_batch(file_paths, journal)
+        finally:
+            if journal:
+                journal.close()
+
+
+def _scan_dicom_instance(
+    file_path: str,
+) -> Tuple[str, Optional[Tuple[str, str, Optional[str]]], Optional[str]]:
+    """
+    Reads the header for a single DICOM instance.
+    Runs within a worker process, so the return value is kept small and picklable.
+    :param file_path: The path to the DICOM instance
+    :returns: tuple of (file path, (study uid, series uid, modality), error)
+    """
+    try:
+        dataset = load_dicom_header(file_path)
+        uids = (
+            str(dataset.StudyInstanceUID),
+            str(dataset.SeriesInstanceUID),
+            dataset.get("Modality"),
+        )
+        return file_path, uids, None
+    except Exception as ex:
+        return file_path, None, f"{type(ex).__name__}: {ex}"
+
+
+class DicomStudyWorkflow:
+    """
+    Processes a DICOM study stored as a directory of instances or a DICOMDIR.
+
+    Instance headers are scanned in parallel, without reading pixel data, and grouped by study and series UID.
+    Instances which cannot be read are returned as failures rather than failing the entire study.
+    """
+
+    def __init__(
+        self,
+        study_path: str,
+        max_workers: Optional[int] = None,
+    ):
+        """
+        Configures the DicomStudyWorkflow instance.
+        :param study_path: The path to the study directory or DICOMDIR file
+        :param max_workers: The number of scanning processes. Defaults to the number of processors.
+        A value of 1 scans instances within the current process.
+        """
+        self.study_path = study_path
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.instance_paths: List[str] = []
+        self.metrics: EdiProcessingMetrics = EdiProcessingMetrics(
+            analyzeTime=0.0, enrichTime=0.0, validateTime=0.0, translateTime=0.0
+        )
+
+    def _scan(self) -> List[Tuple]:
+        """
+        Scans the study's instance headers, using a process pool when more than one worker is configured.
+        """
+        if self.max_workers == 1 or len(self.instance_paths) <= 1:
+            return [_scan_dicom_instance(p) for p in self.instance_paths]
 
-        if enrich:
-            self._enrich()
+        # larger chunks amortize IPC overhead across studies with thousands of instances
+        chunk_size = max(1, len(self.instance_paths) // (self.max_workers * 4))
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(
+                executor.map(
+                    _scan_dicom_instance, self.instance_paths, chunksize=chunk_size
+                )
+            )
 
-        if validate:
+    def run(self) -> EdiStudyResult:
+        """
+        Runs the study workflow, returning an aggregate result.
+        """
+        studies: Dict[str, Dict[str, DicomSeriesSummary]] = {}
+        failures: List[EdiInstanceFailure] = []
+
+        with Timer() as t:
             try:
-                self._validate()
-            except EdiDataValidationException:
-                raise
+                self.instance_paths = list_dicom_instances(self.study_path)
             except Exception as ex:
-                raise EdiValidationException(
-                    f"An EDI Validation Exception Occurred: {ex}"
+                raise EdiAnalysisException(
+                    f"Unable to list DICOM instances for {self.study_path}: {ex}"
                 ) from ex
 
-        if translate:
-            self._translate()
+            for file_path, uids, error in self._scan():
+                if error:
+                    failures.append(EdiInstanceFailure(path=file_path, error=error))
+                    continue
 
-        return self._create_edi_result()
+                study_uid, series_uid, modality = uids
+                series = studies.setdefault(study_uid, {})
+                if series_uid not in series:
+                    series[series_uid] = DicomSeriesSummary(
+                        seriesInstanceUid=series_uid, modality=modality
+                    )
+                series[series_uid].instanceCount += 1
+
+        self.metrics.analyzeTime = t.elapsed_time
+
+        study_summaries = []
+        for study_uid in sorted(studies):
+            series_summaries = [
+                studies[study_uid][s] for s in sorted(studies[study_uid])
+            ]
+            study_summaries.append(
+                DicomStudySummary(
+                    studyInstanceUid=study_uid,
+                    instanceCount=sum(s.instanceCount for s in series_summaries),
+                    series=series_summaries,
+                )
+            )
+
+        return EdiStudyResult(
+            studies=study_summaries,
+            failures=failures,
+            metrics=EdiProcessingMetrics(**self.metrics.dict()),
+        )
 
 
-def load_workflow_from_file(file_path: str) -> EdiWorkflow:
+def load_study_workflow(
+    study_path: str, max_workers: Optional[int] = None
+) -> DicomStudyWorkflow:
     """
-    Loads an EDI workflow from an EDI file
-    :param file_path: The path to the EDI file
-    :returns: EdiWorkflow
+    Loads a DICOM study workflow from a study directory or DICOMDIR file
+    :param study_path: The path to the study directory or DICOMDIR file
+    :param max_workers: The number of scanning processes
+    :returns: DicomStudyWorkflow
     """
-    with open(file_path, "rb") as f:
-        contents: bytes = f.read()
-
-    try:
-        buffer = contents[0:1024]
-        buffer.decode("utf-8")
-        is_unicode = True
-    except UnicodeDecodeError:
-        is_unicode = False
-
-    input_message = contents.decode("utf-8") if is_unicode else contents
-    return EdiWorkflow(input_message)
+    return DicomStudyWorkflow(study_path, max_workers=max_workers)
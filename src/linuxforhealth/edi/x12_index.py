@@ -0,0 +1,454 @@
+"""
+x12_index.py
+
+Indexes the segment offsets of large X12 files, providing random access to individual transactions and claims.
+
+The index is built with a single regular expression scan of the memory mapped file. Only the envelope segments (ISA,
+GS, ST, SE, GE, IEA) and the hierarchical level (HL) and claim (CLM) segments which start loops are matched, and
+their offsets are stored in arrays, so other segments are never split or copied into Python objects.
+
+Each transaction's offsets and its segment, hierarchical level and claim counts are saved in a binary sidecar index,
+"<file path>.x12idx", which is reused while the X12 file's size and modification time are unchanged.
+
+A single transaction is then read through the memory map and wrapped in its interchange and group envelope, so it can
+be analyzed, validated or translated without parsing the rest of the file.
+
+Usage:
+with X12IndexedFile("/data/claims.x12") as indexed_file:
+    for transaction in indexed_file.index.transactions:
+        print(transaction.claim_count)
+    edi_result = indexed_file.create_workflow(42).run()
+"""
+from array import array
+import bisect
+from enum import IntEnum
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+from typing import List, NamedTuple, Optional, Tuple
+
+from .support import EdiMessageBuffer
+from .validation import X12_ISA_LENGTH
+from .workflows import EdiWorkflow
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE_SUFFIX = ".x12idx"
+INDEX_MAGIC = b"LFHX12I1"
+
+# magic, source size, source mtime, element separator, segment terminator, transaction count, segment count
+_INDEX_HEADER = struct.Struct("<8sQQccQQ")
+# interchange, group, transaction start and end offsets, and segment, hierarchical level and claim counts
+_TRANSACTION_RECORD = struct.Struct("<QQQQQII")
+
+
+class X12SegmentKind(IntEnum):
+    """
+    The indexed X12 segments, numbered by their capture group in the index pattern
+    """
+
+    ISA = 1
+    GS = 2
+    ST = 3
+    SE = 4
+    GE = 5
+    IEA = 6
+    HL = 7
+    CLM = 8
+
+
+class X12TransactionEntry(NamedTuple):
+    """
+    The offsets and counts of an indexed transaction.
+    The end offset follows the SE segment terminator.
+    """
+
+    interchange_offset: int
+    group_offset: int
+    start: int
+    end: int
+    segment_count: int
+    hl_count: int
+    claim_count: int
+
+
+def _compile_segment_pattern(element_separator: bytes, segment_terminator: bytes):
+    """
+    Compiles the pattern which matches the start of indexed segments.
+    A segment starts at the beginning of the file or after a segment terminator and optional whitespace.
+    """
+    names = b"|".join(b"(" + k.name.encode() + b")" for k in X12SegmentKind)
+    return re.compile(
+        b"(?:\\A|"
+        + re.escape(segment_terminator)
+        + b")\\s*(?:"
+        + names
+        + b")"
+        + re.escape(element_separator)
+    )
+
+
+def _to_little_endian(values: array) -> bytes:
+    """Returns an array's bytes in little endian order"""
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode: str, data: bytes) -> array:
+    """Returns an array from little endian bytes"""
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+class X12SegmentIndex:
+    """
+    The offsets of an X12 file's transactions, hierarchical levels and claims.
+    """
+
+    def __init__(
+        self,
+        element_separator: bytes,
+        segment_terminator: bytes,
+        transactions: List[X12TransactionEntry],
+        kinds: array,
+        offsets: array,
+        source_size: int,
+        source_mtime_ns: int,
+    ):
+        """
+        :param element_separator: The X12 element separator
+        :param segment_terminator: The X12 segment terminator
+        :param transactions: The indexed transactions, in file order
+        :param kinds: The X12SegmentKind of each indexed HL and CLM segment
+        :param offsets: The offset of each indexed HL and CLM segment
+        :param source_size: The size of the indexed file
+        :param source_mtime_ns: The modification time of the indexed file
+        """
+        self.element_separator = element_separator
+        self.segment_terminator = segment_terminator
+        self.transactions = transactions
+        self.kinds = kinds
+        self.offsets = offsets
+        self.source_size = source_size
+        self.source_mtime_ns = source_mtime_ns
+
+    @classmethod
+    def build(cls, file_path: str) -> "X12SegmentIndex":
+        """
+        Builds the index for an X12 file.
+        :param file_path: The path to the X12 file
+        :returns: X12SegmentIndex
+        :raises: ValueError if the file does not start with an ISA segment, or the envelope segments are out of order
+        """
+        with open(file_path, "rb") as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size < X12_ISA_LENGTH:
+                raise ValueError(f"{file_path} is not an X12 file")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return cls._build(mm, stat)
+
+    @classmethod
+    def _build(cls, mm: mmap.mmap, stat: os.stat_result) -> "X12SegmentIndex":
+        """Builds the index from a memory mapped X12 file"""
+        isa_offset = len(mm[:64]) - len(mm[:64].lstrip())
+        if mm[isa_offset : isa_offset + 3] != b"ISA":
+            raise ValueError("X12 file does not start with an ISA segment")
+        element_separator = mm[isa_offset + 3 : isa_offset + 4]
+        segment_terminator = mm[
+            isa_offset + X12_ISA_LENGTH - 1 : isa_offset + X12_ISA_LENGTH
+        ]
+        pattern = _compile_segment_pattern(element_separator, segment_terminator)
+
+        transactions = []
+        kinds = array("B")
+        offsets = array("Q")
+        interchange_offset = group_offset = start = None
+        hl_count = claim_count = 0
+
+        for match in pattern.finditer(mm):
+            kind = match.lastindex
+            offset = match.start(kind)
+
+            if kind == X12SegmentKind.HL or kind == X12SegmentKind.CLM:
+                if start is None:
+                    raise ValueError(
+                        f"Segment at offset {offset} is not in a transaction"
+                    )
+                kinds.append(kind)
+                offsets.append(offset)
+                if kind == X12SegmentKind.HL:
+                    hl_count += 1
+                else:
+                    claim_count += 1
+            elif kind == X12SegmentKind.ISA:
+                interchange_offset = offset
+            elif kind == X12SegmentKind.GS:
+                if interchange_offset is None:
+                    raise ValueError(
+                        f"GS segment at offset {offset} is not in an interchange"
+                    )
+                group_offset = offset
+            elif kind == X12SegmentKind.ST:
+                if group_offset is None:
+                    raise ValueError(f"ST segment at offset {offset} is not in a group")
+                start = offset
+                hl_count = claim_count = 0
+            elif kind == X12SegmentKind.SE:
+                if start is None:
+                    raise ValueError(f"SE segment at offset {offset} has no ST segment")
+                end = mm.find(segment_terminator, offset)
+                end = len(mm) if end == -1 else end + 1
+                segment_count = mm[offset:end].split(element_separator)[1]
+                transactions.append(
+                    X12TransactionEntry(
+                        interchange_offset,
+                        group_offset,
+                        start,
+                        end,
+                        int(segment_count) if segment_count.isdigit() else 0,
+                        hl_count,
+                        claim_count,
+                    )
+                )
+                start = None
+            elif kind == X12SegmentKind.GE:
+                group_offset = None
+            elif kind == X12SegmentKind.IEA:
+                interchange_offset = None
+
+        return cls(
+            element_separator,
+            segment_terminator,
+            transactions,
+            kinds,
+            offsets,
+            stat.st_size,
+            stat.st_mtime_ns,
+        )
+
+    def is_current(self, file_path: str) -> bool:
+        """Returns True if the indexed file's size and modification time are unchanged"""
+        stat = os.stat(file_path)
+        return (
+            stat.st_size == self.source_size
+            and stat.st_mtime_ns == self.source_mtime_ns
+        )
+
+    def claim_offsets(self, transaction_index: int) -> List[int]:
+        """
+        Returns the offsets of a transaction's CLM segments.
+        :param transaction_index: The transaction's position in the file
+        """
+        start, end = self._entry_range(transaction_index)
+        return [
+            self.offsets[i]
+            for i in range(start, end)
+            if self.kinds[i] == X12SegmentKind.CLM
+        ]
+
+    def _entry_range(self, transaction_index: int) -> Tuple[int, int]:
+        """Returns the range of a transaction's HL and CLM entries. Offsets are in file order, so are searched."""
+        transaction = self.transactions[transaction_index]
+        return (
+            bisect.bisect_right(self.offsets, transaction.start),
+            bisect.bisect_left(self.offsets, transaction.end),
+        )
+
+    def save(self, index_path: str) -> None:
+        """
+        Writes the index to a file, replacing the file atomically.
+        :param index_path: The index file path
+        """
+        temp_path = f"{index_path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(
+                _INDEX_HEADER.pack(
+                    INDEX_MAGIC,
+                    self.source_size,
+                    self.source_mtime_ns,
+                    self.element_separator,
+                    self.segment_terminator,
+                    len(self.transactions),
+                    len(self.kinds),
+                )
+            )
+            for transaction in self.transactions:
+                f.write(_TRANSACTION_RECORD.pack(*transaction))
+            f.write(self.kinds.tobytes())
+            f.write(_to_little_endian(self.offsets))
+        os.replace(temp_path, index_path)
+
+    @classmethod
+    def load(cls, index_path: str) -> "X12SegmentIndex":
+        """
+        Reads an index file.
+        :param index_path: The index file path
+        :returns: X12SegmentIndex
+        :raises: ValueError if the file is not a valid index
+        """
+        with open(index_path, "rb") as f:
+            data = f.read()
+
+        if len(data) < _INDEX_HEADER.size:
+            raise ValueError(f"{index_path} is not an X12 segment index")
+        (
+            magic,
+            source_size,
+            source_mtime_ns,
+            element_separator,
+            segment_terminator,
+            transaction_count,
+            segment_count,
+        ) = _INDEX_HEADER.unpack_from(data)
+
+        kinds_offset = _INDEX_HEADER.size + transaction_count * _TRANSACTION_RECORD.size
+        offsets_offset = kinds_offset + segment_count
+        if magic != INDEX_MAGIC or len(data) != offsets_offset + segment_count * 8:
+            raise ValueError(f"{index_path} is not an X12 segment index")
+
+        transactions = [
+            X12TransactionEntry(*t)
+            for t in _TRANSACTION_RECORD.iter_unpack(
+                data[_INDEX_HEADER.size : kinds_offset]
+            )
+        ]
+        kinds = array("B", data[kinds_offset:offsets_offset])
+        offsets = _from_little_endian("Q", data[offsets_offset:])
+        return cls(
+            element_separator,
+            segment_terminator,
+            transactions,
+            kinds,
+            offsets,
+            source_size,
+            source_mtime_ns,
+        )
+
+
+def load_x12_index(file_path: str, rebuild: bool = False) -> X12SegmentIndex:
+    """
+    Loads an X12 file's sidecar index, building and saving the index if it does not exist or is out of date.
+    The index is still returned if it cannot be saved.
+    :param file_path: The path to the X12 file
+    :param rebuild: When True, the index is rebuilt
+    :returns: X12SegmentIndex
+    """
+    index_path = file_path + INDEX_FILE_SUFFIX
+    if not rebuild and os.path.exists(index_path):
+        try:
+            index = X12SegmentIndex.load(index_path)
+            if index.is_current(file_path):
+                return index
+        except (OSError, ValueError) as ex:
+            logger.warning(f"Rebuilding X12 segment index {index_path}: {ex}")
+
+    index = X12SegmentIndex.build(file_path)
+    try:
+        index.save(index_path)
+    except OSError as ex:
+        logger.warning(f"Unable to save X12 segment index {index_path}: {ex}")
+    return index
+
+
+class X12IndexedFile:
+    """
+    Reads transactions and claims from a memory mapped X12 file using its segment index.
+    """
+
+    def __init__(self, file_path: str, index: Optional[X12SegmentIndex] = None):
+        """
+        :param file_path: The path to the X12 file
+        :param index: The file's index. Defaults to the sidecar index, which is built if required.
+        """
+        self.file_path = file_path
+        self.index = index or load_x12_index(file_path)
+        self._file = open(file_path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def transaction_count(self) -> int:
+        return len(self.index.transactions)
+
+    def _read_segment(self, offset: int) -> bytes:
+        """Returns the segment at an offset, including its terminator"""
+        end = self._mm.find(self.index.segment_terminator, offset)
+        return self._mm[offset : len(self._mm) if end == -1 else end + 1]
+
+    def read_transaction(self, transaction_index: int) -> bytes:
+        """
+        Reads a transaction, wrapped in its interchange and group headers and trailers.
+        The GE and IEA trailers are recreated with a count of 1.
+        :param transaction_index: The transaction's position in the file
+        :returns: The transaction as a standalone X12 interchange
+        """
+        transaction = self.index.transactions[transaction_index]
+        separator = self.index.element_separator
+        terminator = self.index.segment_terminator
+
+        isa_segment = self._read_segment(transaction.interchange_offset)
+        gs_segment = self._read_segment(transaction.group_offset)
+        group_control_number = gs_segment.rstrip(terminator).split(separator)[6]
+        interchange_control_number = isa_segment.split(separator)[13]
+
+        return b"".join(
+            (
+                isa_segment,
+                gs_segment,
+                self._mm[transaction.start : transaction.end],
+                separator.join((b"GE", b"1", group_control_number)),
+                terminator,
+                separator.join((b"IEA", b"1", interchange_control_number)),
+                terminator,
+            )
+        )
+
+    def read_claim(self, transaction_index: int, claim_index: int) -> bytes:
+        """
+        Reads a claim loop's segments: the CLM segment up to the next HL or CLM segment, or the end of the
+        transaction.
+        :param transaction_index: The transaction's position in the file
+        :param claim_index: The claim's position within the transaction
+        :returns: The claim loop's segments
+        """
+        transaction = self.index.transactions[transaction_index]
+        claim_offset = self.index.claim_offsets(transaction_index)[claim_index]
+
+        offsets = self.index.offsets
+        position = bisect.bisect_right(offsets, claim_offset)
+        if position < len(offsets) and offsets[position] < transaction.end:
+            end = offsets[position]
+        else:
+            # the claim is the transaction's last loop, which ends at the SE segment
+            end = self._mm.rfind(
+                self.index.segment_terminator, claim_offset, transaction.end - 1
+            )
+            end = end + 1 if end != -1 else transaction.end
+        return self._mm[claim_offset:end].strip()
+
+    def create_workflow(self, transaction_index: int) -> EdiWorkflow:
+        """
+        Creates a workflow for a single transaction.
+        :param transaction_index: The transaction's position in the file
+        :returns: EdiWorkflow
+        """
+        return EdiWorkflow(
+            EdiMessageBuffer(self.read_transaction(transaction_index), is_binary=False)
+        )
+
+    def close(self) -> None:
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,691 @@
+"""
+x12_translation.py
+
+Translates X12 5010 transaction sets to FHIR R4 resources:
+* 270 eligibility inquiries to CoverageEligibilityRequest
+* 271 eligibility responses to CoverageEligibilityResponse
+* 837 professional claims to Claim
+
+Supporting Patient, Organization, Practitioner and Coverage resources are generated for the parties referenced within
+a transaction. Resources reference each other using "urn:uuid" references, matching the fullUrls used within Bundles.
+
+Translation is incremental. Transaction sets are parsed one at a time from the X12 input, and resources are yielded as
+each loop is translated, so memory use is bounded by the largest transaction set rather than by the size of the input.
+
+Usage:
+translator = get_x12_translator()
+with open("claims.ndjson", "w") as f, FhirNdjsonWriter(f) as writer:
+    translator.write(x12_file_path, writer)
+"""
+import datetime
+from decimal import Decimal
+from functools import lru_cache
+import logging
+import uuid
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from linuxforhealth.x12.io import X12SegmentGroup
+
+from .support import iter_x12
+from .terminology import X12_ICD10_QUALIFIERS, X12_PROCEDURE_QUALIFIER
+from .translation import HL7_CODING_SYSTEM_URIS
+
+logger = logging.getLogger(__name__)
+
+X12_CURRENCY = "USD"
+
+NPI_SYSTEM = "http://hl7.org/fhir/sid/us-npi"
+SERVICE_TYPE_SYSTEM = "https://x12.org/codes/service-type-codes"
+ELIGIBILITY_BENEFIT_SYSTEM = "https://x12.org/codes/eligibility-benefit-information"
+PLACE_OF_SERVICE_SYSTEM = "https://www.cms.gov/Medicare/Coding/place-of-service-codes/Place_of_Service_Code_Set"
+IDENTIFIER_TYPE_SYSTEM = "http://terminology.hl7.org/CodeSystem/v2-0203"
+BENEFIT_NETWORK_SYSTEM = "http://terminology.hl7.org/CodeSystem/benefit-network"
+CLAIM_TYPE_SYSTEM = "http://terminology.hl7.org/CodeSystem/claim-type"
+PROCESS_PRIORITY_SYSTEM = "http://terminology.hl7.org/CodeSystem/processpriority"
+NULL_FLAVOR_SYSTEM = "http://terminology.hl7.org/CodeSystem/v3-NullFlavor"
+
+# X12 HI segment qualifiers for ICD-9 diagnosis codes
+X12_ICD9_QUALIFIERS = frozenset({"BK", "BF", "BJ", "PR"})
+
+# X12 DMG gender codes
+X12_GENDERS = {"F": "female", "M": "male", "U": "unknown"}
+
+# EB01 eligibility or benefit codes which indicate active and inactive coverage
+X12_ACTIVE_COVERAGE_CODES = frozenset({"1", "2", "3", "4", "5"})
+X12_INACTIVE_COVERAGE_CODES = frozenset({"6", "7", "8"})
+
+# DTP qualifiers for eligibility, plan and service dates
+X12_ELIGIBILITY_DATE_QUALIFIERS = frozenset({"291", "307", "346", "356"})
+X12_SERVICE_DATE_QUALIFIER = "472"
+
+Resource = Dict[str, Any]
+
+
+def _as_list(value: Any) -> List[Any]:
+    """Returns an optional loop or segment, or list of loops or segments, as a list"""
+    if value is None:
+        return []
+    elif isinstance(value, list):
+        return value
+    return [value]
+
+
+def _components(segment: Any, value: Any) -> List[str]:
+    """
+    Returns the components of a composite element.
+    Composite elements are parsed as lists, or as strings if the X12 model does not define the element as a composite.
+    """
+    if value is None:
+        return []
+    elif isinstance(value, list):
+        return [str(v) for v in value]
+
+    delimiters = getattr(segment, "delimiters", None)
+    separator = delimiters.component_separator if delimiters else ":"
+    return str(value).split(separator)
+
+
+def _date(value: Any) -> Optional[str]:
+    """Converts an X12 date value to a FHIR date"""
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.strftime("%Y-%m-%d")
+    elif isinstance(value, str) and len(value) >= 8 and value[0:8].isdigit():
+        return f"{value[0:4]}-{value[4:6]}-{value[6:8]}"
+    return None
+
+
+def _money(value: Any) -> Optional[Dict]:
+    """Converts an X12 amount to a FHIR Money value"""
+    if value is None:
+        return None
+    return {"value": float(Decimal(str(value))), "currency": X12_CURRENCY}
+
+
+def _codeable_concept(system: str, code: Optional[str]) -> Optional[Dict]:
+    """Returns a single coding CodeableConcept, or None if the code is empty"""
+    if not code:
+        return None
+    return {"coding": [{"system": system, "code": code}]}
+
+
+def _prune(resource: Dict) -> Dict:
+    """Removes empty values from a resource's top level elements"""
+    return {k: v for k, v in resource.items() if v not in (None, [], {}, "")}
+
+
+def _reference(resource: Optional[Resource]) -> Optional[Dict]:
+    """Returns a reference to a resource, or None if the resource is not available"""
+    if resource is None:
+        return None
+    return {"reference": f"urn:uuid:{resource['id']}"}
+
+
+def _create_resource(resource_type: str, **elements) -> Resource:
+    """Creates a resource with a generated id, omitting empty elements"""
+    return _prune({"resourceType": resource_type, "id": str(uuid.uuid4()), **elements})
+
+
+def _create_party(
+    nm1_segment: Any, dmg_segment: Any = None, is_patient: bool = False
+) -> Optional[Resource]:
+    """
+    Creates a resource for an NM1 entity.
+    Persons (NM1-02 "1") are returned as Patients within subscriber, dependent and patient loops, and as Practitioners
+    otherwise. Non-persons are returned as Organizations.
+    :param nm1_segment: The NM1 segment
+    :param dmg_segment: The loop's DMG segment. DMG is situational, and is only translated for patients.
+    :param is_patient: True if the NM1 segment is within a subscriber, dependent or patient loop
+    """
+    if nm1_segment is None:
+        return None
+
+    identifier = None
+    if nm1_segment.identification_code:
+        if nm1_segment.identification_code_qualifier == "XX":
+            identifier = {
+                "system": NPI_SYSTEM,
+                "value": nm1_segment.identification_code,
+            }
+        elif nm1_segment.identification_code_qualifier == "MI":
+            identifier = {
+                "type": _codeable_concept(IDENTIFIER_TYPE_SYSTEM, "MB"),
+                "value": nm1_segment.identification_code,
+            }
+        else:
+            identifier = {"value": nm1_segment.identification_code}
+
+    if nm1_segment.entity_type_qualifier != "1":
+        return _create_resource(
+            "Organization",
+            identifier=[identifier] if identifier else None,
+            name=nm1_segment.name_last_or_organization_name,
+        )
+
+    name = _prune(
+        {
+            "family": nm1_segment.name_last_or_organization_name,
+            "given": [
+                n for n in (nm1_segment.name_first, nm1_segment.name_middle) if n
+            ],
+            "suffix": [nm1_segment.name_suffix] if nm1_segment.name_suffix else None,
+        }
+    )
+
+    if not is_patient:
+        return _create_resource(
+            "Practitioner",
+            identifier=[identifier] if identifier else None,
+            name=[name] if name else None,
+        )
+
+    return _create_resource(
+        "Patient",
+        identifier=[identifier] if identifier else None,
+        name=[name] if name else None,
+        gender=X12_GENDERS.get(dmg_segment.gender_code) if dmg_segment else None,
+        birthDate=_date(dmg_segment.date_time_period) if dmg_segment else None,
+    )
+
+
+def _trace_identifiers(trn_segments: Any) -> List[Dict]:
+    """Returns FHIR identifiers for TRN trace numbers"""
+    return [
+        _prune(
+            {
+                "system": f"urn:x12:trn:{t.originating_company_identifier}"
+                if t.originating_company_identifier
+                else None,
+                "value": t.reference_identification_1,
+            }
+        )
+        for t in _as_list(trn_segments)
+        if t.reference_identification_1
+    ]
+
+
+def _find_date(dtp_segments: Any, qualifiers: Iterable[str]) -> Optional[str]:
+    """Returns the first DTP date matching a qualifier"""
+    for dtp_segment in _as_list(dtp_segments):
+        if dtp_segment.date_time_qualifier in qualifiers:
+            return _date(dtp_segment.date_time_period)
+    return None
+
+
+def _creation_date(model: X12SegmentGroup) -> Optional[str]:
+    """Returns the BHT transaction set creation date"""
+    return _date(model.header.bht_segment.transaction_set_creation_date)
+
+
+def _eligibility_members(
+    information_source_loop: Any,
+) -> Iterator[Tuple[Any, Any, Any]]:
+    """
+    Yields the receiver, subscriber and dependent loops within a 270/271 information source (2000A) loop.
+    Dependents are yielded as (receiver, dependent 2000D, dependent 2100D) and subscribers as (receiver, subscriber
+    2000C, subscriber 2100C).
+    """
+    for receiver_loop in _as_list(information_source_loop.loop_2000b):
+        for subscriber_loop in _as_list(receiver_loop.loop_2000c):
+            yield receiver_loop, subscriber_loop, subscriber_loop.loop_2100c
+            for dependent_loop in _as_list(subscriber_loop.loop_2000d):
+                yield receiver_loop, dependent_loop, dependent_loop.loop_2100d
+
+
+def _translate_eligibility_request(model: X12SegmentGroup) -> Iterator[Resource]:
+    """Translates a 270 eligibility inquiry to CoverageEligibilityRequests"""
+    created = _creation_date(model)
+
+    for information_source_loop in _as_list(model.loop_2000a):
+        insurer = _create_party(information_source_loop.loop_2100a.nm1_segment)
+        yield insurer
+
+        providers: Dict[int, Resource] = {}
+        for receiver_loop, member_loop, name_loop in _eligibility_members(
+            information_source_loop
+        ):
+            provider = providers.get(id(receiver_loop))
+            if provider is None:
+                provider = _create_party(receiver_loop.loop_2100b.nm1_segment)
+                providers[id(receiver_loop)] = provider
+                yield provider
+
+            patient = _create_party(
+                name_loop.nm1_segment, name_loop.dmg_segment, is_patient=True
+            )
+            yield patient
+
+            inquiry_loops = _as_list(
+                getattr(name_loop, "loop_2110c", None)
+                or getattr(name_loop, "loop_2110d", None)
+            )
+            items = []
+            for inquiry_loop in inquiry_loops:
+                eq_segment = inquiry_loop.eq_segment
+                for service_type in _as_list(eq_segment.service_type_code):
+                    items.append(
+                        {
+                            "category": _codeable_concept(
+                                SERVICE_TYPE_SYSTEM, service_type
+                            )
+                        }
+                    )
+
+            yield _create_resource(
+                "CoverageEligibilityRequest",
+                identifier=_trace_identifiers(member_loop.trn_segment),
+                status="active",
+                purpose=["benefits"],
+                patient=_reference(patient),
+                servicedDate=_find_date(
+                    name_loop.dtp_segment, X12_ELIGIBILITY_DATE_QUALIFIERS
+                ),
+                created=created,
+                provider=_reference(provider),
+                insurer=_reference(insurer),
+                item=items,
+            )
+
+
+def _benefit_items(eb_segment: Any) -> List[Dict]:
+    """Translates an EB segment to CoverageEligibilityResponse insurance items"""
+    benefit = None
+    if eb_segment.benefit_amount is not None:
+        benefit = {"allowedMoney": _money(eb_segment.benefit_amount)}
+    elif eb_segment.benefit_percent is not None:
+        benefit = {"allowedString": f"{eb_segment.benefit_percent}"}
+
+    if benefit is not None:
+        benefit["type"] = _codeable_concept(
+            ELIGIBILITY_BENEFIT_SYSTEM, eb_segment.eligibility_benefit_information
+        )
+
+    network = None
+    if eb_segment.inplan_network_indicator == "Y":
+        network = _codeable_concept(BENEFIT_NETWORK_SYSTEM, "in")
+    elif eb_segment.inplan_network_indicator == "N":
+        network = _codeable_concept(BENEFIT_NETWORK_SYSTEM, "out")
+
+    item = {
+        "network": network,
+        "description": eb_segment.plan_coverage_description,
+        "benefit": [benefit] if benefit else None,
+    }
+    service_types = _as_list(eb_segment.service_type_code) or [None]
+    items = [
+        _prune(
+            {"category": _codeable_concept(SERVICE_TYPE_SYSTEM, service_type), **item}
+        )
+        for service_type in service_types
+    ]
+    return [i for i in items if i]
+
+
+def _translate_eligibility_response(model: X12SegmentGroup) -> Iterator[Resource]:
+    """
+    Translates a 271 eligibility response to CoverageEligibilityResponses.
+    The originating request is referenced by the 270 reference identification (BHT03), which the 271 returns.
+    """
+    created = _creation_date(model)
+    request = {
+        "type": "CoverageEligibilityRequest",
+        "identifier": {
+            "value": model.header.bht_segment.submitter_transactional_identifier
+        },
+    }
+
+    for information_source_loop in _as_list(model.loop_2000a):
+        insurer = _create_party(information_source_loop.loop_2100a.nm1_segment)
+        yield insurer
+
+        requestors: Dict[int, Resource] = {}
+        for receiver_loop, member_loop, name_loop in _eligibility_members(
+            information_source_loop
+        ):
+            requestor = requestors.get(id(receiver_loop))
+            if requestor is None:
+                requestor = _create_party(receiver_loop.loop_2100b.nm1_segment)
+                requestors[id(receiver_loop)] = requestor
+                yield requestor
+
+            patient = _create_party(
+                name_loop.nm1_segment, name_loop.dmg_segment, is_patient=True
+            )
+            yield patient
+
+            benefit_loops = _as_list(
+                getattr(name_loop, "loop_2110c", None)
+                or getattr(name_loop, "loop_2110d", None)
+            )
+            in_force = None
+            items = []
+            for benefit_loop in benefit_loops:
+                eb_segment = benefit_loop.eb_segment
+                if (
+                    eb_segment.eligibility_benefit_information
+                    in X12_ACTIVE_COVERAGE_CODES
+                ):
+                    in_force = True
+                elif (
+                    eb_segment.eligibility_benefit_information
+                    in X12_INACTIVE_COVERAGE_CODES
+                    and in_force is None
+                ):
+                    in_force = False
+                items.extend(_benefit_items(eb_segment))
+
+            coverage = _create_resource(
+                "Coverage",
+                status="active" if in_force is not False else "cancelled",
+                subscriberId=name_loop.nm1_segment.identification_code,
+                beneficiary=_reference(patient),
+                payor=[_reference(insurer)],
+            )
+            yield coverage
+
+            yield _create_resource(
+                "CoverageEligibilityResponse",
+                identifier=_trace_identifiers(member_loop.trn_segment),
+                status="active",
+                purpose=["benefits"],
+                patient=_reference(patient),
+                servicedDate=_find_date(
+                    name_loop.dtp_segment, X12_ELIGIBILITY_DATE_QUALIFIERS
+                ),
+                created=created,
+                requestor=_reference(requestor),
+                request=request,
+                outcome="complete",
+                insurer=_reference(insurer),
+                insurance=[
+                    _prune(
+                        {
+                            "coverage": _reference(coverage),
+                            "inforce": in_force,
+                            "item": items,
+                        }
+                    )
+                ],
+            )
+
+
+def _claim_diagnoses(claim_loop: Any) -> List[Dict]:
+    """Translates 2300 HI segments to Claim diagnoses"""
+    diagnoses = []
+    for hi_segment in _as_list(claim_loop.hi_segment):
+        for field_name in hi_segment.__fields__:
+            if not field_name.startswith("health_care_code_"):
+                continue
+
+            components = _components(hi_segment, getattr(hi_segment, field_name))
+            if len(components) < 2:
+                continue
+
+            qualifier, code = components[0], components[1]
+            if qualifier in X12_ICD10_QUALIFIERS:
+                system = HL7_CODING_SYSTEM_URIS["I10"]
+            elif qualifier in X12_ICD9_QUALIFIERS:
+                system = HL7_CODING_SYSTEM_URIS["I9C"]
+            else:
+                continue
+
+            diagnoses.append(
+                {
+                    "sequence": len(diagnoses) + 1,
+                    "diagnosisCodeableConcept": _codeable_concept(system, code),
+                }
+            )
+    return diagnoses
+
+
+def _claim_item(service_loop: Any, place_of_service: Optional[str]) -> Dict:
+    """Translates a 2400 service line to a Claim item"""
+    sv1_segment = service_loop.sv1_segment
+    procedure = _components(sv1_segment, sv1_segment.product_service_id_qualifier)
+
+    # productOrService is required, so service lines without a procedure code are translated as unknown
+    product_or_service = {
+        "coding": [{"system": NULL_FLAVOR_SYSTEM, "code": "UNK", "display": "unknown"}]
+    }
+    if len(procedure) >= 2 and procedure[0] == X12_PROCEDURE_QUALIFIER and procedure[1]:
+        code = procedure[1]
+        system = HL7_CODING_SYSTEM_URIS["HCPCS" if code[0:1].isalpha() else "CPT"]
+        product_or_service = _codeable_concept(system, code)
+
+    diagnosis_pointers = _components(
+        sv1_segment, sv1_segment.composite_diagnosis_code_pointer
+    )
+
+    quantity = None
+    if sv1_segment.service_unit_count is not None:
+        quantity = {"value": float(Decimal(str(sv1_segment.service_unit_count)))}
+
+    return _prune(
+        {
+            "sequence": service_loop.lx_segment.assigned_number,
+            "diagnosisSequence": [int(p) for p in diagnosis_pointers if p.isdigit()],
+            "productOrService": product_or_service,
+            "servicedDate": _find_date(
+                service_loop.dtp_segment, {X12_SERVICE_DATE_QUALIFIER}
+            ),
+            "locationCodeableConcept": _codeable_concept(
+                PLACE_OF_SERVICE_SYSTEM,
+                sv1_segment.place_of_service_code or place_of_service,
+            ),
+            "quantity": quantity,
+            "net": _money(sv1_segment.line_item_charge_amount),
+        }
+    )
+
+
+def _translate_claim(
+    claim_loop: Any,
+    created: Optional[str],
+    patient: Resource,
+    provider: Optional[Resource],
+    insurer: Optional[Resource],
+    coverage: Resource,
+) -> Resource:
+    """Translates a 2300 claim loop to a Claim"""
+    clm_segment = claim_loop.clm_segment
+    location = _components(
+        clm_segment, clm_segment.health_care_service_location_information
+    )
+    place_of_service = location[0] if location else None
+
+    return _create_resource(
+        "Claim",
+        identifier=[{"value": clm_segment.patient_control_number}],
+        status="active",
+        type=_codeable_concept(CLAIM_TYPE_SYSTEM, "professional"),
+        use="claim",
+        patient=_reference(patient),
+        created=created,
+        insurer=_reference(insurer),
+        provider=_reference(provider),
+        priority=_codeable_concept(PROCESS_PRIORITY_SYSTEM, "normal"),
+        insurance=[{"sequence": 1, "focal": True, "coverage": _reference(coverage)}],
+        diagnosis=_claim_diagnoses(claim_loop),
+        item=[
+            _claim_item(service_loop, place_of_service)
+            for service_loop in _as_list(claim_loop.loop_2400)
+        ],
+        total=_money(clm_segment.total_claim_charge_amount),
+    )
+
+
+def _translate_professional_claim(model: X12SegmentGroup) -> Iterator[Resource]:
+    """
+    Translates an 837 professional claim transaction to Claims.
+    Claims are yielded as each 2300 loop is translated.
+    """
+    created = _creation_date(model)
+
+    for billing_provider_loop in _as_list(model.loop_2000a):
+        provider = _create_party(billing_provider_loop.loop_2010aa.nm1_segment)
+        yield provider
+
+        for subscriber_loop in _as_list(billing_provider_loop.loop_2000b):
+            subscriber_name_loop = subscriber_loop.loop_2010ba
+            subscriber = _create_party(
+                subscriber_name_loop.nm1_segment,
+                subscriber_name_loop.dmg_segment,
+                is_patient=True,
+            )
+            yield subscriber
+
+            insurer = _create_party(subscriber_loop.loop_2010bb.nm1_segment)
+            yield insurer
+
+            sbr_segment = subscriber_loop.sbr_segment
+            coverage = _create_resource(
+                "Coverage",
+                status="active",
+                subscriber=_reference(subscriber),
+                subscriberId=subscriber_name_loop.nm1_segment.identification_code,
+                beneficiary=_reference(subscriber),
+                payor=[_reference(insurer)],
+                **{
+                    "class": [
+                        {
+                            "type": _codeable_concept(
+                                "http://terminology.hl7.org/CodeSystem/coverage-class",
+                                "group",
+                            ),
+                            "value": sbr_segment.group_policy_number,
+                        }
+                    ]
+                    if sbr_segment.group_policy_number
+                    else None
+                },
+            )
+            yield coverage
+
+            for claim_loop in _as_list(subscriber_loop.loop_2300):
+                yield _translate_claim(
+                    claim_loop, created, subscriber, provider, insurer, coverage
+                )
+
+            for patient_loop in _as_list(subscriber_loop.loop_2000c):
+                patient_name_loop = patient_loop.loop_2010ca
+                patient = _create_party(
+                    patient_name_loop.nm1_segment,
+                    patient_name_loop.dmg_segment,
+                    is_patient=True,
+                )
+                yield patient
+
+                for claim_loop in _as_list(patient_loop.loop_2300):
+                    yield _translate_claim(
+                        claim_loop, created, patient, provider, insurer, coverage
+                    )
+
+
+# translation functions by transaction set code and implementation convention
+X12_TRANSLATORS: Dict[
+    Tuple[str, str], Callable[[X12SegmentGroup], Iterator[Resource]]
+] = {
+    ("270", "005010X279A1"): _translate_eligibility_request,
+    ("271", "005010X279A1"): _translate_eligibility_response,
+    ("837", "005010X222A2"): _translate_professional_claim,
+}
+
+
+class X12FhirTranslator:
+    """
+    Translates X12 transaction set models to FHIR R4 resources.
+    Translators are stateless and may be shared.
+    """
+
+    def __init__(
+        self,
+        translators: Optional[
+            Dict[Tuple[str, str], Callable[[X12SegmentGroup], Iterator[Resource]]]
+        ] = None,
+    ):
+        """
+        :param translators: Translation functions keyed by transaction set code and implementation convention
+        reference, such as ("837", "005010X222A2"). Defaults to X12_TRANSLATORS.
+        """
+        self.translators = translators if translators is not None else X12_TRANSLATORS
+
+    def _get_translator(
+        self, model: X12SegmentGroup
+    ) -> Optional[Callable[[X12SegmentGroup], Iterator[Resource]]]:
+        """Returns the translation function for a transaction set"""
+        st_segment = model.header.st_segment
+        return self.translators.get(
+            (
+                st_segment.transaction_set_identifier_code,
+                st_segment.implementation_convention_reference,
+            )
+        )
+
+    def supports(self, model: X12SegmentGroup) -> bool:
+        """Returns True if the transaction set can be translated"""
+        return self._get_translator(model) is not None
+
+    def resources(self, model: X12SegmentGroup) -> Iterator[Resource]:
+        """
+        Translates a transaction set to FHIR resources.
+        :param model: The transaction set model
+        :returns: iterator of FHIR resources as dictionaries. Unsupported transaction sets yield no resources.
+        """
+        translator = self._get_translator(model)
+        if translator is None:
+            logger.debug(
+                f"X12 transaction {model.header.st_segment.transaction_set_identifier_code} is not supported"
+            )
+            return
+        yield from translator(model)
+
+    def stream(self, x12_input: str) -> Iterator[Resource]:
+        """
+        Translates an X12 message, or file, incrementally.
+        Transaction sets are parsed and translated one at a time.
+        :param x12_input: The X12 message or file path
+        :returns: iterator of FHIR resources as dictionaries
+        """
+        for model in iter_x12(x12_input, output_delimiters=True):
+            yield from self.resources(model)
+
+    def write(self, x12_input: str, writer: Any) -> int:
+        """
+        Translates an X12 message, or file, to a resource writer such as FhirNdjsonWriter or FhirBundleWriter.
+        :param x12_input: The X12 message or file path
+        :param writer: The resource writer
+        :returns: the number of resources written
+        """
+        count = 0
+        for resource in self.stream(x12_input):
+            writer.write(resource)
+            count += 1
+        return count
+
+    def translate(self, models: Iterable[X12SegmentGroup]) -> Optional[Dict]:
+        """
+        Translates transaction sets to a FHIR Bundle.
+        :param models: The transaction set models
+        :returns: The FHIR Bundle as a dictionary, or None if no transaction sets are supported
+        """
+        entries = []
+        supported = False
+        for model in models:
+            if not self.supports(model):
+                continue
+            supported = True
+            for resource in self.resources(model):
+                entries.append(
+                    {"fullUrl": f"urn:uuid:{resource['id']}", "resource": resource}
+                )
+
+        if not supported:
+            return None
+        return _prune(
+            {"resourceType": "Bundle", "type": "collection", "entry": entries}
+        )
+
+
+@lru_cache()
+def get_x12_translator() -> X12FhirTranslator:
+    """Returns the X12FhirTranslator for the default transaction sets"""
+    return X12FhirTranslator()
@@ -0,0 +1,276 @@
+"""
+x12_validation.py
+
+Full validation of large X12 837 transactions across processes.
+
+A single 837 transaction may contain tens of thousands of claims, and building its data model is bound to one core.
+The transaction is split at subscriber (2000B) loop boundaries into chunks containing a bounded number of claims.
+Each chunk is a standalone interchange containing the transaction's header loops (BHT, submitter and receiver), the
+billing provider (2000A) loop of its subscribers, and recreated SE, GE and IEA trailers, so it is validated by the
+X12 model reader without the rest of the transaction.
+
+Chunks are copied into a shared memory block and validated by a process pool, which receives each chunk's offset
+within the block rather than a pickled copy of the chunk. The errors are reported in transaction order, and the chunk
+models are merged back into a single transaction model: the billing provider loops of each chunk are appended to the
+first chunk's model, and a billing provider loop repeated at the start of a chunk is merged with the previous chunk's
+loop. The merged model is equal to the model loaded from the whole transaction. The transaction's segment count and
+control numbers are checked before it is split, since each chunk's trailers are recreated.
+
+Usage:
+models = load_x12_parallel(message_text, max_workers=8, max_claims=1000)
+"""
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import multiprocessing
+from typing import List, NamedTuple, Optional, Tuple
+
+from linuxforhealth.x12.io import X12SegmentGroup
+
+from .exceptions import EdiDataValidationException
+from .shared_buffer import SharedBufferRef, SharedMessageBlock, attach_shared_buffers
+from .support import load_x12
+from .validation import X12_ISA_LENGTH
+
+# the transaction sets which are split into chunks
+SPLIT_TRANSACTION_SETS = frozenset({"837"})
+
+# HL03 hierarchical level codes
+BILLING_PROVIDER_LEVEL = "20"
+SUBSCRIBER_LEVEL = "22"
+
+
+class X12Chunk(NamedTuple):
+    """A standalone interchange containing a transaction, or a chunk of a split transaction"""
+
+    # the index of the chunk's transaction within the message
+    transaction_index: int
+    # the segment count of the chunk's transaction, before it was split
+    transaction_segment_count: int
+    text: str
+
+
+def _fail(msg: str) -> None:
+    raise EdiDataValidationException(msg)
+
+
+def _split_transaction(
+    transaction: List[List[str]], max_claims: int
+) -> List[List[List[str]]]:
+    """
+    Splits a transaction's segments into chunks at subscriber loop boundaries.
+    :param transaction: The transaction's segments, from ST to SE, split into elements
+    :param max_claims: The number of claims after which a chunk is completed
+    :returns: list of chunks, each containing the chunk's segments from ST to SE
+    """
+    st_segment, se_segment = transaction[0], transaction[-1]
+    hl_positions = [i for i, s in enumerate(transaction) if s[0] == "HL"]
+    transaction_set = st_segment[1] if len(st_segment) > 1 else None
+    if transaction_set not in SPLIT_TRANSACTION_SETS or not hl_positions:
+        return [transaction]
+
+    header = transaction[: hl_positions[0]]
+    hl_positions.append(len(transaction) - 1)
+
+    chunks = []
+    body: List[List[str]] = []
+    provider_loop: List[List[str]] = []
+    claim_count = 0
+    for start, end in zip(hl_positions, hl_positions[1:]):
+        loop = transaction[start:end]
+        level_code = loop[0][3] if len(loop[0]) > 3 else None
+
+        if (
+            level_code in (BILLING_PROVIDER_LEVEL, SUBSCRIBER_LEVEL)
+            and body
+            and claim_count >= max_claims
+        ):
+            chunks.append(body)
+            body = [] if level_code == BILLING_PROVIDER_LEVEL else list(provider_loop)
+            claim_count = 0
+
+        if level_code == BILLING_PROVIDER_LEVEL:
+            provider_loop = loop
+        body.extend(loop)
+        claim_count += sum(1 for s in loop if s[0] == "CLM")
+    chunks.append(body)
+
+    if len(chunks) == 1:
+        return [transaction]
+
+    return [
+        header + body + [["SE", str(len(header) + len(body) + 1)] + se_segment[2:]]
+        for body in chunks
+    ]
+
+
+def split_x12_message(text: str, max_claims: int) -> List[str]:
+    """
+    Splits an X12 message into standalone interchanges, splitting 837 transactions with more than max_claims claims
+    into chunks. Other transactions are returned as a single chunk.
+    :param text: The X12 message
+    :param max_claims: The number of claims after which a chunk is completed
+    :returns: list of X12 interchanges, in message order
+    :raises: EdiDataValidationException if the message's envelope, segment counts or control numbers are invalid
+    """
+    return [chunk.text for chunk in split_x12_chunks(text, max_claims)]
+
+
+def split_x12_chunks(text: str, max_claims: int) -> List[X12Chunk]:
+    """
+    Splits an X12 message into standalone interchanges, recording the transaction each interchange was split from.
+    :param text: The X12 message
+    :param max_claims: The number of claims after which a chunk is completed
+    :returns: list of X12Chunk, in message order
+    :raises: EdiDataValidationException if the message's envelope, segment counts or control numbers are invalid
+    """
+    text = text.strip()
+    if not text.startswith("ISA") or len(text) < X12_ISA_LENGTH:
+        _fail("X12 message does not start with an ISA segment")
+    element_separator = text[3]
+    segment_terminator = text[X12_ISA_LENGTH - 1]
+
+    segments = [
+        s.strip().split(element_separator)
+        for s in text.split(segment_terminator)
+        if s.strip()
+    ]
+    isa_segment = segments[0]
+
+    chunks: List[Tuple[int, int, List[List[str]]]] = []
+    gs_segment: Optional[List[str]] = None
+    transaction_start: Optional[int] = None
+    transaction_count = 0
+    transaction_index = 0
+    for position, segment in enumerate(segments):
+        segment_name = segment[0]
+        if segment_name == "GS":
+            gs_segment = segment
+            transaction_count = 0
+        elif segment_name == "ST":
+            transaction_start = position
+            transaction_count += 1
+        elif segment_name == "SE":
+            if transaction_start is None or gs_segment is None:
+                _fail("SE segment does not follow an ST segment")
+            transaction = segments[transaction_start : position + 1]
+            if segment[2:3] != transaction[0][2:3]:
+                _fail("ST and SE transaction control numbers do not match")
+            if segment[1:2] != [str(len(transaction))]:
+                _fail(
+                    f"SE segment count {segment[1:2]} != actual count {len(transaction)}"
+                )
+            for chunk in _split_transaction(transaction, max_claims):
+                chunk_segments = (
+                    [isa_segment, gs_segment]
+                    + chunk
+                    + [["GE", "1"] + gs_segment[6:7], ["IEA", "1"] + isa_segment[13:14]]
+                )
+                chunks.append((transaction_index, len(transaction), chunk_segments))
+            transaction_start = None
+            transaction_index += 1
+        elif segment_name == "GE":
+            if gs_segment is None or segment[2:3] != gs_segment[6:7]:
+                _fail("GS and GE group control numbers do not match")
+            if segment[1:2] != [str(transaction_count)]:
+                _fail(
+                    f"GE transaction count {segment[1:2]} != actual count {transaction_count}"
+                )
+            gs_segment = None
+
+    return [
+        X12Chunk(
+            index,
+            segment_count,
+            segment_terminator.join(element_separator.join(s) for s in chunk)
+            + segment_terminator,
+        )
+        for index, segment_count, chunk in chunks
+    ]
+
+
+def _merge_chunk_models(
+    models: List[X12SegmentGroup], segment_count: int
+) -> X12SegmentGroup:
+    """
+    Merges the models of a split 837 transaction's chunks into the first chunk's model.
+    Each chunk repeats the transaction's header loops, which are kept from the first chunk. A chunk which starts
+    within a billing provider loop repeats the loop, so its subscriber loops are appended to the previous chunk's loop.
+    :param models: The chunk models, in transaction order
+    :param segment_count: The transaction's segment count, before it was split
+    :returns: the merged transaction model
+    """
+    merged = models[0]
+    for model in models[1:]:
+        provider_loops = list(model.loop_2000a)
+        last_provider_loop = merged.loop_2000a[-1]
+        if (
+            provider_loops[0].hl_segment.hierarchical_id_number
+            == last_provider_loop.hl_segment.hierarchical_id_number
+        ):
+            last_provider_loop.loop_2000b.extend(provider_loops.pop(0).loop_2000b)
+        merged.loop_2000a.extend(provider_loops)
+    merged.footer.se_segment.transaction_segment_count = segment_count
+    return merged
+
+
+def _load_x12_chunk(
+    ref: SharedBufferRef,
+) -> Tuple[Optional[List[X12SegmentGroup]], Optional[str]]:
+    """
+    Loads an X12 chunk, held in shared memory, within a worker process.
+    Errors are returned as messages, since model validation errors may not be picklable.
+    :returns: tuple of (chunk models, None) or (None, error message)
+    """
+    try:
+        with attach_shared_buffers([ref]) as buffers:
+            text = buffers[0].text
+        return load_x12(text), None
+    except Exception as ex:
+        return None, f"{type(ex).__name__}: {ex}"
+
+
+@lru_cache()
+def get_x12_validation_executor(max_workers: int) -> ProcessPoolExecutor:
+    """Returns the process pool used to validate X12 chunks, starting it on first use"""
+    return ProcessPoolExecutor(max_workers=max_workers)
+
+
+def load_x12_parallel(
+    text: str, max_workers: int, max_claims: int
+) -> List[X12SegmentGroup]:
+    """
+    Loads an X12 message into transaction set models, validating chunks of large 837 transactions in parallel.
+    Messages which are not split, and messages loaded within daemon processes such as batch workers, which cannot
+    start child processes, are loaded in the current process.
+    :param text: The X12 message
+    :param max_workers: The number of validation processes
+    :param max_claims: The number of claims per chunk
+    :returns: list of transaction set models, equal to the models loaded within the current process
+    :raises: EdiDataValidationException if a chunk is invalid. The errors of all invalid chunks are reported in
+    message order.
+    """
+    if max_workers <= 1 or multiprocessing.current_process().daemon:
+        return load_x12(text)
+
+    chunks = split_x12_chunks(text, max_claims)
+    if len(chunks) == 1:
+        return load_x12(text)
+
+    executor = get_x12_validation_executor(max_workers)
+    with SharedMessageBlock([c.text for c in chunks]) as block:
+        results = list(executor.map(_load_x12_chunk, block.refs))
+
+    errors = [f"chunk {i}: {e}" for i, (_, e) in enumerate(results) if e]
+    if errors:
+        _fail(f"X12 validation failed for {len(errors)} chunks. {'; '.join(errors)}")
+
+    # each chunk is an interchange containing a single transaction
+    transactions: List[Tuple[int, List[X12SegmentGroup]]] = []
+    for chunk, (models, _) in zip(chunks, results):
+        if chunk.transaction_index == len(transactions):
+            transactions.append((chunk.transaction_segment_count, []))
+        transactions[-1][1].extend(models)
+    return [
+        _merge_chunk_models(models, segment_count)
+        for segment_count, models in transactions
+    ]
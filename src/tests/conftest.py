@@ -43,3 +43,53 @@ def dicom_message():
     file_path = os.path.join(resources_directory, "dcm_1.dcm")
     with open(file_path, "rb") as f:
         return f.read()
+
+
+def _write_dicom_instance(
+    file_path: str, study_uid: str, series_uid: str, instance_number: int
+) -> None:
+    """Writes a minimal CT DICOM instance to file_path"""
+    from pydicom.dataset import Dataset, FileMetaDataset
+    from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+    sop_instance_uid = generate_uid()
+    file_meta = FileMetaDataset()
+    file_meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.2"
+    file_meta.MediaStorageSOPInstanceUID = sop_instance_uid
+    file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    dataset = Dataset()
+    dataset.file_meta = file_meta
+    dataset.SOPClassUID = file_meta.MediaStorageSOPClassUID
+    dataset.SOPInstanceUID = sop_instance_uid
+    dataset.StudyInstanceUID = study_uid
+    dataset.SeriesInstanceUID = series_uid
+    dataset.Modality = "CT"
+    dataset.InstanceNumber = instance_number
+    dataset.PatientName = "Test^Patient"
+    dataset.is_little_endian = True
+    dataset.is_implicit_VR = False
+    dataset.save_as(file_path, write_like_original=False)
+
+
+@pytest.fixture
+def dicom_study_directory(tmp_path):
+    """
+    A DICOM study directory containing two series (3 and 2 instances) and one invalid file.
+    """
+    study_uid = "1.2.826.0.1.3680043.8.498.100"
+    series = {
+        "1.2.826.0.1.3680043.8.498.200": 3,
+        "1.2.826.0.1.3680043.8.498.300": 2,
+    }
+
+    for series_index, (series_uid, instance_count) in enumerate(series.items()):
+        series_directory = tmp_path / f"series{series_index}"
+        series_directory.mkdir()
+        for i in range(instance_count):
+            _write_dicom_instance(
+                str(series_directory / f"IM{i:04d}"), study_uid, series_uid, i + 1
+            )
+
+    (tmp_path / "README.txt").write_text("not a dicom instance")
+    return str(tmp_path)
@@ -0,0 +1,158 @@
+"""
+test_admission.py
+
+Tests admission control for EDI workflows.
+"""
+import os
+import threading
+import time
+
+from linuxforhealth.edi.admission import (
+    AdmissionController,
+    AdmissionLane,
+    classify_message,
+    run_admitted_workflow,
+)
+from linuxforhealth.edi.exceptions import EdiAdmissionException
+from linuxforhealth.edi.support import EdiMessageBuffer
+from tests import resources_directory
+import pytest
+
+
+def _wait_for(condition, timeout: float = 5.0) -> None:
+    """Waits until a condition is true"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def _admit_in_thread(controller: AdmissionController, admitted: list, *args, **kwargs):
+    """Admits a message in a new thread, appending the ticket to admitted when the message is admitted"""
+
+    def admit():
+        admitted.append(controller.admit(*args, **kwargs))
+
+    thread = threading.Thread(target=admit, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_classify_message(hl7_message, x12_message):
+    assert classify_message(EdiMessageBuffer(hl7_message), 1024 * 1024) == "latency"
+    assert classify_message(EdiMessageBuffer(x12_message), 1024 * 1024) == "latency"
+    assert classify_message(EdiMessageBuffer(hl7_message), 100) == "bulk"
+
+    with open(os.path.join(resources_directory, "837.x12")) as f:
+        x12_837_message = f.read()
+    assert classify_message(EdiMessageBuffer(x12_837_message), 1024 * 1024) == "bulk"
+
+    dicom_message = b"\x00" * 128 + b"DICM" + b"\x00" * 16
+    assert classify_message(EdiMessageBuffer(dicom_message), 1024 * 1024) == "bulk"
+
+
+def test_admit_and_release():
+    controller = AdmissionController(max_messages=2, max_bytes=100)
+    with controller.admit(40, tenant="a") as ticket:
+        assert ticket.size == 40
+        assert controller.in_flight_messages == 1
+        assert controller.in_flight_bytes == 40
+        assert controller.tenant_in_flight("a") == {"messages": 1, "bytes": 40}
+
+    assert controller.in_flight_messages == 0
+    assert controller.in_flight_bytes == 0
+    assert controller.tenant_in_flight("a") == {"messages": 0, "bytes": 0}
+    # releasing a ticket more than once has no effect
+    ticket.release()
+    assert controller.in_flight_messages == 0
+    assert controller.admitted_count == 1
+
+
+def test_admit_exceeds_budget():
+    controller = AdmissionController(max_bytes=100, tenant_max_bytes=50, bulk_share=0.3)
+    with pytest.raises(EdiAdmissionException, match="tenant budget"):
+        controller.admit(60)
+
+    with pytest.raises(EdiAdmissionException, match="bulk lane budget"):
+        controller.admit(40, lane=AdmissionLane.BULK, timeout=0)
+    assert controller.rejected_count == 2
+
+
+def test_admit_queued():
+    controller = AdmissionController(max_messages=1)
+    ticket = controller.admit(10)
+
+    admitted = []
+    thread = _admit_in_thread(controller, admitted, 10)
+    _wait_for(lambda: controller.queued_count() == 1)
+    assert not admitted
+
+    ticket.release()
+    thread.join(timeout=5)
+    assert len(admitted) == 1
+    assert controller.queued_count() == 0
+    assert controller.in_flight_messages == 1
+
+
+def test_admit_rejected():
+    controller = AdmissionController(max_messages=1, max_queue=1, queue_timeout=0.05)
+    ticket = controller.admit(10)
+
+    with pytest.raises(EdiAdmissionException, match="not admitted within"):
+        controller.admit(10)
+
+    admitted = []
+    thread = _admit_in_thread(controller, admitted, 10, timeout=5)
+    _wait_for(lambda: controller.queued_count() == 1)
+    with pytest.raises(EdiAdmissionException, match="queue is full"):
+        controller.admit(10)
+
+    ticket.release()
+    thread.join(timeout=5)
+    assert len(admitted) == 1
+    assert controller.rejected_count == 2
+
+
+def test_admit_tenant_budgets():
+    controller = AdmissionController(tenant_max_messages=1, queue_timeout=0.05)
+    controller.admit(10, tenant="a")
+
+    # other tenants are admitted while tenant a's budget is exhausted
+    controller.admit(10, tenant="b")
+    with pytest.raises(EdiAdmissionException):
+        controller.admit(10, tenant="a")
+
+    assert controller.tenant_in_flight("a")["messages"] == 1
+    assert controller.tenant_in_flight("b")["messages"] == 1
+
+
+def test_admit_latency_before_bulk():
+    controller = AdmissionController(max_messages=4, bulk_share=0.5)
+    tickets = [controller.admit(10) for _ in range(3)]
+    bulk_ticket = controller.admit(10, lane=AdmissionLane.BULK)
+
+    # the bulk lane is limited to half of the message budget
+    admitted = []
+    bulk_thread = _admit_in_thread(
+        controller, admitted, 10, lane=AdmissionLane.BULK, timeout=5
+    )
+    _wait_for(lambda: controller.queued_count(AdmissionLane.BULK) == 1)
+    latency_thread = _admit_in_thread(controller, admitted, 10, timeout=5)
+    _wait_for(lambda: controller.queued_count(AdmissionLane.LATENCY) == 1)
+
+    # the queued latency message is admitted first
+    tickets[0].release()
+    latency_thread.join(timeout=5)
+    assert [t.lane for t in admitted] == [AdmissionLane.LATENCY]
+
+    bulk_ticket.release()
+    bulk_thread.join(timeout=5)
+    assert [t.lane for t in admitted] == [AdmissionLane.LATENCY, AdmissionLane.BULK]
+
+
+def test_run_admitted_workflow(x12_message):
+    controller = AdmissionController(max_messages=1)
+    edi_result = run_admitted_workflow(x12_message, tenant="a", controller=controller)
+    assert edi_result.metadata.ediMessageFormat == "X12"
+    assert controller.admitted_count == 1
+    assert controller.in_flight_messages == 0
@@ -36,8 +36,18 @@ def test_analyze_fhir_json(fhir_json_message):
 
 
 def test_analyze_fhir_xml(fhir_xml_message):
-    with pytest.raises(NotImplementedError):
-        analyze(fhir_xml_message)
+    edi_message_metadata = analyze(fhir_xml_message)
+    assert edi_message_metadata.baseMessageFormat == BaseMessageFormat.XML
+    assert edi_message_metadata.ediMessageFormat == EdiMessageFormat.FHIR
+    assert edi_message_metadata.specificationVersion == "R4"
+    assert edi_message_metadata.implementationVersions == [
+        "http://hl7.org/fhir/us/core/StructureDefinition/us-core-patient"
+    ]
+
+
+def test_analyze_xml_invalid():
+    with pytest.raises(EdiDataValidationException):
+        analyze("<ClinicalDocument xmlns='urn:hl7-org:v3'/>")
 
 
 def test_analyze_hl7(hl7_message):
@@ -0,0 +1,65 @@
+"""
+test_config.py
+
+Tests EDI application settings.
+"""
+from linuxforhealth.edi.config import EdiSettings
+from pydantic import ValidationError
+import pytest
+
+
+def test_edi_settings(monkeypatch):
+    monkeypatch.setenv("LFH_EDI_JSON_BACKEND", "ORJSON")
+    settings = EdiSettings()
+    assert settings.json_backend == "orjson"
+
+
+def test_edi_settings_invalid_json_backend(monkeypatch):
+    monkeypatch.setenv("LFH_EDI_JSON_BACKEND", "simplejson")
+    with pytest.raises(ValidationError):
+        EdiSettings()
+
+
+@pytest.mark.parametrize("rate", ["-0.1", "1.5"])
+def test_edi_settings_invalid_memory_sample_rate(monkeypatch, rate):
+    monkeypatch.setenv("LFH_EDI_MEMORY_SAMPLE_RATE", rate)
+    with pytest.raises(ValidationError):
+        EdiSettings()
+
+
+@pytest.mark.parametrize(
+    "name", ["LFH_EDI_X12_VALIDATION_WORKERS", "LFH_EDI_X12_VALIDATION_CHUNK_CLAIMS"]
+)
+def test_edi_settings_invalid_x12_validation(monkeypatch, name):
+    monkeypatch.setenv(name, "0")
+    with pytest.raises(ValidationError):
+        EdiSettings()
+
+
+def test_edi_settings_fhir_warmup(monkeypatch):
+    monkeypatch.setenv("LFH_EDI_FHIR_WARMUP_RELEASES", '["r4", "STU3"]')
+    monkeypatch.setenv("LFH_EDI_FHIR_WARMUP_RESOURCE_TYPES", '["Patient", "Bundle"]')
+    settings = EdiSettings()
+    assert settings.fhir_warmup_releases == ["R4", "STU3"]
+    assert settings.fhir_warmup_resource_types == ["Patient", "Bundle"]
+
+    monkeypatch.setenv("LFH_EDI_FHIR_WARMUP_RELEASES", '["R5"]')
+    with pytest.raises(ValidationError):
+        EdiSettings()
+
+
+@pytest.mark.parametrize(
+    "name,value",
+    [
+        ("LFH_EDI_ADMISSION_MAX_MESSAGES", "0"),
+        ("LFH_EDI_ADMISSION_TENANT_MAX_BYTES", "-1"),
+        ("LFH_EDI_ADMISSION_BULK_SHARE", "0"),
+        ("LFH_EDI_ADMISSION_BULK_SHARE", "1.5"),
+        ("LFH_EDI_ADMISSION_BULK_MESSAGE_SIZE", "0"),
+        ("LFH_EDI_ADMISSION_QUEUE_TIMEOUT", "-1"),
+    ],
+)
+def test_edi_settings_invalid_admission(monkeypatch, name, value):
+    monkeypatch.setenv(name, value)
+    with pytest.raises(ValidationError):
+        EdiSettings()
@@ -0,0 +1,222 @@
+"""
+test_dedupe.py
+
+Tests the persistent dedupe index and the pipeline dedupe stage.
+"""
+import hashlib
+import os
+import time
+
+from linuxforhealth.edi.dedupe import (
+    LOG_FILE_NAME,
+    BloomFilter,
+    DedupeIndex,
+    RECORD,
+)
+from linuxforhealth.edi.pipeline import (
+    AnalyzeStage,
+    DedupeStage,
+    EdiPipeline,
+    ValidateStage,
+)
+from linuxforhealth.edi.workflows import EdiWorkflow, run_workflows
+import pytest
+
+
+def _checksum(value: str) -> str:
+    return hashlib.sha256(value.encode()).hexdigest()
+
+
+def test_bloom_filter(tmp_path):
+    bloom = BloomFilter.create(1000)
+    digests = [hashlib.sha256(str(i).encode()).digest() for i in range(1000)]
+    for digest in digests:
+        bloom.add(digest)
+    assert all(d in bloom for d in digests)
+
+    absent = [hashlib.sha256(f"absent-{i}".encode()).digest() for i in range(1000)]
+    assert sum(d in bloom for d in absent) < 50
+
+    file_path = str(tmp_path / "test.bloom")
+    bloom.save(file_path)
+    loaded = BloomFilter.load(file_path)
+    assert loaded.hash_count == bloom.hash_count
+    assert all(d in loaded for d in digests)
+
+    with open(file_path, "wb") as f:
+        f.write(b"not a bloom filter file")
+    with pytest.raises(ValueError):
+        BloomFilter.load(file_path)
+
+
+def test_dedupe_index(tmp_path):
+    index_directory = str(tmp_path / "dedupe")
+    checksums = [_checksum(str(i)) for i in range(50)]
+
+    with DedupeIndex(index_directory) as index:
+        assert not any(index.check_and_add(c) for c in checksums)
+        assert all(c in index for c in checksums)
+        assert index.check_and_add(checksums[0])
+        assert _checksum("new") not in index
+
+    # the log is reloaded when the index is opened
+    with DedupeIndex(index_directory) as index:
+        assert all(c in index for c in checksums)
+        assert index.compact() == 50
+        assert index.table_size == 50
+        assert not index.log_records
+        assert all(c in index for c in checksums)
+
+        index.add(_checksum("new"))
+        assert _checksum("new") in index
+
+    with DedupeIndex(index_directory) as index:
+        assert index.table_size == 50
+        assert len(index.log_records) == 1
+        assert all(c in index for c in checksums + [_checksum("new")])
+
+
+def test_dedupe_index_partial_log_record(tmp_path):
+    index_directory = str(tmp_path)
+    with DedupeIndex(index_directory) as index:
+        index.add(_checksum("a"))
+
+    with open(os.path.join(index_directory, LOG_FILE_NAME), "ab") as f:
+        f.write(b"\x00" * (RECORD.size // 2))
+
+    with DedupeIndex(index_directory) as index:
+        assert len(index.log_records) == 1
+        assert _checksum("a") in index
+
+
+def test_dedupe_index_retention(tmp_path, monkeypatch):
+    index_directory = str(tmp_path)
+    with DedupeIndex(index_directory, retention_seconds=3600) as index:
+        index.add(_checksum("recent"))
+        # records an expired checksum
+        digest = bytes.fromhex(_checksum("expired"))
+        timestamp = int(time.time()) - 7200
+        index._log_file.write(RECORD.pack(digest, timestamp))
+        index._log_file.flush()
+        index.log_records[digest] = timestamp
+        index.bloom.add(digest)
+
+        assert _checksum("recent") in index
+        assert _checksum("expired") not in index
+        assert not index.check_and_add(_checksum("expired"))
+
+    with DedupeIndex(index_directory, retention_seconds=1) as index:
+        # compaction reloads the log, so the records are expired by advancing the clock
+        now = time.time() + 10
+        monkeypatch.setattr(time, "time", lambda: now)
+        assert index.compact() == 0
+
+
+def _add_expired(index: DedupeIndex, checksum: str, age: int) -> None:
+    """Appends a log record for a checksum first seen age seconds ago"""
+    digest = bytes.fromhex(checksum)
+    timestamp = int(time.time()) - age
+    index._log_file.write(RECORD.pack(digest, timestamp))
+    index._log_file.flush()
+    index.log_records[digest] = timestamp
+    index.bloom.add(digest)
+
+
+def test_dedupe_index_expired_resend(tmp_path):
+    index_directory = str(tmp_path)
+    checksum = _checksum("resent")
+    with DedupeIndex(index_directory, retention_seconds=3600) as index:
+        _add_expired(index, checksum, 7200)
+        index.compact()
+        assert index.table_size == 0
+
+        _add_expired(index, checksum, 7200)
+        # compaction retains the expired table record only while it is within the window
+        index.retention_seconds = None
+        index.compact()
+        index.retention_seconds = 3600
+        assert index.table_size == 1
+        assert checksum not in index
+
+        # the resend is recorded in the log, and the newer log record is used
+        assert not index.check_and_add(checksum)
+        assert index.check_and_add(checksum)
+        assert index.check_and_add(checksum)
+
+        # compaction keeps the newest timestamp
+        assert index.compact() == 1
+        assert checksum in index
+
+
+def test_dedupe_index_shared(tmp_path):
+    index_directory = str(tmp_path)
+    with DedupeIndex(index_directory) as index, DedupeIndex(index_directory) as other:
+        index.add(_checksum("a"))
+        other.add(_checksum("b"))
+
+        # records appended by other processes are merged when the index is compacted
+        assert index.compact() == 2
+        assert _checksum("b") in index
+
+        other.add(_checksum("c"))
+        with other._lock(exclusive=True):
+            assert index.compact(blocking=False) is None
+        assert index.compact() == 3
+
+    assert not [f for f in os.listdir(index_directory) if f.endswith(".tmp")]
+
+
+def test_dedupe_index_compact_threshold(tmp_path):
+    index_directory = str(tmp_path)
+    with DedupeIndex(index_directory, compact_threshold=10) as index:
+        for i in range(10):
+            index.add(_checksum(str(i)))
+
+    with DedupeIndex(index_directory, compact_threshold=10) as index:
+        assert index.table_size == 10
+        assert not index.log_records
+        assert _checksum("5") in index
+
+
+def test_dedupe_stage(tmp_path, x12_message):
+    pipeline = EdiPipeline(
+        [AnalyzeStage(), DedupeStage(DedupeIndex(str(tmp_path)), skip=False)]
+    )
+    results = list(run_workflows([x12_message, x12_message], pipeline=pipeline))
+    assert [r.duplicate for r in results] == [False, True]
+
+    workflow = EdiWorkflow(x12_message)
+    pipeline.run(workflow)
+    assert workflow.duplicate
+    assert workflow.operations == ["analyze", "dedupe"]
+
+
+def test_dedupe_stage_skip(tmp_path, x12_message, hl7_message):
+    pipeline = EdiPipeline(
+        [
+            AnalyzeStage(),
+            DedupeStage(DedupeIndex(str(tmp_path)), skip=True),
+            ValidateStage(),
+        ]
+    )
+
+    workflow = EdiWorkflow(x12_message)
+    pipeline.run(workflow)
+    assert workflow.operations == ["analyze", "dedupe", "validate"]
+
+    workflow = EdiWorkflow(x12_message)
+    pipeline.run(workflow)
+    assert workflow.cancelled
+    assert workflow.operations == ["analyze", "dedupe"]
+
+    workflows = [EdiWorkflow(x12_message), EdiWorkflow(hl7_message)]
+    assert pipeline.run_batch(workflows) == [None, None]
+    assert workflows[0].operations == ["analyze", "dedupe"]
+    assert workflows[1].operations == ["analyze", "dedupe", "validate"]
+
+
+def test_dedupe_stage_not_configured(x12_message):
+    workflow = EdiWorkflow(x12_message)
+    workflow.run(enrich=False, validate=False, translate=False)
+    assert workflow.duplicate is None
+    assert workflow.operations == ["analyze"]
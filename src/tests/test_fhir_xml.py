@@ -0,0 +1,138 @@
+"""
+test_fhir_xml.py
+
+Tests streaming FHIR XML analysis, conversion and code extraction.
+"""
+import json
+
+from linuxforhealth.edi.exceptions import EdiDataValidationException
+from linuxforhealth.edi.fhir_xml import (
+    convert_fhir_xml,
+    is_fhir_xml,
+    iter_fhir_xml_codes,
+    load_fhir_xml,
+    scan_fhir_xml,
+)
+from linuxforhealth.edi.models import ValidationLevel
+from linuxforhealth.edi.pipeline import get_default_pipeline
+from linuxforhealth.edi.support import construct_fhir_resource
+from linuxforhealth.edi.workflows import EdiWorkflow
+import pytest
+
+
+@pytest.fixture
+def fhir_xml_bytes(fhir_xml_message) -> bytes:
+    return fhir_xml_message.encode("utf-8")
+
+
+@pytest.fixture
+def fhir_bundle() -> dict:
+    """A Bundle containing resources with contained resources, primitive extensions and repeating elements"""
+    extension = {"url": "http://example.org", "valueString": "x"}
+    observation = {
+        "resourceType": "Observation",
+        "id": "observation",
+        "status": "final",
+        "_status": {"extension": [extension]},
+        "code": {"coding": [{"system": "http://loinc.org", "code": "2345-7"}]},
+        "valueQuantity": {"value": 5.4, "unit": "mg/dL"},
+        "contained": [{"resourceType": "Patient", "id": "patient", "active": True}],
+        "component": [
+            {"code": {"text": "a"}, "valueBoolean": False},
+            {"code": {"text": "b"}, "valueInteger": 3},
+        ],
+    }
+    patient = {
+        "resourceType": "Patient",
+        "id": "patient",
+        "identifier": [{"system": "http://hl7.org/fhir/sid/us-npi", "value": "1"}],
+        "name": [
+            {"given": ["Amy", "V."], "_given": [None, {"extension": [extension]}]}
+        ],
+    }
+    return {
+        "resourceType": "Bundle",
+        "type": "collection",
+        "entry": [{"resource": observation}, {"resource": patient}],
+    }
+
+
+def test_is_fhir_xml(fhir_xml_bytes, fhir_json_message):
+    assert is_fhir_xml(fhir_xml_bytes)
+    assert not is_fhir_xml(b"<ClinicalDocument xmlns='urn:hl7-org:v3'/>")
+    assert not is_fhir_xml(fhir_json_message.encode("utf-8"))
+
+
+def test_scan_fhir_xml(fhir_xml_bytes):
+    summary = scan_fhir_xml(fhir_xml_bytes)
+    assert summary.resource_type == "Patient"
+    assert summary.profiles == [
+        "http://hl7.org/fhir/us/core/StructureDefinition/us-core-patient"
+    ]
+    assert summary.element_names[:3] == ["id", "meta", "text"]
+    assert summary.specification_version() == "R4"
+
+    with pytest.raises(EdiDataValidationException, match="not well formed"):
+        scan_fhir_xml(fhir_xml_bytes[:-20])
+
+    with pytest.raises(EdiDataValidationException, match="not a FHIR resource"):
+        scan_fhir_xml(b"<Patient/>")
+
+
+def test_load_fhir_xml(fhir_xml_bytes, fhir_json_message):
+    expected_resource = construct_fhir_resource(
+        "R4", "Patient", json.loads(fhir_json_message)
+    )
+    fhir_resource = load_fhir_xml(memoryview(fhir_xml_bytes), "R4")
+    assert fhir_resource.dict() == expected_resource.dict()
+
+
+def test_load_fhir_xml_bundle(fhir_bundle):
+    extension = {"url": "http://example.org", "valueString": "x"}
+    expected_resource = construct_fhir_resource("R4", "Bundle", fhir_bundle)
+    fhir_xml = expected_resource.xml().encode("utf-8")
+
+    fhir_json = convert_fhir_xml(fhir_xml, "R4")
+    patient = fhir_json["entry"][1]["resource"]
+    assert patient["name"][0]["_given"] == [None, {"extension": [extension]}]
+    assert fhir_json["entry"][0]["resource"]["contained"][0]["resourceType"] == (
+        "Patient"
+    )
+
+    assert load_fhir_xml(fhir_xml, "R4").dict() == expected_resource.dict()
+
+
+def test_load_fhir_xml_invalid(fhir_xml_message):
+    with pytest.raises(EdiDataValidationException, match="not a FHIR R4 resource"):
+        load_fhir_xml(b'<NotAResource xmlns="http://hl7.org/fhir"/>', "R4")
+
+    invalid_message = fhir_xml_message.replace("<active", "<notAnElement")
+    with pytest.raises(ValueError, match="notAnElement"):
+        load_fhir_xml(invalid_message.encode("utf-8"), "R4")
+
+
+def test_iter_fhir_xml_codes(fhir_bundle):
+    fhir_xml = construct_fhir_resource("R4", "Bundle", fhir_bundle).xml()
+    assert list(iter_fhir_xml_codes(fhir_xml.encode("utf-8"))) == [
+        ("http://loinc.org", "2345-7"),
+        ("http://hl7.org/fhir/sid/us-npi", "1"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "validation_level",
+    [ValidationLevel.ENVELOPE, ValidationLevel.STRUCTURAL, ValidationLevel.FULL],
+)
+def test_workflow_run_fhir_xml(fhir_xml_message, validation_level):
+    pipeline = get_default_pipeline(validation_level=validation_level)
+    workflow = EdiWorkflow(fhir_xml_message)
+    edi_result = workflow.run(pipeline=pipeline)
+    assert edi_result.metadata.specificationVersion == "R4"
+    assert edi_result.validationLevel == validation_level
+    if validation_level == ValidationLevel.FULL:
+        assert workflow.data_model.resource_type == "Patient"
+
+    # analysis rejects elements which are not defined by any FHIR release
+    invalid_message = fhir_xml_message.replace("<active", "<notAnElement")
+    with pytest.raises(EdiDataValidationException, match="not compatible"):
+        EdiWorkflow(invalid_message).run(pipeline=pipeline)
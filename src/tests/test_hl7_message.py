@@ -0,0 +1,68 @@
+"""
+test_hl7_message.py
+
+Tests the lazily parsed HL7v2 message.
+"""
+import hl7
+
+from linuxforhealth.edi.hl7_message import LazyHl7Message
+import pytest
+
+
+@pytest.fixture
+def hl7_text(hl7_message) -> str:
+    return hl7_message.replace("\n", "")
+
+
+def test_parse(hl7_text):
+    message = LazyHl7Message.parse(hl7_text)
+    expected_message = hl7.parse(hl7_text)
+
+    assert isinstance(message, hl7.Message)
+    assert len(message) == len(expected_message)
+    assert message.parsed_count == 0
+    assert str(message) == str(expected_message)
+
+    assert message == expected_message
+    assert message.parsed_count == len(message)
+    assert str(message) == str(expected_message)
+
+
+def test_parse_all(hl7_text):
+    message = LazyHl7Message.parse(hl7_text)
+    assert message.parse_all() is message
+    assert message.parsed_count == len(message)
+    assert message == hl7.parse(hl7_text)
+
+
+def test_parse_invalid():
+    with pytest.raises(hl7.ParseException):
+        LazyHl7Message.parse("PID|1")
+
+
+def test_segment_access(hl7_text):
+    message = LazyHl7Message.parse(hl7_text)
+    expected_message = hl7.parse(hl7_text)
+
+    assert message["PID.F3"] == expected_message["PID.F3"]
+    assert message.parsed_count == 1
+
+    assert message.segment("MSH")[9] == expected_message.segment("MSH")[9]
+    assert message[2] == expected_message[2]
+    assert message.parsed_count == 2
+
+    assert message[1:3] == expected_message[1:3]
+    assert str(message[1:3]) == str(expected_message[1:3])
+    assert message.parsed_count == 3
+
+    with pytest.raises(KeyError):
+        message.segments("ZZZ")
+
+
+def test_assign_field(hl7_text):
+    message = LazyHl7Message.parse(hl7_text)
+    expected_message = hl7.parse(hl7_text)
+
+    message["PID.F5.R1.C1"] = "SMITH"
+    expected_message["PID.F5.R1.C1"] = "SMITH"
+    assert str(message) == str(expected_message)
@@ -0,0 +1,384 @@
+"""
+test_journal.py
+
+Tests the BatchJournal and resumable batch runs.
+"""
+import gzip
+import json
+import os
+import tracemalloc
+import zipfile
+
+from linuxforhealth.edi import workflows as workflows_module
+from linuxforhealth.edi.config import get_settings
+from linuxforhealth.edi.exceptions import EdiDataValidationException
+from linuxforhealth.edi.journal import BatchJournal, JournalOutcome
+from linuxforhealth.edi.models import CompressionFormat, EdiResult
+from linuxforhealth.edi.pipeline import EdiPipeline, get_default_pipeline
+from linuxforhealth.edi.support import MemoryTracer
+from linuxforhealth.edi.workflows import (
+    LARGE_FILE_MEMORY_FACTOR,
+    MEMORY_FACTOR,
+    BatchWorkflow,
+    _process_file,
+    get_large_file_pipeline,
+    load_workflow_from_file,
+    load_workflows_from_file,
+)
+from tests.test_x12_validation import _create_837
+import pytest
+
+
+@pytest.fixture
+def batch_files(tmp_path, hl7_message, x12_message):
+    """Writes two valid messages and one invalid message to separate files"""
+    file_paths = []
+    for file_name, contents in (
+        ("message.hl7", hl7_message),
+        ("message.x12", x12_message),
+        ("invalid.txt", "IS"),
+    ):
+        file_path = tmp_path / file_name
+        file_path.write_text(contents)
+        file_paths.append(str(file_path))
+    return file_paths
+
+
+def test_journal_record(tmp_path):
+    journal_path = str(tmp_path / "journal.log")
+    with BatchJournal(journal_path, sync_batch_size=1) as journal:
+        journal.record("a.x12", 100, 200, "abc", JournalOutcome.SUCCESS)
+        journal.record("b.x12", 10, 20, None, JournalOutcome.FAILURE)
+        assert journal.is_processed("a.x12", 100, 200)
+
+    with BatchJournal(journal_path) as journal:
+        assert len(journal.index) == 2
+        assert journal.is_processed("a.x12", 100, 200)
+        assert not journal.is_processed("a.x12", 101, 200)
+        assert not journal.is_processed("a.x12", 100, 201)
+        assert journal.is_processed("b.x12", 10, 20)
+        assert not journal.is_processed("b.x12", 10, 20, retry_failed=True)
+        assert not journal.is_processed("c.x12", 1, 1)
+
+
+def test_journal_partial_line(tmp_path):
+    journal_path = tmp_path / "journal.log"
+    entry = {
+        "path": os.path.abspath("a.x12"),
+        "size": 1,
+        "mtime": 2,
+        "checksum": None,
+        "outcome": "success",
+    }
+    journal_path.write_text(json.dumps(entry) + '\n{"path": "b.x1')
+
+    with BatchJournal(str(journal_path)) as journal:
+        assert list(journal.index) == [os.path.abspath("a.x12")]
+        journal.record("c.x12", 3, 4, None, JournalOutcome.SUCCESS)
+
+    with BatchJournal(str(journal_path)) as journal:
+        assert journal.is_processed("a.x12", 1, 2)
+        assert journal.is_processed("c.x12", 3, 4)
+
+
+def test_batch_workflow(batch_files):
+    results = list(BatchWorkflow(batch_files, batch_size=2).run())
+    assert [p for p, _ in results] == batch_files
+    assert isinstance(results[0][1], EdiResult)
+    assert isinstance(results[1][1], EdiResult)
+    assert isinstance(results[2][1], EdiDataValidationException)
+
+
+def test_batch_workflow_resume(tmp_path, batch_files):
+    journal_path = str(tmp_path / "journal.log")
+
+    # simulates an interrupted run which processed the first file
+    batch_workflow = BatchWorkflow(batch_files[0:1], journal_path=journal_path)
+    assert len(list(batch_workflow.run())) == 1
+
+    batch_workflow = BatchWorkflow(batch_files, journal_path=journal_path)
+    results = list(batch_workflow.run())
+    assert [p for p, _ in results] == batch_files[1:]
+    assert batch_workflow.skipped_count == 1
+    assert batch_workflow.processed_count == 2
+
+    with BatchJournal(journal_path) as journal:
+        outcomes = [journal.index[os.path.abspath(p)].outcome for p in batch_files]
+        assert outcomes == [
+            JournalOutcome.SUCCESS,
+            JournalOutcome.SUCCESS,
+            JournalOutcome.FAILURE,
+        ]
+        assert journal.index[os.path.abspath(batch_files[1])].checksum is not None
+
+    # completed runs are skipped, unless failures are retried
+    batch_workflow = BatchWorkflow(batch_files, journal_path=journal_path)
+    assert list(batch_workflow.run()) == []
+    assert batch_workflow.skipped_count == 3
+
+    batch_workflow = BatchWorkflow(
+        batch_files, journal_path=journal_path, retry_failed=True
+    )
+    assert [p for p, _ in batch_workflow.run()] == batch_files[2:]
+
+
+def test_batch_workflow_missing_file(tmp_path, batch_files):
+    journal_path = str(tmp_path / "journal.log")
+    missing_path = str(tmp_path / "missing.x12")
+    results = list(
+        BatchWorkflow([missing_path] + batch_files, journal_path=journal_path).run()
+    )
+    assert results[0][0] == missing_path
+    assert isinstance(results[0][1], OSError)
+    assert len(results) == 4
+
+
+def test_batch_workflow_metrics(batch_files):
+    pipeline = EdiPipeline(
+        get_default_pipeline(enrich=False).stages, memory_sample_rate=1
+    )
+    batch_workflow = BatchWorkflow(batch_files, pipeline=pipeline)
+    results = [r for _, r in batch_workflow.run()]
+
+    metrics = batch_workflow.metrics
+    assert metrics.analyzeTime == pytest.approx(
+        sum(r.metrics.analyzeTime for r in results[0:2])
+    )
+    assert set(metrics.memory) == {"analyze", "validate", "translate"}
+    assert metrics.memory["translate"].sampleCount == 2
+    assert metrics.memory["translate"].peakBytes == max(
+        r.metrics.memory["translate"].peakBytes for r in results[0:2]
+    )
+
+
+def test_batch_workflow_large_files(batch_files):
+    results = list(BatchWorkflow(batch_files, large_file_size=1).run())
+    assert [p for p, _ in results] == batch_files
+    hl7_result, x12_result = results[0][1], results[1][1]
+    assert hl7_result.validationLevel == "structural"
+    assert x12_result.validationLevel == "structural"
+    assert x12_result.translation is None
+    assert x12_result.metadata.checksum
+    assert isinstance(results[2][1], EdiDataValidationException)
+
+
+def test_batch_workflow_parallel(tmp_path, batch_files):
+    journal_path = str(tmp_path / "journal.log")
+    missing_path = str(tmp_path / "missing.x12")
+
+    # a budget smaller than any file processes one file at a time, largest first
+    batch_workflow = BatchWorkflow(
+        [missing_path] + batch_files,
+        journal_path=journal_path,
+        max_workers=2,
+        memory_budget=1,
+    )
+    results = list(batch_workflow.run())
+    sizes = [os.path.getsize(p) for p in batch_files]
+    assert [p for p, _ in results] == [missing_path] + [
+        p for _, p in sorted(zip(sizes, batch_files), reverse=True)
+    ]
+    assert isinstance(results[0][1], OSError)
+    results = dict(results)
+    assert isinstance(results[batch_files[0]], EdiResult)
+    assert isinstance(results[batch_files[1]], EdiResult)
+    assert isinstance(results[batch_files[2]], EdiDataValidationException)
+    assert batch_workflow.processed_count == 4
+
+    with BatchJournal(journal_path) as journal:
+        assert journal.index[os.path.abspath(batch_files[1])].checksum == (
+            results[batch_files[1]].metadata.checksum
+        )
+
+    batch_workflow = BatchWorkflow(
+        batch_files, journal_path=journal_path, max_workers=2
+    )
+    assert list(batch_workflow.run()) == []
+    assert batch_workflow.skipped_count == 3
+
+
+@pytest.fixture
+def compressed_files(tmp_path, hl7_message, x12_message):
+    """Writes a gzip file, a zip archive containing two messages, and a corrupt gzip file"""
+    gzip_path = tmp_path / "message.x12.gz"
+    gzip_path.write_bytes(gzip.compress(x12_message.encode()))
+
+    zip_path = tmp_path / "messages.zip"
+    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("adt.hl7", hl7_message)
+        archive.writestr("270.x12", x12_message)
+
+    corrupt_path = tmp_path / "corrupt.gz"
+    corrupt_path.write_bytes(gzip.compress(x12_message.encode())[0:40])
+    return [str(gzip_path), str(zip_path), str(corrupt_path)]
+
+
+def test_load_workflows_from_file(compressed_files, x12_message):
+    gzip_path, zip_path, corrupt_path = compressed_files
+
+    workflow = load_workflow_from_file(gzip_path)
+    assert workflow.input_message.text == x12_message
+    assert workflow.compression.compressionFormat == CompressionFormat.GZIP
+    assert workflow.compression.compressedSize == os.path.getsize(gzip_path)
+
+    workflows = list(load_workflows_from_file(zip_path))
+    assert [p for p, _ in workflows] == [f"{zip_path}!adt.hl7", f"{zip_path}!270.x12"]
+    assert workflows[1][1].compression.archiveMember == "270.x12"
+    with pytest.raises(EdiDataValidationException):
+        load_workflow_from_file(zip_path)
+
+    with pytest.raises(EdiDataValidationException):
+        load_workflow_from_file(corrupt_path)
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_batch_workflow_compressed_files(tmp_path, compressed_files, max_workers):
+    gzip_path, zip_path, corrupt_path = compressed_files
+    journal_path = str(tmp_path / "journal.log")
+
+    batch_workflow = BatchWorkflow(
+        compressed_files, journal_path=journal_path, max_workers=max_workers
+    )
+    results = dict(batch_workflow.run())
+    assert set(results) == {
+        gzip_path,
+        f"{zip_path}!adt.hl7",
+        f"{zip_path}!270.x12",
+        corrupt_path,
+    }
+    x12_result = results[f"{zip_path}!270.x12"]
+    assert x12_result.metadata.ediMessageFormat == "X12"
+    assert x12_result.compression.compressionFormat == CompressionFormat.ZIP
+    assert results[gzip_path].metadata.checksum == x12_result.metadata.checksum
+    assert results[gzip_path].compression.compressedChecksum != (
+        x12_result.compression.compressedChecksum
+    )
+    assert isinstance(results[corrupt_path], EdiDataValidationException)
+    assert batch_workflow.processed_count == 3
+
+    with BatchJournal(journal_path) as journal:
+        entry = journal.index[os.path.abspath(zip_path)]
+        assert entry.outcome == JournalOutcome.SUCCESS
+        assert entry.checksum == x12_result.compression.compressedChecksum
+        assert (
+            journal.index[os.path.abspath(corrupt_path)].outcome
+            == JournalOutcome.FAILURE
+        )
+
+
+@pytest.fixture
+def large_files(tmp_path, hl7_message):
+    """Writes an X12 and an HL7 message, each about 2MB, to separate files"""
+    x12_path = tmp_path / "large.x12"
+    x12_path.write_text(_create_837(provider_count=20, subscriber_count=200))
+
+    segments = [s for s in hl7_message.split("\r") if s.strip()]
+    hl7_path = tmp_path / "large.hl7"
+    hl7_path.write_text("\r".join(segments[:1] + segments[1:] * 4000) + "\r")
+    return [str(x12_path), str(hl7_path)]
+
+
+def test_process_large_file_memory(large_files):
+    pipeline = get_large_file_pipeline()
+    # loads the parsers and models outside of the measured block
+    for file_path in large_files:
+        _process_file(file_path, pipeline, memory_map=True)
+
+    tracemalloc.start()
+    try:
+        for file_path in large_files:
+            with MemoryTracer() as m:
+                _, results = _process_file(file_path, pipeline, memory_map=True)
+            assert isinstance(results[0][1], EdiResult)
+            assert results[0][1].validationLevel == "structural"
+
+            size = os.path.getsize(file_path)
+            assert size > 1024 * 1024
+            # segments are scanned over the memory mapped file, which is not traced
+            assert m.peak_bytes < size * LARGE_FILE_MEMORY_FACTOR
+            assert m.peak_bytes < size / 10
+    finally:
+        tracemalloc.stop()
+
+
+def test_inspect_large_files(tmp_path, large_files):
+    size = os.path.getsize(large_files[0])
+    batch_workflow = BatchWorkflow(large_files, large_file_size=size)
+    assert batch_workflow._inspect(large_files[0], size) == (
+        size,
+        True,
+        size * LARGE_FILE_MEMORY_FACTOR,
+    )
+
+    # compressed files are planned by their decompressed size, and are loaded into memory, as is FHIR JSON
+    gzip_path = str(tmp_path / "large.x12.gz")
+    with open(large_files[0], "rb") as f, gzip.open(gzip_path, "wb") as g:
+        g.write(f.read())
+    gzip_size = os.path.getsize(gzip_path)
+    assert batch_workflow._inspect(gzip_path, gzip_size) == (
+        size,
+        True,
+        size * MEMORY_FACTOR,
+    )
+
+    zip_path = str(tmp_path / "large.zip")
+    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.write(large_files[0], "large.x12")
+        archive.writestr("small.x12", "ISA")
+    assert batch_workflow._inspect(zip_path, os.path.getsize(zip_path))[0:2] == (
+        size,
+        True,
+    )
+
+    json_path = tmp_path / "large.json"
+    json_path.write_text(' \n{"resourceType": "Patient"}' + " " * size)
+    json_size = os.path.getsize(json_path)
+    assert batch_workflow._inspect(str(json_path), json_size) == (
+        json_size,
+        True,
+        json_size * MEMORY_FACTOR,
+    )
+
+
+def test_batch_workflow_large_compressed_file(tmp_path, large_files):
+    gzip_path = str(tmp_path / "large.x12.gz")
+    with open(large_files[0], "rb") as f, gzip.open(gzip_path, "wb") as g:
+        g.write(f.read())
+
+    # the compressed file is smaller than the large file size, and its message is not
+    large_file_size = os.path.getsize(large_files[0])
+    assert os.path.getsize(gzip_path) < large_file_size
+    results = list(BatchWorkflow([gzip_path], large_file_size=large_file_size).run())
+    assert results[0][1].validationLevel == "structural"
+    assert results[0][1].compression.compressionFormat == CompressionFormat.GZIP
+
+
+def test_batch_workflow_buffer_size(monkeypatch, compressed_files):
+    monkeypatch.setattr(workflows_module, "BATCH_BUFFER_SIZE", 1)
+    batch_sizes = []
+    run_batch = EdiPipeline.run_batch
+
+    def count_run_batch(self, workflows):
+        batch_sizes.append(len(workflows))
+        return run_batch(self, workflows)
+
+    monkeypatch.setattr(EdiPipeline, "run_batch", count_run_batch)
+    results = list(BatchWorkflow(compressed_files).run())
+    assert len(results) == 4
+    # each message is processed as it is read
+    assert max(batch_sizes) == 1
+
+
+def test_max_decompressed_size(monkeypatch, compressed_files, x12_message):
+    gzip_path, zip_path, _ = compressed_files
+    monkeypatch.setenv("LFH_EDI_MAX_DECOMPRESSED_SIZE", str(len(x12_message) - 1))
+    get_settings.cache_clear()
+    try:
+        with pytest.raises(EdiDataValidationException, match="byte limit"):
+            load_workflow_from_file(gzip_path)
+        with pytest.raises(
+            EdiDataValidationException, match="Archive member .* exceeds"
+        ):
+            list(load_workflows_from_file(zip_path))
+    finally:
+        get_settings.cache_clear()
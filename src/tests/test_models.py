@@ -8,6 +8,11 @@ from linuxforhealth.edi.models import (
     EdiProcessingMetrics,
     EdiMessageMetadata,
     EdiResult,
+    DicomSeriesSummary,
+    DicomStudySummary,
+    EdiInstanceFailure,
+    EdiStudyResult,
+    EdiCode,
 )
 
 
@@ -17,6 +22,31 @@ def test_edi_processing_metrics():
     assert metrics
 
 
+def test_edi_processing_metrics_add():
+    data = EdiProcessingMetrics.Config.schema_extra["example"]
+    metrics = EdiProcessingMetrics()
+    example_metrics = EdiProcessingMetrics(**data)
+    metrics.add(example_metrics)
+    metrics.add(EdiProcessingMetrics(analyzeTime=1.0))
+    assert metrics.analyzeTime == data["analyzeTime"] + 1.0
+    assert metrics.totalTime == data["totalTime"] + 1.0
+
+    metrics.add(
+        EdiProcessingMetrics(
+            memory={
+                "translate": {"peakBytes": 100, "netBytes": 10, "allocatedBlocks": 1}
+            }
+        )
+    )
+    translate_memory = metrics.memory["translate"]
+    assert translate_memory.peakBytes == 1843200
+    assert translate_memory.netBytes == 524288 + 10
+    assert translate_memory.allocatedBlocks == 4096 + 1
+    assert translate_memory.sampleCount == 2
+    # the added metrics are not modified
+    assert example_metrics.memory["translate"].netBytes == 524288
+
+
 def test_edi_message_metadata():
     data = EdiMessageMetadata.Config.schema_extra["example"]
     edi_message_metadata = EdiMessageMetadata(**data)
@@ -27,3 +57,33 @@ def test_edi_result():
     data = EdiResult.Config.schema_extra["example"]
     edi_result = EdiResult(**data)
     assert edi_result
+
+
+def test_dicom_series_summary():
+    data = DicomSeriesSummary.Config.schema_extra["example"]
+    dicom_series_summary = DicomSeriesSummary(**data)
+    assert dicom_series_summary
+
+
+def test_dicom_study_summary():
+    data = DicomStudySummary.Config.schema_extra["example"]
+    dicom_study_summary = DicomStudySummary(**data)
+    assert dicom_study_summary
+
+
+def test_edi_instance_failure():
+    data = EdiInstanceFailure.Config.schema_extra["example"]
+    edi_instance_failure = EdiInstanceFailure(**data)
+    assert edi_instance_failure
+
+
+def test_edi_study_result():
+    data = EdiStudyResult.Config.schema_extra["example"]
+    edi_study_result = EdiStudyResult(**data)
+    assert edi_study_result
+
+
+def test_edi_code():
+    data = EdiCode.Config.schema_extra["example"]
+    edi_code = EdiCode(**data)
+    assert edi_code
@@ -0,0 +1,192 @@
+"""
+test_pipeline.py
+
+Tests EdiPipeline stage registration and execution.
+"""
+import json
+from typing import List
+import tracemalloc
+
+from linuxforhealth.edi import pipeline as pipeline_module
+from linuxforhealth.edi.dedupe import DedupeIndex
+from linuxforhealth.edi.exceptions import (
+    EdiDataValidationException,
+    EdiEnrichmentException,
+)
+from linuxforhealth.edi.models import EdiMessageFormat
+from linuxforhealth.edi.pipeline import (
+    AnalyzeStage,
+    DedupeStage,
+    EdiPipeline,
+    EdiStage,
+    EnrichStage,
+    TranslateStage,
+    ValidateStage,
+    get_default_pipeline,
+)
+from linuxforhealth.edi.support import dump_edi_result
+from linuxforhealth.edi.workflows import EdiWorkflow, run_workflows
+import pytest
+
+
+class BatchCountingStage(EdiStage):
+    """Records the size of each batch processed for X12 messages"""
+
+    name = "count"
+    inputs = frozenset({"meta_data"})
+    formats = frozenset({EdiMessageFormat.X12})
+
+    def __init__(self):
+        self.batch_sizes: List[int] = []
+
+    def process(self, workflow):
+        self.batch_sizes.append(1)
+
+    def process_batch(self, workflows):
+        self.batch_sizes.append(len(workflows))
+        return [None] * len(workflows)
+
+
+class FailingStage(EdiStage):
+    """Fails for HL7 messages"""
+
+    name = "fail"
+    inputs = frozenset({"meta_data"})
+    exception_class = EdiEnrichmentException
+
+    def process(self, workflow):
+        if workflow.meta_data.ediMessageFormat == EdiMessageFormat.HL7:
+            raise RuntimeError("failed")
+
+
+def test_default_pipeline():
+    pipeline = get_default_pipeline()
+    assert pipeline.stage_names == ["analyze", "enrich", "validate", "translate"]
+    assert get_default_pipeline() is pipeline
+
+    pipeline = get_default_pipeline(enrich=False, translate=False)
+    assert pipeline.stage_names == ["analyze", "validate"]
+
+
+def test_pipeline_register():
+    pipeline = EdiPipeline([AnalyzeStage(), ValidateStage()])
+    pipeline.register(EnrichStage(), before="validate")
+    pipeline.register(TranslateStage(), after="validate")
+    assert pipeline.stage_names == ["analyze", "enrich", "validate", "translate"]
+
+    with pytest.raises(ValueError):
+        pipeline.register(EnrichStage())
+
+    with pytest.raises(ValueError):
+        pipeline.unregister("validate")
+
+    pipeline.unregister("translate")
+    assert pipeline.stage_names == ["analyze", "enrich", "validate"]
+
+
+def test_pipeline_missing_inputs():
+    with pytest.raises(ValueError):
+        EdiPipeline([ValidateStage(), AnalyzeStage()])
+
+
+def test_pipeline_run(hl7_message, x12_message):
+    counting_stage = BatchCountingStage()
+    pipeline = EdiPipeline([AnalyzeStage(), counting_stage])
+
+    hl7_workflow = EdiWorkflow(hl7_message)
+    hl7_workflow.run(pipeline=pipeline)
+    assert hl7_workflow.operations == ["analyze"]
+
+    x12_workflow = EdiWorkflow(x12_message)
+    edi_result = x12_workflow.run(pipeline=pipeline)
+    assert x12_workflow.operations == ["analyze", "count"]
+    assert x12_workflow.data_model is None
+    assert edi_result.metrics.analyzeTime > 0.0
+
+
+def test_pipeline_run_exception(hl7_message):
+    pipeline = EdiPipeline([AnalyzeStage(), FailingStage()])
+    with pytest.raises(EdiEnrichmentException):
+        EdiWorkflow(hl7_message).run(pipeline=pipeline)
+
+
+def test_pipeline_stream(hl7_message, x12_message):
+    counting_stage = BatchCountingStage()
+    pipeline = EdiPipeline([AnalyzeStage(), FailingStage(), counting_stage])
+    workflows = [EdiWorkflow(m) for m in (x12_message, hl7_message, x12_message)]
+
+    results = list(pipeline.stream(workflows, batch_size=2))
+    assert [w for w, _ in results] == workflows
+    assert results[0][1] is None
+    assert isinstance(results[1][1], EdiEnrichmentException)
+    assert results[2][1] is None
+    assert counting_stage.batch_sizes == [1, 1]
+    assert workflows[1].operations == ["analyze"]
+
+
+def test_pipeline_stream_failure(x12_message, tmp_path, monkeypatch):
+    load_count = 0
+    load_x12_parallel = pipeline_module.load_x12_parallel
+
+    def count_load_x12_parallel(*args):
+        nonlocal load_count
+        load_count += 1
+        return load_x12_parallel(*args)
+
+    monkeypatch.setattr(pipeline_module, "load_x12_parallel", count_load_x12_parallel)
+    pipeline = EdiPipeline(
+        [
+            AnalyzeStage(),
+            DedupeStage(DedupeIndex(str(tmp_path)), skip=False),
+            ValidateStage(),
+        ]
+    )
+    # distinct messages, with an invalid message in the middle of the batch
+    messages = [
+        x12_message.replace("BHT*0022*13*10001234", f"BHT*0022*13*1000123{i}")
+        for i in range(10)
+    ]
+    # the date passes the structural checks, and fails when the data model is loaded
+    messages[4] = x12_message.replace("DTP*291*D8*20200101", "DTP*291*D8*20201301")
+    workflows = [EdiWorkflow(m) for m in messages]
+
+    exceptions = pipeline.run_batch(workflows)
+    assert [i for i, ex in enumerate(exceptions) if ex is not None] == [4]
+    assert isinstance(exceptions[4], EdiDataValidationException)
+    # each stage runs once per message, so no message is a duplicate of itself
+    assert load_count == 10
+    assert not any(w.duplicate for w in workflows)
+    assert workflows[0].operations == ["analyze", "dedupe", "validate"]
+    assert workflows[4].operations == ["analyze", "dedupe"]
+
+
+def test_run_workflows(hl7_message, x12_message, fhir_json_message):
+    results = list(run_workflows([hl7_message, "IS", x12_message, fhir_json_message]))
+    assert len(results) == 4
+    assert results[0].metadata.ediMessageFormat == EdiMessageFormat.HL7
+    assert isinstance(results[1], EdiDataValidationException)
+    assert results[2].metadata.ediMessageFormat == EdiMessageFormat.X12
+    assert results[3].metadata.ediMessageFormat == EdiMessageFormat.FHIR
+    assert results[3].metrics.validateTime > 0.0
+
+
+def test_pipeline_memory_sampling(hl7_message, x12_message):
+    stages = get_default_pipeline(enrich=False).stages
+    pipeline = EdiPipeline(stages, memory_sample_rate=1)
+
+    results = list(run_workflows([hl7_message, x12_message], pipeline=pipeline))
+    for result in results:
+        assert set(result.metrics.memory) == {"analyze", "validate", "translate"}
+        translate_memory = result.metrics.memory["translate"]
+        assert translate_memory.peakBytes > 0
+        assert translate_memory.peakBytes >= translate_memory.netBytes
+        assert json.loads(dump_edi_result(result))["metrics"]["memory"]["translate"]
+    assert not tracemalloc.is_tracing()
+
+    results = list(
+        run_workflows(
+            [hl7_message, x12_message],
+            pipeline=EdiPipeline(stages, memory_sample_rate=0),
+        )
+    )
+    assert all(r.metrics.memory is None for r in results)
@@ -0,0 +1,148 @@
+"""
+test_pool.py
+
+Tests WorkerPool time limits, worker recycling and failures.
+"""
+import os
+import time
+
+from linuxforhealth.edi.exceptions import EdiTimeoutException, EdiWorkerException
+from linuxforhealth.edi import pool as pool_module
+from linuxforhealth.edi.pool import WorkerPool
+from linuxforhealth.edi.workflows import BatchWorkflow
+import pytest
+from tests.test_x12_validation import _create_837
+
+
+def _sleep(seconds: float) -> int:
+    time.sleep(seconds)
+    return os.getpid()
+
+
+def _spin(seconds: float) -> int:
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+    return os.getpid()
+
+
+def _exit() -> None:
+    os._exit(3)
+
+
+def _fail() -> None:
+    raise ValueError("task failed")
+
+
+def _collect(pool: WorkerPool) -> dict:
+    results = {}
+    while pool.busy_count:
+        results.update(pool.wait())
+    return results
+
+
+def test_worker_pool():
+    with WorkerPool(2) as pool:
+        assert pool.wait() == []
+        pool.submit("a", _sleep, 0)
+        pool.submit("b", _fail)
+        assert pool.idle_count == 0
+        with pytest.raises(RuntimeError):
+            pool.submit("c", _sleep, 0)
+
+        results = _collect(pool)
+        assert isinstance(results["a"], int)
+        assert isinstance(results["b"], ValueError)
+        assert pool.idle_count == 2
+
+
+def test_worker_pool_message_timeout():
+    with WorkerPool(2, message_timeout=0.5) as pool:
+        pool.submit("slow", _sleep, 30)
+        pool.submit("fast", _sleep, 0)
+        start = time.monotonic()
+        results = _collect(pool)
+        assert time.monotonic() - start < 10
+        assert isinstance(results["slow"], EdiTimeoutException)
+        assert isinstance(results["fast"], int)
+        assert pool.timeout_count == 1
+
+        # the killed worker is replaced
+        pool.submit("a", _sleep, 0)
+        pool.submit("b", _sleep, 0)
+        results = _collect(pool)
+        assert all(isinstance(r, int) for r in results.values())
+
+
+def test_worker_pool_cpu_timeout():
+    with WorkerPool(1, cpu_timeout=0.2) as pool:
+        pool.submit("spin", _spin, 30)
+        results = _collect(pool)
+        assert isinstance(results["spin"], EdiTimeoutException)
+        assert pool.timeout_count == 1
+
+        pool.submit("sleep", _sleep, 0.5)
+        assert isinstance(_collect(pool)["sleep"], int)
+
+
+def test_worker_pool_limits_unavailable(monkeypatch):
+    # platforms without the resource module, such as Windows
+    monkeypatch.setattr(pool_module, "resource", None)
+    with pytest.raises(NotImplementedError, match="CPU time"):
+        WorkerPool(1, cpu_timeout=1)
+
+    with WorkerPool(1) as pool:
+        pool.submit("a", _sleep, 0)
+        assert isinstance(_collect(pool)["a"], int)
+
+
+def test_worker_pool_recycling():
+    with WorkerPool(1, max_messages_per_worker=2) as pool:
+        pids = []
+        for i in range(4):
+            pool.submit(i, _sleep, 0)
+            pids.append(_collect(pool)[i])
+        assert pids[0] == pids[1]
+        assert pids[1] != pids[2]
+        assert pids[2] == pids[3]
+        assert pool.recycled_count == 2
+
+    with WorkerPool(1, max_worker_rss=1) as pool:
+        pool.submit("a", _sleep, 0)
+        pid = _collect(pool)["a"]
+        pool.submit("b", _sleep, 0)
+        assert _collect(pool)["b"] != pid
+        assert pool.recycled_count == 2
+
+
+def test_worker_pool_worker_exit():
+    with WorkerPool(1) as pool:
+        pool.submit("exit", _exit)
+        results = _collect(pool)
+        assert isinstance(results["exit"], EdiWorkerException)
+        assert "3" in str(results["exit"])
+
+        pool.submit("a", _sleep, 0)
+        assert isinstance(_collect(pool)["a"], int)
+
+
+def test_batch_workflow_message_timeout(tmp_path, x12_message):
+    file_path = tmp_path / "message.x12"
+    file_path.write_text(x12_message)
+
+    results = list(BatchWorkflow([str(file_path)], message_timeout=0.001).run())
+    assert isinstance(results[0][1], EdiTimeoutException)
+
+    results = list(BatchWorkflow([str(file_path)], message_timeout=60).run())
+    assert results[0][1].metadata.ediMessageFormat == "X12"
+
+
+def test_batch_workflow_cpu_timeout(tmp_path):
+    # loading the X12 data model takes several CPU seconds, so the limit is reached within load_x12
+    file_path = tmp_path / "large.x12"
+    file_path.write_text(_create_837(provider_count=20, subscriber_count=100))
+
+    start = time.monotonic()
+    results = list(BatchWorkflow([str(file_path)], cpu_timeout=0.05).run())
+    assert isinstance(results[0][1], EdiTimeoutException)
+    assert time.monotonic() - start < 30
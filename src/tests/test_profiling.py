@@ -0,0 +1,99 @@
+"""
+test_profiling.py
+
+Tests message profiling and collapsed stack output.
+"""
+import os
+import pstats
+import time
+
+from linuxforhealth.edi.pipeline import AnalyzeStage, EdiPipeline, EdiStage
+from linuxforhealth.edi.profiling import MessageProfiler, StackSampler
+from linuxforhealth.edi.workflows import EdiWorkflow, run_workflows
+import pytest
+
+
+class SleepStage(EdiStage):
+    """Sleeps for X12 messages, simulating a slow parser"""
+
+    name = "sleep"
+    inputs = frozenset({"meta_data"})
+
+    def process(self, workflow: "EdiWorkflow") -> None:
+        if workflow.meta_data.ediMessageFormat == "X12":
+            time.sleep(0.1)
+
+
+def _busy_wait(seconds: float) -> None:
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        pass
+
+
+def test_stack_sampler():
+    sampler = StackSampler(interval=0.001)
+    sampler.start()
+    _busy_wait(0.1)
+    stacks = sampler.stop()
+    assert sum(stacks.values()) > 10
+    assert any(s.endswith("test_profiling.py:_busy_wait") for s in stacks)
+
+
+def test_message_profiler_every(tmp_path, hl7_message, x12_message):
+    profiler = MessageProfiler(str(tmp_path), every=2)
+    pipeline = EdiPipeline([AnalyzeStage()], profiler=profiler)
+
+    results = list(
+        run_workflows([hl7_message, x12_message, hl7_message], pipeline=pipeline)
+    )
+    assert profiler.message_count == 3
+    assert profiler.profiled_count == 1
+
+    checksum = results[1].metadata.checksum
+    dump_path = tmp_path / f"x12-{checksum}.prof"
+    assert [p.name for p in tmp_path.glob("*.prof")] == [dump_path.name]
+    stats = pstats.Stats(str(dump_path))
+    assert any(name == "analyze" for _, _, name in stats.stats)
+
+
+def test_message_profiler_every_aggregate(tmp_path, hl7_message, x12_message):
+    profiler = MessageProfiler(str(tmp_path), every=1, sample_interval=0.001)
+    pipeline = EdiPipeline([AnalyzeStage(), SleepStage()], profiler=profiler)
+
+    workflows = [EdiWorkflow(hl7_message), EdiWorkflow(x12_message)]
+    assert pipeline.run_batch(workflows) == [None, None]
+    assert profiler.profiled_count == 2
+
+    # messages profiled with cProfile are sampled into the aggregate stacks
+    lines = open(profiler.aggregate_path).read().splitlines()
+    assert any("test_profiling.py:process" in line for line in lines)
+    assert not list(tmp_path.glob("x12-*.collapsed"))
+
+
+def test_message_profiler_slower_than(tmp_path, hl7_message, x12_message):
+    profiler = MessageProfiler(str(tmp_path), slower_than=0.05, sample_interval=0.001)
+    pipeline = EdiPipeline([AnalyzeStage(), SleepStage()], profiler=profiler)
+
+    workflows = [EdiWorkflow(hl7_message), EdiWorkflow(x12_message)]
+    assert pipeline.run_batch(workflows) == [None, None]
+    assert workflows[1].operations == ["analyze", "sleep"]
+    assert profiler.profiled_count == 1
+
+    dump_path = tmp_path / f"x12-{workflows[1].meta_data.checksum}.collapsed"
+    lines = dump_path.read_text().splitlines()
+    assert any("test_profiling.py:process" in line for line in lines)
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert int(count) > 0
+
+    assert os.path.exists(profiler.aggregate_path)
+
+
+def test_message_profiler_failed_message(tmp_path):
+    profiler = MessageProfiler(str(tmp_path), every=1)
+    pipeline = EdiPipeline([AnalyzeStage()], profiler=profiler)
+    assert pipeline.run_batch([EdiWorkflow("invalid message")])[0] is not None
+    assert [p.name for p in tmp_path.glob("*.prof")][0].startswith("unknown-")
+
+    with pytest.raises(ValueError):
+        MessageProfiler(str(tmp_path))
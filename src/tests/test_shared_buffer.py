@@ -0,0 +1,57 @@
+"""
+test_shared_buffer.py
+
+Tests transferring messages to worker processes through shared memory.
+"""
+from multiprocessing.shared_memory import SharedMemory
+
+from linuxforhealth.edi.pipeline import EdiPipeline, AnalyzeStage, ValidateStage
+from linuxforhealth.edi.shared_buffer import SharedMessageBlock, attach_shared_buffers
+from linuxforhealth.edi.support import EdiMessageBuffer
+from linuxforhealth.edi.workflows import run_workflows
+import pytest
+
+
+def test_shared_message_block(hl7_message, x12_message):
+    messages = [hl7_message, x12_message.encode("utf-8"), b"", EdiMessageBuffer("IS")]
+    with SharedMessageBlock(messages) as block:
+        assert [r.offset for r in block.refs] == [
+            0,
+            len(hl7_message),
+            len(hl7_message) + len(x12_message),
+            len(hl7_message) + len(x12_message),
+        ]
+        assert [r.is_binary for r in block.refs] == [False, True, True, False]
+        assert block.size == len(hl7_message) + len(x12_message) + 2
+
+        with attach_shared_buffers(block.refs) as buffers:
+            assert buffers[0].text == hl7_message
+            assert bytes(buffers[1].data) == x12_message.encode("utf-8")
+            assert buffers[2].text == ""
+            assert buffers[3].text == "IS"
+            views = [b.data for b in buffers]
+
+        # views are released when the context exits
+        with pytest.raises(ValueError):
+            bytes(views[0])
+
+    # the block is unlinked when it is closed
+    with pytest.raises(FileNotFoundError):
+        SharedMemory(name=block.refs[0].name)
+
+
+def test_run_workflows_parallel(hl7_message, x12_message, fhir_json_message):
+    messages = [hl7_message, "IS", x12_message, fhir_json_message] * 3
+    pipeline = EdiPipeline([AnalyzeStage(), ValidateStage()])
+
+    expected_results = list(run_workflows(messages, pipeline=pipeline))
+    results = list(
+        run_workflows(messages, pipeline=pipeline, batch_size=2, max_workers=2)
+    )
+
+    assert len(results) == len(expected_results) == 12
+    for result, expected_result in zip(results, expected_results):
+        assert type(result) == type(expected_result)
+        if not isinstance(result, Exception):
+            assert result.metadata == expected_result.metadata
+            assert result.validationLevel == expected_result.validationLevel
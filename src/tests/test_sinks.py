@@ -0,0 +1,151 @@
+"""
+test_sinks.py
+
+Tests buffered result sinks and result flattening.
+"""
+import json
+import sqlite3
+
+from linuxforhealth.edi.exceptions import EdiDataValidationException
+from linuxforhealth.edi.sinks import (
+    NdjsonResultSink,
+    ParquetResultSink,
+    RESULT_COLUMNS,
+    SqliteResultSink,
+    create_result_sink,
+    flatten_result,
+)
+from linuxforhealth.edi.workflows import EdiWorkflow
+import pytest
+
+
+@pytest.fixture
+def results(hl7_message, x12_message):
+    return [
+        ("adt.hl7", EdiWorkflow(hl7_message).run()),
+        ("270.x12", EdiWorkflow(x12_message).run()),
+        ("invalid.txt", EdiDataValidationException("invalid message")),
+    ]
+
+
+def test_flatten_result(results):
+    row = flatten_result(*results[1])
+    assert list(row) == [c for c, _ in RESULT_COLUMNS]
+    assert row["path"] == "270.x12"
+    assert row["error"] is None
+    assert row["metadata_ediMessageFormat"] == "X12"
+    assert row["metadata_implementationVersions"] == "005010X279A1"
+    assert row["metadata_messageSize"] == results[1][1].metadata.messageSize
+    assert row["metrics_totalTime"] > 0
+    assert row["compression_compressionFormat"] is None
+
+    row = flatten_result(*results[2])
+    assert row["error"] == "EdiDataValidationException: invalid message"
+    assert row["metadata_checksum"] is None
+
+
+def test_flatten_result_duplicate(results):
+    path, result = results[1]
+    assert flatten_result(path, result)["duplicate"] is None
+
+    duplicate = result.copy(update={"duplicate": True})
+    row = flatten_result(path, duplicate)
+    assert row["duplicate"] == 1
+    assert type(row["duplicate"]) is int
+
+
+def test_ndjson_sink(tmp_path, results):
+    file_path = tmp_path / "results.ndjson"
+    with NdjsonResultSink(str(file_path), buffer_size=2) as sink:
+        for result in results:
+            sink.write(*result)
+        # the first two results are written once the buffer is full
+        assert len(file_path.read_text().splitlines()) == 2
+    assert sink.count == 3
+
+    lines = [json.loads(line) for line in file_path.read_text().splitlines()]
+    assert [line["path"] for line in lines] == ["adt.hl7", "270.x12", "invalid.txt"]
+    assert lines[0]["metadata"]["ediMessageFormat"] == "HL7"
+    assert "error" in lines[2]
+
+
+def test_ndjson_sink_rotation(tmp_path, results):
+    file_path = tmp_path / "results.ndjson"
+    with NdjsonResultSink(str(file_path), max_file_size=1, buffer_size=1) as sink:
+        for result in results:
+            sink.write(*result)
+
+    assert sink.file_paths == [
+        str(file_path),
+        str(tmp_path / "results.1.ndjson"),
+        str(tmp_path / "results.2.ndjson"),
+    ]
+    for path in sink.file_paths:
+        with open(path) as f:
+            assert len(f.readlines()) == 1
+
+
+def test_sqlite_sink(tmp_path, results):
+    db_path = str(tmp_path / "results.db")
+    with SqliteResultSink(db_path, buffer_size=2) as sink:
+        for result in results:
+            sink.write(*result)
+
+    # appends to an existing table
+    with create_result_sink(db_path) as sink:
+        sink.write(*results[0])
+
+    with sqlite3.connect(db_path) as connection:
+        rows = connection.execute(
+            "SELECT path, error, metadata_ediMessageFormat FROM edi_results"
+        ).fetchall()
+    assert len(rows) == 4
+    assert rows[1] == ("270.x12", None, "X12")
+    assert rows[2][1].startswith("EdiDataValidationException")
+
+
+def test_sqlite_sink_duplicate(tmp_path, results):
+    db_path = str(tmp_path / "results.db")
+    path, result = results[1]
+    with SqliteResultSink(db_path) as sink:
+        sink.write(path, result.copy(update={"duplicate": True}))
+
+    with sqlite3.connect(db_path) as connection:
+        rows = connection.execute("SELECT duplicate FROM edi_results").fetchall()
+    assert rows == [(1,)]
+
+
+def test_parquet_sink(tmp_path, results):
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+
+    file_path = str(tmp_path / "results.parquet")
+    with ParquetResultSink(file_path, buffer_size=2) as sink:
+        for result in results:
+            sink.write(*result)
+
+    parquet_file = pyarrow_parquet.ParquetFile(file_path)
+    assert parquet_file.metadata.num_row_groups == 2
+    table = parquet_file.read()
+    assert table.column("path").to_pylist() == ["adt.hl7", "270.x12", "invalid.txt"]
+
+
+def test_parquet_sink_duplicate(tmp_path, results):
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+
+    path, result = results[1]
+    file_path = str(tmp_path / "results.parquet")
+    with ParquetResultSink(file_path) as sink:
+        sink.write(path, result.copy(update={"duplicate": True}))
+        sink.write(path, result.copy(update={"duplicate": False}))
+        sink.write(path, result)
+
+    table = pyarrow_parquet.read_table(file_path)
+    assert table.column("duplicate").to_pylist() == [1, 0, None]
+
+
+def test_create_result_sink(tmp_path):
+    with create_result_sink(str(tmp_path / "results.jsonl")) as sink:
+        assert isinstance(sink, NdjsonResultSink)
+
+    with pytest.raises(ValueError):
+        create_result_sink(str(tmp_path / "results.csv"))
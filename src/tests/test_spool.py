@@ -0,0 +1,106 @@
+"""
+test_spool.py
+
+Tests spool directory monitoring, claiming and processing.
+"""
+import json
+import os
+import threading
+
+from linuxforhealth.edi.sinks import NdjsonResultSink
+from linuxforhealth.edi.spool import (
+    SpoolWatcher,
+    _InotifyMonitor,
+    _PollingMonitor,
+)
+import pytest
+
+
+def _deliver(spool_directory, name: str, message: str) -> None:
+    """Delivers a file atomically, by writing a hidden file and renaming it"""
+    temp_path = os.path.join(spool_directory, f".{name}")
+    with open(temp_path, "w") as f:
+        f.write(message)
+    os.rename(temp_path, os.path.join(spool_directory, name))
+
+
+def _read_results(file_path) -> list:
+    with open(f"{file_path}.result.ndjson") as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.mark.parametrize("use_inotify", [True, False])
+def test_spool_watcher(tmp_path, x12_message, use_inotify):
+    spool = tmp_path / "spool"
+    with SpoolWatcher(str(spool), use_inotify=use_inotify) as watcher:
+        if use_inotify:
+            assert isinstance(watcher._monitor, _InotifyMonitor)
+        else:
+            assert isinstance(watcher._monitor, _PollingMonitor)
+
+        assert watcher.process_pending() == 0
+        _deliver(spool, "270.x12", x12_message)
+        _deliver(spool, "invalid.txt", "invalid message")
+        assert watcher.process_pending() == 2
+        assert watcher.process_pending() == 0
+
+    assert watcher.processed_count == 2
+    assert watcher.failed_count == 1
+    assert os.listdir(spool / ".claimed") == []
+    assert set(os.listdir(spool / "done")) == {"270.x12", "270.x12.result.ndjson"}
+
+    results = _read_results(spool / "done" / "270.x12")
+    assert results[0]["path"] == str(spool / "done" / "270.x12")
+    assert results[0]["metadata"]["ediMessageFormat"] == "X12"
+
+    results = _read_results(spool / "failed" / "invalid.txt")
+    assert "error" in results[0]
+
+
+def test_spool_watcher_recovery(tmp_path, x12_message):
+    spool = tmp_path / "spool"
+    os.makedirs(spool / ".claimed")
+    (spool / ".claimed" / "270.x12").write_text(x12_message)
+    (spool / "done").mkdir()
+    (spool / "done" / "270.x12").write_text(x12_message)
+
+    with SpoolWatcher(str(spool), use_inotify=False) as watcher:
+        assert os.listdir(spool / ".claimed") == []
+        assert watcher.process_pending() == 1
+
+    # the previously processed file is not replaced
+    assert os.path.exists(spool / "done" / "270.x12.1.result.ndjson")
+
+
+def test_spool_watcher_workers(tmp_path, x12_message, hl7_message):
+    spool = tmp_path / "spool"
+    spool.mkdir()
+    for i in range(5):
+        _deliver(spool, f"{i}.x12", x12_message)
+    _deliver(spool, "adt.hl7", hl7_message)
+
+    with SpoolWatcher(str(spool), max_workers=2, chunk_size=2) as watcher:
+        assert watcher.process_pending() == 6
+    assert watcher.failed_count == 0
+    assert len(os.listdir(spool / "done")) == 12
+
+
+def test_spool_watcher_run(tmp_path, x12_message):
+    spool = tmp_path / "spool"
+    output_path = tmp_path / "results.ndjson"
+    sink = NdjsonResultSink(str(output_path))
+
+    with SpoolWatcher(str(spool), poll_interval=0.05, sink=sink) as watcher:
+        thread = threading.Thread(target=watcher.run)
+        thread.start()
+        _deliver(spool, "270.x12", x12_message)
+        for _ in range(100):
+            if watcher.processed_count:
+                break
+            thread.join(0.05)
+        watcher.stop()
+        thread.join()
+    sink.close()
+
+    assert watcher.processed_count == 1
+    assert len(output_path.read_text().splitlines()) == 1
@@ -3,21 +3,52 @@ test_support.py
 
 Tests EDI support functions.
 """
-from linuxforhealth.edi.models import EdiProcessingMetrics
+import bz2
+import gzip
+from io import BytesIO
+import tracemalloc
+import zipfile
+
+from linuxforhealth.edi.models import (
+    CompressionFormat,
+    EdiProcessingMetrics,
+    EdiResult,
+    EdiStudyResult,
+    EdiMessageMetadata,
+)
 from linuxforhealth.edi.support import (
     create_checksum,
     load_xml,
     load_json,
     Timer,
+    MemoryTracer,
+    COMPRESSION_RATIO,
+    decompress_stream,
+    detect_compression,
+    estimate_decompressed_size,
+    iter_zip_members,
     load_fhir_json,
+    get_fhir_model_class,
+    construct_fhir_resource,
+    warm_up_fhir_models,
     load_hl7,
     load_x12,
+    list_dicom_instances,
+    load_dicom_header,
+    EdiMessageBuffer,
+    is_unicode,
+    dump_edi_result,
+    get_json_backend,
 )
+from linuxforhealth.edi.config import get_settings
+from linuxforhealth.edi.exceptions import EdiDataValidationException
 
 import pytest
 from lxml.etree import ParseError
 from json import JSONDecodeError
 import time
+import json
+import os
 
 
 @pytest.fixture
@@ -86,6 +117,42 @@ def test_load_fhir_json(fhir_json_message):
     assert fhir_model.resource_type == "Patient"
 
 
+def test_get_fhir_model_class():
+    model_class = get_fhir_model_class("R4", "Patient")
+    assert model_class.__name__ == "Patient"
+    assert get_fhir_model_class("R4", "Patient") is model_class
+    assert get_fhir_model_class("STU3", "Patient") is not model_class
+
+    assert get_fhir_model_class("R4", "NotAResource") is None
+    assert get_fhir_model_class("R5", "Patient") is None
+
+
+def test_construct_fhir_resource(fhir_json_message):
+    fhir_model = construct_fhir_resource("R4", "Patient", load_json(fhir_json_message))
+    assert fhir_model.resource_type == "Patient"
+
+    with pytest.raises(LookupError):
+        construct_fhir_resource("R4", "NotAResource", {})
+
+
+def test_warm_up_fhir_models(monkeypatch):
+    assert warm_up_fhir_models() == 0
+
+    # element classes referenced by the resource's fields are loaded
+    class_count = warm_up_fhir_models(["R4"], ["Patient"])
+    assert class_count > 1
+    assert (
+        warm_up_fhir_models(["R4", "STU3"], ["Patient", "NotAResource"]) > class_count
+    )
+
+    monkeypatch.setenv("LFH_EDI_FHIR_WARMUP_RESOURCE_TYPES", '["Patient"]')
+    get_settings.cache_clear()
+    try:
+        assert warm_up_fhir_models() == class_count
+    finally:
+        get_settings.cache_clear()
+
+
 def test_load_hl7(hl7_message):
     hl7_model = load_hl7(hl7_message)
     assert hl7_model is not None
@@ -102,3 +169,176 @@ def test_timer():
     with Timer() as t:
         [x for x in range(1_0000)]
     assert t.elapsed_time >= 0
+
+
+def test_memory_tracer():
+    tracemalloc.start()
+    try:
+        with MemoryTracer() as m:
+            data = [bytearray(1024) for _ in range(100)]
+            del data[50:]
+    finally:
+        tracemalloc.stop()
+    assert m.peak_bytes >= 100 * 1024
+    assert 50 * 1024 <= m.net_bytes < m.peak_bytes
+    assert m.allocated_blocks >= 50
+
+
+def test_list_dicom_instances(dicom_study_directory):
+    instance_paths = list_dicom_instances(dicom_study_directory)
+    assert len(instance_paths) == 6
+    assert instance_paths == sorted(instance_paths)
+
+
+def test_load_dicom_header(dicom_study_directory):
+    instance_path = os.path.join(dicom_study_directory, "series0", "IM0000")
+    dataset = load_dicom_header(instance_path)
+    assert dataset.StudyInstanceUID == "1.2.826.0.1.3680043.8.498.100"
+    assert "PatientName" not in dataset
+
+
+def test_edi_message_buffer_text(hl7_message):
+    message_buffer = EdiMessageBuffer(hl7_message)
+    assert not message_buffer.is_binary
+    assert message_buffer.text is hl7_message
+    assert message_buffer.parseable() is hl7_message
+    assert len(message_buffer) == 892
+    assert create_checksum(message_buffer) == create_checksum(hl7_message)
+
+
+def test_edi_message_buffer_bytes(x12_message):
+    contents = x12_message.encode("utf-8")
+    message_buffer = EdiMessageBuffer(contents, is_binary=False)
+    assert message_buffer.data is contents
+    assert message_buffer.parseable() is contents
+    assert message_buffer.text == x12_message
+    assert message_buffer.parseable() == x12_message
+    assert EdiMessageBuffer(memoryview(contents)).lead(3) == "ISA"
+
+
+@pytest.mark.parametrize(
+    "data, expected_result",
+    [
+        (b"MSH|^~\\&|", True),
+        ("café".encode("utf-8") * 300, True),
+        (b"\x00" * 128 + b"DICM\x02\x00\x00\x00\xff\xfe", False),
+    ],
+)
+def test_is_unicode(data, expected_result):
+    assert is_unicode(data) == expected_result
+
+
+@pytest.mark.parametrize("model_class", [EdiResult, EdiStudyResult, EdiMessageMetadata])
+def test_dump_edi_result(model_class):
+    edi_result = model_class(**model_class.Config.schema_extra["example"])
+    assert json.loads(dump_edi_result(edi_result)) == json.loads(edi_result.json())
+    assert json.loads(dump_edi_result(edi_result, pretty=True)) == json.loads(
+        edi_result.json()
+    )
+
+
+@pytest.fixture
+def json_backend_setting(monkeypatch):
+    """Sets the JSON backend setting, resetting cached settings before and after the test"""
+
+    def set_backend(backend_name: str):
+        monkeypatch.setenv("LFH_EDI_JSON_BACKEND", backend_name)
+        get_settings.cache_clear()
+        get_json_backend.cache_clear()
+
+    yield set_backend
+    get_settings.cache_clear()
+    get_json_backend.cache_clear()
+
+
+@pytest.mark.parametrize("backend_name", ["json", "orjson", "ujson"])
+def test_json_backend(backend_name, json_backend_setting, fhir_json_message):
+    if backend_name != "json":
+        pytest.importorskip(backend_name)
+    json_backend_setting(backend_name)
+
+    backend = get_json_backend()
+    assert backend.name == backend_name
+
+    expected_data = json.loads(fhir_json_message)
+    message_bytes = fhir_json_message.encode("utf-8")
+    assert load_json(fhir_json_message) == expected_data
+    assert load_json(memoryview(message_bytes)) == expected_data
+    assert json.loads(backend.dumps(expected_data, True)) == expected_data
+
+    with pytest.raises(JSONDecodeError):
+        load_json("<Patient/>")
+
+
+def test_json_backend_auto(json_backend_setting):
+    json_backend_setting("auto")
+    assert get_json_backend().name in ("orjson", "ujson", "json")
+
+
+@pytest.mark.parametrize(
+    "data, expected_result",
+    [
+        (gzip.compress(b"ISA*00"), CompressionFormat.GZIP),
+        (bz2.compress(b"ISA*00"), CompressionFormat.BZIP2),
+        (b"PK\x03\x04\x14\x00", CompressionFormat.ZIP),
+        (b"ISA*00", None),
+        (b"", None),
+    ],
+)
+def test_detect_compression(data, expected_result):
+    assert detect_compression(data) == expected_result
+
+
+@pytest.mark.parametrize(
+    "compression_format, compress",
+    [(CompressionFormat.GZIP, gzip.compress), (CompressionFormat.BZIP2, bz2.compress)],
+)
+def test_decompress_stream(x12_message, compression_format, compress):
+    compressed = compress(x12_message.encode())
+    contents, compression = decompress_stream(BytesIO(compressed), compression_format)
+    assert contents == x12_message.encode()
+    assert compression.compressionFormat == compression_format
+    assert compression.compressedSize == len(compressed)
+    assert compression.compressedChecksum == create_checksum(compressed)
+
+
+@pytest.mark.parametrize(
+    "compression_format, compress",
+    [(CompressionFormat.GZIP, gzip.compress), (CompressionFormat.BZIP2, bz2.compress)],
+)
+def test_estimate_decompressed_size(x12_message, compression_format, compress):
+    compressed = compress(x12_message.encode())
+    size = estimate_decompressed_size(BytesIO(compressed), compression_format)
+    # gzip records the decompressed size, bzip2 does not
+    if compression_format == CompressionFormat.GZIP:
+        assert size == len(x12_message)
+    else:
+        assert size == int(len(compressed) * COMPRESSION_RATIO)
+
+
+def test_decompress_stream_max_size(x12_message):
+    compressed = gzip.compress(x12_message.encode())
+    contents, _ = decompress_stream(
+        BytesIO(compressed), CompressionFormat.GZIP, len(x12_message)
+    )
+    assert len(contents) == len(x12_message)
+    with pytest.raises(EdiDataValidationException, match="byte limit"):
+        decompress_stream(
+            BytesIO(compressed), CompressionFormat.GZIP, len(x12_message) - 1
+        )
+
+
+def test_iter_zip_members(hl7_message, x12_message):
+    stream = BytesIO()
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("messages/", "")
+        archive.writestr("messages/adt.hl7", hl7_message)
+        archive.writestr("messages/270.x12", x12_message)
+
+    members = list(iter_zip_members(stream))
+    assert [m.decode() for m, _ in members] == [hl7_message, x12_message]
+    assert [c.archiveMember for _, c in members] == [
+        "messages/adt.hl7",
+        "messages/270.x12",
+    ]
+    assert members[0][1].compressedChecksum == create_checksum(stream.getvalue())
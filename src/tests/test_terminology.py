@@ -0,0 +1,159 @@
+"""
+test_terminology.py
+
+Tests terminology index compilation, lookups and code extraction for enrichment.
+"""
+import json
+
+from linuxforhealth.edi.models import EdiMessageFormat
+from linuxforhealth.edi.pipeline import (
+    AnalyzeStage,
+    EdiPipeline,
+    EnrichStage,
+    ValidateStage,
+)
+from linuxforhealth.edi.support import EdiMessageBuffer
+from linuxforhealth.edi.terminology import (
+    CodeSystem,
+    TerminologyIndex,
+    TerminologyService,
+    compile_terminology_index,
+    extract_codes,
+)
+from linuxforhealth.edi.workflows import EdiWorkflow
+import pytest
+
+
+@pytest.fixture
+def terminology_directory(tmp_path):
+    (tmp_path / "icd10.csv").write_text(
+        "code,display\nE11.9,Type 2 diabetes mellitus without complications\nI10,Essential (primary) hypertension\n"
+    )
+    (tmp_path / "loinc.csv").write_text(
+        'LOINC_NUM,COMPONENT\n8867-4,Heart rate\n8480-6,"Systolic\tblood pressure"\n'
+    )
+    (tmp_path / "npi.csv").write_text("npi,name\n2868383243,DOWNTOWN MEDICAL CENTER\n")
+    return str(tmp_path)
+
+
+def test_terminology_index(tmp_path):
+    reference_path = tmp_path / "icd10.csv"
+    codes = [(f"A{i:02d}.{i % 10}", f"Condition {i}") for i in range(100)]
+    reference_path.write_text(
+        "code,display\n" + "\n".join(f"{c},{d}" for c, d in reversed(codes))
+    )
+    index_path = str(tmp_path / "icd10.idx")
+
+    assert compile_terminology_index(str(reference_path), index_path) == 100
+
+    index = TerminologyIndex(index_path)
+    assert index.size == 100
+    for code, display in codes:
+        assert index.lookup(code) == display
+    assert index.lookup("a05.5") == "Condition 5"
+    assert index.lookup("A055") == "Condition 5"
+    assert index.lookup("Z99") is None
+    assert index.lookup("") is None
+    index.close()
+
+
+def test_terminology_index_invalid(tmp_path):
+    index_path = tmp_path / "loinc.idx"
+    index_path.write_bytes(b"not an index file")
+    with pytest.raises(ValueError):
+        TerminologyIndex(str(index_path))
+
+
+def test_terminology_service(terminology_directory):
+    service = TerminologyService(terminology_directory)
+    assert set(service.indexes) == {CodeSystem.ICD10, CodeSystem.LOINC, CodeSystem.NPI}
+    assert service.lookup(CodeSystem.LOINC, "8480-6") == "Systolic blood pressure"
+    assert service.lookup(CodeSystem.CPT, "99213") is None
+
+    codes = service.resolve(
+        iter(
+            [
+                (CodeSystem.ICD10, "E119"),
+                (CodeSystem.ICD10, "E11.9"),
+                (CodeSystem.CPT, "99213"),
+                (CodeSystem.LOINC, "0000-0"),
+            ]
+        )
+    )
+    assert [(c.codeSystem, c.code, c.display) for c in codes] == [
+        ("ICD10", "E119", "Type 2 diabetes mellitus without complications"),
+        ("LOINC", "0000-0", None),
+    ]
+
+    assert not TerminologyService(None).is_available
+
+
+def test_extract_hl7_codes(hl7_message):
+    hl7_message = hl7_message.replace(
+        "OBX|1|TX|1234|", "OBX|1|NM|8867-4^Heart rate^LN|"
+    ).replace("PRB|", "DG1|1||I10^Hypertension^I10|\rPRB|")
+    hl7_message = hl7_message.replace(
+        "200^ATTEND_DOC_FAMILY_TEST^ATTEND_DOC_GIVEN_TEST",
+        "1234567893^FAMILY^GIVEN^^^^^^NPI",
+    )
+    codes = list(extract_codes(EdiMessageBuffer(hl7_message), EdiMessageFormat.HL7))
+    assert codes == [
+        (CodeSystem.NPI, "1234567893"),
+        (CodeSystem.LOINC, "8867-4"),
+        (CodeSystem.ICD10, "I10"),
+    ]
+
+
+def test_extract_x12_codes(x12_message):
+    x12_message = x12_message.replace("EQ*30~", "EQ*30~HI*ABK:E119*ABF:I10~")
+    codes = list(extract_codes(EdiMessageBuffer(x12_message), EdiMessageFormat.X12))
+    assert codes == [
+        (CodeSystem.NPI, "2868383243"),
+        (CodeSystem.ICD10, "E119"),
+        (CodeSystem.ICD10, "I10"),
+    ]
+
+
+def test_extract_fhir_codes():
+    observation = {
+        "resourceType": "Observation",
+        "code": {"coding": [{"system": "http://loinc.org", "code": "8867-4"}]},
+        "performer": [
+            {
+                "identifier": {
+                    "system": "http://hl7.org/fhir/sid/us-npi",
+                    "value": "2868383243",
+                }
+            }
+        ],
+    }
+    codes = list(
+        extract_codes(EdiMessageBuffer(json.dumps(observation)), EdiMessageFormat.FHIR)
+    )
+    assert codes == [(CodeSystem.LOINC, "8867-4"), (CodeSystem.NPI, "2868383243")]
+
+
+def test_enrich_stage(terminology_directory, x12_message, fhir_json_message):
+    service = TerminologyService(terminology_directory)
+    pipeline = EdiPipeline([AnalyzeStage(), EnrichStage(service), ValidateStage()])
+
+    edi_result = EdiWorkflow(x12_message).run(pipeline=pipeline)
+    assert [c.dict() for c in edi_result.codes] == [
+        {
+            "codeSystem": "NPI",
+            "code": "2868383243",
+            "display": "DOWNTOWN MEDICAL CENTER",
+        }
+    ]
+    assert edi_result.metrics.enrichTime > 0.0
+
+    edi_result = EdiWorkflow(fhir_json_message).run(pipeline=pipeline)
+    assert edi_result.codes == []
+
+    unavailable_pipeline = EdiPipeline(
+        [AnalyzeStage(), EnrichStage(TerminologyService(None))]
+    )
+    workflow = EdiWorkflow(x12_message)
+    edi_result = workflow.run(pipeline=unavailable_pipeline)
+    assert edi_result.codes is None
+    assert workflow.operations == ["analyze"]
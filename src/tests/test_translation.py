@@ -0,0 +1,152 @@
+"""
+test_translation.py
+
+Tests HL7v2 to FHIR translation templates and the Hl7FhirTranslator.
+"""
+from fhir.resources import construct_fhir_element
+from linuxforhealth.edi.support import load_hl7
+from linuxforhealth.edi.translation import (
+    Hl7FhirTranslator,
+    compile_template,
+    get_hl7_translator,
+)
+from linuxforhealth.edi.workflows import EdiWorkflow
+import pytest
+
+ORU_MESSAGE = "\r".join(
+    [
+        "MSH|^~\\&|LAB|HOSP|EHR|HOSP|20210405103000||ORU^R01|MSG00001|P|2.5.1",
+        "PID|1||555-44-3333^^^HOSP^MR||SMITH^JANE||19700101|F",
+        "OBR|1|ORD1|LAB1|24331-1^Lipid panel^LN|||20210405090000-0500|||||||||||||||20210405100000-0500|||F",
+        "OBX|1|NM|2093-3^Cholesterol^LN||196|mg/dL^^UCUM|<200|N|||F|||20210405090000-0500",
+        "OBX|2|ST|8867-4^Heart rate^LN||Regular||||||P",
+    ]
+)
+
+
+def _resources(bundle, resource_type):
+    return [
+        e["resource"]
+        for e in bundle["entry"]
+        if e["resource"]["resourceType"] == resource_type
+    ]
+
+
+def test_translate_adt(hl7_message):
+    bundle = get_hl7_translator().translate(load_hl7(hl7_message))
+    assert bundle["resourceType"] == "Bundle"
+    assert construct_fhir_element("Bundle", bundle) is not None
+    assert [e["resource"]["resourceType"] for e in bundle["entry"]] == [
+        "Patient",
+        "Encounter",
+        "AllergyIntolerance",
+        "AllergyIntolerance",
+    ]
+
+    patient = _resources(bundle, "Patient")[0]
+    assert patient["name"] == [{"family": "DOE", "given": ["JOHN", "A"]}]
+    assert patient["birthDate"] == "1980-02-02"
+    assert patient["gender"] == "female"
+    assert [i["value"] for i in patient["identifier"]] == ["PID1234", "1234568965"]
+    assert bundle["entry"][0]["fullUrl"] == f"urn:uuid:{patient['id']}"
+
+    encounter = _resources(bundle, "Encounter")[0]
+    assert encounter["subject"]["reference"] == bundle["entry"][0]["fullUrl"]
+    assert encounter["status"] == "in-progress"
+    assert len(encounter["participant"]) == 4
+    # PV1-2 "ff" is not a patient class
+    assert encounter["class"]["code"] == "UNK"
+
+    allergy = _resources(bundle, "AllergyIntolerance")[1]
+    assert allergy["code"]["text"] == "TRAMADOL"
+    assert allergy["reaction"][0]["manifestation"] == [
+        {"text": "SEIZURES"},
+        {"text": "VOMITING"},
+    ]
+
+
+def test_translate_oru():
+    bundle = get_hl7_translator().translate(load_hl7(ORU_MESSAGE))
+    assert construct_fhir_element("Bundle", bundle) is not None
+
+    report = _resources(bundle, "DiagnosticReport")[0]
+    observations = _resources(bundle, "Observation")
+    assert report["status"] == "final"
+    assert report["effectiveDateTime"] == "2021-04-05T09:00:00-05:00"
+    assert report["result"] == [
+        {"reference": f"urn:uuid:{o['id']}"} for o in observations
+    ]
+
+    assert observations[0]["valueQuantity"] == {
+        "value": 196.0,
+        "unit": "mg/dL",
+        "system": "http://unitsofmeasure.org",
+        "code": "mg/dL",
+    }
+    assert observations[0]["code"]["coding"][0]["system"] == "http://loinc.org"
+    assert observations[0]["status"] == "final"
+    assert "valueString" not in observations[0]
+    assert observations[1]["valueString"] == "Regular"
+    assert observations[1]["status"] == "preliminary"
+    assert "interpretation" not in observations[1]
+
+
+@pytest.mark.parametrize(
+    "patient_class,system,code",
+    [
+        ("I", "http://terminology.hl7.org/CodeSystem/v3-ActCode", "IMP"),
+        ("", "http://terminology.hl7.org/CodeSystem/v3-NullFlavor", "UNK"),
+    ],
+)
+def test_translate_encounter_class(hl7_message, patient_class, system, code):
+    message = hl7_message.replace("PV1|1|ff|", f"PV1|1|{patient_class}|")
+    bundle = get_hl7_translator().translate(load_hl7(message))
+    encounter = _resources(bundle, "Encounter")[0]
+    assert encounter["class"]["system"] == system
+    assert encounter["class"]["code"] == code
+    assert construct_fhir_element("Bundle", bundle) is not None
+
+
+def test_translate_unsupported_message(hl7_message):
+    message = load_hl7(hl7_message.replace("ADT^A01", "SIU^S12"))
+    translator = get_hl7_translator()
+    assert not translator.supports(message)
+    assert translator.translate(message) is None
+
+
+def test_translate_custom_templates(hl7_message):
+    translator = Hl7FhirTranslator(
+        {
+            "ADT^A01": [
+                {
+                    "$segment": "PID",
+                    "resourceType": "Patient",
+                    "gender": "@PID-8|gender",
+                }
+            ]
+        }
+    )
+    bundles = translator.translate_batch(
+        [load_hl7(hl7_message), load_hl7(hl7_message.replace("ADT^A01", "ADT^A08"))]
+    )
+    assert bundles[0]["entry"][0]["resource"]["gender"] == "female"
+    assert bundles[1] is None
+
+
+@pytest.mark.parametrize(
+    "template",
+    ["@PID", "@PID-5.x", "@PID-7|unknown_transform", {"$each": "@PID-5.1", "$map": {}}],
+)
+def test_compile_template_invalid(template):
+    with pytest.raises(ValueError):
+        compile_template(template)
+
+
+def test_workflow_translate(hl7_message):
+    edi_result = EdiWorkflow(hl7_message).run()
+    assert edi_result.translation["resourceType"] == "Bundle"
+    assert len(edi_result.translation["entry"]) == 4
+    assert edi_result.metrics.translateTime > 0.0
+
+    edi_result = EdiWorkflow(hl7_message).run(translate=False)
+    assert edi_result.translation is None
@@ -0,0 +1,196 @@
+"""
+test_validation.py
+
+Tests envelope and structural validation levels.
+"""
+import json
+import os
+
+from linuxforhealth.edi.exceptions import EdiDataValidationException
+from linuxforhealth.edi.models import (
+    EdiMessageFormat,
+    EdiMessageMetadata,
+    ValidationLevel,
+)
+from linuxforhealth.edi.pipeline import get_default_pipeline
+from linuxforhealth.edi.support import EdiMessageBuffer
+from linuxforhealth.edi.validation import (
+    get_fhir_resource_schema,
+    get_x12_segment_schema,
+    validate_dicom,
+    validate_fhir,
+    validate_hl7,
+    validate_x12,
+)
+from linuxforhealth.edi.workflows import EdiWorkflow
+import pytest
+from . import resources_directory
+
+LIGHTWEIGHT_LEVELS = [ValidationLevel.ENVELOPE, ValidationLevel.STRUCTURAL]
+
+
+@pytest.mark.parametrize(
+    "fixture_name", ["hl7_message", "x12_message", "fhir_json_message"]
+)
+@pytest.mark.parametrize("validation_level", list(ValidationLevel))
+def test_workflow_validation_level(fixture_name, validation_level, request):
+    message = request.getfixturevalue(fixture_name)
+    workflow = EdiWorkflow(message)
+    edi_result = workflow.run(validation_level=validation_level)
+
+    assert edi_result.validationLevel == validation_level
+    assert edi_result.metrics.validateTime > 0.0
+    if validation_level == ValidationLevel.FULL:
+        assert workflow.data_model is not None
+    else:
+        assert workflow.data_model is None
+        assert edi_result.translation is None
+
+
+@pytest.mark.parametrize("validation_level", list(ValidationLevel)[1:])
+def test_validation_levels_are_cumulative(x12_message, validation_level):
+    invalid_messages = [
+        (
+            "MSH|^~\\&|SRC|FAC|DEST|FAC|20210101||ADT^A01|1|P|2.5\rPID|1||",
+            "PID-3",
+        ),
+        (x12_message.replace("DTP*291*D8*20200101", "DTP*291*D8*"), "DTP03"),
+    ]
+    for invalid_message, field_name in invalid_messages:
+        with pytest.raises(EdiDataValidationException, match=field_name):
+            EdiWorkflow(invalid_message).run(
+                validation_level=validation_level, enrich=False, translate=False
+            )
+
+
+def test_full_validation_parses_hl7(hl7_message):
+    workflow = EdiWorkflow(hl7_message)
+    workflow.run(enrich=False, translate=False)
+    assert workflow.data_model.parsed_count == len(workflow.data_model)
+
+
+def test_validation_level_skipped():
+    workflow = EdiWorkflow("MSH|^~\\&|SRC|FAC|DEST|FAC|20210101||ADT^A01|1|P|2.5")
+    edi_result = workflow.run(validate=False, translate=False)
+    assert edi_result.validationLevel is None
+
+
+def test_translate_requires_full_validation():
+    pipeline = get_default_pipeline(enrich=False, validate=False, translate=True)
+    assert pipeline.stage_names == ["analyze", "validate", "translate"]
+    assert pipeline.stages[1].validation_level == ValidationLevel.FULL
+
+
+@pytest.mark.parametrize("validation_level", LIGHTWEIGHT_LEVELS)
+def test_validate_x12_envelope_errors(x12_message, validation_level):
+    with pytest.raises(EdiDataValidationException):
+        validate_x12(x12_message[0:-20], validation_level)
+
+    with pytest.raises(EdiDataValidationException):
+        validate_x12(x12_message.replace("GS*", "GX*"), validation_level)
+
+
+def test_validate_x12_structure(x12_message):
+    # the envelope is intact, the transaction segment count is not
+    invalid_message = x12_message.replace("SE*13*", "SE*12*")
+    validate_x12(invalid_message, ValidationLevel.ENVELOPE)
+    with pytest.raises(EdiDataValidationException, match="SE segment count"):
+        validate_x12(invalid_message, ValidationLevel.STRUCTURAL)
+
+    # DTP03 is required for the DTP segment
+    invalid_message = x12_message.replace("DTP*291*D8*20200101", "DTP*291*D8*")
+    with pytest.raises(EdiDataValidationException, match="DTP03"):
+        validate_x12(invalid_message, ValidationLevel.STRUCTURAL)
+
+    invalid_message = x12_message.replace(
+        "DTP*291*D8*20200101", "DTP*291*D8*20200101*1"
+    )
+    with pytest.raises(EdiDataValidationException, match="maximum is 3"):
+        validate_x12(invalid_message, ValidationLevel.STRUCTURAL)
+
+
+@pytest.mark.parametrize("transaction_code", ["270", "271", "837"])
+def test_validate_x12_transactions(transaction_code):
+    with open(os.path.join(resources_directory, f"{transaction_code}.x12")) as f:
+        validate_x12(f.read(), ValidationLevel.STRUCTURAL)
+
+
+def test_get_x12_segment_schema():
+    schema = get_x12_segment_schema("DTP")
+    assert schema.max_elements == 3
+    assert schema.required_elements == (1, 2, 3)
+    assert get_x12_segment_schema("ZZZ") is None
+
+
+def test_validate_hl7(hl7_message):
+    with pytest.raises(EdiDataValidationException):
+        validate_hl7("PID|1", ValidationLevel.ENVELOPE)
+
+    with pytest.raises(EdiDataValidationException, match="MSH-9"):
+        validate_hl7(
+            "MSH|^~\\&|SRC|FAC|DEST|FAC|20210101|||1|P|2.5", ValidationLevel.ENVELOPE
+        )
+
+    validate_hl7(hl7_message, ValidationLevel.STRUCTURAL)
+    with pytest.raises(EdiDataValidationException, match="PID-5"):
+        validate_hl7(
+            "MSH|^~\\&|SRC|FAC|DEST|FAC|20210101||ADT^A01|1|P|2.5\rPID|1||123",
+            ValidationLevel.STRUCTURAL,
+        )
+
+
+@pytest.mark.parametrize("validation_level", LIGHTWEIGHT_LEVELS)
+def test_validate_fhir_errors(fhir_json_message, validation_level):
+    meta_data = EdiMessageMetadata.construct(
+        ediMessageFormat=EdiMessageFormat.FHIR, specificationVersion="R4"
+    )
+    fhir_json = json.loads(fhir_json_message)
+
+    fhir_json["resourceType"] = "NotAResource"
+    with pytest.raises(EdiDataValidationException, match="NotAResource"):
+        validate_fhir(
+            EdiMessageBuffer(json.dumps(fhir_json)), meta_data, validation_level
+        )
+
+    fhir_json["resourceType"] = "Patient"
+    fhir_json["notAnElement"] = True
+    message = EdiMessageBuffer(json.dumps(fhir_json))
+    if validation_level == ValidationLevel.ENVELOPE:
+        validate_fhir(message, meta_data, validation_level)
+    else:
+        with pytest.raises(EdiDataValidationException, match="notAnElement"):
+            validate_fhir(message, meta_data, validation_level)
+
+
+def test_get_fhir_resource_schema():
+    schema = get_fhir_resource_schema("R4", "Observation")
+    assert "status" in schema.required_elements
+    assert "code" in schema.required_elements
+    assert "_status" in schema.element_names
+    assert get_fhir_resource_schema("R4", "NotAResource") is None
+
+
+@pytest.mark.parametrize("validation_level", LIGHTWEIGHT_LEVELS)
+def test_validate_dicom(dicom_study_directory, validation_level):
+    instance_path = os.path.join(dicom_study_directory, "series0", "IM0000")
+    with open(instance_path, "rb") as f:
+        data = f.read()
+
+    validate_dicom(data, validation_level)
+    with pytest.raises(EdiDataValidationException):
+        validate_dicom(data[0:128] + b"XXXX" + data[132:], validation_level)
+
+
+@pytest.mark.parametrize("validation_level", LIGHTWEIGHT_LEVELS)
+def test_validate_fhir_xml(fhir_xml_message, validation_level):
+    meta_data = EdiMessageMetadata.construct(
+        ediMessageFormat=EdiMessageFormat.FHIR, specificationVersion="R4"
+    )
+    validate_fhir(EdiMessageBuffer(fhir_xml_message), meta_data, validation_level)
+
+    message = EdiMessageBuffer(fhir_xml_message.replace("<active", "<notAnElement"))
+    if validation_level == ValidationLevel.ENVELOPE:
+        validate_fhir(message, meta_data, validation_level)
+    else:
+        with pytest.raises(EdiDataValidationException, match="notAnElement"):
+            validate_fhir(message, meta_data, validation_level)
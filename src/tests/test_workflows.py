@@ -7,8 +7,9 @@ from linuxforhealth.edi.models import (
     BaseMessageFormat,
     EdiMessageFormat,
     EdiProcessingMetrics,
+    EdiResult,
 )
-from linuxforhealth.edi.workflows import EdiWorkflow
+from linuxforhealth.edi.workflows import EdiWorkflow, load_study_workflow
 from linuxforhealth.edi.exceptions import (
     EdiValidationException,
     EdiAnalysisException,
@@ -113,3 +114,42 @@ def test_hl7_workflow_exception(hl7_message):
     invalid_hl7 = hl7_message.replace("MSH|", "FISH|")
     with pytest.raises(EdiDataValidationException):
         EdiWorkflow(invalid_hl7).run()
+
+
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_study_workflow_run(dicom_study_directory, max_workers):
+    study_result = load_study_workflow(dicom_study_directory, max_workers).run()
+
+    assert len(study_result.studies) == 1
+    study = study_result.studies[0]
+    assert study.studyInstanceUid == "1.2.826.0.1.3680043.8.498.100"
+    assert study.instanceCount == 5
+    assert [(s.seriesInstanceUid, s.instanceCount) for s in study.series] == [
+        ("1.2.826.0.1.3680043.8.498.200", 3),
+        ("1.2.826.0.1.3680043.8.498.300", 2),
+    ]
+    assert study.series[0].modality == "CT"
+
+    assert len(study_result.failures) == 1
+    assert study_result.failures[0].path.endswith("README.txt")
+    assert study_result.metrics.analyzeTime > 0.0
+
+
+def test_study_workflow_exception(tmp_path):
+    with pytest.raises(EdiAnalysisException):
+        load_study_workflow(str(tmp_path / "missing")).run()
+
+
+def test_workflow_result_metrics(hl7_message):
+    edi = EdiWorkflow(hl7_message)
+    edi_result = edi.run()
+
+    metrics = edi_result.metrics
+    assert metrics is not edi.metrics
+    assert metrics.totalTime == (
+        metrics.analyzeTime
+        + metrics.enrichTime
+        + metrics.validateTime
+        + metrics.translateTime
+    )
+    assert EdiResult(**edi_result.dict()) == edi_result
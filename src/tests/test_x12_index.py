@@ -0,0 +1,108 @@
+"""
+test_x12_index.py
+
+Tests X12 segment indexing and indexed transaction and claim reads.
+"""
+import os
+
+from linuxforhealth.edi.models import ValidationLevel
+from linuxforhealth.edi.pipeline import get_default_pipeline
+from linuxforhealth.edi.x12_index import (
+    INDEX_FILE_SUFFIX,
+    X12IndexedFile,
+    X12SegmentIndex,
+    load_x12_index,
+)
+from tests import resources_directory
+import pytest
+
+
+@pytest.fixture
+def x12_file_path(tmp_path) -> str:
+    """Writes an 837 interchange containing three claim transactions"""
+    with open(os.path.join(resources_directory, "837.x12")) as f:
+        segments = [s.strip() for s in f.read().split("~") if s.strip()]
+
+    isa, gs = segments[0:2]
+    transaction = segments[2:-2]
+    transactions = []
+    for control_number in ("0001", "0002", "0003"):
+        transactions.extend(
+            s.replace("*0001", f"*{control_number}") if s[:2] in ("ST", "SE") else s
+            for s in transaction
+        )
+    segments = [isa, gs] + transactions + ["GE*3*1", "IEA*1*000000001"]
+
+    file_path = tmp_path / "837.x12"
+    file_path.write_text("~\n".join(segments) + "~\n")
+    return str(file_path)
+
+
+def test_build_index(x12_file_path):
+    index = X12SegmentIndex.build(x12_file_path)
+    assert index.element_separator == b"*"
+    assert index.segment_terminator == b"~"
+    assert len(index.transactions) == 3
+
+    for transaction in index.transactions:
+        assert transaction.interchange_offset == 0
+        assert transaction.segment_count == 33
+        assert transaction.hl_count == 2
+        assert transaction.claim_count == 1
+    assert index.transactions[0].end < index.transactions[1].start
+    assert len(index.claim_offsets(2)) == 1
+
+
+def test_build_index_invalid(tmp_path, hl7_message):
+    file_path = tmp_path / "message.hl7"
+    file_path.write_text(hl7_message)
+    with pytest.raises(ValueError):
+        X12SegmentIndex.build(str(file_path))
+
+
+def test_load_x12_index(x12_file_path):
+    index_path = x12_file_path + INDEX_FILE_SUFFIX
+    index = load_x12_index(x12_file_path)
+    assert os.path.exists(index_path)
+
+    loaded_index = X12SegmentIndex.load(index_path)
+    assert loaded_index.transactions == index.transactions
+    assert loaded_index.offsets == index.offsets
+    assert loaded_index.kinds == index.kinds
+    assert loaded_index.is_current(x12_file_path)
+
+    # a modified file is indexed again
+    with open(x12_file_path, "a") as f:
+        f.write("\n")
+    assert not loaded_index.is_current(x12_file_path)
+    assert load_x12_index(x12_file_path).source_size == index.source_size + 1
+
+    # an invalid index is replaced
+    with open(index_path, "wb") as f:
+        f.write(b"invalid")
+    with pytest.raises(ValueError):
+        X12SegmentIndex.load(index_path)
+    assert load_x12_index(x12_file_path).transactions == index.transactions
+
+
+def test_indexed_file(x12_file_path):
+    with X12IndexedFile(x12_file_path) as indexed_file:
+        assert indexed_file.transaction_count == 3
+
+        transaction = indexed_file.read_transaction(1)
+        assert transaction.startswith(b"ISA*")
+        assert b"ST*837*0002*" in transaction
+        assert b"ST*837*0001*" not in transaction
+        assert transaction.endswith(b"GE*1*1~IEA*1*000000001~")
+
+        claim = indexed_file.read_claim(1, 0)
+        assert claim.startswith(b"CLM*26463774*")
+        assert claim.endswith(b"DTP*472*D8*20061010~")
+
+        pipeline = get_default_pipeline(
+            translate=False, validation_level=ValidationLevel.STRUCTURAL
+        )
+        edi_result = indexed_file.create_workflow(2).run(pipeline=pipeline)
+        assert edi_result.metadata.ediMessageFormat == "X12"
+        assert edi_result.metadata.implementationVersions == ["005010X222A2"]
+        assert edi_result.validationLevel == ValidationLevel.STRUCTURAL
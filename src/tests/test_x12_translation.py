@@ -0,0 +1,196 @@
+"""
+test_x12_translation.py
+
+Tests X12 to FHIR translation and streamed resource output.
+"""
+import io
+import json
+import os
+import re
+
+from fhir.resources import construct_fhir_element
+from linuxforhealth.edi.support import FhirBundleWriter, FhirNdjsonWriter, load_x12
+from linuxforhealth.edi.workflows import EdiWorkflow
+from linuxforhealth.edi.x12_translation import X12FhirTranslator, get_x12_translator
+import pytest
+from . import resources_directory
+
+
+def _x12_path(transaction_code: str) -> str:
+    return os.path.join(resources_directory, f"{transaction_code}.x12")
+
+
+def _resource_types(resources):
+    return [r["resourceType"] for r in resources]
+
+
+def test_translate_eligibility_request():
+    resources = list(get_x12_translator().stream(_x12_path("270")))
+    assert _resource_types(resources) == [
+        "Organization",
+        "Organization",
+        "Patient",
+        "CoverageEligibilityRequest",
+    ]
+
+    insurer, provider, patient, request = resources
+    assert provider["identifier"][0]["value"] == "2868383243"
+    assert patient["birthDate"] == "1980-05-19"
+    assert request["patient"]["reference"] == f"urn:uuid:{patient['id']}"
+    assert request["insurer"]["reference"] == f"urn:uuid:{insurer['id']}"
+    assert request["servicedDate"] == "2020-01-01"
+    assert request["item"][0]["category"]["coding"][0]["code"] == "30"
+
+
+def test_translate_eligibility_response():
+    resources = list(get_x12_translator().stream(_x12_path("271")))
+    response = resources[-1]
+    assert response["resourceType"] == "CoverageEligibilityResponse"
+    assert response["request"]["identifier"]["value"] == "10001234"
+
+    insurance = response["insurance"][0]
+    assert insurance["inforce"] is True
+    in_network = [
+        i
+        for i in insurance["item"]
+        if i.get("network", {}).get("coding", [{}])[0].get("code") == "in"
+    ]
+    assert len(in_network) == 10
+    assert in_network[0]["benefit"][0]["allowedMoney"] == {
+        "value": 10.0,
+        "currency": "USD",
+    }
+
+
+def test_translate_professional_claim():
+    resources = list(get_x12_translator().stream(_x12_path("837")))
+    assert _resource_types(resources) == [
+        "Organization",
+        "Patient",
+        "Organization",
+        "Coverage",
+        "Claim",
+    ]
+
+    claim = resources[-1]
+    assert claim["identifier"][0]["value"] == "26463774"
+    assert claim["total"] == {"value": 100.0, "currency": "USD"}
+    assert [
+        d["diagnosisCodeableConcept"]["coding"][0]["code"] for d in claim["diagnosis"]
+    ] == ["J020", "Z1159"]
+    assert len(claim["item"]) == 4
+    assert claim["item"][0]["productOrService"]["coding"][0]["code"] == "99213"
+    assert claim["item"][2]["diagnosisSequence"] == [2]
+    assert claim["item"][0]["servicedDate"] == "2006-10-03"
+    assert claim["item"][0]["locationCodeableConcept"]["coding"][0]["code"] == "11"
+
+
+@pytest.mark.parametrize("transaction_code", ["270", "271", "837"])
+def test_translate_bundle_is_valid(transaction_code):
+    with open(_x12_path(transaction_code)) as f:
+        models = load_x12(f.read())
+
+    bundle = get_x12_translator().translate(models)
+    assert construct_fhir_element("Bundle", bundle) is not None
+
+
+def test_translate_claim_item_without_procedure():
+    with open(_x12_path("837")) as f:
+        x12_message = f.read().replace("SV1*HC:99213*", "SV1*ER:99213*")
+
+    bundle = get_x12_translator().translate(load_x12(x12_message))
+    claim = next(
+        e["resource"]
+        for e in bundle["entry"]
+        if e["resource"]["resourceType"] == "Claim"
+    )
+    assert claim["item"][0]["productOrService"]["coding"][0] == {
+        "system": "http://terminology.hl7.org/CodeSystem/v3-NullFlavor",
+        "code": "UNK",
+        "display": "unknown",
+    }
+    assert claim["item"][1]["productOrService"]["coding"][0]["code"] == "87070"
+    assert construct_fhir_element("Bundle", bundle) is not None
+
+
+def _remove_dmg_segments(x12_message: str) -> str:
+    """Removes the situational DMG segments from a transaction, updating the SE segment count"""
+    dmg_count = x12_message.count("DMG*")
+    x12_message = re.sub(r"DMG\*[^~]*~\s*", "", x12_message)
+    return re.sub(
+        r"SE\*(\d+)\*",
+        lambda m: f"SE*{int(m.group(1)) - dmg_count}*",
+        x12_message,
+    )
+
+
+@pytest.mark.parametrize(
+    "transaction_code,resource_type,patient_fields",
+    [
+        ("270", "CoverageEligibilityRequest", ["patient"]),
+        ("271", "CoverageEligibilityResponse", ["patient"]),
+        ("837", "Claim", ["patient"]),
+        ("837", "Coverage", ["subscriber", "beneficiary"]),
+    ],
+)
+def test_translate_without_demographics(
+    transaction_code, resource_type, patient_fields
+):
+    with open(_x12_path(transaction_code)) as f:
+        models = load_x12(_remove_dmg_segments(f.read()))
+
+    bundle = get_x12_translator().translate(models)
+    resources = {
+        f"urn:uuid:{e['resource']['id']}": e["resource"] for e in bundle["entry"]
+    }
+    resource = next(r for r in resources.values() if r["resourceType"] == resource_type)
+    for field_name in patient_fields:
+        patient = resources[resource[field_name]["reference"]]
+        assert patient["resourceType"] == "Patient"
+        assert "birthDate" not in patient
+
+    assert construct_fhir_element("Bundle", bundle) is not None
+
+
+def test_translate_unsupported_transaction():
+    translator = X12FhirTranslator(translators={})
+    with open(_x12_path("270")) as f:
+        models = load_x12(f.read())
+
+    assert not translator.supports(models[0])
+    assert list(translator.resources(models[0])) == []
+    assert translator.translate(models) is None
+
+
+def test_write_ndjson():
+    output = io.StringIO()
+    with FhirNdjsonWriter(output) as writer:
+        count = get_x12_translator().write(_x12_path("837"), writer)
+
+    lines = output.getvalue().splitlines()
+    assert count == writer.count == len(lines) == 5
+    assert json.loads(lines[-1])["resourceType"] == "Claim"
+
+
+def test_write_bundle():
+    output = io.StringIO()
+    with FhirBundleWriter(output) as writer:
+        get_x12_translator().write(_x12_path("271"), writer)
+
+    bundle = json.loads(output.getvalue())
+    assert len(bundle["entry"]) == 5
+    assert construct_fhir_element("Bundle", bundle) is not None
+
+    output = io.StringIO()
+    with FhirBundleWriter(output, bundle_type="batch"):
+        pass
+    assert json.loads(output.getvalue()) == {"resourceType": "Bundle", "type": "batch"}
+
+
+def test_workflow_translate_x12():
+    with open(_x12_path("837")) as f:
+        edi_result = EdiWorkflow(f.read()).run()
+
+    assert edi_result.translation["resourceType"] == "Bundle"
+    assert edi_result.translation["entry"][-1]["resource"]["resourceType"] == "Claim"
+    assert edi_result.metrics.translateTime > 0.0
@@ -0,0 +1,122 @@
+"""
+test_x12_validation.py
+
+Tests splitting large X12 837 transactions and validating the chunks in parallel.
+"""
+import os
+
+from linuxforhealth.edi.exceptions import EdiDataValidationException
+from linuxforhealth.edi.pipeline import (
+    EdiPipeline,
+    AnalyzeStage,
+    TranslateStage,
+    ValidateStage,
+)
+from linuxforhealth.edi.support import load_x12
+from linuxforhealth.edi.workflows import EdiWorkflow
+from linuxforhealth.edi.x12_validation import load_x12_parallel, split_x12_message
+from tests import resources_directory
+import pytest
+
+
+def _create_837(provider_count: int, subscriber_count: int) -> str:
+    """Creates an 837 transaction with a claim for each subscriber of each billing provider"""
+    with open(os.path.join(resources_directory, "837.x12")) as f:
+        segments = [s.strip() for s in f.read().split("~") if s.strip()]
+
+    provider_start = segments.index("HL*1**20*1")
+    subscriber_start = segments.index("HL*2*1*22*0")
+    header = segments[:provider_start]
+    provider_loop = segments[provider_start + 1 : subscriber_start]
+    subscriber_loop = segments[subscriber_start + 1 : -3]
+
+    body = []
+    hl_id = 0
+    for _ in range(provider_count):
+        hl_id += 1
+        provider_id = hl_id
+        body.append(f"HL*{provider_id}**20*1")
+        body.extend(provider_loop)
+        for _ in range(subscriber_count):
+            hl_id += 1
+            body.append(f"HL*{hl_id}*{provider_id}*22*0")
+            body.extend(subscriber_loop)
+
+    segment_count = len(header) - 2 + len(body) + 1
+    segments = header + body + [f"SE*{segment_count}*0001", "GE*1*1", "IEA*1*000000001"]
+    return "~\n".join(segments) + "~\n"
+
+
+@pytest.fixture
+def large_837() -> str:
+    return _create_837(provider_count=2, subscriber_count=5)
+
+
+def test_split_x12_message(large_837):
+    chunks = split_x12_message(large_837, max_claims=3)
+    assert [c.count("CLM*") for c in chunks] == [3, 3, 3, 1]
+    # chunks repeat the billing provider loop of their first subscriber
+    assert [c.count("**20*1") for c in chunks] == [1, 2, 1, 1]
+    for chunk in chunks:
+        assert chunk.startswith("ISA*")
+        assert chunk.endswith("GE*1*1~IEA*1*000000001~")
+        assert len(load_x12(chunk)) == 1
+
+    assert len(split_x12_message(large_837, max_claims=10)) == 1
+
+
+def test_split_x12_message_not_split(x12_message):
+    # 270 transactions are not split
+    assert len(split_x12_message(x12_message, max_claims=1)) == 1
+
+
+def test_split_x12_message_invalid(large_837):
+    with pytest.raises(EdiDataValidationException, match="SE segment count"):
+        split_x12_message(large_837.replace("SE*", "SE*1"), max_claims=3)
+
+    with pytest.raises(EdiDataValidationException, match="GE transaction count"):
+        split_x12_message(large_837.replace("GE*1*", "GE*2*"), max_claims=3)
+
+
+def test_load_x12_parallel(large_837):
+    models = load_x12_parallel(large_837, max_workers=2, max_claims=3)
+    # chunk models are merged into the transaction model
+    assert len(models) == 1
+    assert models[0].dict() == load_x12(large_837)[0].dict()
+    assert models[0].x12() == load_x12(large_837)[0].x12()
+    assert len(models[0].loop_2000a) == 2
+    assert [len(p.loop_2000b) for p in models[0].loop_2000a] == [5, 5]
+    assert len(load_x12_parallel(large_837, max_workers=1, max_claims=3)) == 1
+
+    invalid_message = large_837.replace("CLM*26463774*100*", "CLM*26463774*INVALID*", 1)
+    with pytest.raises(EdiDataValidationException, match="chunk 0"):
+        load_x12_parallel(invalid_message, max_workers=2, max_claims=3)
+
+
+def test_validate_stage_parallel(large_837):
+    pipeline = EdiPipeline(
+        [AnalyzeStage(), ValidateStage(x12_workers=2, x12_chunk_claims=4)]
+    )
+    workflow = EdiWorkflow(large_837)
+    workflow.run(pipeline=pipeline)
+    assert len(workflow.data_model) == 1
+    assert workflow.data_model[0].dict() == load_x12(large_837)[0].dict()
+
+
+def test_translate_parallel(large_837):
+    resource_types = []
+    for x12_workers in (1, 2):
+        pipeline = EdiPipeline(
+            [
+                AnalyzeStage(),
+                ValidateStage(x12_workers=x12_workers, x12_chunk_claims=4),
+                TranslateStage(),
+            ]
+        )
+        workflow = EdiWorkflow(large_837)
+        workflow.run(pipeline=pipeline)
+        resource_types.append(
+            sorted(e["resource"]["resourceType"] for e in workflow.translation["entry"])
+        )
+    # chunks do not repeat the header and billing provider resources
+    assert resource_types[0] == resource_types[1]